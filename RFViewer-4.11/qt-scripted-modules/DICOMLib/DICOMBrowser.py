@@ -45,6 +45,7 @@ class SlicerDICOMBrowser(VTKObservationMixin, qt.QWidget):
     self.pluginInstances = {}
     self.fileLists = []
     self.extensionCheckPending = False
+    self.tagIndexPendingInstanceUIDs = []
 
     self.settings = qt.QSettings()
 
@@ -57,6 +58,7 @@ class SlicerDICOMBrowser(VTKObservationMixin, qt.QWidget):
     self.setup()
 
     self.dicomBrowser.connect('directoryImported()', self.onDirectoryImported)
+    slicer.dicomDatabase.connect('instanceAdded(QString)', self.onInstanceAdded)
     self.dicomBrowser.connect('sendRequested(QStringList)', self.onSend)
 
     # Load when double-clicked on an item in the browser
@@ -213,6 +215,21 @@ class SlicerDICOMBrowser(VTKObservationMixin, qt.QWidget):
         self.extensionCheckPending = False
       qt.QTimer.singleShot(0, timerCallback)
 
+  def onInstanceAdded(self, sopInstanceUID):
+    """The headers of the imported files are indexed in the background.
+    The instances added during the same operation are collected
+    into a single prescan of the tag index."""
+    if not self.tagIndexPendingInstanceUIDs:
+      qt.QTimer.singleShot(0, self.prescanTagIndex)
+    self.tagIndexPendingInstanceUIDs.append(sopInstanceUID)
+
+  def prescanTagIndex(self):
+    sopInstanceUIDs = self.tagIndexPendingInstanceUIDs
+    self.tagIndexPendingInstanceUIDs = []
+    tagIndex = DICOMLib.DICOMTagIndex.forDatabase()
+    if tagIndex is not None:
+      tagIndex.prescanInstances(sopInstanceUIDs)
+
   def promptForExtensions(self):
     extensionsToOffer = self.checkForExtensions()
     if len(extensionsToOffer) != 0:
@@ -1,6 +1,8 @@
 import os
 import vtk, qt, ctk, slicer
 import logging
+from collections import OrderedDict
+from .DICOMTagIndex import DICOMTagIndex
 
 #########################################################
 #
@@ -381,8 +383,19 @@ def importDicom(dicomDataDir, dicomDatabase=None, copyFiles=False):
     assert indexer is not None
     if dicomDatabase is None:
       dicomDatabase = slicer.dicomDatabase
-    indexer.addDirectory(dicomDatabase, dicomDataDir, copyFiles)
-    indexer.waitForImportFinished()
+    # Record the instances added by the import, so only their headers are indexed
+    addedInstanceUIDs = []
+    def onInstanceAdded(sopInstanceUID):
+      addedInstanceUIDs.append(sopInstanceUID)
+    dicomDatabase.connect('instanceAdded(QString)', onInstanceAdded)
+    try:
+      indexer.addDirectory(dicomDatabase, dicomDataDir, copyFiles)
+      indexer.waitForImportFinished()
+    finally:
+      dicomDatabase.disconnect('instanceAdded(QString)', onInstanceAdded)
+    tagIndex = DICOMTagIndex.forDatabase(dicomDatabase)
+    if tagIndex is not None and addedInstanceUIDs:
+      tagIndex.prescanInstances(addedInstanceUIDs, dicomDatabase)
   except Exception as e:
     import traceback
     traceback.print_exc()
@@ -522,6 +535,133 @@ class LoadDICOMFilesToDatabase(object):
   def __exit__(self, type, value, traceback):
     pass
 
+#------------------------------------------------------------------------------
+def getFileValues(filePaths, tags):
+  """ Get the values of DICOM tags for a list of files in a single pass.
+
+      tags: list of tags such as "0020,0032"
+      Returns a dictionary of the list of values of each tag, in the order of the files.
+      Missing tags have empty values.
+
+      The values are looked up in the DICOMTagIndex of the database when available
+      and read from the database otherwise.
+  """
+  tagIndex = DICOMTagIndex.forDatabase()
+  if tagIndex is not None:
+    values = tagIndex.values(filePaths, tags)
+    if values is not None:
+      return values
+
+  values = dict((tag, []) for tag in tags)
+  for filePath in filePaths:
+    for tag in tags:
+      values[tag].append(slicer.dicomDatabase.fileValue(filePath, tag))
+  return values
+
+#------------------------------------------------------------------------------
+def _parseDecimalStrings(values, count):
+  """ Parse DICOM multi-valued decimal strings such as "1.0\\2.0\\3.0" into a (N, count) array.
+      The rows of missing or invalid values are NaN.
+  """
+  import numpy as np
+  result = np.full((len(values), count), np.nan)
+  validRows = [row for row, value in enumerate(values) if value and value.count('\\') == count-1]
+  if not validRows:
+    return result
+  try:
+    result[validRows] = np.array('\\'.join(values[row] for row in validRows).split('\\'), dtype=float).reshape(-1, count)
+  except ValueError:
+    # Some values are not numbers, parse the values one by one to only discard these
+    for row in validRows:
+      try:
+        result[row] = [float(zz) for zz in values[row].split('\\')]
+      except ValueError:
+        pass
+  return result
+
+#------------------------------------------------------------------------------
+class SeriesGeometry(object):
+  """ Slice positions, orientations and number of frames of the files of a series.
+
+      The tags of the files are fetched with one getFileValues call and parsed into numpy arrays.
+      The geometries are cached by series instance UID, so the subseries of a series reuse the
+      values of the files fetched for the whole series. The rows of the files are tagged with
+      their modification time and size : a file modified or replaced since it was fetched is
+      fetched again.
+  """
+  positionTag = "0020,0032"
+  orientationTag = "0020,0037"
+  numberOfFramesTag = "0028,0008"
+  seriesUIDTag = "0020,000E"
+
+  maximumCachedSeriesCount = 16
+  _cache = OrderedDict()
+
+  def __init__(self):
+    self.fileRows = {}
+    self.positions = None
+    self.orientations = None
+    self.numberOfFrames = []
+
+  @classmethod
+  def forFiles(cls, filePaths):
+    """ Get the cached geometry of the series of the files, completed with the files not fetched yet
+    """
+    seriesUID = getFileValues(filePaths[:1], [cls.seriesUIDTag])[cls.seriesUIDTag][0]
+    geometry = cls._cache.pop(seriesUID, None) or cls()
+    geometry.addFiles(filePaths)
+    cls._cache[seriesUID] = geometry
+    while len(cls._cache) > cls.maximumCachedSeriesCount:
+      cls._cache.popitem(last=False)
+    return geometry
+
+  @classmethod
+  def clearCache(cls):
+    cls._cache.clear()
+
+  @staticmethod
+  def fileStamp(filePath):
+    """ Modification time and size of the file, None if the file cannot be accessed
+    """
+    try:
+      fileStat = os.stat(filePath)
+    except OSError:
+      return None
+    return fileStat.st_mtime, fileStat.st_size
+
+  def addFiles(self, filePaths):
+    import numpy as np
+    stamps = OrderedDict((filePath, self.fileStamp(filePath)) for filePath in filePaths)
+    newFiles = [filePath for filePath, stamp in stamps.items()
+                if filePath not in self.fileRows or self.fileRows[filePath][0] != stamp]
+    if not newFiles:
+      return
+    values = getFileValues(newFiles, [self.positionTag, self.orientationTag, self.numberOfFramesTag])
+    positions = _parseDecimalStrings(values[self.positionTag], 3)
+    orientations = _parseDecimalStrings(values[self.orientationTag], 6)
+    # The modified files keep their rows, overwritten with the new values, the other files get new rows
+    addedCount = sum(1 for filePath in newFiles if filePath not in self.fileRows)
+    firstRow = len(self.numberOfFrames)
+    if self.positions is None:
+      self.positions = np.empty((0, 3))
+      self.orientations = np.empty((0, 6))
+    self.positions = np.concatenate([self.positions, np.empty((addedCount, 3))])
+    self.orientations = np.concatenate([self.orientations, np.empty((addedCount, 6))])
+    self.numberOfFrames += [None] * addedCount
+    for index, filePath in enumerate(newFiles):
+      if filePath in self.fileRows:
+        row = self.fileRows[filePath][1]
+      else:
+        row = firstRow
+        firstRow += 1
+      self.fileRows[filePath] = (stamps[filePath], row)
+      self.positions[row] = positions[index]
+      self.orientations[row] = orientations[index]
+      self.numberOfFrames[row] = values[self.numberOfFramesTag][index]
+
+  def rows(self, filePaths):
+    return [self.fileRows[filePath][1] for filePath in filePaths]
+
 #------------------------------------------------------------------------------
 # TODO: more consistency checks:
 # - is there gantry tilt?
@@ -539,60 +679,34 @@ def getSortedImageFiles(filePaths, epsilon=0.01):
   if len(filePaths) == 0:
     return filePaths, [], warningText
 
-  # Define DICOM tags used in this function
-  tags = {}
-  tags['position'] = "0020,0032"
-  tags['orientation'] = "0020,0037"
-  tags['numberOfFrames'] = "0028,0008"
-  tags['seriesUID'] = "0020,000E"
-
-  seriesUID = slicer.dicomDatabase.fileValue(filePaths[0], tags['seriesUID'])
+  import numpy as np
+  geometry = SeriesGeometry.forFiles(filePaths)
+  rows = geometry.rows(filePaths)
 
-  if slicer.dicomDatabase.fileValue(filePaths[0], tags['numberOfFrames']) != "":
+  if geometry.numberOfFrames[rows[0]] != "":
     warningText += "Multi-frame image. If slice orientation or spacing is non-uniform then the image may be displayed incorrectly. Use with caution.\n"
 
   # Make sure first file contains valid geometry
-  ref = {}
-  for tag in [tags['position'], tags['orientation']]:
-    value = slicer.dicomDatabase.fileValue(filePaths[0], tag)
-    if not value or value == "":
-      warningText += "Reference image in series does not contain geometry information. Please use caution.\n"
-      return filePaths, [], warningText
-    ref[tag] = value
-
-  # Determine out-of-plane direction for first slice
-  import numpy as np
-  sliceAxes = [float(zz) for zz in ref[tags['orientation']].split('\\')]
-  x = np.array(sliceAxes[:3])
-  y = np.array(sliceAxes[3:])
-  scanAxis = np.cross(x,y)
-  scanOrigin = np.array([float(zz) for zz in ref[tags['position']].split('\\')])
-
-  # For each file in series, calculate the distance along the scan axis, sort files by this
-  sortList = []
-  missingGeometry = False
-  for file in filePaths:
-    positionStr = slicer.dicomDatabase.fileValue(file,tags['position'])
-    orientationStr = slicer.dicomDatabase.fileValue(file,tags['orientation'])
-    if not positionStr or positionStr == "" or not orientationStr or orientationStr == "":
-      missingGeometry = True
-      break
-    position = np.array([float(zz) for zz in positionStr.split('\\')])
-    vec = position - scanOrigin
-    dist = vec.dot(scanAxis)
-    sortList.append((file, dist))
+  positions = geometry.positions[rows]
+  orientations = geometry.orientations[rows]
+  if np.isnan(positions[0]).any() or np.isnan(orientations[0]).any():
+    warningText += "Reference image in series does not contain geometry information. Please use caution.\n"
+    return filePaths, [], warningText
 
-  if missingGeometry:
+  if np.isnan(positions).any() or np.isnan(orientations).any():
     warningText += "One or more images is missing geometry information in series. Please use caution.\n"
     return filePaths, [], warningText
 
-  # Sort files names by distance from reference slice
-  sortedFiles = sorted(sortList, key=lambda x: x[1])
-  files = []
-  distances = {}
-  for file,dist in sortedFiles:
-    files.append(file)
-    distances[file] = dist
+  # Determine out-of-plane direction for first slice
+  scanAxis = np.cross(orientations[0, :3], orientations[0, 3:])
+  scanOrigin = positions[0]
+
+  # For each file in series, calculate the distance along the scan axis, sort files by this
+  fileDistances = (positions - scanOrigin).dot(scanAxis)
+  order = np.argsort(fileDistances, kind='stable')
+  sortedDistances = fileDistances[order]
+  files = [filePaths[index] for index in order]
+  distances = dict(zip(files, sortedDistances.tolist()))
 
   # Get acquisition geometry regularization setting value
   settings = qt.QSettings()
@@ -602,28 +716,18 @@ def getSortedImageFiles(filePaths, epsilon=0.01):
   # - use variable 'epsilon' to determine the tolerance
   spaceWarnings = 0
   if len(files) > 1:
-    file0 = files[0]
-    file1 = files[1]
-    dist0 = distances[file0]
-    dist1 = distances[file1]
-    spacing0 = dist1 - dist0
-    n = 1
-    for fileN in files[1:]:
-      fileNminus1 = files[n-1]
-      distN = distances[fileN]
-      distNminus1 = distances[fileNminus1]
-      spacingN = distN - distNminus1
-      spaceError = spacingN - spacing0
-      if abs(spaceError) > epsilon:
-        spaceWarnings += 1
-        warningText += "Images are not equally spaced (a difference of %g vs %g in spacings was detected)." % (spaceError, spacing0)
-        if acquisitionGeometryRegularizationEnabled:
-          warningText += "  Slicer will apply a transform to this series trying to regularize the volume. Please use caution.\n"
-        else:
-          warningText += ("  If loaded image appears distorted, enable 'Acquisition geometry regularization'"
-            " in Application settings / DICOM / DICOMScalarVolumePlugin. Please use caution.\n")
-        break
-      n += 1
+    spacings = np.diff(sortedDistances)
+    spacing0 = spacings[0]
+    spaceErrors = spacings - spacing0
+    irregularSpacings = np.flatnonzero(np.abs(spaceErrors) > epsilon)
+    if len(irregularSpacings):
+      spaceWarnings += 1
+      warningText += "Images are not equally spaced (a difference of %g vs %g in spacings was detected)." % (spaceErrors[irregularSpacings[0]], spacing0)
+      if acquisitionGeometryRegularizationEnabled:
+        warningText += "  Slicer will apply a transform to this series trying to regularize the volume. Please use caution.\n"
+      else:
+        warningText += ("  If loaded image appears distorted, enable 'Acquisition geometry regularization'"
+          " in Application settings / DICOM / DICOMScalarVolumePlugin. Please use caution.\n")
 
   if spaceWarnings != 0:
     logging.warning("Geometric issues were found with %d of the series. Please use caution.\n" % spaceWarnings)
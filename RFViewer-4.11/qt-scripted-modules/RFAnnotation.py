@@ -3,7 +3,7 @@ from slicer.ScriptedLoadableModule import *
 from RFAnnotationLib import RFLineProfileWidget
 from RFAnnotationLib import RFAnnotationCanalWidget
 from RFViewerHomeLib import RFViewerWidget, jumpSlicesToNthMarkupPosition, removeNodeFromMRMLScene, getNodeByID, \
-  translatable
+  translatable, SessionLoadStage
 from RFVisualizationLib import setNodeVisibleInMainViewsOnly
 
 
@@ -19,6 +19,8 @@ class RFAnnotation(ScriptedLoadableModule):
 
 @translatable
 class RFAnnotationWidget(RFViewerWidget):
+  sessionLoadStage = SessionLoadStage.Annotations
+
   def __init__(self, parent=None):
     RFViewerWidget.__init__(self, parent)
     settings = qt.QSettings()
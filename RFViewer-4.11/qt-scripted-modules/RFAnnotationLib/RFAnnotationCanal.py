@@ -142,16 +142,17 @@ class RFAnnotationCanalWidget(qt.QWidget):
   def onMarkupPointsModified(self, canal):
     self.currentCanal = canal
     self.updateUI(enablePlaceMode=None)
-    self.updateModelFromSegmentMarkupNode()
+    # Cheap tube while a point is dragged, the full resolution tube is generated when the drag ends
+    self.updateModelFromSegmentMarkupNode(preview=canal.isInteracting)
 
   def onEndPlacingFiducial(self, *args):
     if self.currentCanal is not None:
       self.hideOptions()
 
-  def updateModelFromSegmentMarkupNode(self):
+  def updateModelFromSegmentMarkupNode(self, preview=False):
     if not self.currentCanal:
       return
-    self.logic.updateModelFromMarkup(self.currentCanal.markupNode, self.currentCanal.modelNode)
+    self.logic.updateModelFromMarkup(self.currentCanal.markupNode, self.currentCanal.modelNode, preview)
 
   def getParameterDict(self):
     paramDict = {}
@@ -177,21 +178,46 @@ class RFAnnotationCanalLogic(object):
   def __init__(self):
     self.radius = 1.0
     self.numberOfLineSegmentsBetweenControlPoints = 15
+    self.tubeNumberOfSides = 8
+    self.previewNumberOfLineSegmentsBetweenControlPoints = 3
+    self.previewTubeNumberOfSides = 4
     self.interpolationType = slicer.vtkMRMLMarkupsToModelNode.KochanekSpline
     self.polynomialFitType = slicer.vtkMRMLMarkupsToModelNode.MovingLeastSquares
     self.curveGenerator = slicer.vtkCurveGenerator()
-
-  def updateModelFromMarkup(self, inputMarkup, outputModel):
+    # Geometry of the last tube generated in each model (see modelGeometryKey)
+    self._modelGeometryKeys = {}
+
+  def modelGeometryKey(self, inputMarkup, preview):
+    """Markup points and tube parameters from which the model is generated"""
+    position = [0.0, 0.0, 0.0]
+    points = []
+    for i in range(inputMarkup.GetNumberOfControlPoints()):
+      inputMarkup.GetNthControlPointPosition(i, position)
+      points.append(tuple(position))
+    return tuple(points), self.radius, preview
+
+  def updateModelFromMarkup(self, inputMarkup, outputModel, preview=False):
     """
-    Update model to enclose all points in the input markup list
+    Update model to enclose all points in the input markup list.
+
+    The model is not generated again if the markup points, the radius and the resolution didn't change since its last
+    update. Preview models have fewer tube sides and line segments, they are meant to be shown while the markup points
+    are dragged.
     """
+    geometryKey = self.modelGeometryKey(inputMarkup, preview)
+    if self._modelGeometryKeys.get(outputModel.GetID()) == geometryKey:
+      return
+    self._modelGeometryKeys[outputModel.GetID()] = geometryKey
+
     markupsToModel = slicer.modules.markupstomodel.logic()
     tubeLoop = False
-    tubeNumberOfSides = 8
+    tubeNumberOfSides = self.previewTubeNumberOfSides if preview else self.tubeNumberOfSides
+    numberOfLineSegmentsBetweenControlPoints = self.previewNumberOfLineSegmentsBetweenControlPoints if preview \
+      else self.numberOfLineSegmentsBetweenControlPoints
     cleanMarkups = True
     polynomialOrder = 3
     # Create Canal from points
     markupsToModel.UpdateOutputCurveModel( inputMarkup, outputModel,
-      self.interpolationType, tubeLoop, self.radius, tubeNumberOfSides, self.numberOfLineSegmentsBetweenControlPoints,
+      self.interpolationType, tubeLoop, self.radius, tubeNumberOfSides, numberOfLineSegmentsBetweenControlPoints,
       cleanMarkups, polynomialOrder, slicer.vtkMRMLMarkupsToModelNode.RawIndices, self.curveGenerator,
-      self.polynomialFitType )
\ No newline at end of file
+      self.polynomialFitType )
@@ -3,14 +3,29 @@ from RFViewerHomeLib import removeNodeFromMRMLScene, Signal
 
 
 class RFCanal:
+  """
+  Canal markup points and the tube model generated from them.
+
+  The markup events are coalesced : markupPointsModifiedSignal is emitted once per event loop iteration whatever the
+  number of markup events received during the iteration. isInteracting is True while a markup point is dragged, the
+  signal is emitted again when the drag ends.
+  """
+
   def __init__(self, radius):
     self.modelNode = None
     self.markupNode = None
     self.markupNodeObservers = []
     self.radius = radius
+    self.isInteracting = False
     self.markupPointsModifiedSignal = Signal("RFCanal")
 
+    self._modifiedTimer = qt.QTimer()
+    self._modifiedTimer.setSingleShot(True)
+    self._modifiedTimer.setInterval(0)
+    self._modifiedTimer.connect('timeout()', self._emitCanalModified)
+
   def __del__(self):
+    self._modifiedTimer.stop()
     self.deleteFromScene()
 
   def isPresentInScene(self):
@@ -20,6 +35,7 @@ class RFCanal:
     if not self.isPresentInScene():
       return
 
+    self._modifiedTimer.stop()
     for observers in self.markupNodeObservers:
       self.markupNode.RemoveObserver(observers)
 
@@ -71,9 +87,6 @@ class RFCanal:
     self._observeMarkupNode()
 
   def _observeMarkupNode(self):
-    def emitCanalModified(*args):
-      self.markupPointsModifiedSignal.emit(self)
-
     # Set and observe new parameter node
     eventIds = [vtk.vtkCommand.ModifiedEvent,
       slicer.vtkMRMLMarkupsNode.PointModifiedEvent,
@@ -81,11 +94,30 @@ class RFCanal:
       slicer.vtkMRMLMarkupsNode.PointRemovedEvent]
 
     for eventId in eventIds:
-      self.markupNodeObservers.append(self.markupNode.AddObserver(eventId, emitCanalModified))
+      self.markupNodeObservers.append(self.markupNode.AddObserver(eventId, self._onMarkupModified))
 
+    self.markupNodeObservers.append(
+      self.markupNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointStartInteractionEvent, self._onInteractionStarted))
+    self.markupNodeObservers.append(
+      self.markupNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointEndInteractionEvent, self._onInteractionEnded))
     self.markupNodeObservers.append(
       self.markupNode.AddObserver(slicer.vtkMRMLMarkupsNode.DisplayModifiedEvent, self._onMarkupDisplayChanged))
 
+  def _onMarkupModified(self, *args):
+    if not self._modifiedTimer.isActive():
+      self._modifiedTimer.start()
+
+  def _onInteractionStarted(self, *args):
+    self.isInteracting = True
+
+  def _onInteractionEnded(self, *args):
+    self.isInteracting = False
+    self._onMarkupModified()
+
+  def _emitCanalModified(self):
+    if self.isPresentInScene():
+      self.markupPointsModifiedSignal.emit(self)
+
   def _onMarkupDisplayChanged(self, *args):
     if not self.isPresentInScene():
       return
@@ -1,6 +1,9 @@
+import numpy as np
 import qt
 import slicer
 import vtk
+import vtk.util.numpy_support
+from slicer.ScriptedLoadableModule import ScriptedLoadableModuleTest
 
 from RFAnnotationLib import getLineResolutionFromLineLength, getOrCreateTableColumn, getCurrentLayout
 from RFVisualizationLib import RFLayoutType
@@ -64,29 +67,162 @@ class RFLineProfileWidget(qt.QWidget):
     self.enableApplyButton()
     self.logic.setMarkupNode(node)
 
+#
+# RFLineProfilePipeline
+#
+class RFLineProfilePipeline(object):
+  """
+  Intensity profile of a markup curve in a volume.
+
+  The RAS to IJK transform and probe filters are created once and only fed with the new curve points : dragging a line
+  point doesn't rebuild the VTK pipeline.
+  """
+
+  def __init__(self):
+    self._rasToIJKMatrix = vtk.vtkMatrix4x4()
+    self._inputVolumeToIJKTransform = vtk.vtkTransform()
+    self._rasToInputVolumeTransform = vtk.vtkGeneralTransform()
+    rasToIJKTransform = vtk.vtkGeneralTransform()
+    rasToIJKTransform.Concatenate(self._inputVolumeToIJKTransform)
+    rasToIJKTransform.Concatenate(self._rasToInputVolumeTransform)
+
+    self._curvePoly_RAS = vtk.vtkPolyData()
+    self._transformRasToIjk = vtk.vtkTransformPolyDataFilter()
+    self._transformRasToIjk.SetInputData(self._curvePoly_RAS)
+    self._transformRasToIjk.SetTransform(rasToIJKTransform)
+
+    self._sampledCurvePoints_IJK = vtk.vtkPoints()
+    sampledCurvePoly_IJK = vtk.vtkPolyData()
+    sampledCurvePoly_IJK.SetPoints(self._sampledCurvePoints_IJK)
+    self._probeFilter = vtk.vtkProbeFilter()
+    self._probeFilter.SetInputData(sampledCurvePoly_IJK)
+    self._probeFilter.ComputeToleranceOff()
+
+  def profile(self, markupNode, volumeNode):
+    """
+    Probes the volume along the curve of the markup node, every 1 / getLineResolutionFromLineLength(1) mm.
+
+    :return: (distances, intensities) numpy arrays of the profile, None if the curve has less than 2 points
+    """
+    if markupNode.GetNumberOfDefinedControlPoints() < 2:
+      return None
+
+    curvePoints_RAS = markupNode.GetCurvePointsWorld()
+    isClosedCurve = markupNode.IsA('vtkMRMLClosedCurveNode')
+    curveLengthMm = slicer.vtkMRMLMarkupsCurveNode.GetCurveLength(curvePoints_RAS, isClosedCurve)
+    lineResolution = getLineResolutionFromLineLength(curveLengthMm)
+
+    curvePoints_IJK = self._transformRASToIJK(curvePoints_RAS, volumeNode)
+    self._moveCurvePointsEndPointsToFitSingleSliceVolume(curvePoints_IJK, volumeNode)
+
+    samplingDistance = curveLengthMm / lineResolution
+    probedPoints = self._probeVolumeAlongCurve(curvePoints_IJK, samplingDistance, isClosedCurve, volumeNode)
+
+    pointCount = probedPoints.GetNumberOfPoints()
+    intensities = vtk.util.numpy_support.vtk_to_numpy(probedPoints.GetPointData().GetScalars())
+    distances = np.arange(pointCount) * (curveLengthMm / max(pointCount - 1, 1))
+    return distances, intensities.reshape(pointCount, -1)[:, 0]
+
+  def _transformRASToIJK(self, curvePoints_RAS, volume):
+    # Need to get the start/end point of the line in the IJK coordinate system
+    # as VTK filters cannot take into account direction cosines
+    # We transform the curve points from RAS coordinate system (instead of directly from the inputCurve coordinate system)
+    # to make sure the curve is transformed to RAS exactly the same way as it is done for display.
+    volume.GetRASToIJKMatrix(self._rasToIJKMatrix)
+    self._inputVolumeToIJKTransform.SetMatrix(self._rasToIJKMatrix)
+    slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(None, volume.GetParentTransformNode(),
+                                                         self._rasToInputVolumeTransform)
+    self._curvePoly_RAS.SetPoints(curvePoints_RAS)
+    self._transformRasToIjk.Modified()
+    self._transformRasToIjk.Update()
+    return self._transformRasToIjk.GetOutput().GetPoints()
+
+  def _moveCurvePointsEndPointsToFitSingleSliceVolume(self, curvePoints_IJK, inputVolume):
+    startPointIndex = 0
+    endPointIndex = curvePoints_IJK.GetNumberOfPoints() - 1
+    lineStartPoint_IJK = list(curvePoints_IJK.GetPoint(startPointIndex))
+    lineEndPoint_IJK = list(curvePoints_IJK.GetPoint(endPointIndex))
+
+    # Special case: single-slice volume
+    # vtkProbeFilter treats vtkImageData as a general data set and it considers its bounds to end
+    # in the middle of edge voxels. This makes single-slice volumes to have zero thickness, which
+    # can be easily missed by a line that that is drawn on the plane (e.g., they happen to be
+    # extremely on the same side of the plane, very slightly off, due to runding errors).
+    # We move the start/end points very close to the plane and force them to be on opposite sides of the plane.
+    dims = inputVolume.GetImageData().GetDimensions()
+    for axisIndex in range(3):
+      if dims[axisIndex] == 1:
+        if abs(lineStartPoint_IJK[axisIndex]) < 0.5 and abs(lineEndPoint_IJK[axisIndex]) < 0.5:
+          # both points are inside the volume plane
+          # keep their distance the same (to keep the overall length of the line he same)
+          # but make sure the points are on the opposite side of the plane (to ensure probe filter
+          # considers the line crossing the image plane)
+          pointDistance = max(abs(lineStartPoint_IJK[axisIndex]-lineEndPoint_IJK[axisIndex]), 1e-6)
+          lineStartPoint_IJK[axisIndex] = -0.5 * pointDistance
+          lineEndPoint_IJK[axisIndex] = 0.5 * pointDistance
+          curvePoints_IJK.SetPoint(startPointIndex, lineStartPoint_IJK)
+          curvePoints_IJK.SetPoint(endPointIndex, lineEndPoint_IJK)
+
+  def _probeVolumeAlongCurve(self, curvePoints_IJK, samplingDistance, isClosedCurve, volumeNode):
+    slicer.vtkMRMLMarkupsCurveNode.ResamplePoints(curvePoints_IJK, self._sampledCurvePoints_IJK, samplingDistance,
+                                                  isClosedCurve)
+    self._sampledCurvePoints_IJK.Modified()
+
+    self._probeFilter.SetSourceData(volumeNode.GetImageData())
+    self._probeFilter.Update()
+
+    return self._probeFilter.GetOutput()
+
+
 #
 # RFLineProfileLogic
 #
 @translatable
 class RFLineProfileLogic(object):
+  """
+  Intensity profiles of markup lines in the input volume, shown in one plot chart.
+
+  The primary line is set with setMarkupNode, more lines can be added to the chart with addMarkupNode. Each line has
+  its own table and plot series. Line modifications are coalesced : the profiles of the lines modified since the last
+  update are computed at most once per updateIntervalMs, the other lines are not computed again.
+  """
+  updateIntervalMs = 15
+  seriesColors = [(0.0, 0.0, 0.9), (0.9, 0.0, 0.0), (0.0, 0.6, 0.0), (0.9, 0.5, 0.0), (0.5, 0.0, 0.7)]
 
   def __init__(self):
     self.inputVolumeNode = None
     self.markupNode = None
-    self.markupObservation = None
-    self.tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode")
     self.distanceArrayName = "Distance"
     self.intensityArrayName = "Intensity"
+    self._pipeline = RFLineProfilePipeline()
 
-    self.plotSeriesNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotSeriesNode")
+    # Series of the primary line first, then series of the lines added with addMarkupNode
+    self._series = []
+    self._modifiedSeries = set()
+    self._updateTimer = qt.QTimer()
+    self._updateTimer.setSingleShot(True)
+    self._updateTimer.setInterval(self.updateIntervalMs)
+    self._updateTimer.connect('timeout()', self.updateModifiedProfiles)
 
     self.plotChartNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotChartNode")
     self.plotChartNode.SetXAxisTitle(self.tr("Distance (mm)"))
     self.plotChartNode.SetYAxisTitle(self.tr("Intensity"))
-    self.plotChartNode.AddAndObservePlotSeriesNodeID(self.plotSeriesNode.GetID())
+
+    primarySeries = self._addSeries()
+    self.tableNode = primarySeries.tableNode
+    self.plotSeriesNode = primarySeries.plotSeriesNode
 
   def __del__(self):
-    self.setMarkupObservation(False)
+    self._updateTimer.stop()
+    for series in self._series:
+      series.setObservation(None, None)
+
+  def _addSeries(self):
+    series = RFLineProfileSeries(self.distanceArrayName, self.intensityArrayName,
+                                 self.seriesColors[len(self._series) % len(self.seriesColors)])
+    self.plotChartNode.AddAndObservePlotSeriesNodeID(series.plotSeriesNode.GetID())
+    self._series.append(series)
+    return series
 
   def setInputVolumeNode(self, volumeNode):
     self.inputVolumeNode = volumeNode
@@ -99,76 +235,58 @@ class RFLineProfileLogic(object):
     if self.markupNode == markupNode:
       return
 
-     # remove old observers
-    self.setMarkupObservation(False)
     self.markupNode = markupNode
+    self._series[0].setObservation(markupNode, self.onLineModified)
+    self.update()
 
-    if self.markupNode is not None:
-      # add new observers
-      self.setMarkupObservation(True)
-      self.plotSeriesNode.SetName(self.markupNode.GetName())
-
+  def addMarkupNode(self, markupNode):
+    """Adds the profile of another line to the chart"""
+    if markupNode is None or any(series.markupNode == markupNode for series in self._series):
+      return
+    self._addSeries().setObservation(markupNode, self.onLineModified)
     self.update()
 
+  def removeMarkupNode(self, markupNode):
+    """Removes the profile of a line added with addMarkupNode"""
+    for series in self._series[1:]:
+      if series.markupNode == markupNode:
+        series.setObservation(None, None)
+        self.plotChartNode.RemovePlotSeriesNodeID(series.plotSeriesNode.GetID())
+        series.removeNodes()
+        self._series.remove(series)
+        self._modifiedSeries.discard(series)
+        return
+
+  def getMarkupNodes(self):
+    return [series.markupNode for series in self._series if series.markupNode is not None]
+
   def update(self):
-    if self.inputVolumeNode is None:
+    """Updates the profiles of every line"""
+    self._updateTimer.stop()
+    self._modifiedSeries.clear()
+    self._updateProfiles(self._series)
+
+  def updateModifiedProfiles(self):
+    """Updates the profiles of the lines modified since the last update"""
+    modifiedSeries = [series for series in self._series if series in self._modifiedSeries]
+    self._modifiedSeries.clear()
+    self._updateProfiles(modifiedSeries)
+
+  def _updateProfiles(self, seriesList):
+    if self.inputVolumeNode is None or not seriesList:
       return
-    if self.markupNode is None:
-      # reinitialize plot in order to show empty plot
-      self.reinitializePlot()
-    else:
-      self.updateOutputTable()
-    self.updatePlot()
+    for series in seriesList:
+      series.update(self._pipeline, self.inputVolumeNode)
 
     # We are already in plot view
     if getCurrentLayout() == slicer.vtkMRMLLayoutNode.SlicerLayoutFourUpPlotView:
       # Reinitialize the view in order to fit the whole plot
       slicer.app.layoutManager().plotWidget(0).plotView().fitToContent()
 
-  def setMarkupObservation(self, enable):
-    if self.markupObservation:
-      self.markupNode.RemoveObserver(self.markupObservation)
-      self.markupObservation = None
-    if enable and (self.markupNode is not None):
-      self.markupObservation = self.markupNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self.onLineModified)
-
   def onLineModified(self, caller=None, event=None):
-    self.update()
-
-  def updatePlot(self):
-    if self.plotSeriesNode is None:
-      return
-    # Create plot
-    self.plotSeriesNode.SetAndObserveTableNodeID(self.tableNode.GetID())
-    self.plotSeriesNode.SetXColumnName(self.distanceArrayName)
-    self.plotSeriesNode.SetYColumnName(self.intensityArrayName)
-    self.plotSeriesNode.SetPlotType(slicer.vtkMRMLPlotSeriesNode.PlotTypeScatter)
-    self.plotSeriesNode.SetMarkerStyle(slicer.vtkMRMLPlotSeriesNode.MarkerStyleNone)
-    self.plotSeriesNode.SetColor(0.0, 0.0, 0.9)
-
-  def reinitializePlot(self):
-    for columnName in [self.distanceArrayName, self.intensityArrayName]:
-      getOrCreateTableColumn(self.tableNode, columnName).Initialize()
-
-  def updateOutputTable(self):
-    if self.markupNode.GetNumberOfDefinedControlPoints() < 2:
-      self.tableNode.GetTable().SetNumberOfRows(0)
-      return
-
-    curvePoints_RAS = self.markupNode.GetCurvePointsWorld()
-    isClosedCurve = self.markupNode.IsA('vtkMRMLClosedCurveNode')
-    curveLengthMm = slicer.vtkMRMLMarkupsCurveNode.GetCurveLength(curvePoints_RAS, isClosedCurve)
-    lineResolution = getLineResolutionFromLineLength(curveLengthMm)
-
-    curvePoly_IJK = self._transformRASToIJK(curvePoints_RAS, self.inputVolumeNode)
-    curvePoints_IJK = curvePoly_IJK.GetPoints()
-
-    self._moveCurvePointsEndPointsToFitSingleSliceVolume(curvePoints_IJK, self.inputVolumeNode)
-
-    samplingDistance = curveLengthMm / lineResolution
-    probedPoints = self._probeVolumeAlongCurve(curvePoints_IJK, samplingDistance, isClosedCurve, self.inputVolumeNode)
-
-    self._createArrayOfData(probedPoints, curveLengthMm)
+    self._modifiedSeries.update(series for series in self._series if series.markupNode == caller)
+    if not self._updateTimer.isActive():
+      self._updateTimer.start()
 
   def showPlot(self):
     # Show plot in layout
@@ -176,85 +294,60 @@ class RFLineProfileLogic(object):
     slicer.modules.plots.logic().ShowChartInLayout(self.plotChartNode)
     slicer.app.layoutManager().plotWidget(0).plotView().fitToContent()
 
-  def _transformRASToIJK(self, curvePoints_RAS, volume):
-    # Need to get the start/end point of the line in the IJK coordinate system
-    # as VTK filters cannot take into account direction cosines
-    # We transform the curve points from RAS coordinate system (instead of directly from the inputCurve coordinate system)
-    # to make sure the curve is transformed to RAS exactly the same way as it is done for display.
-    inputVolumeToIJK = vtk.vtkMatrix4x4()
-    volume.GetRASToIJKMatrix(inputVolumeToIJK)
-    rasToInputVolumeTransform = vtk.vtkGeneralTransform()
-    slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(None, volume.GetParentTransformNode(), rasToInputVolumeTransform)
-    rasToIJKTransform = vtk.vtkGeneralTransform()
-    rasToIJKTransform.Concatenate(inputVolumeToIJK)
-    rasToIJKTransform.Concatenate(rasToInputVolumeTransform)
-
-    curvePoly_RAS = vtk.vtkPolyData()
-    curvePoly_RAS.SetPoints(curvePoints_RAS)
 
-    transformRasToIjk = vtk.vtkTransformPolyDataFilter()
-    transformRasToIjk.SetInputData(curvePoly_RAS)
-    transformRasToIjk.SetTransform(rasToIJKTransform)
-    transformRasToIjk.Update()
-    return transformRasToIjk.GetOutput()
+class RFLineProfileSeries(object):
+  """Table and plot series of the intensity profile of one markup line"""
 
-  def _moveCurvePointsEndPointsToFitSingleSliceVolume(self, curvePoints_IJK, inputVolume):
-    startPointIndex = 0
-    endPointIndex = curvePoints_IJK.GetNumberOfPoints() - 1
-    lineStartPoint_IJK = curvePoints_IJK.GetPoint(startPointIndex)
-    lineEndPoint_IJK = curvePoints_IJK.GetPoint(endPointIndex)
+  def __init__(self, distanceArrayName, intensityArrayName, color):
+    self.markupNode = None
+    self._markupObservation = None
+    self.distanceArrayName = distanceArrayName
+    self.intensityArrayName = intensityArrayName
 
-    # Special case: single-slice volume
-    # vtkProbeFilter treats vtkImageData as a general data set and it considers its bounds to end
-    # in the middle of edge voxels. This makes single-slice volumes to have zero thickness, which
-    # can be easily missed by a line that that is drawn on the plane (e.g., they happen to be
-    # extremely on the same side of the plane, very slightly off, due to runding errors).
-    # We move the start/end points very close to the plane and force them to be on opposite sides of the plane.
-    dims = inputVolume.GetImageData().GetDimensions()
-    for axisIndex in range(3):
-      if dims[axisIndex] == 1:
-        if abs(lineStartPoint_IJK[axisIndex]) < 0.5 and abs(lineEndPoint_IJK[axisIndex]) < 0.5:
-          # both points are inside the volume plane
-          # keep their distance the same (to keep the overall length of the line he same)
-          # but make sure the points are on the opposite side of the plane (to ensure probe filter
-          # considers the line crossing the image plane)
-          pointDistance = max(abs(lineStartPoint_IJK[axisIndex]-lineEndPoint_IJK[axisIndex]), 1e-6)
-          lineStartPoint_IJK[axisIndex] = -0.5 * pointDistance
-          lineEndPoint_IJK[axisIndex] = 0.5 * pointDistance
-          curvePoints_IJK.SetPoint(startPointIndex, lineStartPoint_IJK)
-          curvePoints_IJK.SetPoint(endPointIndex, lineEndPoint_IJK)
+    self.tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode")
+    for columnName in [self.distanceArrayName, self.intensityArrayName]:
+      getOrCreateTableColumn(self.tableNode, columnName)
 
-  def _probeVolumeAlongCurve(self, curvePoints_IJK, samplingDistance, isClosedCurve, volumeNode):
-    sampledCurvePoints_IJK = vtk.vtkPoints()
-    slicer.vtkMRMLMarkupsCurveNode.ResamplePoints(curvePoints_IJK, sampledCurvePoints_IJK, samplingDistance, isClosedCurve)
+    self.plotSeriesNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotSeriesNode")
+    self.plotSeriesNode.SetAndObserveTableNodeID(self.tableNode.GetID())
+    self.plotSeriesNode.SetXColumnName(self.distanceArrayName)
+    self.plotSeriesNode.SetYColumnName(self.intensityArrayName)
+    self.plotSeriesNode.SetPlotType(slicer.vtkMRMLPlotSeriesNode.PlotTypeScatter)
+    self.plotSeriesNode.SetMarkerStyle(slicer.vtkMRMLPlotSeriesNode.MarkerStyleNone)
+    self.plotSeriesNode.SetColor(*color)
 
-    sampledCurvePoly_IJK = vtk.vtkPolyData()
-    sampledCurvePoly_IJK.SetPoints(sampledCurvePoints_IJK)
-
-    probeFilter = vtk.vtkProbeFilter()
-    probeFilter.SetInputData(sampledCurvePoly_IJK)
-    probeFilter.SetSourceData(volumeNode.GetImageData())
-    probeFilter.ComputeToleranceOff()
-    probeFilter.Update()
-
-    return probeFilter.GetOutput()
-
-  def _createArrayOfData(self, probedPoints, curveLengthMm):
-    # Create arrays of data
-    distanceArray = getOrCreateTableColumn(self.tableNode, self.distanceArrayName)
-    intensityArray = getOrCreateTableColumn(self.tableNode, self.intensityArrayName)
-    self.tableNode.GetTable().SetNumberOfRows(probedPoints.GetNumberOfPoints())
-    x = range(0, probedPoints.GetNumberOfPoints())
-    xStep = curveLengthMm/(probedPoints.GetNumberOfPoints()-1)
-    probedPointScalars = probedPoints.GetPointData().GetScalars()
-    for i in range(len(x)):
-      distanceArray.SetValue(i, x[i]*xStep)
-      intensityArray.SetValue(i, probedPointScalars.GetTuple(i)[0])
-    distanceArray.Modified()
-    intensityArray.Modified()
-    self.tableNode.GetTable().Modified()
-
-class RFLineProfileTest():
+  def setObservation(self, markupNode, callback):
+    """Observes the point modifications of the markup node, the previous markup node is not observed anymore"""
+    if self._markupObservation:
+      self.markupNode.RemoveObserver(self._markupObservation)
+      self._markupObservation = None
+    self.markupNode = markupNode
+    if markupNode is not None and callback is not None:
+      self._markupObservation = markupNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointModifiedEvent, callback)
+      self.plotSeriesNode.SetName(markupNode.GetName())
+
+  def removeNodes(self):
+    removeNodeFromMRMLScene(self.plotSeriesNode)
+    removeNodeFromMRMLScene(self.tableNode)
+
+  def update(self, pipeline, volumeNode):
+    profile = pipeline.profile(self.markupNode, volumeNode) if self.markupNode is not None else None
+    distances, intensities = profile if profile is not None else ([], [])
+    self.setProfile(distances, intensities)
+
+  def setProfile(self, distances, intensities):
+    """Copies the profile arrays into the table columns"""
+    table = self.tableNode.GetTable()
+    table.SetNumberOfRows(len(distances))
+    for columnName, values in [(self.distanceArrayName, distances), (self.intensityArrayName, intensities)]:
+      column = getOrCreateTableColumn(self.tableNode, columnName)
+      if len(values):
+        vtk.util.numpy_support.vtk_to_numpy(column)[:] = values
+      column.Modified()
+    table.Modified()
+
+
+class RFLineProfileTest(ScriptedLoadableModuleTest):
   """
   This is the test case for your scripted module.
   Uses ScriptedLoadableModuleTest base class, available at:
@@ -271,6 +364,8 @@ class RFLineProfileTest():
     """
     self.setUp()
     self.test_RFLineProfile1()
+    self.setUp()
+    self.test_RFLineProfileOfSeveralLines()
 
   def test_RFLineProfile1(self):
     """ Ideally you should have several levels of tests.  At the lowest level
@@ -296,3 +391,38 @@ class RFLineProfileTest():
 
     self.delayDisplay('Test passed!')
 
+  def test_RFLineProfileOfSeveralLines(self):
+    volumeNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode')
+    slicer.util.updateVolumeFromArray(volumeNode, np.tile(np.arange(50, dtype=np.int16), (10, 20, 1)))
+
+    firstLine = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsLineNode')
+    firstLine.AddControlPoint(vtk.vtkVector3d(10, 5, 5))
+    firstLine.AddControlPoint(vtk.vtkVector3d(30, 5, 5))
+    secondLine = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsLineNode')
+    secondLine.AddControlPoint(vtk.vtkVector3d(20, 2, 5))
+    secondLine.AddControlPoint(vtk.vtkVector3d(20, 15, 5))
+
+    logic = RFLineProfileLogic()
+    logic.setInputVolumeNode(volumeNode)
+    logic.setMarkupNode(firstLine)
+    logic.addMarkupNode(secondLine)
+    self.assertEqual(logic.getMarkupNodes(), [firstLine, secondLine])
+
+    # The first line goes along the intensity gradient, the intensity is constant along the second line
+    distances = slicer.util.arrayFromTableColumn(logic.tableNode, logic.distanceArrayName)
+    intensities = slicer.util.arrayFromTableColumn(logic.tableNode, logic.intensityArrayName)
+    self.assertAlmostEqual(distances[-1], 20.0)
+    self.assertTrue(np.allclose(intensities, 10 + distances, atol=1e-3))
+    secondTableNode = logic._series[1].tableNode
+    self.assertTrue(np.allclose(slicer.util.arrayFromTableColumn(secondTableNode, logic.intensityArrayName), 20))
+
+    # Only the modified line profile is computed again
+    firstTableMTime = logic.tableNode.GetTable().GetMTime()
+    secondLine.SetNthControlPointPosition(1, 25, 15, 5)
+    secondLine.SetNthControlPointPosition(0, 25, 2, 5)
+    logic.updateModifiedProfiles()
+    self.assertEqual(firstTableMTime, logic.tableNode.GetTable().GetMTime())
+    self.assertTrue(np.allclose(slicer.util.arrayFromTableColumn(secondTableNode, logic.intensityArrayName), 25))
+
+    logic.removeMarkupNode(secondLine)
+    self.assertEqual(logic.getMarkupNodes(), [firstLine])
@@ -1,6 +1,7 @@
 import json
 import logging
 import os
+import unittest
 
 import ctk
 import numpy as np
@@ -11,9 +12,10 @@ from slicer.ScriptedLoadableModule import *
 from slicer.util import VTKObservationMixin
 from shutil import copyfile
 
-from RFImplantLib import RFImplantUI, Roles, RFImplantObject
+from RFImplantLib import RFImplantUI, RFImplantObject, ImplantCatalog, ImplantCatalogModel, \
+    implantColumns, ImplantMeshCache
 from RFViewerHomeLib import createButton, createFileSelector, translatable, RFViewerWidget, nodeID, getNodeByID, \
-    removeNodeFromMRMLScene, wrapInQTimer, TemporarySymlink, getShortPathToExistingPath
+    removeNodeFromMRMLScene, wrapInQTimer, TemporarySymlink, getShortPathToExistingPath, SessionLoadStage
 from RFVisualizationLib import showInMainViews
 from collections import deque
 class RFImplant(ScriptedLoadableModule):
@@ -34,11 +36,14 @@ class RFImplant(ScriptedLoadableModule):
 
 @translatable
 class RFImplantWidget(RFViewerWidget):
+    sessionLoadStage = SessionLoadStage.Implants
+
     def __init__(self, parent):
         RFViewerWidget.__init__(self, parent)
         self._implantUI = RFImplantUI()
         self._dbLineEdit = None
         self._dbFilePath = None
+        self._catalog = None
         self._implantDataSubDir = 'ImplantVMZ'
         self._sceneImplants = []
         self._currentImplant = None
@@ -78,29 +83,49 @@ class RFImplantWidget(RFViewerWidget):
 
     @wrapInQTimer
     def openDB(self):
-        implants, companies, productLines = self.readImplants(self._dbLineEdit.currentPath)
-        if implants is None:
+        catalog = self.readImplants(self._dbLineEdit.currentPath)
+        if catalog is None:
             return
         rootDir = os.path.dirname(self._dbLineEdit.currentPath)
         self._tmpSymlink.setTargetDir(rootDir)
-        # model = self.createImplantModel(implants, rootDir)
-        model = self.createImplantModel(companies, productLines, implants, self._tmpSymlink.getSymlinkPath())
+        model = self.createImplantModel(catalog, self._tmpSymlink.getSymlinkPath())
         self._implantUI.setModel(model)
         self._dbLineEdit.addCurrentPathToHistory()
 
+    @staticmethod
+    def catalogSnapshotDirPath():
+        return os.path.join(slicer.app.cachePath, "RFImplantCatalog")
+
     def readImplants(self, dbFilePath):
-        """Read Microsoft Access database and extract all implants, companies and product lines"""
+        """
+        Returns the ImplantCatalog of the Microsoft Access database.
+
+        The catalog is a local snapshot of the database (see ImplantCatalog), the database itself is only read if it
+        was modified since its snapshot was created.
+        """
         dbFilePath = os.path.normpath(dbFilePath)
-        if dbFilePath == self._dbFilePath:
-            return None, None, None
+        if dbFilePath == self._dbFilePath or not os.path.isfile(dbFilePath):
+            return None
 
+        snapshotPath = ImplantCatalog.defaultSnapshotPath(self.catalogSnapshotDirPath(), dbFilePath)
+        catalog = ImplantCatalog.open(snapshotPath, dbFilePath, lambda: self.readAccessDB(dbFilePath))
+        if catalog is None:
+            return None
+
+        if self._catalog is not None:
+            self._catalog.close()
+        self._catalog = catalog
+        self._dbFilePath = dbFilePath
+        return catalog
+
+    def readAccessDB(self, dbFilePath):
+        """Read Microsoft Access database and extract all implants, companies and product lines"""
         db = qt.QSqlDatabase.addDatabase("QODBC")
         db.setDatabaseName(f'DRIVER={{Microsoft Access Driver (*.mdb, *.accdb)}};FIL={{MS Access}};DBQ={dbFilePath}')
         if not db.open():
             logging.error(f'Failed to open {dbFilePath} : {db.lastError()}')
-            return None, None, None
+            return None
 
-        self._dbFilePath = dbFilePath
         companies = {}
         companyQuery = qt.QSqlQuery("SELECT * FROM Company", db)
         while companyQuery.next():
@@ -154,74 +179,20 @@ class RFImplantWidget(RFViewerWidget):
             companyId = product.get('companyId')
             implant.update({
                 'companyId': companyId,
-                'companyName': companies.get(companyId).get('companyName'),
+                'companyName': companies.get(companyId, {}).get('companyName'),
                 'model': product.get('model')
             })
             implants[implantId] = implant
 
+        db.close()
         return implants, companies, productLines
 
-    # def createImplantModel(self, implants, rootDir):
-    #     model = qt.QStandardItemModel()
-    #     root = model.invisibleRootItem()
-    #     for implantId, implant in implants.items():
-    #         item = qt.QStandardItem()
-    #         iconFilePath = os.path.join(rootDir, self._implantDataSubDir, implant['image_file_name'])
-    #         pixmap = qt.QPixmap(iconFilePath)
-    #         item.setIcon(qt.QIcon(pixmap))
-    #         item.setSizeHint(qt.QSize(60, 60))
-    #         item.setText('{} {}\n{} {}'.format(
-    #             implant['companyName'],
-    #             implant['model'],
-    #             implant['diameter1'],
-    #             implant['length']))
-    #         item.setToolTip(iconFilePath)
-    #         item.setData(implantId, Roles.id)
-    #         item.setData(implant['companyName'], Roles.company)
-    #         item.setData(implant['model'], Roles.model)
-    #         item.setData(implant['diameter1'], Roles.diameter)
-    #         item.setData(implant['length'], Roles.length)
-    #         implantFilePath = os.path.join(rootDir, self._implantDataSubDir, implant['file_name'])
-    #         item.setData(implantFilePath, Roles.file)
-    #         root.appendRow(item)
-
-    #     return model
-    def createImplantModel(self, companies, productLines, implants, rootDir):
-        
-        model = qt.QStandardItemModel()
-        root = model.invisibleRootItem()
-        for companyId, company in companies.items():
-            companyItem = qt.QStandardItem(company['companyName'])
-            for productId, product in productLines.items():
-                if companyId != product['companyId']:
-                    continue
-                productItem = qt.QStandardItem(product['model'])
-                for implantId, implant in implants.items():
-                    if productId != implant['productId']:
-                        continue
-                    item = qt.QStandardItem()
-                    iconFilePath = os.path.join(rootDir, self._implantDataSubDir, implant['image_file_name'])
-                    pixmap = qt.QPixmap(iconFilePath)
-                    item.setIcon(qt.QIcon(pixmap))
-                    item.setSizeHint(qt.QSize(60, 60))
-                    item.setText('{} - {} {} {}'.format(
-                        implant['companyName'],
-                        implant['model'],
-                        implant['diameter1'],
-                        implant['length']))
-                    item.setToolTip(iconFilePath)
-                    item.setData(implantId, Roles.id)
-                    item.setData(implant['companyName'], Roles.company)
-                    item.setData(implant['model'], Roles.model)
-                    item.setData(implant['diameter1'], Roles.diameter)
-                    item.setData(implant['length'], Roles.length)
-                    implantFilePath = os.path.join(rootDir, self._implantDataSubDir, implant['file_name'])
-                    item.setData(implantFilePath, Roles.file)
-                    productItem.appendRow(item)
-                companyItem.appendRow(productItem)
-            root.appendRow(companyItem)
-      
-        return model
+    def createImplantModel(self, catalog, rootDir):
+        """
+        Item models of the implant catalog. The product lines and implants of the tree are created when their parent
+        is expanded, the implant icons are loaded in the background.
+        """
+        return ImplantCatalogModel(catalog, os.path.join(rootDir, self._implantDataSubDir))
 
     def loadImplant(self, implantFilePath):
         newImplant = RFImplantObject.loadFromFilePath(getShortPathToExistingPath(implantFilePath))
@@ -335,4 +306,148 @@ class RFImplantWidget(RFViewerWidget):
     def clean(self):
         """Override from RFViewerWidget"""
         self._currentImplant = None
-        self._sceneImplants.clear()
\ No newline at end of file
+        self._sceneImplants.clear()
+
+
+class RFImplantCatalogTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tempDir = qt.QTemporaryDir()
+        self._tempDir.setAutoRemove(True)
+        self.dbFilePath = os.path.join(self._tempDir.path(), "implants.accdb")
+        self.snapshotPath = ImplantCatalog.defaultSnapshotPath(os.path.join(self._tempDir.path(), "snapshots"),
+                                                               self.dbFilePath)
+        with open(self.dbFilePath, "w") as f:
+            f.write("db")
+        self.readCount = 0
+        self.catalogs = []
+
+    def tearDown(self):
+        for catalog in self.catalogs:
+            catalog.close()
+
+    def an_implant(self, companyId, companyName, productId, model, diameter, length):
+        implant = dict.fromkeys(implantColumns)
+        implant.update(productId=productId, companyId=companyId, companyName=companyName, model=model,
+                       diameter1=diameter, length=length)
+        return implant
+
+    def a_source(self):
+        companies = {1: {'companyName': 'Nobel', 'favorite': 0}, 2: {'companyName': 'Straumann', 'favorite': 1}}
+        productLines = {10: {'companyId': 1, 'model': 'Active', 'favorite': 0},
+                        20: {'companyId': 2, 'model': 'BLT', 'favorite': 0}}
+        implants = {100: self.an_implant(1, 'Nobel', 10, 'Active', 3.5, 10),
+                    101: self.an_implant(1, 'Nobel', 10, 'Active', 4.3, 13),
+                    200: self.an_implant(2, 'Straumann', 20, 'BLT', 4.1, 10)}
+        return implants, companies, productLines
+
+    def read_source(self):
+        self.readCount += 1
+        return self.a_source()
+
+    def open_catalog(self, readSource=None):
+        catalog = ImplantCatalog.open(self.snapshotPath, self.dbFilePath, readSource or self.read_source)
+        if catalog is not None:
+            self.catalogs.append(catalog)
+        return catalog
+
+    def test_the_db_is_read_once_until_it_is_modified(self):
+        catalog = self.open_catalog()
+        self.assertEqual(1, self.readCount)
+        self.assertTrue(os.path.exists(self.snapshotPath))
+        self.assertEqual(['Nobel', 'Straumann'], [company['name'] for company in catalog.companies()])
+        self.assertEqual(['Active'], [product['model'] for product in catalog.productLines(1)])
+        self.assertEqual([100, 101], [implant['id'] for implant in catalog.implants(10)])
+
+        self.open_catalog()
+        self.assertEqual(1, self.readCount)
+
+        stat = os.stat(self.dbFilePath)
+        os.utime(self.dbFilePath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.open_catalog()
+        self.assertEqual(2, self.readCount)
+
+    def test_an_outdated_snapshot_is_not_used_if_the_db_cannot_be_read(self):
+        self.open_catalog()
+        with open(self.dbFilePath, "a") as f:
+            f.write("modified")
+        self.assertIsNone(self.open_catalog(lambda: None))
+
+    def test_implants_are_searched_with_case_insensitive_wildcards(self):
+        catalog = self.open_catalog()
+
+        def searchIds(wildcard):
+            return [implant['id'] for implant in catalog.search(wildcard)]
+
+        self.assertEqual([100, 101], searchIds("nobel"))
+        self.assertEqual([101, 200], searchIds("4.? 1*"))
+        self.assertEqual([200], searchIds("STRAUMANN - BLT"))
+        self.assertEqual([100, 101, 200], searchIds(""))
+        self.assertEqual([100], searchIds("[3]*10"))
+        self.assertEqual([], searchIds("zimmer"))
+        self.assertEqual([100], [implant['id'] for implant in catalog.search("", limit=1)])
+
+
+class RFImplantMeshCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tempDir = qt.QTemporaryDir()
+        self._tempDir.setAutoRemove(True)
+        self.cache = ImplantMeshCache()
+        self.digestCount = 0
+
+        def countingFileDigest(path):
+            self.digestCount += 1
+            return ImplantMeshCache.fileDigest(path)
+
+        self.cache.fileDigest = countingFileDigest
+
+    def an_implant_file(self, fileName, radius=2.0):
+        sphere = vtk.vtkSphereSource()
+        sphere.SetRadius(radius)
+        writer = vtk.vtkPolyDataWriter()
+        writer.SetInputConnection(sphere.GetOutputPort())
+        writer.SetFileName(os.path.join(self._tempDir.path(), fileName))
+        writer.Write()
+        return writer.GetFileName()
+
+    def test_file_digests_are_computed_once_until_the_file_is_modified(self):
+        path = self.an_implant_file("implant.vtk")
+        digest = self.cache.digest(path)
+        self.assertEqual(digest, self.cache.digest(path))
+        self.assertEqual(1, self.digestCount)
+
+        otherPath = self.an_implant_file("implant_copy.vtk")
+        self.assertEqual(digest, self.cache.digest(otherPath))
+        self.assertEqual(2, self.digestCount)
+
+        stat = os.stat(path)
+        self.an_implant_file("implant.vtk", radius=3.0)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertNotEqual(digest, self.cache.digest(path))
+        self.assertEqual(3, self.digestCount)
+
+    def test_models_of_the_same_content_share_their_mesh_until_released(self):
+        first = self.cache.loadModel(self.an_implant_file("implant.vtk"))
+        second = self.cache.loadModel(self.an_implant_file("implant_copy.vtk"))
+        other = self.cache.loadModel(self.an_implant_file("other.vtk", radius=3.0))
+        self.assertIs(first.GetPolyData(), second.GetPolyData())
+        self.assertIsNot(first.GetPolyData(), other.GetPolyData())
+        self.assertEqual(2, len(self.cache._meshes))
+
+        self.cache.releaseModel(first)
+        self.assertEqual(2, len(self.cache._meshes))
+        self.cache.releaseModel(second)
+        self.cache.releaseModel(other)
+        self.assertEqual(0, len(self.cache._meshes))
+
+        for model in (first, second, other):
+            removeNodeFromMRMLScene(model)
+
+
+class RFImplantTest(ScriptedLoadableModuleTest):
+    def runTest(self):
+        # Gather tests for the plugin and run them in a test suite
+        slicer.mrmlScene.Clear()
+        testCases = [RFImplantCatalogTestCase, RFImplantMeshCacheTestCase]
+        suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(case) for case in testCases])
+        unittest.TextTestRunner(verbosity=3).run(suite)
+        slicer.mrmlScene.Clear()
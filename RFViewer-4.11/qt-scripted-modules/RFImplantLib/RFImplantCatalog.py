@@ -0,0 +1,326 @@
+import hashlib
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import qt
+
+from RFImplantLib import Roles
+
+# Columns of the ImplantTree table of the implant Access DB, in their table order
+implantColumns = ['articleNumber', 'diameter1', 'diameter2', 'length', 'total_length', 'insertion_depth', 'color',
+                  'abutment', 'viewCheck', 'favorite', 'file_name', 'image_file_name', 'axis']
+
+
+def implantText(implant):
+  """Text of the implant items, also used to search the implants"""
+  return '{} - {} {} {}'.format(implant['companyName'], implant['model'], implant['diameter1'], implant['length'])
+
+
+def _sqlValue(value):
+  """DB values are stored as is if SQLite supports their type, as str otherwise"""
+  if value is None or isinstance(value, (int, float, str, bytes)):
+    return value
+  return str(value)
+
+
+class ImplantCatalog(object):
+  """
+  Local SQLite snapshot of the implant Access DB.
+
+  The snapshot stores the companies, product lines and implants of the DB with indexes by company and product line. It
+  is tagged with the modification time and size of the DB file : the Access DB is only read again once it changed.
+  The implants of a product line and the implants matching a search are read from the snapshot on demand.
+  """
+  schemaVersion = 1
+
+  def __init__(self, connection):
+    self._connection = connection
+    self._connection.row_factory = sqlite3.Row
+
+  @staticmethod
+  def defaultSnapshotPath(snapshotDirPath, dbFilePath):
+    """Snapshot file of the DB in the snapshot directory"""
+    key = hashlib.sha1(os.path.normcase(os.path.abspath(dbFilePath)).encode("utf-8")).hexdigest()
+    return os.path.join(snapshotDirPath, "ImplantCatalog-{}.sqlite".format(key))
+
+  @staticmethod
+  def sourceSignature(dbFilePath):
+    stat = os.stat(dbFilePath)
+    return "{}:{}:{}".format(ImplantCatalog.schemaVersion, stat.st_mtime_ns, stat.st_size)
+
+  @classmethod
+  def open(cls, snapshotPath, dbFilePath, readSource):
+    """
+    Opens the snapshot of the DB, the snapshot is created first if it is missing or if the DB was modified since.
+
+    :param snapshotPath: path to the SQLite snapshot file
+    :param dbFilePath: path to the implant Access DB
+    :param readSource: callable returning the (implants, companies, productLines) dicts of the DB, or None if the DB
+    can't be read
+    :return: ImplantCatalog or None if the snapshot is outdated and the DB can't be read
+    """
+    signature = cls.sourceSignature(dbFilePath)
+    catalog = cls._openSnapshot(snapshotPath, signature)
+    if catalog is not None:
+      return catalog
+
+    source = readSource()
+    if source is None:
+      return None
+
+    snapshotDirPath = os.path.dirname(snapshotPath)
+    if snapshotDirPath and not os.path.exists(snapshotDirPath):
+      os.makedirs(snapshotDirPath)
+    tmpPath = snapshotPath + ".tmp"
+    if os.path.exists(tmpPath):
+      os.remove(tmpPath)
+    connection = sqlite3.connect(tmpPath)
+    try:
+      cls._writeSnapshot(connection, signature, *source)
+    finally:
+      connection.close()
+    os.replace(tmpPath, snapshotPath)
+    return cls._openSnapshot(snapshotPath, signature)
+
+  @classmethod
+  def _openSnapshot(cls, snapshotPath, signature):
+    if not os.path.exists(snapshotPath):
+      return None
+    connection = sqlite3.connect(snapshotPath)
+    try:
+      row = connection.execute("SELECT value FROM Meta WHERE key = 'signature'").fetchone()
+      if row is not None and row[0] == signature:
+        return cls(connection)
+    except sqlite3.DatabaseError as e:
+      logging.info("Implant catalog snapshot {} is not valid : {}".format(snapshotPath, e))
+    connection.close()
+    return None
+
+  @staticmethod
+  def _writeSnapshot(connection, signature, implants, companies, productLines):
+    connection.executescript("""
+      CREATE TABLE Meta (key TEXT PRIMARY KEY, value TEXT);
+      CREATE TABLE Company (position INTEGER PRIMARY KEY, id, name, favorite);
+      CREATE TABLE ProductLine (position INTEGER PRIMARY KEY, id, companyId, model, favorite);
+      CREATE TABLE Implant (position INTEGER PRIMARY KEY, id, productId, companyId, companyName, model, {},
+                            searchText TEXT);
+      CREATE INDEX ProductLineByCompany ON ProductLine (companyId);
+      CREATE INDEX ImplantByProduct ON Implant (productId);
+      """.format(", ".join(implantColumns)))
+    connection.executemany("INSERT INTO Company (id, name, favorite) VALUES (?, ?, ?)",
+                           [(_sqlValue(i), _sqlValue(c['companyName']), _sqlValue(c['favorite']))
+                            for i, c in companies.items()])
+    connection.executemany("INSERT INTO ProductLine (id, companyId, model, favorite) VALUES (?, ?, ?, ?)",
+                           [(_sqlValue(i), _sqlValue(p['companyId']), _sqlValue(p['model']), _sqlValue(p['favorite']))
+                            for i, p in productLines.items()])
+    columns = ['id', 'productId', 'companyId', 'companyName', 'model'] + implantColumns + ['searchText']
+    connection.executemany("INSERT INTO Implant ({}) VALUES ({})".format(", ".join(columns),
+                                                                        ", ".join("?" * len(columns))),
+                           [[_sqlValue(i)] + [_sqlValue(implant[c]) for c in columns[1:-1]]
+                            + [implantText(implant).lower()] for i, implant in implants.items()])
+    connection.execute("INSERT INTO Meta VALUES ('signature', ?)", (signature,))
+    connection.commit()
+
+  def close(self):
+    self._connection.close()
+
+  def _rows(self, query, parameters=()):
+    return [dict(row) for row in self._connection.execute(query, parameters)]
+
+  def companies(self):
+    return self._rows("SELECT id, name, favorite FROM Company ORDER BY position")
+
+  def productLines(self, companyId):
+    return self._rows("SELECT id, companyId, model, favorite FROM ProductLine WHERE companyId = ? ORDER BY position",
+                      (companyId,))
+
+  def implants(self, productId):
+    return self._rows("SELECT * FROM Implant WHERE productId = ? ORDER BY position", (productId,))
+
+  def search(self, wildcard, limit=1000):
+    """
+    Implants whose text contains the case insensitive wildcard pattern (* any characters, ? one character, [...] one
+    of the characters), as the QSortFilterProxyModel wildcard filter.
+    """
+    pattern = "*{}*".format(wildcard.lower())
+    return self._rows("SELECT * FROM Implant WHERE searchText GLOB ? ORDER BY position LIMIT ?", (pattern, limit))
+
+
+def decodeThumbnail(imageFilePath, size):
+  """
+  Decodes an image file and scales it to fit in a size x size square.
+
+  :return: PNG encoded bytes of the thumbnail or None if the file can't be decoded
+  """
+  import cv2
+
+  try:
+    # numpy reads paths with any character, contrary to cv2.imread
+    image = cv2.imdecode(np.fromfile(imageFilePath, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+  except (IOError, OSError, ValueError):
+    return None
+  if image is None:
+    return None
+
+  scale = float(size) / max(image.shape[0], image.shape[1])
+  if scale < 1:
+    image = cv2.resize(image, (max(1, int(image.shape[1] * scale)), max(1, int(image.shape[0] * scale))),
+                       interpolation=cv2.INTER_AREA)
+  success, encoded = cv2.imencode(".png", image)
+  return encoded.tobytes() if success else None
+
+
+class ImplantIconLoader(object):
+  """
+  Loads the implant icons in a worker thread pool.
+
+  The icon files are decoded and scaled to thumbnails by the workers. The finished thumbnails are converted to icons in
+  the main thread by a polling timer and passed to the requests callbacks. Thumbnails are cached by file path.
+  """
+
+  def __init__(self, thumbnailSize=60, workerCount=4, pollIntervalMs=50):
+    self.thumbnailSize = thumbnailSize
+    self._executor = ThreadPoolExecutor(workerCount)
+    self._icons = {}
+    self._pending = {}
+    self._timer = qt.QTimer()
+    self._timer.setInterval(pollIntervalMs)
+    self._timer.connect('timeout()', self._deliverFinishedIcons)
+
+  def request(self, imageFilePath, callback):
+    """Calls callback(icon) in the main thread once the icon of the image file is loaded"""
+    if imageFilePath in self._icons:
+      callback(self._icons[imageFilePath])
+      return
+
+    if imageFilePath not in self._pending:
+      future = self._executor.submit(decodeThumbnail, imageFilePath, self.thumbnailSize)
+      self._pending[imageFilePath] = (future, [])
+    self._pending[imageFilePath][1].append(callback)
+    if not self._timer.isActive():
+      self._timer.start()
+
+  def cancel(self):
+    """Drops the pending requests, the icons being decoded are cached when they are finished"""
+    for future, callbacks in self._pending.values():
+      future.cancel()
+      callbacks.clear()
+
+  def _deliverFinishedIcons(self):
+    for imageFilePath, (future, callbacks) in list(self._pending.items()):
+      if not future.done():
+        continue
+      del self._pending[imageFilePath]
+      if future.cancelled():
+        continue
+
+      pixmap = qt.QPixmap()
+      thumbnail = future.result()
+      if thumbnail is not None:
+        pixmap.loadFromData(thumbnail)
+      icon = qt.QIcon(pixmap)
+      self._icons[imageFilePath] = icon
+      for callback in callbacks:
+        callback(icon)
+
+    if not self._pending:
+      self._timer.stop()
+
+
+class ImplantCatalogModel(object):
+  """
+  Item models of an ImplantCatalog.
+
+  The company items of the tree model are created first. The product line items of a company and the implant items of
+  a product line are only created when their parent item is expanded (see populate). The implant icons are loaded
+  asynchronously by an ImplantIconLoader when their item is created.
+  """
+  companyType = "company"
+  productType = "product"
+  implantType = "implant"
+  placeholderType = "placeholder"
+
+  def __init__(self, catalog, implantDirPath, iconLoader=None):
+    self.catalog = catalog
+    self.implantDirPath = implantDirPath
+    self.iconLoader = iconLoader or ImplantIconLoader()
+    self.treeModel = qt.QStandardItemModel()
+
+    root = self.treeModel.invisibleRootItem()
+    for company in catalog.companies():
+      root.appendRow(self._createExpandableItem(company['name'], self.companyType, company['id']))
+
+  def _createExpandableItem(self, text, nodeType, nodeId):
+    item = qt.QStandardItem(text)
+    item.setData(nodeType, Roles.nodeType)
+    item.setData(nodeId, Roles.nodeId)
+
+    # Placeholder child making the item expandable before its children are created
+    placeholder = qt.QStandardItem()
+    placeholder.setData(self.placeholderType, Roles.nodeType)
+    item.appendRow(placeholder)
+    return item
+
+  def populate(self, index):
+    """Creates the children of the tree model item at index if they were not created yet"""
+    item = self.treeModel.itemFromIndex(index)
+    if item is None or item.rowCount() != 1 or item.child(0).data(Roles.nodeType) != self.placeholderType:
+      return
+
+    nodeType = item.data(Roles.nodeType)
+    nodeId = item.data(Roles.nodeId)
+    if nodeType == self.companyType:
+      children = [self._createExpandableItem(product['model'], self.productType, product['id'])
+                  for product in self.catalog.productLines(nodeId)]
+    elif nodeType == self.productType:
+      children = [self._createImplantItem(implant) for implant in self.catalog.implants(nodeId)]
+    else:
+      return
+
+    item.removeRow(0)
+    for child in children:
+      item.appendRow(child)
+    self._requestIcons(self.treeModel, item)
+
+  def searchModel(self, wildcard):
+    """Flat item model of the implants matching the wildcard pattern (see ImplantCatalog.search)"""
+    model = qt.QStandardItemModel()
+    root = model.invisibleRootItem()
+    for implant in self.catalog.search(wildcard):
+      root.appendRow(self._createImplantItem(implant))
+    self._requestIcons(model, root)
+    return model
+
+  def _createImplantItem(self, implant):
+    item = qt.QStandardItem()
+    iconFilePath = os.path.join(self.implantDirPath, implant['image_file_name'] or "")
+    item.setSizeHint(qt.QSize(60, 60))
+    item.setText(implantText(implant))
+    item.setToolTip(iconFilePath)
+    item.setData(self.implantType, Roles.nodeType)
+    item.setData(implant['id'], Roles.id)
+    item.setData(implant['companyName'], Roles.company)
+    item.setData(implant['model'], Roles.model)
+    item.setData(implant['diameter1'], Roles.diameter)
+    item.setData(implant['length'], Roles.length)
+    item.setData(os.path.join(self.implantDirPath, implant['file_name'] or ""), Roles.file)
+    return item
+
+  def _requestIcons(self, model, parentItem):
+    for row in range(parentItem.rowCount()):
+      child = parentItem.child(row)
+      # Only the implant items have an icon, product line items have no image file
+      if child.data(Roles.nodeType) != self.implantType:
+        continue
+
+      # Persistent index : the item may be removed from its model before its icon is loaded
+      index = qt.QPersistentModelIndex(child.index())
+
+      def setIcon(icon, model=model, index=index):
+        if index.isValid():
+          model.setData(index.sibling(index.row(), index.column()), icon, qt.Qt.DecorationRole)
+
+      self.iconLoader.request(child.toolTip(), setIcon)
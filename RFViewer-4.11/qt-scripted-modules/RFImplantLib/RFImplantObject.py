@@ -1,10 +1,77 @@
+import hashlib
+import os
+
 import slicer, vtk, numpy
 import ctypes
 from RFVisualizationLib import showInMainViews
 from RFViewerHomeLib import jumpSlicesToLocation, getNodeByID, removeNodeFromMRMLScene
 
 
+class ImplantMeshCache(object):
+  """
+  Meshes of the implant files, shared by the model nodes of the implants.
+
+  The meshes are cached by the SHA-1 digest of their file content : the same implant article placed several times, even
+  from another file path, is read from disk once and all its model nodes share a single vtkPolyData. The instances only
+  differ by their transform. The digest of a file is only computed again once the file is modified.
+  A mesh is evicted from the cache once the last model node sharing it is released.
+  """
+
+  def __init__(self):
+    self._digests = {}
+    self._meshes = {}
+    self._modelDigests = {}
+
+  @staticmethod
+  def fileDigest(path, chunkSize=1024 * 1024):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+      for chunk in iter(lambda: f.read(chunkSize), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+  def digest(self, path):
+    stat = os.stat(path)
+    key = os.path.normcase(os.path.abspath(path))
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    if key not in self._digests or self._digests[key][0] != stamp:
+      self._digests[key] = (stamp, self.fileDigest(path))
+    return self._digests[key][1]
+
+  def loadModel(self, path):
+    """
+    Creates a model node of the implant file. The file is only loaded for the first model node of its content, the
+    next model nodes observe the mesh of the first one.
+    """
+    digest = self.digest(path)
+    mesh = self._meshes.get(digest)
+    if mesh is None:
+      model = slicer.util.loadModel(path)
+      self._meshes[digest] = model.GetPolyData()
+    else:
+      model = slicer.modules.models.logic().AddModel(mesh)
+      model.SetName(slicer.mrmlScene.GetUniqueNameByString(os.path.splitext(os.path.basename(path))[0]))
+      model.CreateDefaultStorageNode()
+    self._modelDigests[model.GetID()] = digest
+    return model
+
+  def releaseModel(self, model):
+    """Releases the mesh of a model node created by loadModel, the mesh is evicted if no other model node uses it"""
+    if model is None:
+      return
+    digest = self._modelDigests.pop(model.GetID(), None)
+    if digest is not None and digest not in self._modelDigests.values():
+      del self._meshes[digest]
+
+  def clear(self):
+    self._digests.clear()
+    self._meshes.clear()
+    self._modelDigests.clear()
+
+
 class RFImplantObject:
+  meshCache = ImplantMeshCache()
+
   def __init__(self):
     self.model = None
     self.markupsNode = None
@@ -15,6 +82,7 @@ class RFImplantObject:
       self.markupsNode.GetInteractionHandleToWorldMatrix().RemoveAllObservers()
 
     transformNode = getNodeByID(self.model.GetTransformNodeID())
+    self.meshCache.releaseModel(self.model)
     removeNodeFromMRMLScene(self.model)
     removeNodeFromMRMLScene(self.markupsNode)
     removeNodeFromMRMLScene(transformNode)
@@ -65,7 +133,7 @@ class RFImplantObject:
   @staticmethod
   def loadFromFilePath(path):
     implant = RFImplantObject()
-    implant.model = slicer.util.loadModel(path)
+    implant.model = RFImplantObject.meshCache.loadModel(path)
     implant.model.SetUndoEnabled(True)
     implant.model.SetSelectable(True)
     display = implant.model.GetDisplayNode()
@@ -13,8 +13,7 @@ class RFImplantUI(qt.QWidget):
   def __init__(self):
     qt.QWidget.__init__(self)
 
-    self._filterModel = qt.QSortFilterProxyModel()
-    self._filterModel.setFilterCaseSensitivity(qt.Qt.CaseInsensitive)
+    self._catalogModel = None
     self.implantLayout = qt.QVBoxLayout()
     self.implantLayout.setSpacing(10)
 
@@ -55,8 +54,10 @@ class RFImplantUI(qt.QWidget):
 
     filterLineEdit = qt.QLineEdit()
     def filterByWildcard():
-      self._filterModel.setFilterWildcard(filterLineEdit.text)
+      self._filterText = filterLineEdit.text
+      self.updateListViewModel()
 
+    self._filterText = ""
     filterLineEdit.connect("textChanged(QString)", filterByWildcard)
 
     return filterLineEdit
@@ -97,15 +98,30 @@ class RFImplantUI(qt.QWidget):
     # listView.setSpacing(0)
     listView.setEditTriggers(qt.QAbstractItemView.NoEditTriggers)
 
-    listView.setModel(self._filterModel)
     listView.connect("doubleClicked(QModelIndex)", self.loadCurrentImplant)
+    listView.connect("expanded(QModelIndex)", self.onImplantItemExpanded)
 
     return listView
 
   def setModel(self, implantModel):
-    """ Initialize the list view with a model that contains elements filling all Roles"""
-    self._filterModel.setSourceModel(implantModel)
-    self._implantModel = implantModel
+    """ Initialize the list view with an ImplantCatalogModel"""
+    if self._catalogModel is not None:
+      self._catalogModel.iconLoader.cancel()
+    self._catalogModel = implantModel
+    self.updateListViewModel()
+
+  def updateListViewModel(self):
+    """Shows the catalog tree, or the implants matching the filter wildcard if the filter is not empty"""
+    if self._catalogModel is None:
+      return
+    if self._filterText:
+      self._listView.setModel(self._catalogModel.searchModel(self._filterText))
+    else:
+      self._listView.setModel(self._catalogModel.treeModel)
+
+  def onImplantItemExpanded(self, index):
+    if self._catalogModel is not None and self._listView.model() == self._catalogModel.treeModel:
+      self._catalogModel.populate(index)
 
   def setAddedImplantModel(self, addedImplantModel):
     """Initialize the list view with added implants model """
@@ -113,7 +129,9 @@ class RFImplantUI(qt.QWidget):
 
   def loadCurrentImplant(self):
     """ Triggered when double-click on implant or on "Load" button click """
-    implantFilePath = self._filterModel.data(self._listView.currentIndex(), Roles.file)
+    implantFilePath = self._listView.currentIndex().data(Roles.file)
+    if not implantFilePath:
+      return
     self.loadImplantRequested.emit(implantFilePath)
 
     item = qt.QStandardItem()
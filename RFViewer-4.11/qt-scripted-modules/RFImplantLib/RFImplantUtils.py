@@ -10,4 +10,6 @@ class Roles(IntEnum):
     diameter = qt.Qt.UserRole + 3
     length = qt.Qt.UserRole + 4
     file = qt.Qt.UserRole + 5
+    nodeType = qt.Qt.UserRole + 6
+    nodeId = qt.Qt.UserRole + 7
 
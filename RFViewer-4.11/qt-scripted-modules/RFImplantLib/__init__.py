@@ -1,3 +1,4 @@
 from .RFImplantUtils import *
+from .RFImplantCatalog import *
 from .RFImplantUI import *
 from .RFImplantObject import *
@@ -7,9 +7,13 @@ import numpy as np
 import os
 import unittest
 import vtk, qt, ctk, slicer
+import vtk.util.numpy_support
 from slicer.ScriptedLoadableModule import *
 import logging
 
+from .StraightenedVolumeProjector import StraightenedVolumeProjector
+from .StraightenedVolumeResampler import StraightenedVolumeResampler
+
 #
 # CurvedPlanarReformat
 #
@@ -170,6 +174,64 @@ class CurvedPlanarReformatLogic(ScriptedLoadableModuleLogic):
     # we just compute for every n-th to make computation faster and inverse computation more robust
     # (less contradiction because of there is less overlapping between neighbor slices)
     self.transformSpacingFactor = 5.0
+    self._resampler = StraightenedVolumeResampler()
+    self._straightenedOutputKey = None
+    self._projector = StraightenedVolumeProjector()
+
+  @staticmethod
+  def curvePointFrames(curveNode, curvePointIndices=None):
+    """
+    Curve point to world transforms of the curve points, as returned by GetCurvePointToWorldTransformAtPointIndex.
+
+    The frames are read at once from the arrays computed by a Frenet-Serret frame generator on the world curve (see
+    batchedCurvePointFrames). If the generator is not available, the frames are queried point by point.
+
+    :param curveNode: vtkMRMLMarkupsCurveNode
+    :param curvePointIndices: indices of the curve points. All the curve points by default
+    :return: (N, 4, 4) numpy array of the curve point to world matrices
+    """
+    frames = CurvedPlanarReformatLogic.batchedCurvePointFrames(curveNode, curvePointIndices)
+    if frames is not None:
+      return frames
+
+    if curvePointIndices is None:
+      curvePointIndices = range(curveNode.GetCurvePointsWorld().GetNumberOfPoints())
+    frames = np.zeros((len(curvePointIndices), 4, 4))
+    curvePointToWorld = vtk.vtkMatrix4x4()
+    for frame, curvePointIndex in zip(frames, curvePointIndices):
+      curveNode.GetCurvePointToWorldTransformAtPointIndex(int(curvePointIndex), curvePointToWorld)
+      frame[:] = slicer.util.arrayFromVTKMatrix(curvePointToWorld)
+    return frames
+
+  @staticmethod
+  def batchedCurvePointFrames(curveNode, curvePointIndices=None):
+    """
+    Curve point to world transforms of the curve points, read at once from the FSNormals, FSBinormals and FSTangents
+    arrays of a vtkFrenetSerretFrame run on the world curve. The curve node computes the frames of
+    GetCurvePointToWorldTransformAtPointIndex with the same generator and default settings, but doesn't expose it.
+
+    :return: (N, 4, 4) numpy array of the curve point to world matrices or None if the generator is not available
+    """
+    if not hasattr(slicer, "vtkFrenetSerretFrame"):
+      return None
+    frameGenerator = slicer.vtkFrenetSerretFrame()
+    frameGenerator.SetInputData(curveNode.GetCurveWorld())
+    frameGenerator.Update()
+    curvePoly = frameGenerator.GetOutput()
+    pointData = curvePoly.GetPointData()
+    axisArrays = [pointData.GetArray(name) for name in ["FSNormals", "FSBinormals", "FSTangents"]]
+    if None in axisArrays:
+      return None
+
+    if curvePointIndices is None:
+      curvePointIndices = np.arange(curvePoly.GetNumberOfPoints())
+    curvePointIndices = np.asarray(curvePointIndices, dtype=int)
+    frames = np.zeros((len(curvePointIndices), 4, 4))
+    frames[:, 3, 3] = 1.0
+    for axis, axisArray in enumerate(axisArrays):
+      frames[:, 0:3, axis] = vtk.util.numpy_support.vtk_to_numpy(axisArray)[curvePointIndices]
+    frames[:, 0:3, 3] = vtk.util.numpy_support.vtk_to_numpy(curvePoly.GetPoints().GetData())[curvePointIndices]
+    return frames
 
   def computeStraighteningTransform(self, transformToStraightenedNode, curveNode, sliceSizeMm, outputSpacingMm):
     """
@@ -177,18 +239,25 @@ class CurvedPlanarReformatLogic(ScriptedLoadableModuleLogic):
     resamplingCurveSpacingFactor: 
     """
 
-    # Create a temporary resampled curve
+    # Create a temporary resampled curve. The curve is not added to the scene.
     resamplingCurveSpacing = outputSpacingMm * self.transformSpacingFactor
     originalCurvePoints = curveNode.GetCurvePointsWorld()
     sampledPoints = vtk.vtkPoints()
     if not slicer.vtkMRMLMarkupsCurveNode.ResamplePoints(originalCurvePoints, sampledPoints, resamplingCurveSpacing, False):
-      raise("Redampling curve failed")
-    resampledCurveNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsCurveNode", "CurvedPlanarReformat_resampled_curve_temp")
+      raise RuntimeError("Resampling curve failed")
+    resampledCurveNode = slicer.vtkMRMLMarkupsCurveNode()
     resampledCurveNode.SetNumberOfPointsPerInterpolatingSegment(1)
     resampledCurveNode.SetCurveTypeToLinear()
     resampledCurveNode.SetControlPointPositionsWorld(sampledPoints)
     numberOfSlices = resampledCurveNode.GetNumberOfControlPoints()
 
+    # Frames of the curve points of every slice
+    curvePointIndices = [resampledCurveNode.GetCurvePointIndexFromControlPointIndex(gridK) for gridK in range(numberOfSlices)]
+    curvePointToWorldArrays = self.curvePointFrames(resampledCurveNode, curvePointIndices)
+    curveAxesX_RAS = curvePointToWorldArrays[:, 0:3, 0]
+    curveAxesY_RAS = curvePointToWorldArrays[:, 0:3, 1]
+    curvePoints_RAS = curvePointToWorldArrays[:, 0:3, 3]
+
     # Z axis (from first curve point to last, this will be the straightened curve long axis)
     curveStartPoint = np.zeros(3)
     curveEndPoint = np.zeros(3)
@@ -197,13 +266,7 @@ class CurvedPlanarReformatLogic(ScriptedLoadableModuleLogic):
     transformGridAxisZ = (curveEndPoint-curveStartPoint)/np.linalg.norm(curveEndPoint-curveStartPoint)
   
     # X axis = average X axis of curve, to minimize torsion (and so have a simple displacement field, which can be robustly inverted)
-    sumCurveAxisX_RAS = np.zeros(3)
-    for gridK in range(numberOfSlices):
-      curvePointToWorld = vtk.vtkMatrix4x4()
-      resampledCurveNode.GetCurvePointToWorldTransformAtPointIndex(resampledCurveNode.GetCurvePointIndexFromControlPointIndex(gridK), curvePointToWorld)
-      curvePointToWorldArray = slicer.util.arrayFromVTKMatrix(curvePointToWorld)
-      curveAxisX_RAS = curvePointToWorldArray[0:3, 0]
-      sumCurveAxisX_RAS += curveAxisX_RAS
+    sumCurveAxisX_RAS = curveAxesX_RAS.sum(axis=0)
     meanCurveAxisX_RAS = sumCurveAxisX_RAS/np.linalg.norm(sumCurveAxisX_RAS)
     transformGridAxisX = meanCurveAxisX_RAS
 
@@ -248,33 +311,51 @@ class CurvedPlanarReformatLogic(ScriptedLoadableModuleLogic):
     transform.SetGridDirectionMatrix(gridDirectionMatrix)
     transformToStraightenedNode.SetAndObserveTransformFromParent(transform)
 
-    # Compute displacements
+    # Compute displacements of the (K, J, I) grid corners at once
     transformDisplacements_RAS = slicer.util.arrayFromGridTransform(transformToStraightenedNode)
-    for gridK in range(gridDimensions[2]):
-      curvePointToWorld = vtk.vtkMatrix4x4()
-      resampledCurveNode.GetCurvePointToWorldTransformAtPointIndex(resampledCurveNode.GetCurvePointIndexFromControlPointIndex(gridK), curvePointToWorld)
-      curvePointToWorldArray = slicer.util.arrayFromVTKMatrix(curvePointToWorld)
-      curveAxisX_RAS = curvePointToWorldArray[0:3, 0]
-      curveAxisY_RAS = curvePointToWorldArray[0:3, 1]
-      curvePoint_RAS = curvePointToWorldArray[0:3, 3]
-      for gridJ in range(gridDimensions[1]):
-        for gridI in range(gridDimensions[0]):
-          straightenedVolume_RAS = (transformGridOrigin
-            + gridI*gridSpacing[0]*transformGridAxisX
-            + gridJ*gridSpacing[1]*transformGridAxisY
-            + gridK*gridSpacing[2]*transformGridAxisZ)
-          inputVolume_RAS = (curvePoint_RAS
-            + (gridI-0.5)*sliceSizeMm[0]*curveAxisX_RAS
-            + (gridJ-0.5)*sliceSizeMm[1]*curveAxisY_RAS)
-          transformDisplacements_RAS[gridK][gridJ][gridI] = inputVolume_RAS - straightenedVolume_RAS
+    transformDisplacements_RAS[:] = self.straighteningDisplacements(
+      curvePoints_RAS, curveAxesX_RAS, curveAxesY_RAS, sliceSizeMm, transformGridOrigin, gridSpacing,
+      [transformGridAxisX, transformGridAxisY, transformGridAxisZ])
     slicer.util.arrayFromGridTransformModified(transformToStraightenedNode)
 
-    slicer.mrmlScene.RemoveNode(resampledCurveNode)  # delete temporary curve
-
+  @staticmethod
+  def straighteningDisplacements(curvePoints, curveAxesX, curveAxesY, sliceSizeMm, gridOrigin, gridSpacing, gridAxes):
+    """
+    Displacements from the straightened volume slice corners to the corresponding reformatted slice corners along the
+    curve.
+
+    :param curvePoints: (K, 3) curve point of each slice
+    :param curveAxesX: (K, 3) X axis of the curve frame of each slice
+    :param curveAxesY: (K, 3) Y axis of the curve frame of each slice
+    :param sliceSizeMm: (X, Y) size of the slices
+    :param gridOrigin: (3,) origin of the grid transform
+    :param gridSpacing: (I, J, K) spacing of the grid transform
+    :param gridAxes: I, J and K axes of the grid transform
+    :return: (K, 2, 2, 3) displacements array in the grid transform (K, J, I) order
+    """
+    numberOfSlices = len(curvePoints)
+    gridI = np.arange(2).reshape(1, 1, 2, 1)
+    gridJ = np.arange(2).reshape(1, 2, 1, 1)
+    gridK = np.arange(numberOfSlices).reshape(numberOfSlices, 1, 1, 1)
+    gridAxisX, gridAxisY, gridAxisZ = [np.asarray(axis).reshape(1, 1, 1, 3) for axis in gridAxes]
+
+    straightenedVolume_RAS = (np.asarray(gridOrigin).reshape(1, 1, 1, 3)
+      + gridI*gridSpacing[0]*gridAxisX
+      + gridJ*gridSpacing[1]*gridAxisY
+      + gridK*gridSpacing[2]*gridAxisZ)
+    inputVolume_RAS = (curvePoints[:, np.newaxis, np.newaxis, :]
+      + (gridI-0.5)*sliceSizeMm[0]*curveAxesX[:, np.newaxis, np.newaxis, :]
+      + (gridJ-0.5)*sliceSizeMm[1]*curveAxesY[:, np.newaxis, np.newaxis, :])
+    return inputVolume_RAS - straightenedVolume_RAS
 
   def straightenVolume(self, outputStraightenedVolume, volumeNode, outputStraightenedVolumeSpacing, straighteningTransformNode):
     """
     Compute straightened volume (useful for example for visualization of curved vessels)
+
+    The input volume is resampled in process by a StraightenedVolumeResampler. When the same output volume is
+    straightened again with the same geometry, only the slices whose straightening frames changed are resampled.
+
+    :return: number of resampled slices
     """
     gridTransform = straighteningTransformNode.GetTransformFromParentAs("vtkOrientedGridTransform")
     if not gridTransform:
@@ -290,23 +371,62 @@ class CurvedPlanarReformatLogic(ScriptedLoadableModuleLogic):
 
     # Compute IJK to RAS matrix of output volume
     # Get grid axis directions
-    straightenedVolumeIJKToRASArray = slicer.util.arrayFromVTKMatrix(gridIjkToRasDirectionMatrix)
+    gridDirectionArray = slicer.util.arrayFromVTKMatrix(gridIjkToRasDirectionMatrix)
     # Apply scaling
-    straightenedVolumeIJKToRASArray = np.dot(straightenedVolumeIJKToRASArray,
+    straightenedVolumeIJKToRASArray = np.dot(gridDirectionArray,
       np.diag([outputStraightenedVolumeSpacing[0], outputStraightenedVolumeSpacing[1], outputStraightenedVolumeSpacing[2], 1]))
     # Set origin
     straightenedVolumeIJKToRASArray[0:3,3] = gridOrigin 
 
-    outputStraightenedImageData = vtk.vtkImageData()
-    outputStraightenedImageData.SetExtent(
+    # Reuse the output image data if its geometry didn't change, the unchanged slices are kept
+    inputImageData = volumeNode.GetImageData()
+    outputExtent = (
       0, int(gridExtentMm[0]/outputStraightenedVolumeSpacing[0])-1,
       0, int(gridExtentMm[1]/outputStraightenedVolumeSpacing[1])-1,
       0, int(gridExtentMm[2]/outputStraightenedVolumeSpacing[2])-1)
-    outputStraightenedImageData.AllocateScalars(volumeNode.GetImageData().GetScalarType(), volumeNode.GetImageData().GetNumberOfScalarComponents())
-    outputStraightenedVolume.SetAndObserveImageData(outputStraightenedImageData)
+    outputStraightenedImageData = outputStraightenedVolume.GetImageData()
+    if (outputStraightenedImageData is None or tuple(outputStraightenedImageData.GetExtent()) != outputExtent
+        or outputStraightenedImageData.GetScalarType() != inputImageData.GetScalarType()
+        or outputStraightenedImageData.GetNumberOfScalarComponents() != inputImageData.GetNumberOfScalarComponents()):
+      outputStraightenedImageData = vtk.vtkImageData()
+      outputStraightenedImageData.SetExtent(outputExtent)
+      outputStraightenedImageData.AllocateScalars(inputImageData.GetScalarType(), inputImageData.GetNumberOfScalarComponents())
+      outputStraightenedVolume.SetAndObserveImageData(outputStraightenedImageData)
     outputStraightenedVolume.SetIJKToRASMatrix(slicer.util.vtkMatrixFromArray(straightenedVolumeIJKToRASArray))
 
-    # Resample input volume to straightened volume
+    if inputImageData.GetNumberOfScalarComponents() != 1:
+      self.straightenVolumeWithCLI(outputStraightenedVolume, volumeNode, straighteningTransformNode)
+      return outputStraightenedImageData.GetDimensions()[2]
+
+    # Input position of the straightening grid corners
+    gridIndices = np.stack(np.meshgrid(np.arange(gridDimensions[2]), np.arange(2), np.arange(2), indexing="ij")[::-1], axis=-1)
+    gridPoints_RAS = np.array(gridOrigin) + (gridIndices * np.array(gridSpacing)).dot(gridDirectionArray[0:3, 0:3].T)
+    inputCorners_RAS = gridPoints_RAS + slicer.util.arrayFromGridTransform(straighteningTransformNode)
+
+    # Slices resampled before are only kept if the output volume wasn't modified since
+    outputKey = (outputStraightenedVolume.GetID(), outputStraightenedImageData.GetMTime())
+    if outputKey != self._straightenedOutputKey:
+      self._resampler.reset()
+
+    rasToIjk = vtk.vtkMatrix4x4()
+    volumeNode.GetRASToIJKMatrix(rasToIjk)
+    rasToIjkArray = slicer.util.arrayFromVTKMatrix(rasToIjk)
+    sourceKey = (volumeNode.GetID(), inputImageData.GetMTime(), tuple(rasToIjkArray.ravel()))
+    resampledSliceCount = self._resampler.resample(slicer.util.arrayFromVolume(volumeNode), rasToIjkArray,
+                                                   inputCorners_RAS, gridSpacing,
+                                                   slicer.util.arrayFromVolume(outputStraightenedVolume),
+                                                   outputStraightenedVolumeSpacing, sourceKey)
+    slicer.util.arrayFromVolumeModified(outputStraightenedVolume)
+    self._straightenedOutputKey = (outputStraightenedVolume.GetID(), outputStraightenedImageData.GetMTime())
+
+    outputStraightenedVolume.CreateDefaultDisplayNodes()
+    outputStraightenedVolume.GetDisplayNode().CopyContent(volumeNode.GetDisplayNode())
+    return resampledSliceCount
+
+  def straightenVolumeWithCLI(self, outputStraightenedVolume, volumeNode, straighteningTransformNode):
+    """
+    Resample the input volume into the straightened volume geometry with the resamplescalarvectordwivolume CLI
+    """
     parameters = {}
     parameters["inputVolume"] = volumeNode.GetID()
     parameters["outputVolume"] = outputStraightenedVolume.GetID()
@@ -319,28 +439,43 @@ class CurvedPlanarReformatLogic(ScriptedLoadableModuleLogic):
     outputStraightenedVolume.GetDisplayNode().CopyContent(volumeNode.GetDisplayNode())
     slicer.mrmlScene.RemoveNode(parameterNode)
 
-  def projectVolume(self, outputProjectedVolume, inputStraightenedVolume, projectionAxisIndex = 0):
-    """Create panoramic volume by mean intensity projection along an axis of the straightened volume
-    """
+  def projectVolume(self, outputProjectedVolume, inputStraightenedVolume, projectionAxisIndex = 0,
+                    mode=StraightenedVolumeProjector.Mean, slabThicknessMm=None, weights=None):
+    """Create panoramic volume by intensity projection along an axis of the straightened volume
+
+    The projection is computed in the scalar type of the straightened volume by a StraightenedVolumeProjector. The
+    projector is kept between calls : projecting the same straightened volume with another slab thickness only reads
+    its cumulative sums.
 
-    projectedImageData = vtk.vtkImageData()
-    outputProjectedVolume.SetAndObserveImageData(projectedImageData)
+    :param mode: StraightenedVolumeProjector.Mean, Maximum or Weighted projection
+    :param slabThicknessMm: thickness of the projected slab centered in the straightened volume, whole volume if None
+    :param weights: weight of each slice along the projection axis for the Weighted mode (see gaussianSlabWeights)
+    """
     straightenedImageData = inputStraightenedVolume.GetImageData()
 
     outputImageDimensions = list(straightenedImageData.GetDimensions())
     outputImageDimensions[projectionAxisIndex] = 1
-    projectedImageData.SetDimensions(outputImageDimensions)
 
-    projectedImageData.AllocateScalars(straightenedImageData.GetScalarType(), straightenedImageData.GetNumberOfScalarComponents())
+    # Reuse the output image data if its geometry didn't change
+    projectedImageData = outputProjectedVolume.GetImageData()
+    if (projectedImageData is None or list(projectedImageData.GetDimensions()) != outputImageDimensions
+        or projectedImageData.GetScalarType() != straightenedImageData.GetScalarType()
+        or projectedImageData.GetNumberOfScalarComponents() != straightenedImageData.GetNumberOfScalarComponents()):
+      projectedImageData = vtk.vtkImageData()
+      projectedImageData.SetDimensions(outputImageDimensions)
+      projectedImageData.AllocateScalars(straightenedImageData.GetScalarType(), straightenedImageData.GetNumberOfScalarComponents())
+      outputProjectedVolume.SetAndObserveImageData(projectedImageData)
     outputProjectedVolumeArray = slicer.util.arrayFromVolume(outputProjectedVolume)
     inputStraightenedVolumeArray = slicer.util.arrayFromVolume(inputStraightenedVolume)
 
-    if projectionAxisIndex == 0:
-      outputProjectedVolumeArray[:, :, 0] = inputStraightenedVolumeArray.mean(2-projectionAxisIndex)
-    elif projectionAxisIndex == 1:
-      outputProjectedVolumeArray[:, 0, :] = inputStraightenedVolumeArray.mean(2-projectionAxisIndex)
-    else:
-      outputProjectedVolumeArray[0, :, :] = inputStraightenedVolumeArray.mean(2-projectionAxisIndex)
+    projectionAxis = 2 - projectionAxisIndex
+    self._projector.setVolume(inputStraightenedVolumeArray, projectionAxis,
+                              (inputStraightenedVolume.GetID(), straightenedImageData.GetMTime()))
+    slabThickness = None
+    if slabThicknessMm is not None:
+      slabThickness = slabThicknessMm / inputStraightenedVolume.GetSpacing()[projectionAxisIndex]
+    self._projector.project(np.squeeze(outputProjectedVolumeArray, axis=projectionAxis), mode, slabThickness,
+                            weights=weights)
 
     slicer.util.arrayFromVolumeModified(outputProjectedVolume)
 
@@ -377,6 +512,14 @@ class CurvedPlanarReformatTest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_CurvedPlanarReformat1()
+    self.setUp()
+    self.test_CurvePointFramesMatchCurvePointToWorldTransforms()
+    self.setUp()
+    self.test_StraighteningTransformBenchmark()
+    self.setUp()
+    self.test_InProcessStraighteningMatchesResamplerCLI()
+    self.setUp()
+    self.test_SlabProjections()
 
   def test_CurvedPlanarReformat1(self):
     """ Ideally you should have several levels of tests.  At the lowest level
@@ -431,3 +574,137 @@ class CurvedPlanarReformatTest(ScriptedLoadableModuleTest):
     slicer.util.setSliceViewerLayers(background=straightenedVolume, fit=True, rotateToVolumePlane=True)
 
     self.delayDisplay('Test passed!')
+
+  @staticmethod
+  def createDentalArchCurve(archWidthMm=60.0, archDepthMm=50.0, numberOfControlPoints=15):
+    """Parabolic dental arch curve in the axial plane"""
+    curveNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsCurveNode')
+    for x in np.linspace(-archWidthMm / 2, archWidthMm / 2, numberOfControlPoints):
+      y = archDepthMm * (1 - (2 * x / archWidthMm) ** 2)
+      curveNode.AddControlPoint(vtk.vtkVector3d(x, y, 0.1 * x))
+    return curveNode
+
+  def test_CurvePointFramesMatchCurvePointToWorldTransforms(self):
+    curveNode = self.createDentalArchCurve()
+    # The frames must be computed in batch, not by the point by point fallback
+    frames = CurvedPlanarReformatLogic.batchedCurvePointFrames(curveNode)
+    self.assertIsNotNone(frames)
+    self.assertEqual(curveNode.GetCurvePointsWorld().GetNumberOfPoints(), len(frames))
+    self.assertTrue(np.allclose(CurvedPlanarReformatLogic.curvePointFrames(curveNode), frames))
+
+    curvePointToWorld = vtk.vtkMatrix4x4()
+    for curvePointIndex in range(0, len(frames), 7):
+      curveNode.GetCurvePointToWorldTransformAtPointIndex(curvePointIndex, curvePointToWorld)
+      self.assertTrue(np.allclose(slicer.util.arrayFromVTKMatrix(curvePointToWorld), frames[curvePointIndex]))
+
+  def test_StraighteningTransformBenchmark(self):
+    """Straightening transform of a long dental arch sampled with a fine curve resolution"""
+    import time
+    curveNode = self.createDentalArchCurve(archWidthMm=120.0, archDepthMm=90.0, numberOfControlPoints=40)
+    straighteningTransformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTransformNode', 'Straightening transform')
+    nodeCount = slicer.mrmlScene.GetNumberOfNodes()
+
+    logic = CurvedPlanarReformatLogic()
+    for spacingAlongCurveMm in [0.5, 0.1, 0.05]:
+      startTime = time.perf_counter()
+      logic.computeStraighteningTransform(straighteningTransformNode, curveNode, [40.0, 80.0], spacingAlongCurveMm)
+      elapsed = time.perf_counter() - startTime
+
+      displacements = slicer.util.arrayFromGridTransform(straighteningTransformNode)
+      logging.info("Straightening transform: {} slices in {:.3f}s".format(len(displacements), elapsed))
+      self.assertEqual(nodeCount, slicer.mrmlScene.GetNumberOfNodes())
+
+      # The straightened slice centers are mapped to the curve
+      gridTransform = straighteningTransformNode.GetTransformFromParentAs("vtkOrientedGridTransform")
+      gridImage = gridTransform.GetDisplacementGrid()
+      directions = slicer.util.arrayFromVTKMatrix(gridTransform.GetGridDirectionMatrix())[0:3, 0:3]
+      gridK = np.arange(len(displacements))
+      sliceCenters = (np.array(gridImage.GetOrigin())
+        + directions[:, 0] * gridImage.GetSpacing()[0] / 2
+        + directions[:, 1] * gridImage.GetSpacing()[1] / 2
+        + np.outer(gridK * gridImage.GetSpacing()[2], directions[:, 2]))
+      mappedCenters = sliceCenters + displacements.mean(axis=(1, 2))
+      curvePoints = slicer.util.arrayFromMarkupsCurvePoints(curveNode)
+      maxSegmentLength = np.linalg.norm(np.diff(curvePoints, axis=0), axis=1).max()
+      distances = np.linalg.norm(mappedCenters[:, np.newaxis, :] - curvePoints[np.newaxis, :, :], axis=2).min(axis=1)
+      self.assertLessEqual(distances.max(), maxSegmentLength)
+
+  def test_InProcessStraighteningMatchesResamplerCLI(self):
+    volumeNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode')
+    k, j, i = np.mgrid[0:80, 0:120, 0:140]
+    slicer.util.updateVolumeFromArray(volumeNode, (10 * i + 5 * j + 3 * k).astype(np.int16))
+    volumeNode.SetSpacing(0.8, 0.8, 0.8)
+    volumeNode.SetOrigin(-56.0, -10.0, -30.0)
+    volumeNode.CreateDefaultDisplayNodes()
+
+    curveNode = self.createDentalArchCurve()
+    straighteningTransformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTransformNode', 'Straightening transform')
+    outputSpacing = [0.5, 0.5, 1.0]
+    logic = CurvedPlanarReformatLogic()
+    logic.computeStraighteningTransform(straighteningTransformNode, curveNode, [20.0, 30.0], outputSpacing[2])
+
+    straightenedVolume = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', 'straightened')
+    sliceCount = logic.straightenVolume(straightenedVolume, volumeNode, outputSpacing, straighteningTransformNode)
+    straightenedArray = slicer.util.arrayFromVolume(straightenedVolume)
+    self.assertEqual(len(straightenedArray), sliceCount)
+
+    referenceVolume = slicer.modules.volumes.logic().CloneVolume(slicer.mrmlScene, straightenedVolume, 'reference')
+    logic.straightenVolumeWithCLI(referenceVolume, volumeNode, straighteningTransformNode)
+    # The input values are linear : they are interpolated exactly up to the rounding of the output values, except at
+    # the boundary. The voxels outside of the input volume (0 in either output), their neighbors which are partly
+    # interpolated with the outside and the faces of the straightened volume are excluded.
+    referenceArray = slicer.util.arrayFromVolume(referenceVolume)
+    outside = (straightenedArray == 0) | (referenceArray == 0)
+    interior = ~outside
+    for axis in range(3):
+      for shift in (-1, 1):
+        interior &= ~np.roll(outside, shift, axis=axis)
+    interior[[0, -1], :, :] = False
+    interior[:, [0, -1], :] = False
+    interior[:, :, [0, -1]] = False
+    self.assertGreater(np.count_nonzero(interior), outside.size // 10)
+
+    difference = np.abs(straightenedArray.astype(int) - referenceArray)[interior]
+    self.assertLessEqual(np.percentile(difference, 99), 1)
+
+    # Moving the last control point only resamples the end of the straightened volume
+    lastPoint = np.zeros(3)
+    curveNode.GetNthControlPointPositionWorld(curveNode.GetNumberOfControlPoints() - 1, lastPoint)
+    curveNode.SetNthControlPointPositionWorld(curveNode.GetNumberOfControlPoints() - 1, lastPoint + [0.0, 0.0, 2.0])
+    logic.computeStraighteningTransform(straighteningTransformNode, curveNode, [20.0, 30.0], outputSpacing[2])
+    resampledSliceCount = logic.straightenVolume(straightenedVolume, volumeNode, outputSpacing, straighteningTransformNode)
+    self.assertLess(resampledSliceCount, sliceCount)
+
+    fullyResampledVolume = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', 'fully resampled')
+    CurvedPlanarReformatLogic().straightenVolume(fullyResampledVolume, volumeNode, outputSpacing, straighteningTransformNode)
+    self.assertTrue(np.array_equal(slicer.util.arrayFromVolume(fullyResampledVolume),
+                                   slicer.util.arrayFromVolume(straightenedVolume)))
+
+  def test_SlabProjections(self):
+    from .StraightenedVolumeProjector import gaussianSlabWeights
+
+    straightenedVolume = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', 'straightened')
+    straightenedArray = np.random.RandomState(0).randint(-1000, 3000, (60, 40, 50)).astype(np.int16)
+    slicer.util.updateVolumeFromArray(straightenedVolume, straightenedArray)
+    straightenedVolume.SetSpacing(0.5, 0.5, 1.0)
+    projectedVolume = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', 'projected')
+    logic = CurvedPlanarReformatLogic()
+
+    logic.projectVolume(projectedVolume, straightenedVolume)
+    projectedArray = slicer.util.arrayFromVolume(projectedVolume)
+    self.assertEqual(projectedArray.dtype, np.int16)
+    self.assertTrue(np.array_equal(projectedArray[:, :, 0], np.rint(straightenedArray.mean(2))))
+
+    # 5 mm slab of 10 slices centered in the straightened volume
+    logic.projectVolume(projectedVolume, straightenedVolume, slabThicknessMm=5.0)
+    self.assertTrue(np.array_equal(slicer.util.arrayFromVolume(projectedVolume)[:, :, 0],
+                                   np.rint(straightenedArray[:, :, 20:30].mean(2))))
+
+    logic.projectVolume(projectedVolume, straightenedVolume, mode=StraightenedVolumeProjector.Maximum, slabThicknessMm=5.0)
+    self.assertTrue(np.array_equal(slicer.util.arrayFromVolume(projectedVolume)[:, :, 0],
+                                   straightenedArray[:, :, 20:30].max(2)))
+
+    weights = gaussianSlabWeights(50, 24.5, 4.0)
+    logic.projectVolume(projectedVolume, straightenedVolume, mode=StraightenedVolumeProjector.Weighted, weights=weights)
+    self.assertTrue(np.array_equal(slicer.util.arrayFromVolume(projectedVolume)[:, :, 0],
+                                   np.rint(straightenedArray.dot(weights / weights.sum()))))
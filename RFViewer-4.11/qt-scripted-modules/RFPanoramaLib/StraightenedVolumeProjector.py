@@ -0,0 +1,151 @@
+import numpy as np
+
+from .StraightenedVolumeResampler import _castInto
+
+
+def gaussianSlabWeights(sliceCount, center, standardDeviation):
+  """
+  Gaussian weights of the slices along the projection axis, e.g. to simulate the focal trough of a panoramic X-ray.
+
+  :param sliceCount: number of slices along the projection axis
+  :param center: float index of the slice of maximum weight
+  :param standardDeviation: standard deviation of the weights in slices
+  :return: (sliceCount,) float64 array of the weights
+  """
+  offsets = (np.arange(sliceCount) - center) / max(float(standardDeviation), 1e-6)
+  return np.exp(-0.5 * offsets ** 2)
+
+
+def _cumulativeSumDType(volumeArray):
+  """Smallest dtype in which the cumulative sums of the volume along any axis are exact"""
+  if not np.issubdtype(volumeArray.dtype, np.integer):
+    return np.float64
+  info = np.iinfo(volumeArray.dtype)
+  largestSum = max(abs(int(info.min)), abs(int(info.max))) * max(volumeArray.shape)
+  return np.int32 if largestSum <= np.iinfo(np.int32).max else np.int64
+
+
+class StraightenedVolumeProjector(object):
+  """
+  Mean, maximum and weighted intensity projections of a straightened volume along one of its axes.
+
+  The projections are computed chunk by chunk along the first non projected axis in the dtype of the volume, so no
+  temporary of the size of the whole volume is allocated. The first mean projection of a volume builds a table of the
+  cumulative sums along the projection axis : the mean of any slab is then computed from two table entries per output
+  pixel, changing the slab thickness or position doesn't go through the volume again.
+  """
+  Mean = "mean"
+  Maximum = "max"
+  Weighted = "weighted"
+  modes = (Mean, Maximum, Weighted)
+
+  def __init__(self, chunkSize=16):
+    self.chunkSize = max(1, int(chunkSize))
+    self._volumeArray = None
+    self._axis = None
+    self._key = None
+    self._cumulativeSums = None
+
+  def setVolume(self, volumeArray, axis, key=None):
+    """
+    Sets the volume to project.
+
+    :param volumeArray: (K, J, I) numpy array of the straightened volume
+    :param axis: numpy axis of the projection (2 for the I axis)
+    :param key: hashable identifying the volume content. The cumulative sums are kept while the key doesn't change.
+    """
+    if key is None or key != self._key or axis != self._axis:
+      self._cumulativeSums = None
+    self._volumeArray = volumeArray
+    self._axis = axis
+    self._key = key
+
+  @property
+  def sliceCount(self):
+    return self._volumeArray.shape[self._axis]
+
+  def slabRange(self, thickness=None, center=None):
+    """
+    Slices of the slab along the projection axis.
+
+    :param thickness: number of slices of the slab, all the slices if None
+    :param center: float index of the slab center, the volume center if None
+    :return: (start, stop) of the slab, clipped to the volume and of at least one slice
+    """
+    sliceCount = self.sliceCount
+    if thickness is None:
+      return 0, sliceCount
+    thickness = int(min(max(round(thickness), 1), sliceCount))
+    center = (sliceCount - 1) / 2. if center is None else center
+    start = int(min(max(round(center - (thickness - 1) / 2.), 0), sliceCount - thickness))
+    return start, start + thickness
+
+  def _chunks(self):
+    """Slices of the volume along the first non projected axis"""
+    chunkAxis = 1 if self._axis == 0 else 0
+    for start in range(0, self._volumeArray.shape[chunkAxis], self.chunkSize):
+      yield chunkAxis, slice(start, start + self.chunkSize)
+
+  @staticmethod
+  def _index(axis, index, ndim=3):
+    indices = [slice(None)] * ndim
+    indices[axis] = index
+    return tuple(indices)
+
+  def cumulativeSums(self):
+    """Cumulative sums along the projection axis, with a leading plane of zeros"""
+    if self._cumulativeSums is None:
+      shape = list(self._volumeArray.shape)
+      shape[self._axis] += 1
+      cumulativeSums = np.empty(shape, dtype=_cumulativeSumDType(self._volumeArray))
+      cumulativeSums[self._index(self._axis, 0)] = 0
+      sumsAfterFirst = cumulativeSums[self._index(self._axis, slice(1, None))]
+      for chunkAxis, chunk in self._chunks():
+        np.cumsum(self._volumeArray[self._index(chunkAxis, chunk)], axis=self._axis, dtype=cumulativeSums.dtype,
+                  out=sumsAfterFirst[self._index(chunkAxis, chunk)])
+      self._cumulativeSums = cumulativeSums
+    return self._cumulativeSums
+
+  def project(self, out, mode=Mean, thickness=None, center=None, weights=None):
+    """
+    Projects a slab of the volume along the projection axis.
+
+    :param out: numpy array of the volume shape without the projection axis, written in place. Integer outputs are
+    rounded and saturated.
+    :param mode: Mean, Maximum or Weighted
+    :param thickness: number of slices of the slab, all the slices if None (see slabRange)
+    :param center: float index of the slab center, the volume center if None
+    :param weights: (sliceCount,) weights of the slices for the Weighted mode, restricted to the slab
+    :return: out
+    """
+    if mode not in self.modes:
+      raise ValueError("Unknown projection mode : {}".format(mode))
+    start, stop = self.slabRange(thickness, center)
+    # The chunk axis is the first axis of the output
+    outputChunkAxis = 0
+
+    if mode == self.Mean:
+      cumulativeSums = self.cumulativeSums()
+      for chunkAxis, chunk in self._chunks():
+        sums = cumulativeSums[self._index(chunkAxis, chunk)]
+        slabSums = sums[self._index(self._axis, stop)] - sums[self._index(self._axis, start)]
+        _castInto(slabSums / float(stop - start), out[self._index(outputChunkAxis, chunk, 2)])
+      return out
+
+    if mode == self.Weighted:
+      if weights is None or len(weights) != self.sliceCount:
+        raise ValueError("Weighted projection expects one weight per slice")
+      slabWeights = np.asarray(weights, dtype=np.float64)[start:stop]
+      weightSum = slabWeights.sum()
+      if weightSum <= 0:
+        raise ValueError("Weighted projection expects positive weights in the slab")
+      slabWeights = slabWeights / weightSum
+
+    for chunkAxis, chunk in self._chunks():
+      slab = self._volumeArray[self._index(chunkAxis, chunk)][self._index(self._axis, slice(start, stop))]
+      outChunk = out[self._index(outputChunkAxis, chunk, 2)]
+      if mode == self.Maximum:
+        np.max(slab, axis=self._axis, out=outChunk)
+      else:
+        _castInto(np.tensordot(slab, slabWeights, axes=([self._axis], [0])), outChunk)
+    return out
@@ -0,0 +1,142 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def trilinearSample(volumeArray, ijkPoints, defaultValue=0.0):
+  """
+  Trilinear interpolation of a volume at continuous voxel positions.
+
+  As for the ITK linear interpolator, positions up to half a voxel outside of the volume are interpolated with the
+  border voxels. Positions further away get the default value.
+
+  :param volumeArray: (K, J, I) numpy array of the volume voxels
+  :param ijkPoints: (..., 3) array of continuous (i, j, k) voxel positions
+  :param defaultValue: value of the positions outside of the volume
+  :return: (...) float64 array of the interpolated values
+  """
+  shape = ijkPoints.shape[:-1]
+  points = ijkPoints.reshape(-1, 3)
+  sizes = np.array(volumeArray.shape[::-1])
+
+  inside = np.all((points >= -0.5) & (points <= sizes - 0.5), axis=1)
+  points = np.clip(points, 0, sizes - 1)
+  lower = np.minimum(np.floor(points).astype(np.intp), np.maximum(sizes - 2, 0))
+  fractions = points - lower
+  upper = np.minimum(lower + 1, sizes - 1)
+
+  flatVolume = volumeArray.reshape(-1)
+  strides = np.array([1, sizes[0], sizes[0] * sizes[1]])
+  values = np.zeros(len(points))
+  for corner in range(8):
+    bits = [(corner >> axis) & 1 for axis in range(3)]
+    indices = np.where(bits, upper, lower)
+    weights = np.prod(np.where(bits, fractions, 1.0 - fractions), axis=1)
+    values += weights * flatVolume[indices.dot(strides)]
+
+  values[~inside] = defaultValue
+  return values.reshape(shape)
+
+
+def _castInto(values, out):
+  """Writes float values into the output array, rounded and saturated for integer outputs"""
+  if np.issubdtype(out.dtype, np.integer):
+    info = np.iinfo(out.dtype)
+    values = np.clip(np.rint(values), info.min, info.max)
+  out[...] = values
+
+
+class StraightenedVolumeResampler(object):
+  """
+  In-process resampling of a volume along the frames of a curve straightening grid.
+
+  The straightening grid has 2x2 corners per grid slice, each corner being mapped to a position of the input volume
+  (see CurvedPlanarReformatLogic.computeStraighteningTransform). The input position of an output voxel is the linear
+  interpolation of the corners, as done by the grid transform, and the voxel value is trilinearly interpolated in the
+  input volume. The output slices are resampled by a thread pool, directly into the output array.
+
+  The input corners of each output slice are kept after resampling. When the same input volume is resampled again
+  into an output of the same shape, only the output slices whose input corners changed are resampled.
+  """
+
+  def __init__(self, workerCount=None, slabSize=8, tolerance=1e-6):
+    self.workerCount = workerCount or max(1, min(8, os.cpu_count() or 1))
+    self.slabSize = max(1, int(slabSize))
+    self.tolerance = tolerance
+    self._previous = None
+
+  def reset(self):
+    """Resample every slice on the next call to resample"""
+    self._previous = None
+
+  @staticmethod
+  def outputSliceCorners(inputCorners, gridSpacing, outputSpacing, outputShape):
+    """
+    Input positions of the 2x2 corners of the output slices.
+
+    :param inputCorners: (N, 2, 2, 3) input RAS position of the (K, J, I) straightening grid corners
+    :param gridSpacing: (I, J, K) spacing of the straightening grid
+    :param outputSpacing: (I, J, K) spacing of the output volume
+    :param outputShape: (K, J, I) shape of the output volume
+    :return: (K, 2, 2, 3) input RAS positions of the grid corners interpolated at each output slice
+    """
+    gridK = np.arange(outputShape[0]) * outputSpacing[2] / gridSpacing[2]
+    lower = np.clip(np.floor(gridK).astype(np.intp), 0, max(len(inputCorners) - 2, 0))
+    upper = np.minimum(lower + 1, len(inputCorners) - 1)
+    t = np.clip(gridK - lower, 0.0, 1.0)[:, np.newaxis, np.newaxis, np.newaxis]
+    return (1.0 - t) * inputCorners[lower] + t * inputCorners[upper]
+
+  def _resampleSlices(self, sourceArray, rasToIjk, sliceCorners, uv, outputArray, sliceIndices):
+    u, v = uv
+    for k in sliceIndices:
+      q = sliceCorners[k]
+      inputRas = (q[0, 0] + u * (q[0, 1] - q[0, 0]) + v * (q[1, 0] - q[0, 0])
+                  + u * v * (q[1, 1] - q[0, 1] - q[1, 0] + q[0, 0]))
+      ijk = inputRas.dot(rasToIjk[0:3, 0:3].T) + rasToIjk[0:3, 3]
+      _castInto(trilinearSample(sourceArray, ijk), outputArray[k])
+
+  def changedSlices(self, sourceKey, sliceCorners, outputShape):
+    """Indices of the output slices which must be resampled"""
+    previous = self._previous
+    if previous is None or previous[0] != sourceKey or previous[1] != tuple(outputShape):
+      return np.arange(outputShape[0])
+    difference = np.abs(sliceCorners - previous[2]).reshape(len(sliceCorners), -1).max(axis=1)
+    return np.flatnonzero(difference > self.tolerance)
+
+  def resample(self, sourceArray, rasToIjk, inputCorners, gridSpacing, outputArray, outputSpacing, sourceKey=None):
+    """
+    Resamples the input volume into the output array along the straightening grid.
+
+    :param sourceArray: (K, J, I) numpy array of the input volume
+    :param rasToIjk: 4x4 numpy RAS to IJK matrix of the input volume
+    :param inputCorners: (N, 2, 2, 3) input RAS position of the straightening grid corners
+    :param gridSpacing: (I, J, K) spacing of the straightening grid
+    :param outputArray: (K, J, I) numpy array of the output volume, written in place
+    :param outputSpacing: (I, J, K) spacing of the output volume
+    :param sourceKey: hashable identifying the input volume content. Incremental resampling is disabled if None.
+    :return: number of resampled output slices
+    """
+    outputShape = outputArray.shape
+    sliceCorners = self.outputSliceCorners(np.asarray(inputCorners, dtype=float), gridSpacing, outputSpacing,
+                                           outputShape)
+    sliceIndices = self.changedSlices(sourceKey, sliceCorners, outputShape) if sourceKey is not None else \
+      np.arange(outputShape[0])
+
+    # Normalized position of the output voxels between the grid corners
+    u = (np.arange(outputShape[2]) * outputSpacing[0] / gridSpacing[0])[np.newaxis, :, np.newaxis]
+    v = (np.arange(outputShape[1]) * outputSpacing[1] / gridSpacing[1])[:, np.newaxis, np.newaxis]
+
+    slabs = [sliceIndices[i:i + self.slabSize] for i in range(0, len(sliceIndices), self.slabSize)]
+    rasToIjk = np.asarray(rasToIjk, dtype=float)
+    if len(slabs) > 1 and self.workerCount > 1:
+      with ThreadPoolExecutor(self.workerCount) as executor:
+        for future in [executor.submit(self._resampleSlices, sourceArray, rasToIjk, sliceCorners, (u, v),
+                                       outputArray, slab) for slab in slabs]:
+          future.result()
+    else:
+      for slab in slabs:
+        self._resampleSlices(sourceArray, rasToIjk, sliceCorners, (u, v), outputArray, slab)
+
+    self._previous = None if sourceKey is None else (sourceKey, tuple(outputShape), sliceCorners)
+    return len(sliceIndices)
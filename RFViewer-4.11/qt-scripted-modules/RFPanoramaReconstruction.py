@@ -1,6 +1,5 @@
 import logging
 import os
-from itertools import chain
 
 import ctk
 import numpy as np
@@ -9,6 +8,7 @@ import slicer
 from slicer.ScriptedLoadableModule import *
 
 from RFReconstruction import RFReconstructionLogic
+from RFReconstructionLib import PanoramaSynthesizer, panoramaFrameIndices, panoramaColumnWindows
 from RFViewerHomeLib import RFViewerWidget, createFileSelector, translatable, showVolumeOnSlices, wrapInQTimer, \
   removeNodesFromMRMLScene
 from RFVisualizationLib import RFLayoutType, ViewTag
@@ -175,19 +175,6 @@ class RFPanoramaReconstructionWidget(RFViewerWidget):
 # RFPanoramaReconstructionLogic
 #
 
-def stitchColumns(columnList):
-  return np.concatenate(columnList, axis=1)
-
-def getColumn(array2D, x, width):
-  return array2D[:, int(x + 0.5):int(x+width+0.5)]
-  # return array2D[:, (x-width/2):(x+width/2)]
-
-def get2DSlice(array, nSlice):
-  return array[nSlice, :, :]
-
-def get3DSlice(array, nSlice):
-  return get2DSlice(array, nSlice)[np.newaxis]
-
 class RFPanoramaReconstructionLogic(RFReconstructionLogic):
   """
   2D panorama reconstruction from stack of frames
@@ -198,6 +185,7 @@ class RFPanoramaReconstructionLogic(RFReconstructionLogic):
     self._projectionName = 'PanoramaReconProjectionVol'
     self._panoramaName = self._projectionName + "-panorama"
     self._initNames = True
+    self._panoramaSynthesizer = None
 
   @staticmethod
   def generateNodeName(baseName):
@@ -205,115 +193,89 @@ class RFPanoramaReconstructionLogic(RFReconstructionLogic):
     slicer.modules.RFViewerHomeWidget.getDataLoader().addIgnoredVolumeName(nodeName)
     return nodeName
 
-  def run(self, mnri_file_path, initialAngleOffset=0, numberOfAngles=80, startX=0, panoramaVolume=None,
-          projectionsVolume=None):
-    """
-    Run the actual algorithm
+  def panoramaSynthesizer(self, mnri_file_path, mnri_settings, projectionsVolume=None):
     """
+    Returns the PanoramaSynthesizer of the MNRI acquisition frames. The synthesizer and its decoded columns are kept
+    until another frame folder is used or one of its frame files is modified.
 
-    if self._initNames:
-      self.generateNodeName(self._projectionName)
-      self.generateNodeName(self._panoramaName)
+    Raw frames are memory mapped from the MNRI frame folder. Frames of other image formats are loaded as a projections
+    volume.
 
-    logging.info('Reconstruct Panorama')
-    mnri_settings = self.MNRISettings(mnri_file_path)
-    if projectionsVolume is None:
+    :return: (synthesizer, projectionsVolume), projectionsVolume is None for raw frames
+    """
+    imageFormat = mnri_settings.value("Frame/ImageFormat")
+    frameTypes = {'Raw8': np.uint8, 'Raw16': np.uint16}
+    if imageFormat not in frameTypes and projectionsVolume is None:
       logging.info('Load frames from MNRI')
-
       mhdFilePath = self.createMhdFile(mnri_file_path)
       # TODO: load volume silently
       projectionsVolume = slicer.util.loadVolume(mhdFilePath,
                                                  {'show': False, 'name': self.generateNodeName(self._projectionName)})
-    inputImageData = projectionsVolume.GetImageData()
-
-    # Get input image info
-    inputSize = inputImageData.GetDimensions()
-    numberOfSlices = inputSize[2]
-    sliceSize = list(inputSize[0:2])
-    inputOrigin = projectionsVolume.GetOrigin()
-    inputSpacing = projectionsVolume.GetSpacing()
-    inputImageDirections = [[0] * 3] * 3
-    projectionsVolume.GetIJKToRASDirections(inputImageDirections)
-
-    logging.info('inputSize: {}'.format(inputSize))
-    logging.info('numberOfSlices: {}'.format(numberOfSlices))
-    logging.info('sliceSize: {}'.format(sliceSize))
-    logging.info('inputOrigin: {}'.format(inputOrigin))
-    logging.info('inputSpacing: {}'.format(inputSpacing))
-    logging.info('inputImageDirections: {}'.format(inputImageDirections))
-
-    array = slicer.util.arrayFromVolume(projectionsVolume)
-    totalAngle = mnri_settings.value("Geometry/TotalAngle") # 360
-    offsetOrient = mnri_settings.value("Geometry/OffsetOrient") # -0.3
-    firstSliceAngle = mnri_settings.value("Geometry/InitAngle")
 
-    logging.info('totalAngle: {}'.format(totalAngle))
-    logging.info('offsetOrient: {}'.format(offsetOrient))
+    if imageFormat in frameTypes:
+      frameDirPath = os.path.join(os.path.dirname(mnri_file_path), mnri_settings.value("Frame/FrameFolder"))
+      frames = self.projectionStack(mnri_settings, frameDirPath, frameTypes[imageFormat])
+      sourceKey = (os.path.normpath(frameDirPath), tuple(self.fileStamp(path) for path in frames.framePaths))
+    else:
+      sourceKey = (projectionsVolume.GetID(), projectionsVolume.GetImageData().GetMTime())
 
-    def relativeAngleToSliceIndex(angle):
-      # Convert an angle to a slice index where 0 is frontAngle
-      projectionAngle = 90 + firstSliceAngle + angle + initialAngleOffset
-      return int(projectionAngle * (numberOfSlices / totalAngle))
-      # return int((angle + initialAngle - offsetOrient) * (numberOfSlices / totalAngle))
+    if self._panoramaSynthesizer is None or self._panoramaSynthesizer.sourceKey != sourceKey:
+      if imageFormat not in frameTypes:
+        frames = slicer.util.arrayFromVolume(projectionsVolume)
+      iDark, i0 = RFReconstructionLogic.range(mnri_settings)
+      self._panoramaSynthesizer = PanoramaSynthesizer(frames, iDark, i0, sourceKey)
+    return self._panoramaSynthesizer, projectionsVolume
 
-    # angles = [-160, -130, -100, -70, -40, 0, 40, 70, 100, 130, 160]
-    # angles = range(-180, 160, 3)
-    # indices = [sliceIndexForAngleFromInitialAngle(angle) for angle in angles]
+  @staticmethod
+  def fileStamp(filePath):
+    """Returns (modification time, size) of the file, None if it does not exist"""
+    try:
+      fileStat = os.stat(filePath)
+    except OSError:
+      return None
+    return fileStat.st_mtime_ns, fileStat.st_size
 
-    reverse = -90 < initialAngleOffset < 90
-    firstSlice = relativeAngleToSliceIndex(-numberOfAngles) % numberOfSlices
-    lastSlice = relativeAngleToSliceIndex(numberOfAngles) % numberOfSlices
-    print(firstSlice, lastSlice, reverse)
+  def run(self, mnri_file_path, initialAngleOffset=0, numberOfAngles=80, startX=0, panoramaVolume=None,
+          projectionsVolume=None):
+    """
+    Synthesizes the panorama of the MNRI acquisition by stitching a column window of each frame around the front angle
+    (see panoramaFrameIndices, panoramaColumnWindows and panoramaSynthesizer).
 
-    slices = []
-    if firstSlice < lastSlice:
-      slices = range(firstSlice, lastSlice)
-    else:
-      slices = chain(range(firstSlice, numberOfSlices), range(0, lastSlice))
+    :return: [panoramaVolume, projectionsVolume], projectionsVolume is only loaded for non raw frames and can be passed
+    to the next run of the same MNRI file.
+    """
 
-    slices = list(slices)
-    if reverse:
-      slices.reverse()
-    print(slices)
+    if self._initNames:
+      self.generateNodeName(self._projectionName)
+      self.generateNodeName(self._panoramaName)
 
-    columns = []
+    logging.info('Reconstruct Panorama')
+    mnri_settings = self.MNRISettings(mnri_file_path)
+    synthesizer, projectionsVolume = self.panoramaSynthesizer(mnri_file_path, mnri_settings, projectionsVolume)
 
-    # sliceWidth = sliceSize[0]
+    totalAngle = mnri_settings.value("Geometry/TotalAngle") # 360
+    firstSliceAngle = mnri_settings.value("Geometry/InitAngle")
     frameWidth = mnri_settings.value("Frame/FrameWidth")
-    # columnWidth = int(frameWidth / len(slices))
-    # N slices are covering frameWidth - (2*startX) pixels
-    columnWidth = (frameWidth - 2*startX) / len(slices)
-    # middle of middle slice shoul
-    # For slice 0, column should start at startX
-    # For middle slice, column should be start frameWidth/2-columnWidth/2
-    # For slice n-1, column should start at frameWidth-columnWidth-startX
-    # inc = (frameWidth-columnWidth)/ ((len(slices) - 1))
-    inc = (frameWidth-columnWidth-startX) / (len(slices) - 1)
-    i = 0
-    for index in slices:
-      slice = get2DSlice(array, index)
-      column = getColumn(slice, i * inc + startX, columnWidth)
-      columns.append(column)
-      i += 1
-
-    # columns.reverse()
-    stiched = stitchColumns(columns)
-    stiched3D = stiched[np.newaxis]
-
-    volumesLogic = slicer.modules.volumes.logic()
+
+    frameIndices = panoramaFrameIndices(len(synthesizer.frames), totalAngle, firstSliceAngle, initialAngleOffset,
+                                        numberOfAngles)
+    columnWindows = panoramaColumnWindows(frameWidth, len(frameIndices), startX)
+    logging.info('frames: {} to {} ({} frames)'.format(frameIndices[0], frameIndices[-1], len(frameIndices)))
+    attenuation = synthesizer.synthesize(frameIndices, columnWindows)[np.newaxis]
+
     if panoramaVolume is None:
-      panoramaVolume = volumesLogic.CloneVolumeWithoutImageData(
-        slicer.mrmlScene, projectionsVolume, self.generateNodeName(self._panoramaName))
-      panoramaVolume.SetOrigin(inputOrigin)
-      panoramaVolume.SetSpacing(inputSpacing)
+      panoramaVolume = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode',
+                                                          self.generateNodeName(self._panoramaName))
+      panoramaVolume.SetSpacing(mnri_settings.value("Frame/FrameLengthWidth") / frameWidth,
+                                mnri_settings.value("Frame/FrameLengthHeight") / mnri_settings.value("Frame/FrameHeight"),
+                                1)
       coronal_direction = [[-1, 0, 0], [0, 0, 1], [0, -1, 0]]
       panoramaVolume.SetIJKToRASDirections(coronal_direction)
       panoramaVolume.CreateDefaultDisplayNodes()
       panoramaVolume.CreateDefaultStorageNode()
 
-    stiched3D = self.scaleFromRawToAttenuation(stiched3D, mnri_settings)
-    stiched3D = self.scaleFromAttenuationToHounsfieldUnits(stiched3D, mnri_settings)
-    slicer.util.updateVolumeFromArray(panoramaVolume, stiched3D)
+    slicer.util.updateVolumeFromArray(panoramaVolume,
+                                      self.scaleFromAttenuationToHounsfieldUnits(attenuation, mnri_settings))
 
     logging.info('Processing completed')
 
@@ -325,22 +287,11 @@ class RFPanoramaReconstructionLogic(RFReconstructionLogic):
     Convert input array from raw values to Hounsfield Units
     """
     # Extract air and water normalized values from presets
-    CTValuePreset = qt.QSettings('CTValuePreset.ini', qt.QSettings.IniFormat)  # File must be next to RFViewer.ini
     selected_preset = int(mnri_settings.value('Volume/TFPresetIndex'))
-    air_norm_value = float(CTValuePreset.value('CTValuePreset{:04d}_Air'.format(selected_preset), 0))
-    water_norm_value = float(CTValuePreset.value('CTValuePreset{:04d}_Water'.format(selected_preset), 0.018))
+    air_norm_value, water_norm_value = map(float, RFReconstructionLogic.ctValuePreset(selected_preset))
 
     # Normalize array and scale the array
     shift = -water_norm_value
     scale = 1000. / (water_norm_value - air_norm_value)
 
     return (att_arr + shift) * scale
-
-  @staticmethod
-  def scaleFromRawToAttenuation(array, mnri_settings):
-    # Frame is normalized between [0, 2^NBB]
-    iDark, i0 = RFReconstructionLogic.range(mnri_settings)
-    #att_arr = -np.log(max( (array- iDark) / (i0 - iDark), 1))
-    att_arr = array
-    att_arr[att_arr <= 0] = 1
-    return -np.log((att_arr - iDark) / (i0 - iDark))
@@ -1,12 +1,14 @@
-import errno
-import shutil
+import hashlib
 import logging
 import os
 import unittest
 import sys
+from collections import OrderedDict
 import numpy
 import qt
 import slicer
+import vtk
+from vtk.util.numpy_support import get_vtk_array_type
 from sys import byteorder as system_endian
 from array import array
 import pickle
@@ -15,15 +17,21 @@ from slicer.ScriptedLoadableModule import *
 import chardet
 import math
 from RFViewerHomeLib import createButton, createFileSelector, translatable, RFViewerWidget, removeNodeFromMRMLScene, \
-    TemporarySymlink, ExportDirectorySettings, DataLoader
+    TemporarySymlink, ExportDirectorySettings, DataLoader, loadIniSettings
+from RFReconstructionLib import ProjectionStack, ProjectionSubset, FrameSubtractionEngine, frameFileName, \
+    MhdVolumeInfo, stackedVolumeShape, readStackedVolumesInto, ParallelCLIScheduler, maxConcurrentRuns, \
+    MetalArtifactReductionEngine, reduceMetalArtifacts, SliceMetalArtifactReductionJob, hotSliceIndices, \
+    PanoramaSynthesizer, panoramaFrameIndices, panoramaColumnWindows
+from RFReconstructionLib.RFDicomMetalArtifactReduction import DicomMetalArtifactReductionBatch
 import time
-import re
 import CropVolumeSequence
 import cv2
 import codecs
 
 from skimage.transform import radon, rescale, iradon,iradon_sart
 from skimage.data import shepp_logan_phantom
+import pydicom
+from pydicom.pixel_data_handlers.util import apply_voi_lut
 class RFReconstruction(ScriptedLoadableModule):
     """
     Module responsible for wrapping calls to volume reconstruction implemented as a Command Line Interface module
@@ -54,6 +62,10 @@ class RFReconstructionWidget(RFViewerWidget):
         self._volumeFiltersUI = None
         self._volumeFiltersLogic = None
         self._dataLoaderWidget = None
+        self._twoImagesScheduler = None
+        self._previewCliNode = None
+        self._previewVolume = None
+        self._previewMnriPath = None
 
         self._progressText = self.tr("Reconstructing...")
 
@@ -62,7 +74,8 @@ class RFReconstructionWidget(RFViewerWidget):
 
         # Disable module if CUDA is not found
         try:
-            from RFReconstructionLib import RFVolumeFiltersUI, VolumeFiltersLogic
+            from RFReconstructionLib.RFVolumeFilters import VolumeFiltersLogic
+            from RFReconstructionLib.RFVolumeFiltersUI import RFVolumeFiltersUI
             self._volumeFiltersUI = RFVolumeFiltersUI()
             self._volumeFiltersUI.setEnabled(False)
             self._volumeFiltersLogic = VolumeFiltersLogic()
@@ -101,7 +114,9 @@ class RFReconstructionWidget(RFViewerWidget):
         section.
         """
         isEnabled = os.path.isfile(self._mnriLineEdit.currentPath) and (
-                    self._cliNode is None or not self._cliNode.IsBusy())
+                    self._cliNode is None or not self._cliNode.IsBusy()) and (
+                    self._previewCliNode is None or not self._previewCliNode.IsBusy()) and (
+                    self._twoImagesScheduler is None or self._twoImagesScheduler.isDone())
         self._reconstructButton.setEnabled(isEnabled)
 
         self._editCliWidget.setEnabled(self._cliNode is not None)
@@ -135,27 +150,45 @@ class RFReconstructionWidget(RFViewerWidget):
                     self.reconstruct(isCliSynchronous=False, mnriPath=self._mnriLineEdit.currentPath)
                 else:
                     mnrifilepath = self._mnriLineEdit.currentPath
-                    self.reconstructForTwoImages(mnrifilepath)
+                    self.reconstructForTwoImages(mnrifilepath, isCliSynchronous=False)
             else:
                 self.reconstruct(isCliSynchronous=False, mnriPath=self._mnriLineEdit.currentPath)    
         except:
             self.reconstruct(isCliSynchronous=False, mnriPath=self._mnriLineEdit.currentPath)
             # self.launchVolumeFilter1()
-    def reconstructForTwoImages(self, mnrifilepath):
+    def reconstructForTwoImages(self, mnrifilepath, isCliSynchronous=True):
+        """
+        Reconstruct the odd and even frames of a two images acquisition concurrently and stack both reconstructed
+        volumes into the final volume once both reconstructions are finished.
+        """
         self._logic.converting_files(mnrifilepath)
-        
+
         self._dir_path = os.path.dirname(mnrifilepath)
-        
-        self.oddMnriPath = os.path.join(self._dir_path, "frame1/NAOMICT_UTF8.mnri") 
-        self.evenMnriPath = os.path.join(self._dir_path, "frame2/NAOMICT_UTF8.mnri") 
-        cliNode = self.reconstruct_odd(isCliSynchronous=True, mnriPath = self.oddMnriPath )
-        shutil.rmtree(os.path.join(self._dir_path, "frame1"))
-        shutil.rmtree(os.path.join(self._dir_path, "frame2"))
-        shutil.rmtree(os.path.join(self._dir_path, "frame_result1"))
-        shutil.rmtree(os.path.join(self._dir_path, "frame_result2"))
-        # tmp = CropVolumeSequence.CropVolumeSequenceWidget()
-        # tmp.onApplyButton()
-        return cliNode
+        if self._mnriLineEdit.currentPath != mnrifilepath:
+            self._mnriLineEdit.setCurrentPath(mnrifilepath)
+
+        self.cancelTwoImagesReconstruction()
+        self.addProgressBar.emit(self._progressText)
+        self._twoImagesScheduler = self._logic.reconstructTwoImages(mnrifilepath)
+        self._twoImagesScheduler.completed.connect(self.onTwoImagesReconstructed)
+        self._cliNode = self._twoImagesScheduler.cliNodes[-1]
+        self.updateReconstructButtonEnabled()
+
+        if isCliSynchronous:
+            self._twoImagesScheduler.wait()
+        return self._twoImagesScheduler.resultNode()
+
+    def cancelTwoImagesReconstruction(self):
+        if self._twoImagesScheduler is None:
+            return
+
+        self._twoImagesScheduler.cancel()
+        for cliNode in self._twoImagesScheduler.cliNodes:
+            removeNodeFromMRMLScene(cliNode)
+        if self._cliNode in self._twoImagesScheduler.cliNodes:
+            self._cliNode = None
+        self._twoImagesScheduler = None
+
     def reconstruct(self, mnriPath, isCliSynchronous):
         # Mar
         mnri_settings = self._logic.MNRISettings(mnriPath)
@@ -204,6 +237,14 @@ class RFReconstructionWidget(RFViewerWidget):
         updateCliObserver = self.addObserver if not isCliSynchronous else self.removeObserver
         updateCliObserver(self._cliNode, self._cliNode.StatusModifiedEvent, self.onCLIModified)
 
+        # In the background, a low resolution preview is reconstructed and shown first. The full resolution
+        # reconstruction is started once the preview is finished (see onPreviewCLIModified).
+        previewFactor = self._logic.previewFactor()
+        if not isCliSynchronous and previewFactor > 1:
+            self.reconstructPreview(mnriPath, previewFactor)
+            self.updateReconstructButtonEnabled()
+            return self._cliNode
+
         # Reconstruct the geometry
         self._cliNode = self._logic.reconstruct(mnriPath, cliNode=self._cliNode, sync=isCliSynchronous)
 
@@ -214,84 +255,89 @@ class RFReconstructionWidget(RFViewerWidget):
         self.updateReconstructButtonEnabled()
         return self._cliNode
 
-    def reconstruct_odd(self, mnriPath, isCliSynchronous):
-        # Synchronize line edit file path with input file path if necessary
-        if self._mnriLineEdit.currentPath != mnriPath:
-            self._mnriLineEdit.setCurrentPath(mnriPath)
-
-        # Create CLI Node if necessary
-        if self._cliNode is None:
-            self._cliNode = slicer.cli.createNode(slicer.modules.simplertk)
-
-        # Add or remove CLI observer depending on if the execution is synchronous
-        updateCliObserver = self.addObserver if not isCliSynchronous else self.removeObserver
-        updateCliObserver(self._cliNode, self._cliNode.StatusModifiedEvent, self.onCLIModified)
-
-        # Reconstruct the geometry
-        self._cliNode = self._logic.reconstruct_odd(mnriPath, cliNode=self._cliNode, sync=True)
-
-        # Load the reconstructed geometry if synchronous
-        if isCliSynchronous:
-            self.onCLIModified_odd(self._cliNode, self._cliNode.StatusModifiedEvent)
-            self.reconstruct_even(isCliSynchronous=True, mnriPath = self.evenMnriPath)
-        self.updateReconstructButtonEnabled()
-        self.onReconstructedfortwoimage(self._cliNode)
-        return self._cliNode
-    def reconstruct_even(self, mnriPath, isCliSynchronous):
-        # Synchronize line edit file path with input file path if necessary
-        # if self._mnriLineEdit.currentPath != mnriPath:
-        #     self._mnriLineEdit.setCurrentPath(mnriPath)
-
-        # Create CLI Node if necessary
-        if self._cliNode is None:
-            self._cliNode = slicer.cli.createNode(slicer.modules.simplertk)
-
-        # Add or remove CLI observer depending on if the execution is synchronous
-        updateCliObserver = self.addObserver if not isCliSynchronous else self.removeObserver
-        updateCliObserver(self._cliNode, self._cliNode.StatusModifiedEvent, self.onCLIModified)
+    def reconstructPreview(self, mnriPath, previewFactor):
+        """Starts the low resolution preview reconstruction of the input MNRI file (see createPreviewCLIParameters)"""
+        self.cancelPreviewReconstruction()
+        self._previewMnriPath = mnriPath
+        self._previewCliNode = slicer.cli.createNode(slicer.modules.simplertk)
+        self.addObserver(self._previewCliNode, self._previewCliNode.StatusModifiedEvent, self.onPreviewCLIModified)
+        self.addProgressBar.emit(self._progressText)
+        self._logic.reconstruct(mnriPath, cliNode=self._previewCliNode, sync=False, preview_factor=previewFactor)
+
+    def cancelPreviewReconstruction(self):
+        if self._previewCliNode is None:
+            return
 
-        # Reconstruct the geometry
-        self._cliNode = self._logic.reconstruct_even(mnriPath, cliNode=self._cliNode, sync=True)
+        try:
+            self.removeObserver(self._previewCliNode, self._previewCliNode.StatusModifiedEvent,
+                                self.onPreviewCLIModified)
+            self._previewCliNode.Cancel()
+            removeNodeFromMRMLScene(self._previewCliNode)
+        finally:
+            self._previewCliNode = None
+            self.removeProgressBar.emit(self._progressText)
 
-        # Load the reconstructed geometry if synchronous
-        if isCliSynchronous:
-            self.onCLIModified_even(self._cliNode, self._cliNode.StatusModifiedEvent)
-            self.integratTwoRawFiles(self._dir_path)
-        self.updateReconstructButtonEnabled()
-        
-        
+    def onPreviewCLIModified(self, cliNode, event):
+        if cliNode.IsBusy():
+            return
 
-        return self._cliNode    
-    def onCLIModified_odd(self, cliNode, event):
         logging.info('{}:{}'.format(cliNode.GetParameterAsString('output'), cliNode.GetStatusString()))
+        self.removeObserver(cliNode, cliNode.StatusModifiedEvent, self.onPreviewCLIModified)
+        isFullReconstructionStarted = False
+        try:
+            if cliNode.GetStatusString() == 'Completed':
+                self.onPreviewReconstructed(cliNode)
+            elif cliNode.GetErrorText():
+                logging.debug('{}\n'.format(cliNode.GetErrorText()))
+
+            # A failed preview doesn't prevent the full resolution reconstruction
+            if cliNode.GetStatusString() != 'Cancelled':
+                self._cliNode = self._logic.reconstruct(self._previewMnriPath, cliNode=self._cliNode, sync=False)
+                isFullReconstructionStarted = True
+        finally:
+            # The progress bar is otherwise removed once the full resolution reconstruction is done (see onCLIModified)
+            if not isFullReconstructionStarted:
+                self.removeProgressBar.emit(self._progressText)
+            self.updateReconstructButtonEnabled()
+
+    def onPreviewReconstructed(self, cliNode):
+        """Shows the preview volume. It will be replaced in place by the full resolution volume (see onReconstructed)"""
+        outputPath = cliNode.GetParameterAsString('output')
+        logging.info('Loading preview: {}'.format(outputPath))
+        self._previewVolume = self.loadReconstructedVolume(outputPath)
+
+    def loadReconstructedVolume(self, outputPath):
+        """Loads the reconstructed volume file and sets it as the current volume (see logic loadReconstructedVolume)"""
+        loadFunction = lambda: self._logic.loadReconstructedVolume(outputPath)
+        if self._dataLoaderWidget is not None:
+            return self._dataLoaderWidget.loadNode(loadFunction, outputPath)
+        return loadFunction()
 
-        if self._cliNode.GetErrorText():
-            logging.debug('{}\n'.format(self._cliNode.GetErrorText()))
-
-        if cliNode.GetStatusString() == 'Scheduled':
-            self.addProgressBar.emit(self._progressText)
+    def _replacePreviewVolume(self, outputPath):
+        """
+        Replaces the image data of the displayed preview volume with the full resolution reconstructed volume and
+        notifies the widgets of the replaced volume.
 
-        if not cliNode.IsBusy():
-            self.removeProgressBar.emit(self._progressText)
+        :return: the updated volume node or None if there is no preview volume to replace
+        """
+        previewVolume, self._previewVolume = self._previewVolume, None
+        if previewVolume is None or not slicer.mrmlScene.IsNodePresent(previewVolume):
+            return None
 
-            # if cliNode.GetStatusString() == 'Completed':
-            #     self.onReconstructed_odd(cliNode)
-        self.updateReconstructButtonEnabled()
-    def onCLIModified_even(self, cliNode, event):
-        logging.info('{}:{}'.format(cliNode.GetParameterAsString('output'), cliNode.GetStatusString()))
+        try:
+            self._logic.setStackedVolumes(previewVolume, [outputPath])
+        except (IOError, ValueError):
+            logging.exception('Failed to replace the preview volume with: {}'.format(outputPath))
+            removeNodeFromMRMLScene(previewVolume)
+            return None
 
-        if self._cliNode.GetErrorText():
-            logging.debug('{}\n'.format(self._cliNode.GetErrorText()))
+        previewVolume.SetName(os.path.splitext(os.path.basename(outputPath))[0])
 
-        if cliNode.GetStatusString() == 'Scheduled':
-            self.addProgressBar.emit(self._progressText)
+        # The widgets were set up with the preview image data, set them up again with the full resolution data
+        if self._dataLoaderWidget is not None and self._dataLoaderWidget.getCurrentVolumeNode() is previewVolume:
+            self._dataLoaderWidget.notifyCurrentVolumeNodeReplaced()
+        return previewVolume
 
-        if not cliNode.IsBusy():
-            self.removeProgressBar.emit(self._progressText)
-
-            # if cliNode.GetStatusString() == 'Completed':
-            #     self.onReconstructed_even(cliNode)
-        self.updateReconstructButtonEnabled()
     def onCLIModified(self, cliNode, event):
         logging.info('{}:{}'.format(cliNode.GetParameterAsString('output'), cliNode.GetStatusString()))
 
@@ -307,44 +353,18 @@ class RFReconstructionWidget(RFViewerWidget):
             if cliNode.GetStatusString() == 'Completed':
                 self.onReconstructed(cliNode)
         self.updateReconstructButtonEnabled()
-    def integratTwoRawFiles(self, dir_path):
-        
-        mhdfilepath1 = os.path.join(dir_path,"frame1/reconstructed-volume1.raw")
-        # if os.path.exists(mhdfilepath1):
-        #     self.itkimage1 = sitk.ReadImage(mhdfilepath1)
-        mhdfilepath2 = os.path.join(dir_path,"frame2/reconstructed-volume2.raw")
-        mhdfilepath3 = os.path.join(dir_path,"reconstructed-volume1.raw")
-        # if not os.path.exists(mhdfilepath2):
-        #     time.sleep(30)
-        # if not os.path.exists(mhdfilepath3):
-        #     time.sleep(30)
-        
-        num_type = numpy.uint16
-        with open(mhdfilepath1, "rb") as rawfile:
-            self.volume1 = numpy.frombuffer(bytearray(rawfile.read()), dtype=num_type)
-        with open(mhdfilepath2, "rb") as rawfile:
-            self.volume2 = numpy.frombuffer(bytearray(rawfile.read()), dtype=num_type)    
-        with open(mhdfilepath3, "wb") as raw_file:
-            raw_file.write(bytearray(self.volume1.astype(self.volume1.dtype).flatten()))         
-            raw_file.write(bytearray(self.volume2.astype(self.volume2.dtype).flatten()))
-        shutil.copy(os.path.join(dir_path,"frame1/reconstructed-volume1.mhd"), os.path.join(dir_path,"reconstructed-volume1.mhd"))
-        with open(os.path.join(dir_path,"frame1/reconstructed-volume1.mhd"), "r") as mhdfile:
-            s = mhdfile.read()
-            # Read grid dimensions
-        m = re.search('DimSize = ([0-9]*) ([0-9]*) ([0-9]*)', s)
-        dimstr = 'DimSize = ' + m.group(1) + " " + m.group(2) + " " + m.group(3) 
-        dimstr1 = 'DimSize = ' + m.group(1) + " " + m.group(2) + " " + str(int(m.group(3)) * 2) 
-        s = s.replace(dimstr, dimstr1)
-        with open(os.path.join(dir_path,"reconstructed-volume1.mhd"), "w") as mhdfile:
-            mhdfile.write(s)
-        self._dataLoaderWidget.loadData(os.path.join(dir_path,"reconstructed-volume1.mhd"))   
+    def onTwoImagesReconstructed(self, cliNodes):
+        self.removeProgressBar.emit(self._progressText)
+        self.updateReconstructButtonEnabled()
+        if all(cliNode.GetStatusString() == 'Completed' for cliNode in cliNodes):
+            self.onReconstructedfortwoimage(cliNodes)
+
     def onReconstructed(self, cliNode):
         # Load reconstructed volume
         logging.info('Loading: {}'.format(cliNode.GetParameterAsString('output')))
-        if self._dataLoaderWidget is not None:
-            self._reconstructedVolume = self._dataLoaderWidget.loadData(cliNode.GetParameterAsString('output'))
-        else:
-            self._reconstructedVolume = slicer.util.loadVolume(cliNode.GetParameterAsString('output'))
+        self._reconstructedVolume = self._replacePreviewVolume(cliNode.GetParameterAsString('output'))
+        if self._reconstructedVolume is None:
+            self._reconstructedVolume = self.loadReconstructedVolume(cliNode.GetParameterAsString('output'))
         if self._reconstructedVolume is not None:
             
             self._volumeFiltersUI.setEnabled(True)
@@ -368,15 +388,16 @@ class RFReconstructionWidget(RFViewerWidget):
 
         # Save MNRI directory as next session direction
         qt.QSettings().setValue("SessionDirectory", os.path.dirname(self._mnriLineEdit.currentPath))
-    def onReconstructedfortwoimage(self, cliNode):
-        # Load reconstructed volume
-        logging.info('Loading: {}'.format(cliNode.GetParameterAsString('output')))
+    def onReconstructedfortwoimage(self, cliNodes):
+        # Stack the odd and even reconstructed volumes directly in the loaded volume
+        mhdPaths = [cliNode.GetParameterAsString('output') for cliNode in cliNodes]
+        volumeName = "reconstructed-volume1"
+        logging.info('Loading: {}'.format(", ".join(mhdPaths)))
+        loadFunction = lambda: self._logic.createStackedVolumeNode(mhdPaths, volumeName)
         if self._dataLoaderWidget is not None:
-            Strtmp = os.path.join(self._dir_path ,"reconstructed-volume1.mhd")
-            self._reconstructedVolume = self._dataLoaderWidget.loadData(Strtmp)
+            self._reconstructedVolume = self._dataLoaderWidget.loadNode(loadFunction, mhdPaths[0])
         else:
-            Strtmp = os.path.join(self._dir_path ,"reconstructed-volume1.mhd")
-            self._reconstructedVolume = slicer.util.loadVolume(Strtmp)
+            self._reconstructedVolume = loadFunction()
         if self._reconstructedVolume is not None:
             
             self._volumeFiltersUI.setEnabled(True)
@@ -391,29 +412,11 @@ class RFReconstructionWidget(RFViewerWidget):
             elif filter == 'lowpass':
                 self._volumeFiltersLogic.applySharpenFilter(self._reconstructedVolume)
 
-    def onReconstructed_even(self, cliNode):
-        # Load reconstructed volume
-        logging.info('Loading: {}'.format(cliNode.GetParameterAsString('output')))
-        if self._dataLoaderWidget is not None:
-            self._reconstructedVolume = self._dataLoaderWidget.loadData(cliNode.GetParameterAsString('output'))
-        else:
-            self._reconstructedVolume = slicer.util.loadVolume(cliNode.GetParameterAsString('output'))
-        if self._reconstructedVolume is not None:
-            # msg = qt.QMessageBox()
-            # msg.setText(self._reconstructedVolume)
-            # msg.exec_()
-            self._volumeFiltersUI.setEnabled(True)
-            mnri_settings = self._logic.MNRISettings(self.evenMnriPath)
-            filter = mnri_settings.value('SieraRE/ProjSmoothFilterType', '').lower()
-            kernelSize = mnri_settings.value('SieraRE/ProjSmoothFilterW')
-            if filter == 'median':
-                self._volumeFiltersLogic.applyMedianFilter(self._reconstructedVolume, kernelSize)
-            elif filter == 'gauss':
-                self._volumeFiltersLogic.applyGaussianFilter(self._reconstructedVolume, kernelSize)
-            elif filter == 'lowpass':
-                self._volumeFiltersLogic.applySharpenFilter(self._reconstructedVolume)
     def clean(self):
         # Cancel previously running reconstruction if necessary on session reload
+        self.cancelTwoImagesReconstruction()
+        self.cancelPreviewReconstruction()
+        self._previewVolume = None
         if self._cliNode:
             self._cliNode.Cancel()
             removeNodeFromMRMLScene(self._cliNode)
@@ -423,30 +426,20 @@ class RFReconstructionWidget(RFViewerWidget):
 class RFReconstructionLogic(ScriptedLoadableModuleLogic):
 
     class Settings:
-        """Convenient class to access INI values in original type"""
+        """
+        Convenient class to access INI values in original type.
+        The file is parsed once and shared by every instance created for the same unmodified file (see
+        loadIniSettings).
+        """
         def __init__(self, ini_file_path):
-            if not os.path.isfile(ini_file_path):
-                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), ini_file_path)
-            
-            self.settings = qt.QSettings()
-            self.settings.setIniCodec("UTF-8")        
+            self.settings = loadIniSettings(ini_file_path)
 
-            self.settings = qt.QSettings(ini_file_path, qt.QSettings.IniFormat)
-            self.settings.setIniCodec("UTF-8")  
         def value(self, name, default=None):
             """Read INI value with input name section and return value as float if number else as str"""
-            try:
-                value = self.settings.value(name, default)
-                if value is None:
-                    return ""
-                else:    
-                    return float(value)
-            except ValueError:
-                # value =value.encode("utf-8")
-                # value = value.decode("utf-8")
-                return value        
+            return self.settings.value(name, default)
+
         def sectionValue(self, section, name, default=None):
-            return self.value('{}/{}'.format(section, name), default)
+            return self.settings.sectionValue(section, name, default)
 
     class MNRISettings(Settings):
         """Convenient class to access MNRI values in original type"""
@@ -472,6 +465,22 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
             #     os.rename(tmpfile, mnri_file_path)
             super().__init__(mnri_file_path)
 
+    @staticmethod
+    def ctValuePreset(preset):
+        """
+        Returns the (air, water) normalization values of the input preset index of CTValuePreset.ini.
+        The file must be next to RFViewer.ini (application working directory).
+        """
+        ct_value_presets = loadIniSettings('CTValuePreset.ini', mustExist=False)
+        return (ct_value_presets.value('CTValuePreset{:04d}_Air'.format(preset), 0.0),
+                ct_value_presets.value('CTValuePreset{:04d}_Water'.format(preset), 0.018))
+
+    imageFormatToElementType = {
+        'Bmp': 'MET_USHORT',
+        'Raw8': 'MET_UCHAR',
+        'Raw16': 'MET_USHORT'  # special meaning for RTK (see rtkProjectionsReader)
+    }
+
     def __init__(self):
         super(RFReconstructionLogic, self).__init__()
         self._tmpSymlink = TemporarySymlink()
@@ -546,269 +555,107 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
         :raises: ValueError if MNRI file doesn't exist
         :return: full path to the created MHD file
         """
-        mhd_file_text = self.convertMnriToMhd(mnri_file_path)
+        return self.createSubsetMhdFile(mnri_file_path, ProjectionSubset.full())
 
-        out_file_name = os.path.basename(mnri_file_path).replace(".mnri", ".mhd")
-        output_path = os.path.join(os.path.dirname(mnri_file_path), out_file_name)
+    def subsetMhdFilePath(self, mnri_file_path, subset):
+        """Path of the mhd file of the input ProjectionSubset, next to the MNRI file and named after it"""
+        suffix = "_" + subset.name if subset.name else ""
+        out_file_name = os.path.basename(mnri_file_path).replace(".mnri", "{}.mhd".format(suffix))
+        return os.path.join(os.path.dirname(mnri_file_path), out_file_name)
 
-        with open(output_path, "w") as f:
-            f.write(mhd_file_text)
-
-        return output_path
-
-    def convertMnriToMhd1(self, mnri_file_path):
+    def convertMnriToSubsetMhd(self, mnri_file_path, subset, mhd_dir_path=None):
         """
-        Creates an mhd string corresponding to the information contained in the input mnri file path.
+        Creates an mhd string describing the frames of the input ProjectionSubset.
+        The frames are referenced in place in the MNRI Frame/FrameFolder directory : no frame file is copied.
 
         :param mnri_file_path: Path to the mnri file
-        :raises: ValueError if MNRI file doesn't exist
-        :return: str containing the mhd information extracted from the mnri file
+        :param subset: ProjectionSubset of the frames
+        :param mhd_dir_path: Directory where the mhd will be written. Defaults to the mnri directory
+        :return: str containing the mhd information of the frame subset
         """
-
-        # read MNRI file as .ini settings file
         mnri_settings = self.MNRISettings(mnri_file_path)
+        dir_path = os.path.dirname(mnri_file_path)
+        if mhd_dir_path is None:
+            mhd_dir_path = dir_path
 
-        # Extract values from mnri settings and try to convert them to float if possible
-        data_names = ["ImageFormat", "FrameWidth", "FrameHeight", "FrameCount1", "FrameLengthWidth", "FrameLengthHeight",
-                      "FrameNameDigit", "FrameFolder", "FrameBaseName", "ImageFileExt"]
-        mnri_data = {name: mnri_settings.sectionValue('Frame', name) for name in data_names}
-
-        mnri_data["XSpacing"] = mnri_data["FrameLengthWidth"] / mnri_data["FrameWidth"]
-        mnri_data["YSpacing"] = mnri_data["FrameLengthHeight"] / mnri_data["FrameHeight"]
-        mnri_data["LastFrameIndex"] = mnri_data["FrameCount1"] - 1
-
-        imageFormatToElementType = {
-            'Bmp':'MET_USHORT',
-            'Raw8': 'MET_UCHAR',
-            'Raw16': 'MET_USHORT'  # special meaning for RTK (see rtkProjectionsReader)
-        }
-        mnri_data['ElementType'] = imageFormatToElementType[mnri_data["ImageFormat"]]
-
-        # Create MHD file pattern based and fill it with mnri data
-        mhd = """
-            ObjectType = Image
-            NDims = 3
-            DimSize = {FrameWidth:.0f} {FrameHeight:.0f} {FrameCount1:.0f}
-            ElementType = {ElementType}
-            HeaderSize = -1
-            ElementSize = 1 1 1
-            ElementSpacing = {XSpacing:.5f} {YSpacing:.5f} 1
-            ElementByteOrderMSB = False
-            ElementDataFile = {FrameFolder}/{FrameBaseName}%0{FrameNameDigit:.0f}d.{ImageFileExt} 0 {LastFrameIndex:.0f} 1
-            """.format(**mnri_data)
+        frames = subset.frameRange(int(mnri_settings.value("Frame/FrameCount" + subset.geometryIndex)))
+        stack = self.projectionStack(mnri_settings, os.path.join(dir_path, mnri_settings.value("Frame/FrameFolder")))
+        stack = stack.subset(frames.start, frames.stop, frames.step)
 
-        return self.stripWhiteSpace(mhd)
+        spacing = (mnri_settings.value("Frame/FrameLengthWidth") / mnri_settings.value("Frame/FrameWidth"),
+                   mnri_settings.value("Frame/FrameLengthHeight") / mnri_settings.value("Frame/FrameHeight"))
+        element_type = self.imageFormatToElementType[mnri_settings.value("Frame/ImageFormat")]
+        return stack.mhdHeader(mhd_dir_path, spacing, element_type)
 
-    def createMhdFile1(self, mnri_file_path):
+    def createSubsetMhdFile(self, mnri_file_path, subset):
         """
-        Reads an MNRI file and creates an mhd file in the same directory as the source MNRI file
+        Creates the mhd file of the input ProjectionSubset (see subsetMhdFilePath). The full acquisition is described
+        with the MNRI frame name pattern (see convertMnriToMhd).
 
-        :param mnri_file_path: full path to an existing MNRI file
-        :raises: ValueError if MNRI file doesn't exist
         :return: full path to the created MHD file
         """
-        mhd_file_text = self.convertMnriToMhd1(mnri_file_path)
-
-        out_file_name = os.path.basename(mnri_file_path).replace(".mnri", ".mhd")
-        output_path = os.path.join(os.path.dirname(mnri_file_path), out_file_name)
-
-        with open(output_path, "w") as f:
-            f.write(mhd_file_text)
-
-        return output_path
-    def convertMnriToMhd2(self, mnri_file_path):
-        """
-        Creates an mhd string corresponding to the information contained in the input mnri file path.
-
-        :param mnri_file_path: Path to the mnri file
-        :raises: ValueError if MNRI file doesn't exist
-        :return: str containing the mhd information extracted from the mnri file
-        """
-
-        # read MNRI file as .ini settings file
         mnri_settings = self.MNRISettings(mnri_file_path)
+        if subset.isFull(int(mnri_settings.value("Frame/FrameCount"))):
+            mhd_file_text = self.convertMnriToMhd(mnri_file_path)
+        else:
+            mhd_file_text = self.convertMnriToSubsetMhd(mnri_file_path, subset)
 
-        # Extract values from mnri settings and try to convert them to float if possible
-        data_names = ["ImageFormat", "FrameWidth", "FrameHeight", "FrameCount2", "FrameLengthWidth", "FrameLengthHeight",
-                      "FrameNameDigit", "FrameFolder", "FrameBaseName", "ImageFileExt"]
-        mnri_data = {name: mnri_settings.sectionValue('Frame', name) for name in data_names}
-
-        mnri_data["XSpacing"] = mnri_data["FrameLengthWidth"] / mnri_data["FrameWidth"]
-        mnri_data["YSpacing"] = mnri_data["FrameLengthHeight"] / mnri_data["FrameHeight"]
-        mnri_data["LastFrameIndex"] = mnri_data["FrameCount2"] - 1
-
-        imageFormatToElementType = {
-            'Bmp':'MET_USHORT',
-            'Raw8': 'MET_UCHAR',
-            'Raw16': 'MET_USHORT'  # special meaning for RTK (see rtkProjectionsReader)
-        }
-        mnri_data['ElementType'] = imageFormatToElementType[mnri_data["ImageFormat"]]
-
-        # Create MHD file pattern based and fill it with mnri data
-        mhd = """
-            ObjectType = Image
-            NDims = 3
-            DimSize = {FrameWidth:.0f} {FrameHeight:.0f} {FrameCount2:.0f}
-            ElementType = {ElementType}
-            HeaderSize = -1
-            ElementSize = 1 1 1
-            ElementSpacing = {XSpacing:.5f} {YSpacing:.5f} 1
-            ElementByteOrderMSB = False
-            ElementDataFile = {FrameFolder}/{FrameBaseName}%0{FrameNameDigit:.0f}d.{ImageFileExt} 0 {LastFrameIndex:.0f} 1
-            """.format(**mnri_data)
-
-        return self.stripWhiteSpace(mhd)
-
-    def createMhdFile2(self, mnri_file_path):
-        """
-        Reads an MNRI file and creates an mhd file in the same directory as the source MNRI file
-
-        :param mnri_file_path: full path to an existing MNRI file
-        :raises: ValueError if MNRI file doesn't exist
-        :return: full path to the created MHD file
-        """
-        mhd_file_text = self.convertMnriToMhd2(mnri_file_path)
-
-        out_file_name = os.path.basename(mnri_file_path).replace(".mnri", ".mhd")
-        output_path = os.path.join(os.path.dirname(mnri_file_path), out_file_name)
-
+        output_path = self.subsetMhdFilePath(mnri_file_path, subset)
         with open(output_path, "w") as f:
             f.write(mhd_file_text)
 
         return output_path
 
-    def createCLIParameters(self, mnri_file_path, output_path=None):
-
-        # Create MHD file in the MRNIPath
-        mhdFilePath = self.createMhdFile(mnri_file_path)
-        self._tmpSymlink.setTargetDir(os.path.dirname(mhdFilePath))
-        mhdDirPath = self._tmpSymlink.getSymlinkPath()
-
-        if output_path is None:
-            output_path = os.path.join(mhdDirPath, "reconstructed-volume.mhd")
-
-        mnri_settings = self.MNRISettings(mnri_file_path)
-
-        
-        spacing = mnri_settings.value("Frame/FrameLengthWidth") / mnri_settings.value("Frame/FrameWidth")
-        sign = -1 # maybe the following ?  1 if mnri_settings.value("Frame/ImageFlipNeed") != 'None' else -1
-        angleSign = -1 if mnri_settings.value("Geometry/AntiClkRotDir") == 0 else 1
-
-        settings = qt.QSettings()
-        settings.beginGroup("Reconstruction")
-        hardware = settings.value("hardware", "cuda")
-        settings.endGroup()
-
-        pixel_depth = int(mnri_settings.value("Frame/PixelDepth"))
-        if pixel_depth <= 13:
-            divisions = 1
-            subsetSize = 6
-        else:
-            divisions = 3
-            subsetSize = 30
-
-        preset = int(mnri_settings.value('Volume/TFPresetIndex'))
-        CTValuePreset = qt.QSettings('CTValuePreset.ini', qt.QSettings.IniFormat)  # File must be next to RFViewer.ini
-        airvalue = CTValuePreset.value('CTValuePreset{:04d}_Air'.format(preset), "0.0")
-        watervalue = CTValuePreset.value('CTValuePreset{:04d}_Water'.format(preset), "0.018")
-        
-        tomoTheta = numpy.deg2rad(mnri_settings.value("Geometry/TomoTheta") - 90)
-        tomoDist = numpy.sin(tomoTheta) * mnri_settings.value("Geometry/XSrcDetectDist")
-        
-        offsetX = mnri_settings.value("Geometry/OffsetHoriz") * spacing
-        offsetY = mnri_settings.value("Geometry/OffsetVertical") * spacing
+    def convertMnriToMhd1(self, mnri_file_path):
+        """Creates an mhd string describing the odd projection frames of a two images acquisition."""
+        return self.convertMnriToSubsetMhd(mnri_file_path, ProjectionSubset.odd())
 
-        parameters = {
-            # IO
-            "path": mhdDirPath,
-            "regexp": os.path.basename(mhdFilePath),
-            "output": output_path,
-            # Geometry
-            "nproj": mnri_settings.value("Frame/FrameCount"),
-            "sdd": mnri_settings.value("Geometry/XSrcDetectDist"),  # Source to detector distance (mm)
-            "sid": mnri_settings.value("Geometry/XSrcObjectDist"),  # Source to isocenter distance (mm)
-            "first_angle": mnri_settings.value("Geometry/InitAngle"), # First angle in degrees
-            "proj_iso_x": sign * (offsetX + mnri_settings.value("Geometry/DetectOffset")),
-            "proj_iso_y": sign * (offsetY + tomoDist),
-            "source_x": sign * offsetX,
-            "source_y": sign * offsetY,
-            "arc": angleSign * mnri_settings.value("Geometry/TotalAngle"),
-            "in_angle": mnri_settings.value("Geometry/OffsetOrient"),
-            "out_angle": "0",
-            "rad_crop_perc": mnri_settings.value("Process/RadiusCropPercentage", default=7),  # Percentage of cylinder crop due to beam hardening
-            # FDK
-            "hann": mnri_settings.value("Process/FrequencyCut"),  # Cut frequency for hann window in ]0, 1] (0. disables it)
-            "hardware": hardware, # cuda or cpu
-            "lowmem": True,
-            "divisions": divisions,
-            "subsetsize": subsetSize,
-            "mask": False,
-            # Output
-            "scalarType": "Short",
-            "dimension": '{}, {}, {}'.format(
-                int(mnri_settings.value("BackProjection/VolXDim")),
-                int(mnri_settings.value("BackProjection/VolYDim")),
-                int(mnri_settings.value("BackProjection/VolZDim"))
-            ),  # Output dimension
-            "spacing": '{}, {}, {}'.format(
-            spacing * float(mnri_settings.value("BackProjection/VolXPitch")),
-            spacing * float(mnri_settings.value("BackProjection/VolYPitch")),
-            spacing * float(mnri_settings.value("BackProjection/VolZPitch"))
-            ),  # Output spacing
-            "neworigin": '{},{},{}'.format(
-                - mnri_settings.value("Frame/FrameLengthWidth") / 2 + offsetX,
-                - mnri_settings.value("Frame/FrameLengthHeight") / 2,
-                0), # New origin of input projections (before pre-processing)
-            # "direction": '0, 0, -1, 1, 0, 0, 0, 1, 0', # Output direction -> 0 1 0 0 0 1 -1 0 0
-            #"direction": '0, 1, 0, 0, 0, 1, -1, 0, 0', # Output direction -> 0 0 -1 1 0 0 0 1 0 -> 0 0 -1 -1 0 0 0 -1 0
-            "origin": '{},{},{}'.format(
-                mnri_settings.value("BackProjection/VolXStart") * spacing,
-                mnri_settings.value("BackProjection/VolYStart") * spacing,
-                mnri_settings.value("BackProjection/VolZStart") * spacing
-            ), # new origin
-            "airvalue": airvalue,
-            "watervalue": watervalue
-            }
+    def createMhdFile1(self, mnri_file_path):
+        """Creates the odd frames mhd file in the same directory as the source MNRI file"""
+        return self.createSubsetMhdFile(mnri_file_path, ProjectionSubset.odd())
 
-        if mnri_settings.value("Process/HFilterType") == "Median":
-            parameters["radius"] = '{},{}'.format(
-                int(mnri_settings.value("Process/HFilterMaskRadius")),
-                int(mnri_settings.value("Process/VFilterMaskRadius"))
-            )  # Radius of neighborhood for conditionl median filtering
-            parameters["multiplier"] = '1'
-        parameters["multiplier"] = '1'    
-        iDark, i0 = RFReconstructionLogic.range(mnri_settings)
+    def convertMnriToMhd2(self, mnri_file_path):
+        """Creates an mhd string describing the even projection frames of a two images acquisition."""
+        return self.convertMnriToSubsetMhd(mnri_file_path, ProjectionSubset.even())
 
-        if iDark is not None:
-            parameters["idark"] = iDark
+    def createMhdFile2(self, mnri_file_path):
+        """Creates the even frames mhd file in the same directory as the source MNRI file"""
+        return self.createSubsetMhdFile(mnri_file_path, ProjectionSubset.even())
 
-        if i0 is not None:
-            parameters["i0"] = i0
+    @staticmethod
+    def reconstructionHardware():
+        """Reconstruction hardware (cuda or cpu) of the application settings"""
+        settings = qt.QSettings()
+        settings.beginGroup("Reconstruction")
+        hardware = settings.value("hardware", "cuda")
+        settings.endGroup()
+        return hardware
 
-        return parameters
-            
-    def createCLIParameters1(self, mnri_file_path, output_path=None):
+    @classmethod
+    def subsetGeometryParameters(cls, mnri_settings, subset, hardware="cuda"):
+        """
+        Creates the simplertk geometry, FDK and output parameters of the input ProjectionSubset.
 
-        # Create MHD file in the MRNIPath
-        mhdFilePath = self.createMhdFile1(mnri_file_path)
-        self._tmpSymlink.setTargetDir(os.path.dirname(mhdFilePath))
-        mhdDirPath = self._tmpSymlink.getSymlinkPath()
+        The Geometry and BackProjection values of the subset geometryIndex are used. Partial arcs of a single
+        acquisition keep the acquisition geometry : the simplertk CLI spreads the nproj projection angles evenly over
+        arc starting from first_angle, first_angle and arc are therefore shifted and scaled to the subset frames.
 
-        if output_path is None:
-            output_path = os.path.join(mhdDirPath, "reconstructed-volume1.mhd")
+        :return: dict of the simplertk parameters without the IO parameters (path, regexp and output)
+        """
+        index = subset.geometryIndex
+        frame_count = int(mnri_settings.value("Frame/FrameCount" + index))
+        frames = subset.frameRange(frame_count)
 
-        mnri_settings = self.MNRISettings(mnri_file_path)
+        def geometry(name):
+            return mnri_settings.value("Geometry/{}{}".format(name, index))
+
+        def backProjection(name):
+            return mnri_settings.value("BackProjection/{}{}".format(name, index))
 
-        
         spacing = mnri_settings.value("Frame/FrameLengthWidth") / mnri_settings.value("Frame/FrameWidth")
         sign = -1 # maybe the following ?  1 if mnri_settings.value("Frame/ImageFlipNeed") != 'None' else -1
         angleSign = -1 if mnri_settings.value("Geometry/AntiClkRotDir") == 0 else 1
 
-        settings = qt.QSettings()
-        settings.beginGroup("Reconstruction")
-        hardware = settings.value("hardware", "cuda")
-        settings.endGroup()
-
         pixel_depth = int(mnri_settings.value("Frame/PixelDepth"))
         if pixel_depth <= 13:
             divisions = 1
@@ -818,32 +665,33 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
             subsetSize = 30
 
         preset = int(mnri_settings.value('Volume/TFPresetIndex'))
-        CTValuePreset = qt.QSettings('CTValuePreset.ini', qt.QSettings.IniFormat)  # File must be next to RFViewer.ini
-        airvalue = CTValuePreset.value('CTValuePreset{:04d}_Air'.format(preset), "0.0")
-        watervalue = CTValuePreset.value('CTValuePreset{:04d}_Water'.format(preset), "0.018")
-        
-        tomoTheta = numpy.deg2rad(mnri_settings.value("Geometry/TomoTheta1") - 90)
-        tomoDist = numpy.sin(tomoTheta) * mnri_settings.value("Geometry/XSrcDetectDist1")
-        
-        offsetX = mnri_settings.value("Geometry/OffsetHoriz1") * spacing
-        offsetY = mnri_settings.value("Geometry/OffsetVertical1") * spacing
+        airvalue, watervalue = cls.ctValuePreset(preset)
+
+        tomoTheta = numpy.deg2rad(geometry("TomoTheta") - 90)
+        tomoDist = numpy.sin(tomoTheta) * geometry("XSrcDetectDist")
+
+        offsetX = geometry("OffsetHoriz") * spacing
+        offsetY = geometry("OffsetVertical") * spacing
+
+        first_angle = geometry("InitAngle")
+        arc = angleSign * geometry("TotalAngle")
+        if not index and not subset.isFull(frame_count):
+            angle_step = arc / frame_count
+            first_angle += frames.start * angle_step
+            arc = angle_step * frames.step * len(frames)
 
         parameters = {
-            # IO
-            "path": mhdDirPath,
-            "regexp": os.path.basename(mhdFilePath),
-            "output": output_path,
             # Geometry
-            "nproj": mnri_settings.value("Frame/FrameCount1"),
-            "sdd": mnri_settings.value("Geometry/XSrcDetectDist1"),  # Source to detector distance (mm)
-            "sid": mnri_settings.value("Geometry/XSrcObjectDist1"),  # Source to isocenter distance (mm)
-            "first_angle": mnri_settings.value("Geometry/InitAngle1"), # First angle in degrees
-            "proj_iso_x": sign * (offsetX + mnri_settings.value("Geometry/DetectOffset1")),
+            "nproj": len(frames),
+            "sdd": geometry("XSrcDetectDist"),  # Source to detector distance (mm)
+            "sid": geometry("XSrcObjectDist"),  # Source to isocenter distance (mm)
+            "first_angle": first_angle, # First angle in degrees
+            "proj_iso_x": sign * (offsetX + geometry("DetectOffset")),
             "proj_iso_y": sign * (offsetY + tomoDist),
             "source_x": sign * offsetX,
             "source_y": sign * offsetY,
-            "arc": angleSign * mnri_settings.value("Geometry/TotalAngle1"),
-            "in_angle": mnri_settings.value("Geometry/OffsetOrient1"),
+            "arc": arc,
+            "in_angle": geometry("OffsetOrient"),
             "out_angle": "0",
             "rad_crop_perc": mnri_settings.value("Process/RadiusCropPercentage", default=7),  # Percentage of cylinder crop due to beam hardening
             # FDK
@@ -856,14 +704,14 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
             # Output
             "scalarType": "Short",
             "dimension": '{}, {}, {}'.format(
-                int(mnri_settings.value("BackProjection/VolXDim1")),
-                int(mnri_settings.value("BackProjection/VolYDim1")),
-                int(mnri_settings.value("BackProjection/VolZDim1"))
+                int(backProjection("VolXDim")),
+                int(backProjection("VolYDim")),
+                int(backProjection("VolZDim"))
             ),  # Output dimension
             "spacing": '{}, {}, {}'.format(
-            spacing * float(mnri_settings.value("BackProjection/VolXPitch1")),
-            spacing * float(mnri_settings.value("BackProjection/VolYPitch1")),
-            spacing * float(mnri_settings.value("BackProjection/VolZPitch1"))
+            spacing * float(backProjection("VolXPitch")),
+            spacing * float(backProjection("VolYPitch")),
+            spacing * float(backProjection("VolZPitch"))
             ),  # Output spacing
             "neworigin": '{},{},{}'.format(
                 - mnri_settings.value("Frame/FrameLengthWidth") / 2 + offsetX,
@@ -872,9 +720,9 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
             # "direction": '0, 0, -1, 1, 0, 0, 0, 1, 0', # Output direction -> 0 1 0 0 0 1 -1 0 0
             #"direction": '0, 1, 0, 0, 0, 1, -1, 0, 0', # Output direction -> 0 0 -1 1 0 0 0 1 0 -> 0 0 -1 -1 0 0 0 -1 0
             "origin": '{},{},{}'.format(
-                mnri_settings.value("BackProjection/VolXStart1") * spacing,
-                mnri_settings.value("BackProjection/VolYStart1") * spacing,
-                mnri_settings.value("BackProjection/VolZStart1") * spacing
+                backProjection("VolXStart") * spacing,
+                backProjection("VolYStart") * spacing,
+                backProjection("VolZStart") * spacing
             ), # new origin
             "airvalue": airvalue,
             "watervalue": watervalue
@@ -886,7 +734,10 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
                 int(mnri_settings.value("Process/VFilterMaskRadius"))
             )  # Radius of neighborhood for conditional median filtering
             parameters["multiplier"] = '1'
-            
+        elif not index:
+            # The frames of a single acquisition always set the multiplier, the odd and even frames only with a median
+            parameters["multiplier"] = '1'
+
         iDark, i0 = RFReconstructionLogic.range(mnri_settings)
 
         if iDark is not None:
@@ -896,116 +747,115 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
             parameters["i0"] = i0
 
         return parameters
-            
-    def createCLIParameters2(self, mnri_file_path, output_path=None):
 
-        # Create MHD file in the MRNIPath
-        mhdFilePath = self.createMhdFile2(mnri_file_path)
-        self._tmpSymlink.setTargetDir(os.path.dirname(mhdFilePath))
-        mhdDirPath = self._tmpSymlink.getSymlinkPath()
+    # Subset geometry parameters and mhd file signature by content key (see createSubsetCLIParameters)
+    _subsetParametersCache = OrderedDict()
+    _subsetParametersCacheSize = 16
 
-        if output_path is None:
-            output_path = os.path.join(mhdDirPath, "reconstructed-volume2.mhd")
+    @staticmethod
+    def _fileSignature(file_path):
+        stat = os.stat(file_path)
+        return stat.st_size, stat.st_mtime_ns
 
+    def _subsetParametersKey(self, mnri_file_path, subset, hardware):
+        """Content hash of the inputs of the subset parameters : MNRI file content, CT value presets and hardware"""
         mnri_settings = self.MNRISettings(mnri_file_path)
+        with open(mnri_file_path, "rb") as f:
+            content_hash = hashlib.sha1(f.read())
+        content_hash.update(repr((tuple(subset), hardware,
+                                  self.ctValuePreset(int(mnri_settings.value('Volume/TFPresetIndex'))))).encode())
+        return os.path.normcase(os.path.abspath(mnri_file_path)), content_hash.hexdigest()
 
-        
-        spacing = mnri_settings.value("Frame/FrameLengthWidth") / mnri_settings.value("Frame/FrameWidth")
-        sign = -1 # maybe the following ?  1 if mnri_settings.value("Frame/ImageFlipNeed") != 'None' else -1
-        angleSign = -1 if mnri_settings.value("Geometry/AntiClkRotDir") == 0 else 1
+    def createSubsetCLIParameters(self, mnri_file_path, subset, output_path=None):
+        """
+        Creates the mhd file and the simplertk parameters reconstructing the input ProjectionSubset of an MNRI
+        acquisition.
 
-        settings = qt.QSettings()
-        settings.beginGroup("Reconstruction")
-        hardware = settings.value("hardware", "cuda")
-        settings.endGroup()
+        The parameters are cached by content hash of the MNRI file : reconstructing again an unchanged acquisition
+        neither parses its geometry nor regenerates its mhd file as long as the mhd file is unchanged on disk.
 
-        pixel_depth = int(mnri_settings.value("Frame/PixelDepth"))
-        if pixel_depth <= 13:
-            divisions = 1
-            subsetSize = 6
-        else:
-            divisions = 3
-            subsetSize = 30
+        :param mnri_file_path: Path to the MNRI file
+        :param subset: ProjectionSubset to reconstruct
+        :param output_path: Reconstructed volume path. Defaults to reconstructed-volume[-<subset name>].mhd in the mhd
+        directory
+        :return: dict of the simplertk parameters
+        """
+        hardware = self.reconstructionHardware()
+        key = self._subsetParametersKey(mnri_file_path, subset, hardware)
+        mhdFilePath = self.subsetMhdFilePath(mnri_file_path, subset)
+
+        cache = RFReconstructionLogic._subsetParametersCache
+        cached = cache.pop(key, None)
+        if cached is None or not os.path.exists(mhdFilePath) or self._fileSignature(mhdFilePath) != cached[1]:
+            self.createSubsetMhdFile(mnri_file_path, subset)
+            geometry = self.subsetGeometryParameters(self.MNRISettings(mnri_file_path), subset, hardware)
+            cached = (geometry, self._fileSignature(mhdFilePath))
+        cache[key] = cached
+        while len(cache) > self._subsetParametersCacheSize:
+            cache.popitem(last=False)
 
-        preset = int(mnri_settings.value('Volume/TFPresetIndex'))
-        CTValuePreset = qt.QSettings('CTValuePreset.ini', qt.QSettings.IniFormat)  # File must be next to RFViewer.ini
-        airvalue = CTValuePreset.value('CTValuePreset{:04d}_Air'.format(preset), "0.0")
-        watervalue = CTValuePreset.value('CTValuePreset{:04d}_Water'.format(preset), "0.018")
-        
-        tomoTheta = numpy.deg2rad(mnri_settings.value("Geometry/TomoTheta2") - 90)
-        tomoDist = numpy.sin(tomoTheta) * mnri_settings.value("Geometry/XSrcDetectDist2")
-        
-        offsetX = mnri_settings.value("Geometry/OffsetHoriz2") * spacing
-        offsetY = mnri_settings.value("Geometry/OffsetVertical2") * spacing
+        # Create MHD file in the MRNIPath
+        self._tmpSymlink.setTargetDir(os.path.dirname(mhdFilePath))
+        mhdDirPath = self._tmpSymlink.getSymlinkPath()
+
+        if output_path is None:
+            suffix = "-" + subset.name if subset.name else ""
+            output_path = os.path.join(mhdDirPath, "reconstructed-volume{}.mhd".format(suffix))
 
         parameters = {
             # IO
             "path": mhdDirPath,
             "regexp": os.path.basename(mhdFilePath),
             "output": output_path,
-            # Geometry
-            "nproj": mnri_settings.value("Frame/FrameCount2"),
-            "sdd": mnri_settings.value("Geometry/XSrcDetectDist2"),  # Source to detector distance (mm)
-            "sid": mnri_settings.value("Geometry/XSrcObjectDist2"),  # Source to isocenter distance (mm)
-            "first_angle": mnri_settings.value("Geometry/InitAngle2"), # First angle in degrees
-            "proj_iso_x": sign * (offsetX + mnri_settings.value("Geometry/DetectOffset2")),
-            "proj_iso_y": sign * (offsetY + tomoDist),
-            "source_x": sign * offsetX,
-            "source_y": sign * offsetY,
-            "arc": angleSign * mnri_settings.value("Geometry/TotalAngle2"),
-            "in_angle": mnri_settings.value("Geometry/OffsetOrient2"),
-            "out_angle": "0",
-            "rad_crop_perc": mnri_settings.value("Process/RadiusCropPercentage", default=7),  # Percentage of cylinder crop due to beam hardening
-            # FDK
-            "hann": mnri_settings.value("Process/FrequencyCut"),  # Cut frequency for hann window in ]0, 1] (0. disables it)
-            "hardware": hardware, # cuda or cpu
-            "lowmem": True,
-            "divisions": divisions,
-            "subsetsize": subsetSize,
-            "mask": False,
-            # Output
-            "scalarType": "Short",
-            "dimension": '{}, {}, {}'.format(
-                int(mnri_settings.value("BackProjection/VolXDim2")),
-                int(mnri_settings.value("BackProjection/VolYDim2")),
-                int(mnri_settings.value("BackProjection/VolZDim2"))
-            ),  # Output dimension
-            "spacing": '{}, {}, {}'.format(
-            spacing * float(mnri_settings.value("BackProjection/VolXPitch2")),
-            spacing * float(mnri_settings.value("BackProjection/VolYPitch2")),
-            spacing * float(mnri_settings.value("BackProjection/VolZPitch2"))
-            ),  # Output spacing
-            "neworigin": '{},{},{}'.format(
-                - mnri_settings.value("Frame/FrameLengthWidth") / 2 + offsetX,
-                - mnri_settings.value("Frame/FrameLengthHeight") / 2,
-                0), # New origin of input projections (before pre-processing)
-            # "direction": '0, 0, -1, 1, 0, 0, 0, 1, 0', # Output direction -> 0 1 0 0 0 1 -1 0 0
-            #"direction": '0, 1, 0, 0, 0, 1, -1, 0, 0', # Output direction -> 0 0 -1 1 0 0 0 1 0 -> 0 0 -1 -1 0 0 0 -1 0
-            "origin": '{},{},{}'.format(
-                mnri_settings.value("BackProjection/VolXStart2") * spacing,
-                mnri_settings.value("BackProjection/VolYStart2") * spacing,
-                mnri_settings.value("BackProjection/VolZStart2") * spacing
-            ), # new origin
-            "airvalue": airvalue,
-            "watervalue": watervalue
-            }
+        }
+        parameters.update(cached[0])
+        return parameters
 
-        if mnri_settings.value("Process/HFilterType") == "Median":
-            parameters["radius"] = '{},{}'.format(
-                int(mnri_settings.value("Process/HFilterMaskRadius")),
-                int(mnri_settings.value("Process/VFilterMaskRadius"))
-            )  # Radius of neighborhood for conditional median filtering
-            parameters["multiplier"] = '1'
-            
-        iDark, i0 = RFReconstructionLogic.range(mnri_settings)
+    @staticmethod
+    def previewFactor():
+        """
+        Downsampling factor of the preview reconstruction run before the full reconstruction (Reconstruction/preview
+        application setting). 0 or 1 disables the preview.
+        """
+        settings = qt.QSettings()
+        settings.beginGroup("Reconstruction")
+        factor = settings.value("preview", 4)
+        settings.endGroup()
+        try:
+            return int(factor)
+        except (TypeError, ValueError):
+            return 0
 
-        if iDark is not None:
-            parameters["idark"] = iDark
+    def createPreviewCLIParameters(self, mnri_file_path, factor=4, output_path=None):
+        """
+        Creates the simplertk parameters of a low resolution preview of the full reconstruction : one projection out of
+        factor is reconstructed on an output grid factor times coarser covering the same field of view. The detector
+        pixels are not binned : the frames are read in place at full resolution.
 
-        if i0 is not None:
-            parameters["i0"] = i0
+        :return: dict of the simplertk parameters
+        """
+        parameters = self.createSubsetCLIParameters(mnri_file_path, ProjectionSubset.arc("preview", 0, None, factor),
+                                                    output_path)
+
+        dimension = [int(v) for v in parameters["dimension"].split(",")]
+        spacing = [float(v) for v in parameters["spacing"].split(",")]
+        origin = [float(v) for v in parameters["origin"].split(",")]
 
+        # The first coarse voxel is centered on the first factor x factor x factor block of full resolution voxels
+        parameters["dimension"] = '{}, {}, {}'.format(*[max(1, int(math.ceil(d / factor))) for d in dimension])
+        parameters["spacing"] = '{}, {}, {}'.format(*[s * factor for s in spacing])
+        parameters["origin"] = '{},{},{}'.format(*[o + s * (factor - 1) / 2 for o, s in zip(origin, spacing)])
         return parameters
+
+    def createCLIParameters(self, mnri_file_path, output_path=None):
+        return self.createSubsetCLIParameters(mnri_file_path, ProjectionSubset.full(), output_path)
+
+    def createCLIParameters1(self, mnri_file_path, output_path=None):
+        return self.createSubsetCLIParameters(mnri_file_path, ProjectionSubset.odd(), output_path)
+
+    def createCLIParameters2(self, mnri_file_path, output_path=None):
+        return self.createSubsetCLIParameters(mnri_file_path, ProjectionSubset.even(), output_path)
+
     @staticmethod
     def imageBits(mnri_settings):
         imageFormatToBits = {'Raw8': 8, 'Raw16': 16}
@@ -1064,318 +914,60 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
     def int_to_signed_short(self, value):
         return -(value & 0x8000) | (value & 0x7fff)
 
-    def filesubtration(self,totalcount,count, dir_path, filename1, filename2):
-        print(filename1)
-        print(filename2) 
-
-        img_path = os.path.join(dir_path, "frame/" + filename1)
-        img_path1 = os.path.join(dir_path, "frame/"+ filename2)
-        tmpcount = int(count//2)
-        tmpcount1 = int(totalcount // 2) + tmpcount
-        if tmpcount < 10:
-            newfilename = "image_00" + str(tmpcount) + ".img"
-        elif tmpcount< 100:
-            newfilename = "image_0" + str(tmpcount) + ".img"
-        else:
-            newfilename = "image_" + str(tmpcount) + ".img"
-        
-        if tmpcount1 < 10:
-            newfilename1 = "image_00" + str(tmpcount1) + ".img"
-        elif tmpcount1< 100:
-            newfilename1 = "image_0" + str(tmpcount1) + ".img"
-        else:
-            newfilename1 = "image_" + str(tmpcount1) + ".img"
-
-        print(newfilename)
-        print(newfilename1) 
-        # arraysize = int (os.stat(img_path).st_size / 2 + 1)
-
-        # resultfile = self.read_file(img_path, "little")
-        # resultfile1 = self.read_file(img_path1, "little")
-        # tmp_result = [None] * len(resultfile);    
-
-        # for i in range(0, len(resultfile)):    
-        #     if i< 40 :
-        #         tmp_result[i] = resultfile[i] 
-        #     else:
-        #         tmp_result[i] = resultfile[i] - round(resultfile1[i] * 0.017)     
-        
-        result_dir = os.path.join(dir_path,"frame_result1")
-        if not os.path.exists(result_dir):
-            os.mkdir(result_dir)
-        
-        shutil.copy(img_path, result_dir)
-        os.rename(os.path.join(result_dir, filename1), os.path.join(result_dir, newfilename))
-        dir = os.path.join(dir_path,"frame1")
-        if not os.path.exists(dir):
-            os.mkdir(dir)
-        shutil.copy(os.path.join(dir_path, "NAOMICT_UTF8.mnri"), dir)
-        
-        dir = os.path.join(dir_path,"frame1/frame")
-        if not os.path.exists(dir):
-            os.mkdir(dir)    
-        shutil.copy(os.path.join(result_dir, newfilename), dir)
-        
+    @staticmethod
+    def projectionStack(mnri_settings, frame_dir_path, dtype=np.uint16):
+        """Returns the ProjectionStack of the frames in frame_dir_path described by the input MNRI settings"""
+        frameShape = (int(mnri_settings.value("Frame/FrameHeight")), int(mnri_settings.value("Frame/FrameWidth")))
+        return ProjectionStack.fromDirectory(frame_dir_path, int(mnri_settings.value("Frame/FrameCount")), frameShape,
+                                             dtype=dtype,
+                                             baseName=mnri_settings.value("Frame/FrameBaseName", "image_"),
+                                             digits=int(mnri_settings.value("Frame/FrameNameDigit", 3)),
+                                             ext=mnri_settings.value("Frame/ImageFileExt", "img"))
 
-        result_dir = os.path.join(dir_path,"frame_result2")
-        if not os.path.exists(result_dir):
-            os.mkdir(result_dir)
-
-        shutil.copy(img_path1, result_dir)
-        os.rename(os.path.join(result_dir, filename2), os.path.join(result_dir, newfilename))
-        dir = os.path.join(dir_path,"frame2")
-        if not os.path.exists(dir):
-            os.mkdir(dir)
-        shutil.copy(os.path.join(dir_path, "NAOMICT_UTF8.mnri"), dir)
-        dir = os.path.join(dir_path,"frame2/frame")
-        if not os.path.exists(dir):
-            os.mkdir(dir) 
-        shutil.copy(os.path.join(result_dir, newfilename), dir)
-        print(os.path.join(result_dir, filename1))
-        print(os.path.join(result_dir, filename2))
-        print(os.path.join(result_dir, newfilename))
-        #     dir = os.path.join(dir_path,"frame2")    
-        #     if not os.path.exists(dir):
-        #         os.mkdir(dir)
-        #     result_img_path = os.path.join(dir_path, "frame2/"+ newfilename)
-        #     my_array = np.array( tmp_result , dtype='H')
-        #     self.write_file(result_img_path, my_array)
-        #     shutil.copy(result_img_path, result_dir)
-        # return "ok"
     def converting_files(self, mnri_file_path):
-        
+        """
+        Dual-energy subtraction of the projection frames : every frame is replaced by frame[i] - frame[i - 1] * k
+        where k is the MNRI Frame/Subtraction value (0.017 by default).
+        The original frames are moved to the frame_original directory.
+
+        The odd and even frames used by the two images reconstruction are then read in place from the frame directory
+        (see createMhdFile1 and createMhdFile2).
+        """
         mnri_settings = self.MNRISettings(mnri_file_path)
-        # typevalues = mnri_settings.value("Frame/Type")
-        # if typevalues == 1:
         dir_path = os.path.dirname(mnri_file_path)
-        filecount = int(mnri_settings.value("Frame/FrameCount"))
-        print(filecount)
         try:
-            rangeValue =  float(mnri_settings.value("Frame/Subtraction"))
-        except:
-            rangeValue =  0.017
-        
-        result_dir11 = os.path.join(dir_path,"framecal")
-        if not os.path.exists(result_dir11):
-            os.mkdir(result_dir11)
-        img_path = ""
-        # print(rangeValue)
-        for i in range(1, filecount, 1):
-            j = i - 1
-            if i < 10:
-                img_path = "image_00" + str(i) + ".img"
-            elif i< 100:
-                img_path = "image_0" + str(i) + ".img"
-            else:
-                img_path = "image_" + str(i) + ".img"
-            img_file_path = os.path.join(dir_path, "frame/" + img_path)
-            print(img_file_path)
-            if j < 10:
-                img_path1 = "image_00" + str(j) + ".img"
-            elif j< 100:
-                img_path1 = "image_0" + str(j) + ".img"
-            else:
-                img_path1 = "image_" + str(j) + ".img"    
-            img_file_path1 = os.path.join(dir_path, "frame/" + img_path1)
-            # print(img_path1)
-            
-            resultfile = np.fromfile(img_file_path, dtype=np.uint16)
-            resultfile1 = np.fromfile(img_file_path1, dtype=np.uint16)
-            print(resultfile)
-            print(resultfile1)
-            # resultfile = self.read_file(img_path, "little")
-            # resultfile1 = self.read_file(img_path1, "little")
-            # tmp_result = [None] * len(resultfile);    
-            tmp_result = resultfile - resultfile1 * rangeValue  
-            
-
+            rangeValue = float(mnri_settings.value("Frame/Subtraction"))
+        except ValueError:
+            rangeValue = 0.017
 
-            # image = tmp_result.reshape(616, int(len(tmp_result) / 616))
-            
-            
-            
-            # image = rescale(image, scale=0.4, mode='reflect', multichannel=False)
-
-            # theta = np.linspace(0., 180., max(image.shape), endpoint=False)
-            # # imagedata = rescale(imagedata, scale=0.4, mode='reflect', multichannel=False)
-            # sinogram = radon(image, theta=theta,circle=False)
-            # print("sinogram")
-            # print(sinogram)
-            # reconstruction_fbp = iradon(sinogram, theta=theta,circle=False)
-            # reconstruction_sart = iradon_sart(sinogram, theta=theta)
-            # reconstruction_sart2 = iradon_sart(sinogram, theta=theta,
-            #                        image=reconstruction_sart)
-            # print(reconstruction_sart2)
-            # np.save(img_path, tmp_result)
-            
-            # tmp_result.tofile(img_path,dtype=np.uint16)
-            # # for i in range(0, len(resultfile)):    
-            # #     if i< 40 :
-            # #         tmp_result[i] = resultfile[i] 
-            # #     else:
-            # #         tmp_result[i] = resultfile[i] - round(resultfile1[i] * rangeValue)         
-
-            # # result_img_path = os.path.join(dir_path,resultfile )
-
-            tmp_result = tmp_result
-            my_array = np.array( tmp_result , dtype=np.uint16)
-            print(my_array)
-            my_array.tofile(result_dir11 + "/" + img_path)
-
-
-
-            resultfile2 = np.fromfile(result_dir11 + "/" + img_path, dtype=np.uint16)
-            print(resultfile2)
-            # print(img_path)
-            # shutil.copy(result_img_path, result_dir)
-        # test = os.listdir(dir_path + "/frame/")
-        # for item in test:
-        #     if item.endswith(".npy"):
-        #         os.remove(os.path.join(dir_path + "/frame", item))
-        shutil.copyfile(dir_path+ "/frame/image_000.img", dir_path+ "/framecal/image_000.img")
-        os.rename(dir_path + "/" + "frame",dir_path + "/" + "frame_original")
-        os.rename(result_dir11,dir_path + "/" + "frame") 
-
-        img_path = ""
-        img_path1 = ""
-        for i in range(1, filecount, 2 ):  
-            j = i - 1  
-            if i < 10:
-                img_path = "image_00" + str(i) + ".img"
-            elif i< 100:
-                img_path = "image_0" + str(i) + ".img"
-            else:
-                img_path = "image_" + str(i) + ".img"
-            
-            if j < 10:
-                img_path1 = "image_00" + str(j) + ".img"
-            elif j< 100:
-                img_path1 = "image_0" + str(j) + ".img"
-            else:
-                img_path1 = "image_" + str(j) + ".img"
-            
-            
-            self.filesubtration(filecount, i, dir_path, img_path, img_path1)
+        frame_dir = os.path.join(dir_path, "frame")
+        result_dir = os.path.join(dir_path, "framecal")
+        stack = self.projectionStack(mnri_settings, frame_dir)
+        FrameSubtractionEngine(rangeValue).runToDirectory(stack, result_dir)
 
-            # oldpath = os.path.join(dir_path,"frame")
-            # tmppath = os.path.join(dir_path,"frame_tmp")
-            # if os.path.exists(oldpath):
-            #     os.rename(oldpath, tmppath)
+        os.rename(frame_dir, os.path.join(dir_path, "frame_original"))
+        os.rename(result_dir, frame_dir)
 
-            # oldpath = os.path.join(dir_path,"frame_result")
-            # tmppath = os.path.join(dir_path,"frame")
-            # if os.path.exists(oldpath):
-            #     os.rename(oldpath, tmppath)
-        
-         
-        # filename1 = ""
-        # source_dir = os.path.join(dir_path,"frame1")
-        # if os.path.exists(source_dir):
-        #     file_names = os.listdir(source_dir)
-        #     ii = 0
-        #     for file_name in file_names:
-        #         # shutil.copy(os.path.join(source_dir, file_name), newpath)
-        #         if ii < 10:
-        #             filename1 = "image_00" + str(ii) + ".img"
-        #         elif ii < 100:
-        #             filename1 = "image_0" + str(ii) + ".img"
-        #         else:
-        #             filename1 = "image_" + str(ii) + ".img"
-        #         os.rename(os.path.join(source_dir, file_name), os.path.join(source_dir, filename1))
-        #         ii = ii + 1
-
-        # shutil.copy(os.path.join(tmppath, "air_0.img"), source_dir)     
-        # shutil.copy(os.path.join(tmppath, "dark_0.img"), source_dir)
-
-        # source_dir = os.path.join(dir_path,"frame2")
-        # if os.path.exists(source_dir):
-        #     file_names = os.listdir(source_dir)
-        #     jj = 0
-        #     for file_name in file_names:
-        #         # shutil.copy(os.path.join(source_dir, file_name), newpath)
-        #         if jj < 10:
-        #             filename1 = "image_00" + str(jj) + ".img"
-        #         elif jj < 100:
-        #             filename1 = "image_0" + str(jj) + ".img"
-        #         else:
-        #             filename1 = "image_" + str(jj) + ".img"
-        #         os.rename(os.path.join(source_dir, file_name), os.path.join(source_dir, filename1))
-        #         jj = jj + 1
-
-        # shutil.copy(os.path.join(tmppath, "air_0.img"), source_dir)     
-        # shutil.copy(os.path.join(tmppath, "dark_0.img"), source_dir)
-
-        # shutil.copy(os.path.join(tmppath, "air_0.img"), newpath)     
-        # shutil.copy(os.path.join(tmppath, "dark_0.img"), newpath)
-        # shutil.copy(os.path.join(tmppath, "image_000.img"), newpath)
     def converting_mar_files(self, mnri_file_path):
-        
+        """
+        Reduce the metal artifacts of the projection frames of the input MNRI acquisition.
+        The frames are processed by a MetalArtifactReductionEngine into the framemar directory which then replaces
+        the frame directory. The original frames are kept in the frame_tmp directory.
+
+        :return: dict with the processing statistics of the MetalArtifactReductionEngine
+        """
         mnri_settings = self.MNRISettings(mnri_file_path)
         dir_path = os.path.dirname(mnri_file_path)
-        filecount = int(mnri_settings.value("Frame/FrameCount"))
-        frameWidth = int(mnri_settings.value("Frame/FrameWidth"))
-        frameHeight = int(mnri_settings.value("Frame/frameHeight"))
-        marthreshold = float(mnri_settings.value("Frame/MarThreshold"))
-        result_dir11 = os.path.join(dir_path,"framemar")
-        if not os.path.exists(result_dir11):
-            os.mkdir(result_dir11)
-        img_path = ""
-        # print(rangeValue)
-        for i in range(0, filecount, 1):
-            print(i)
-            if i < 10:
-                img_path = "image_00" + str(i) + ".img"
-            elif i< 100:
-                img_path = "image_0" + str(i) + ".img"
-            else:
-                img_path = "image_" + str(i) + ".img"
-            img_file_path = os.path.join(dir_path, "frame/" + img_path)
-            
-            resultfile = np.fromfile(img_file_path, dtype=np.uint16)
-            
-            
-            image = resultfile.reshape(frameWidth, frameHeight)
-            image = image.astype(float)
-            print(image)
-            print(np.max(image))
-            
-            average1 = self.Average(self.Average(image))
-            print(average1)
-            if average1 > 3000:
-                theta = np.linspace(0., 180., max(image.shape), endpoint=False)
-                tmp = radon(image, theta=theta, circle=True)
-                print(tmp)
-                average = self.Average(self.Average(tmp))
-                print(average)
-                tmp[ (tmp > average * 5) ] = average * 5
-
-                image[image < (np.max(image) * 0.85)] = 0
-                # image1 = image
-                # image1[(image1>(np.max(image1) * 0.30)) & (image1 < (np.max(image1) * 0.80))] = 0
-                # sinogram[sinogram > 0]=1
-
-                print(tmp)
-                reconstruction_fbp = iradon(tmp, theta=theta, circle=True)
-                print(reconstruction_fbp)
-                
-                
-                # reconstruction_fbp = reconstruction_fbp  image
-                print(reconstruction_fbp)
-                reconstruction_fbp = np.array(reconstruction_fbp).ravel()
-                image = np.array(reconstruction_fbp).ravel()
-                reconstruction_fbp = reconstruction_fbp + image
-                print("reconstruction_fbp")
-                print(reconstruction_fbp)
-
-                my_array = np.array( reconstruction_fbp , dtype=np.uint16)
-                print(my_array)
-                my_array.tofile(result_dir11 + "/" + img_path)
-        os.rename(dir_path + "/" + "frame" ,dir_path + "/" + "frame_tmp" )
-        os.rename(result_dir11,dir_path + "/" + "frame")
-
-
-    def Average(self,lst): 
-        return sum(lst) / len(lst) 
+
+        frame_dir = os.path.join(dir_path, "frame")
+        result_dir = os.path.join(dir_path, "framemar")
+        stack = self.projectionStack(mnri_settings, frame_dir)
+        stats = MetalArtifactReductionEngine().runToDirectory(stack, result_dir)
+
+        os.rename(frame_dir, os.path.join(dir_path, "frame_tmp"))
+        os.rename(result_dir, frame_dir)
+        return stats
+
     def reconstruct_odd(self, mnri_file_path, sync=False, cliNode=None, out_path=None):
         """
         Load an MRNI file, create an MHD file for all the projections,
@@ -1441,7 +1033,93 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
                 cliNode = slicer.cli.run(slicer.modules.simplertk, cliNode, parameters, update_display=False)
             return cliNode
  
-    def reconstruct(self, mnri_file_path, sync=False, cliNode=None, out_path=None):
+    @staticmethod
+    def estimateReconstructionMemory(mnri_settings, parameters):
+        """
+        Estimated peak memory in bytes of one simplertk run : float output volume and short written volume plus the
+        float projections.
+        """
+        voxel_count = numpy.prod([int(v) for v in parameters["dimension"].split(",")])
+        frame_pixel_count = int(mnri_settings.value("Frame/FrameWidth")) * int(mnri_settings.value("Frame/FrameHeight"))
+        return int(voxel_count * (4 + 2) + int(parameters["nproj"]) * frame_pixel_count * 4)
+
+    def reconstructTwoImages(self, mnri_file_path):
+        """
+        Runs the odd and even frames reconstructions of a two images acquisition concurrently.
+        The number of simultaneous runs is bounded by the available cores and physical memory.
+
+        :return: ParallelCLIScheduler of the running reconstructions. Its completed signal is emitted with the odd and
+        even CLI nodes once both reconstructions are finished.
+        """
+        mnri_settings = self.MNRISettings(mnri_file_path)
+        parameter_sets = [self.createCLIParameters1(mnri_file_path), self.createCLIParameters2(mnri_file_path)]
+        memory_per_run = max(self.estimateReconstructionMemory(mnri_settings, p) for p in parameter_sets)
+
+        scheduler = ParallelCLIScheduler(slicer.modules.simplertk, maxConcurrentRuns(len(parameter_sets), memory_per_run))
+        scheduler.start(parameter_sets)
+        return scheduler
+
+    @staticmethod
+    def createStackedVolumeNode(mhd_file_paths, name):
+        """
+        Creates a volume node stacking the input MHD volumes along the slice axis with the geometry of the first volume.
+        The raw voxels are read directly into the preallocated volume image data, without intermediate copy nor
+        temporary file.
+
+        :param mhd_file_paths: List[str] paths to uncompressed MHD volumes with the same slice dimensions
+        :param name: str name of the created volume node
+        :return: vtkMRMLScalarVolumeNode
+        :raises: IOError or ValueError if the volumes cannot be read, the volume node is then removed from the scene
+        """
+        volume_node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", name)
+        try:
+            RFReconstructionLogic.setStackedVolumes(volume_node, mhd_file_paths)
+        except Exception:
+            removeNodeFromMRMLScene(volume_node)
+            raise
+        volume_node.CreateDefaultDisplayNodes()
+        return volume_node
+
+    @staticmethod
+    def loadReconstructedVolume(mhd_file_path):
+        """
+        Loads a reconstructed MHD volume. The raw voxels of uncompressed volumes are read once directly into the volume
+        image data (see createStackedVolumeNode), other volumes are loaded with the Slicer volume reader.
+
+        :return: vtkMRMLScalarVolumeNode
+        """
+        name = os.path.splitext(os.path.basename(mhd_file_path))[0]
+        try:
+            volume_info = MhdVolumeInfo(mhd_file_path)
+        except (KeyError, ValueError):
+            return slicer.util.loadNodeFromFile(mhd_file_path, "VolumeFile")
+        return RFReconstructionLogic.createStackedVolumeNode([volume_info.mhdPath], name)
+
+    @staticmethod
+    def setStackedVolumes(volume_node, mhd_file_paths):
+        """
+        Replaces the image data and geometry of an existing volume node with the stacked input MHD volumes (see
+        createStackedVolumeNode). The display nodes of the volume are kept.
+        """
+        volume_infos = [MhdVolumeInfo(path) for path in mhd_file_paths]
+        shape = stackedVolumeShape(volume_infos)
+
+        image_data = vtk.vtkImageData()
+        image_data.SetDimensions(shape[2], shape[1], shape[0])
+        image_data.AllocateScalars(get_vtk_array_type(volume_infos[0].dtype.newbyteorder("=")), 1)
+
+        volume_node.SetIJKToRASMatrix(slicer.util.vtkMatrixFromArray(volume_infos[0].ijkToRASMatrix()))
+        volume_node.SetAndObserveImageData(image_data)
+        readStackedVolumesInto(volume_infos, slicer.util.arrayFromVolume(volume_node))
+        slicer.util.arrayFromVolumeModified(volume_node)
+        return volume_node
+
+    def _reconstructionParameters(self, mnri_file_path, out_path, preview_factor):
+        if preview_factor is not None and preview_factor > 1:
+            return self.createPreviewCLIParameters(mnri_file_path, preview_factor, out_path)
+        return self.createCLIParameters(mnri_file_path, out_path)
+
+    def reconstruct(self, mnri_file_path, sync=False, cliNode=None, out_path=None, preview_factor=None):
         """
         Load an MRNI file, create an MHD file for all the projections,
         and run the simplertk filter.
@@ -1449,6 +1127,7 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
         If synchronous, returns once the reconstruction is over, otherwise returns as soon
         as the filter is scheduled.
         A cliNode can be provided to observe cli events
+        If a preview_factor is given, a low resolution preview is reconstructed instead (see createPreviewCLIParameters)
         """
         mnri_settings = self.MNRISettings(mnri_file_path)
         
@@ -1456,7 +1135,7 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
         filecount = int(mnri_settings.value("Frame/FrameCount"))
         # self.converting_files(filecount, dir_path)
         try:
-            parameters = self.createCLIParameters(mnri_file_path, out_path)
+            parameters = self._reconstructionParameters(mnri_file_path, out_path, preview_factor)
             if cliNode is None:
                 cliNode = slicer.cli.createNode(slicer.modules.simplertk)
             if sync:
@@ -1509,7 +1188,7 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
                 #     cliNode = slicer.cli.run(slicer.modules.simplertk, cliNode, parameters, update_display=False)
                 # return cliNode
         except:
-            parameters = self.createCLIParameters(mnri_file_path, out_path)
+            parameters = self._reconstructionParameters(mnri_file_path, out_path, preview_factor)
             if cliNode is None:
                 cliNode = slicer.cli.createNode(slicer.modules.simplertk)
 
@@ -1607,6 +1286,376 @@ class RFReconstructionLogicTestCase(unittest.TestCase):
         logic = RFReconstructionLogic()
         logic.cleanupMhdFile("not_an_existing_path.mhd")
 
+    def test_mnri_settings_are_parsed_once_until_the_file_is_modified(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+        mnri_file_path = self.create_mnri_file(self.an_mnri_file(), tempDir.path())
+
+        settings = RFReconstructionLogic.MNRISettings(mnri_file_path)
+        self.assertEqual(888., settings.value("Frame/FrameWidth"))
+        self.assertEqual("Raw16", settings.sectionValue("frame", "imageformat"))
+        self.assertEqual("", settings.value("Frame/Missing"))
+        self.assertIs(settings.settings, RFReconstructionLogic.MNRISettings(mnri_file_path).settings)
+
+        stat = os.stat(mnri_file_path)
+        self.create_mnri_file(self.an_mnri_file().replace("FrameWidth=888", "FrameWidth=444"), tempDir.path())
+        os.utime(mnri_file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(444., RFReconstructionLogic.MNRISettings(mnri_file_path).value("Frame/FrameWidth"))
+
+        with self.assertRaises(FileNotFoundError):
+            RFReconstructionLogic.MNRISettings(os.path.join(tempDir.path(), "missing.mnri"))
+
+    def create_synthetic_frames(self, outDir, frameCount, frameShape, seed=0):
+        frame_dir = os.path.join(outDir, "frame")
+        os.makedirs(frame_dir)
+        frames = np.random.RandomState(seed).randint(0, 2 ** 15, size=(frameCount,) + frameShape, dtype=np.uint16)
+        for i, frame in enumerate(frames):
+            frame.tofile(os.path.join(frame_dir, frameFileName(i)))
+        return frame_dir, frames
+
+    def test_frame_subtraction_matches_reference_with_saturation(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+        frame_dir, frames = self.create_synthetic_frames(tempDir.path(), 37, (16, 12))
+
+        stack = ProjectionStack.fromDirectory(frame_dir, len(frames), frames.shape[1:])
+        out_dir = os.path.join(tempDir.path(), "framecal")
+        FrameSubtractionEngine(1.5, chunkSize=5, workerCount=3).runToDirectory(stack, out_dir)
+
+        expected = frames.astype(np.float64)
+        expected[1:] -= frames[:-1] * 1.5
+        expected = np.clip(expected, 0, 65535).astype(np.uint16)
+        result = ProjectionStack.fromDirectory(out_dir, len(frames), frames.shape[1:])[:]
+        self.assertTrue(np.array_equal(frames[0], result[0]))
+        self.assertLessEqual(np.abs(result.astype(np.int32) - expected).max(), 1)
+
+    @staticmethod
+    def reference_metal_artifact_reduction(frame):
+        # Per frame skimage algorithm of the previous converting_mar_files implementation
+        image = frame.astype(float)
+        if image.mean() <= 3000:
+            return frame
+        theta = np.linspace(0., 180., max(image.shape), endpoint=False)
+        sinogram = radon(image, theta=theta, circle=True)
+        average = sinogram.mean()
+        sinogram[sinogram > average * 5] = average * 5
+        reconstruction_fbp = iradon(sinogram, theta=theta, circle=True) * 2
+        return np.clip(reconstruction_fbp, 0, 65535).astype(np.uint16)
+
+    def test_metal_artifact_reduction_matches_per_frame_skimage_algorithm(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+        frame_dir, frames = self.create_synthetic_frames(tempDir.path(), 7, (24, 24))
+        rows, cols = np.mgrid[:24, :24] - 12
+        frames[:, rows ** 2 + cols ** 2 > 11 ** 2] = 0
+        frames[:, 10:13, 10:13] = 65000
+        frames[3] //= 8
+        for i, frame in enumerate(frames):
+            frame.tofile(os.path.join(frame_dir, frameFileName(i)))
+
+        stack = ProjectionStack.fromDirectory(frame_dir, len(frames), frames.shape[1:])
+        out_dir = os.path.join(tempDir.path(), "framemar")
+        stats = MetalArtifactReductionEngine(batchSize=3, workerCount=2, useProcesses=False).runToDirectory(stack,
+                                                                                                          out_dir)
+
+        expected = np.stack([self.reference_metal_artifact_reduction(frame) for frame in frames])
+        result = ProjectionStack.fromDirectory(out_dir, len(frames), frames.shape[1:])[:]
+        self.assertEqual(len(frames) - 1, stats["correctedCount"])
+        self.assertEqual(len(frames), len(stats["frameSeconds"]))
+        self.assertTrue(np.array_equal(frames[3], result[3]))
+        self.assertLessEqual(np.abs(result.astype(np.int32) - expected).max(), 1)
+
+        batched, corrected = reduceMetalArtifacts(frames)
+        self.assertTrue(np.array_equal(batched, result))
+        self.assertEqual([3], list(np.flatnonzero(~corrected)))
+
+    @staticmethod
+    def reference_slice_metal_artifact_reduction(voi_dataset, volume_slice, eff):
+        # Per slice skimage algorithm of the previous RFVisualizationWidget.calc_mar1 implementation
+        image = apply_voi_lut(volume_slice, voi_dataset)
+        tmp_image = image
+        m = max(abs(np.min(image)), np.max(image))
+        image = (image + m) / np.max(image + m)
+        theta = np.linspace(0., 180., volume_slice.shape[0], endpoint=False)
+        sinogram = radon(image, theta=theta, circle=True)
+        th = np.max(sinogram) * eff
+        sinogram[sinogram > th] = th
+        reconstruction_fbp = iradon(sinogram, theta=theta, circle=True)
+        tmp_image[tmp_image < tmp_image * 0.99] = 0
+        scaled_img = voi_dataset.WindowWidth * reconstruction_fbp - voi_dataset.WindowCenter
+        return scaled_img + (tmp_image / (np.max(tmp_image))) * voi_dataset.WindowWidth
+
+    def test_slice_metal_artifact_reduction_writes_hot_slices_in_place(self):
+        voi_dataset = pydicom.Dataset()
+        voi_dataset.PhotometricInterpretation = "MONOCHROME2"
+        voi_dataset.BitsStored = 16
+        voi_dataset.PixelRepresentation = 1
+        voi_dataset.WindowCenter = 1500
+        voi_dataset.WindowWidth = 4000
+
+        volume = np.random.RandomState(0).randint(-1000, 2000, size=(9, 32, 32)).astype(np.int16)
+        volume[2:5, 14:18, 14:18] = 32000
+        expected = volume.copy()
+        for i in range(2, 5):
+            expected[i] = np.clip(self.reference_slice_metal_artifact_reduction(voi_dataset, volume[i], 0.5),
+                                  -32768, 32767)
+
+        self.assertEqual([2, 3, 4], list(hotSliceIndices(volume)))
+        job = SliceMetalArtifactReductionJob(volume, hotSliceIndices(volume), voi_dataset, 0.5, batchSize=2,
+                                             workerCount=2, useProcesses=False)
+        job.start()
+        job.wait()
+        self.assertTrue(job.isDone())
+        self.assertEqual(3, job.processedCount)
+        self.assertLessEqual(np.abs(volume.astype(np.int32) - expected).max(), 1)
+
+    @staticmethod
+    def create_dicom_slice(dicom_file_path, pixels):
+        file_meta = pydicom.dataset.FileMetaDataset()
+        file_meta.MediaStorageSOPClassUID = pydicom.uid.generate_uid()
+        file_meta.MediaStorageSOPInstanceUID = pydicom.uid.generate_uid()
+        file_meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
+        ds = pydicom.dataset.FileDataset(dicom_file_path, {}, file_meta=file_meta, preamble=b"\0" * 128)
+        ds.is_little_endian = True
+        ds.is_implicit_VR = False
+        ds.Rows, ds.Columns = pixels.shape
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated = 16
+        ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 1
+        ds.PixelData = pixels.astype(np.int16).tobytes()
+        ds.save_as(dicom_file_path)
+
+    def test_dicom_metal_artifact_reduction_batch_is_resumable(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+        input_dir = os.path.join(tempDir.path(), "DICOM16")
+        output_dir = os.path.join(tempDir.path(), "DICOM_tmp")
+        os.makedirs(input_dir)
+        slices = np.zeros((3, 24, 24), dtype=np.int16)
+        slices[1:, 8:16, 8:16] = 1000
+        slices[2, 11:13, 11:13] = 30000
+        for i, pixels in enumerate(slices):
+            self.create_dicom_slice(os.path.join(input_dir, "IMG{:04d}.dcm".format(i)), pixels)
+
+        batch = DicomMetalArtifactReductionBatch(input_dir, output_dir, workerCount=2, useProcesses=False)
+        stats = batch.run()
+        self.assertEqual(3, stats["processedCount"])
+        self.assertEqual(2, stats["correctedCount"])
+        self.assertEqual(["IMG0000.dcm", "IMG0001.dcm", "IMG0002.dcm", batch.manifestFileName],
+                         sorted(os.listdir(output_dir)))
+        self.assertTrue(np.array_equal(slices[0], pydicom.dcmread(os.path.join(output_dir, "IMG0000.dcm")).pixel_array))
+        corrected = pydicom.dcmread(os.path.join(output_dir, "IMG0002.dcm")).pixel_array
+        self.assertEqual(slices[2].shape, corrected.shape)
+        self.assertLess(corrected.max(), slices[2].max())
+
+        self.assertEqual(3, batch.run()["skippedCount"])
+        os.remove(os.path.join(output_dir, "IMG0001.dcm"))
+        stats = batch.run()
+        self.assertEqual(1, stats["processedCount"])
+        self.assertEqual(2, stats["skippedCount"])
+
+    def test_odd_and_even_mhd_files_reference_the_frames_in_place(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+        mnri_file_string = self.an_mnri_file() + """
+            FrameCount1=254
+            FrameCount2=254
+            """
+        mnri_file_path = self.create_mnri_file(mnri_file_string.replace("FrameCount=509", "FrameCount=508"),
+                                               tempDir.path())
+
+        logic = RFReconstructionLogic()
+        odd_lines = logic.convertMnriToMhd1(mnri_file_path).splitlines()
+        even_lines = logic.convertMnriToMhd2(mnri_file_path).splitlines()
+
+        self.assertIn("DimSize = 888 1096 254", odd_lines)
+        self.assertEqual("ElementDataFile = LIST 2D", odd_lines[-255])
+        self.assertEqual(["Frame/" + frameFileName(i) for i in range(1, 508, 2)], odd_lines[-254:])
+        self.assertEqual(["Frame/" + frameFileName(i) for i in range(0, 508, 2)], even_lines[-254:])
+
+        odd_mhd_path = logic.createMhdFile1(mnri_file_path)
+        even_mhd_path = logic.createMhdFile2(mnri_file_path)
+        self.assertNotEqual(odd_mhd_path, even_mhd_path)
+        self.assertEqual(os.path.dirname(odd_mhd_path), tempDir.path())
+
+    def a_geometry_mnri_file(self):
+        return self.an_mnri_file().replace("FrameCount=509", "FrameCount=360") + """
+            [Geometry]
+            AntiClkRotDir=0
+            InitAngle=10
+            TotalAngle=360
+            TomoTheta=90
+            XSrcDetectDist=600
+            XSrcObjectDist=400
+            DetectOffset=0
+            OffsetHoriz=0
+            OffsetVertical=0
+            OffsetOrient=0
+            [BackProjection]
+            VolXDim=100
+            VolYDim=100
+            VolZDim=80
+            VolXPitch=1
+            VolYPitch=1
+            VolZPitch=1
+            VolXStart=-50
+            VolYStart=-50
+            VolZStart=-40
+            [Volume]
+            TFPresetIndex=0
+            [Process]
+            FrequencyCut=0.5
+            """
+
+    def test_partial_arc_parameters_are_derived_from_the_acquisition_geometry(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+        mnri_settings = RFReconstructionLogic.MNRISettings(
+            self.create_mnri_file(self.a_geometry_mnri_file(), tempDir.path()))
+
+        full = RFReconstructionLogic.subsetGeometryParameters(mnri_settings, ProjectionSubset.full())
+        self.assertEqual((360, 10., -360.), (full["nproj"], full["first_angle"], full["arc"]))
+
+        preview_subset = ProjectionSubset.arc("preview", 0, None, 4)
+        preview = RFReconstructionLogic.subsetGeometryParameters(mnri_settings, preview_subset)
+        self.assertEqual((90, 10., -360.), (preview["nproj"], preview["first_angle"], preview["arc"]))
+
+        half = RFReconstructionLogic.subsetGeometryParameters(mnri_settings, ProjectionSubset.arc("half", 180, 360))
+        self.assertEqual((180, -170., -180.), (half["nproj"], half["first_angle"], half["arc"]))
+        self.assertEqual(full["dimension"], half["dimension"])
+
+    def test_subset_parameters_are_cached_until_the_mnri_file_changes(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+        mnri_file_path = self.create_mnri_file(self.a_geometry_mnri_file(), tempDir.path())
+
+        logic = RFReconstructionLogic()
+        created_mhd_files = []
+        create_subset_mhd_file = logic.createSubsetMhdFile
+        logic.createSubsetMhdFile = lambda *args: created_mhd_files.append(create_subset_mhd_file(*args))
+
+        subset = ProjectionSubset.arc("preview", 0, None, 4)
+        parameters = logic.createSubsetCLIParameters(mnri_file_path, subset)
+        self.assertEqual(parameters, logic.createSubsetCLIParameters(mnri_file_path, subset))
+        self.assertEqual([logic.subsetMhdFilePath(mnri_file_path, subset)], created_mhd_files)
+        self.assertTrue(parameters["output"].endswith("reconstructed-volume-preview.mhd"))
+
+        stat = os.stat(mnri_file_path)
+        self.create_mnri_file(self.a_geometry_mnri_file().replace("TotalAngle=360", "TotalAngle=180"), tempDir.path())
+        os.utime(mnri_file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(-180., logic.createSubsetCLIParameters(mnri_file_path, subset)["arc"])
+        self.assertEqual(2, len(created_mhd_files))
+
+    def test_preview_parameters_reconstruct_the_same_field_of_view_on_a_coarse_grid(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+        mnri_file_path = self.create_mnri_file(self.a_geometry_mnri_file(), tempDir.path())
+
+        logic = RFReconstructionLogic()
+        full = logic.createCLIParameters(mnri_file_path)
+        preview = logic.createPreviewCLIParameters(mnri_file_path, 4)
+
+        self.assertEqual(90, preview["nproj"])
+        self.assertEqual("25, 25, 20", preview["dimension"])
+        self.assertTrue(np.allclose([0.96] * 3, [float(v) for v in preview["spacing"].split(",")]))
+        self.assertTrue(np.allclose([-11.64, -11.64, -9.24], [float(v) for v in preview["origin"].split(",")]))
+        self.assertTrue(preview["output"].endswith("reconstructed-volume-preview.mhd"))
+        self.assertNotEqual(full["regexp"], preview["regexp"])
+
+    def create_raw_volume(self, outDir, name, volume):
+        mhd_path = os.path.join(outDir, name + ".mhd")
+        with open(mhd_path, "w") as f:
+            f.write(RFReconstructionLogic.stripWhiteSpace("""
+                ObjectType = Image
+                NDims = 3
+                BinaryData = True
+                BinaryDataByteOrderMSB = False
+                CompressedData = False
+                TransformMatrix = 1 0 0 0 1 0 0 0 1
+                Offset = -10 -20 5
+                ElementSpacing = 0.5 0.5 2
+                DimSize = {} {} {}
+                ElementType = MET_SHORT
+                ElementDataFile = {}.raw
+                """.format(volume.shape[2], volume.shape[1], volume.shape[0], name)))
+        volume.astype(np.int16).tofile(os.path.join(outDir, name + ".raw"))
+        return mhd_path
+
+    def test_odd_and_even_volumes_are_stacked_in_a_single_buffer(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+        odd = np.arange(3 * 4 * 5, dtype=np.int16).reshape(3, 4, 5)
+        even = -odd[:2]
+        infos = [MhdVolumeInfo(self.create_raw_volume(tempDir.path(), "odd", odd)),
+                 MhdVolumeInfo(self.create_raw_volume(tempDir.path(), "even", even))]
+
+        shape = stackedVolumeShape(infos)
+        self.assertEqual((5, 4, 5), shape)
+        stacked = readStackedVolumesInto(infos, np.empty(shape, dtype=np.int16))
+        self.assertTrue(np.array_equal(np.concatenate([odd, even]), stacked))
+        self.assertTrue(np.allclose([10, 20, 5], infos[0].ijkToRASMatrix()[:3, 3]))
+        self.assertTrue(np.allclose([-0.5, -0.5, 2], np.diag(infos[0].ijkToRASMatrix())[:3]))
+
+    def test_volume_filters_applied_slab_by_slab_match_the_whole_volume_filters(self):
+        try:
+            from RFReconstructionLib.RFVolumeFilters import filterSlabsInPlace, sitk
+        except ImportError:
+            self.skipTest("Volume filters are not available")
+
+        volume = np.random.RandomState(0).randint(-1000, 3000, size=(70, 30, 40)).astype(np.int16)
+        spacing = (0.25, 0.3, 0.35)
+        median = sitk.MedianImageFilter()
+        median.SetRadius(2)
+        gaussian = sitk.DiscreteGaussianImageFilter()
+        gaussian.SetVariance(4.)
+
+        for image_filter, halo_size in [(median, 2), (gaussian, gaussian.GetMaximumKernelWidth() + 1)]:
+            image = sitk.GetImageFromArray(volume)
+            image.SetSpacing(spacing)
+            expected = sitk.GetArrayFromImage(image_filter.Execute(image))
+            filtered = filterSlabsInPlace(image_filter, volume.copy(), halo_size, spacing, slabSize=16)
+            self.assertTrue(np.array_equal(expected, filtered))
+
+    def test_panorama_is_stitched_from_cached_frame_columns(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+        frame_dir, frames = self.create_synthetic_frames(tempDir.path(), 90, (20, 64))
+        stack = ProjectionStack.fromDirectory(frame_dir, len(frames), frames.shape[1:])
+        synthesizer = PanoramaSynthesizer(stack, 0, 2 ** 15, blockWidth=8)
+
+        frame_indices = panoramaFrameIndices(len(frames), 360, -0.3, initialAngleOffset=10, numberOfAngles=40)
+        column_windows = panoramaColumnWindows(64, len(frame_indices), startX=4)
+        self.assertEqual(column_windows[0][0], 4)
+        self.assertEqual(column_windows[-1][1], 64)
+
+        expected = np.concatenate([frames[i][:, start:stop] for i, (start, stop) in zip(frame_indices, column_windows)],
+                                  axis=1)
+        expected = -np.log(np.maximum(expected, 1) / 2. ** 15)
+        panorama = synthesizer.synthesize(frame_indices, column_windows)
+        self.assertEqual(expected.shape, panorama.shape)
+        self.assertTrue(np.allclose(expected, panorama, atol=1e-5))
+
+        # The decoded columns are reused, only the columns which were not used before are decoded
+        decoded_block_count = synthesizer.decodedBlockCount
+        synthesizer.synthesize(frame_indices, column_windows)
+        self.assertEqual(decoded_block_count, synthesizer.decodedBlockCount)
+        synthesizer.synthesize(frame_indices, panoramaColumnWindows(64, len(frame_indices), startX=5))
+        self.assertLess(synthesizer.decodedBlockCount - decoded_block_count, decoded_block_count)
+
+    def test_frame_subtraction_throughput(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+        frame_dir, frames = self.create_synthetic_frames(tempDir.path(), 64, (1096, 888))
+
+        stack = ProjectionStack.fromDirectory(frame_dir, len(frames), frames.shape[1:])
+        stats = FrameSubtractionEngine(0.017).runToDirectory(stack, os.path.join(tempDir.path(), "framecal"))
+        logging.info("Frame subtraction benchmark: {framesPerSecond:.1f} frames/s, "
+                     "{megaBytesPerSecond:.1f} MB/s".format(**stats))
+        self.assertEqual(stats["frameCount"], len(frames))
+
 
 class RFReconstructionTest(ScriptedLoadableModuleTest):
     def runTest(self):
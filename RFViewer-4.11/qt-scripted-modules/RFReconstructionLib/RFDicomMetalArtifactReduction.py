@@ -0,0 +1,194 @@
+"""
+Batch metal artifact reduction of the DICOM slices of a reconstructed volume.
+
+The batch can be run without the Slicer application from the qt-scripted-modules directory :
+
+  PythonSlicer -m RFReconstructionLib.RFDicomMetalArtifactReduction <DICOM16 directory> <output directory>
+"""
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import shutil
+import time
+
+import numpy
+import pydicom
+
+from .RFMetalArtifactReduction import radonGeometry, runInWorkerPool, _saturate, _squareCrop
+from .RFProjections import defaultWorkerCount
+
+
+def reduceDicomSliceMetalArtifacts(pixels, sinogramMaxThreshold=19., clipFactor=7.3):
+  """
+  Metal artifact reduction of one DICOM slice.
+
+  The negative pixels are set to 0 and the slice is transformed to its sinogram. If the sinogram maximum is below
+  sinogramMaxThreshold the slice contains no metal and None is returned. Otherwise the sinogram values above
+  average + clipFactor * (maximum - average) / 10 are clipped and the slice is reconstructed by filtered back
+  projection. Non square slices are processed on their centered square, the rest of the slice is kept unchanged.
+
+  :param pixels: (H, W) pixel array of the slice
+  :return: (H, W) corrected array of the dtype of pixels or None if the slice doesn't need a correction
+  """
+  crop = _squareCrop(pixels.shape)
+  image = numpy.maximum(pixels[crop].astype(numpy.float64), 0)
+  geometry = radonGeometry(image.shape[0], max(pixels.shape))
+  sinogram = geometry.radon(image[numpy.newaxis])
+
+  maxValue = sinogram.max()
+  if maxValue < sinogramMaxThreshold:
+    return None
+
+  average = sinogram.mean()
+  numpy.minimum(sinogram, (maxValue - average) / 10 * clipFactor + average, out=sinogram)
+  corrected = numpy.array(pixels, copy=True)
+  corrected[crop] = _saturate(geometry.iradon(sinogram)[0], pixels.dtype)
+  return corrected
+
+
+def _atomicWrite(outputPath, writeFunction):
+  """Writes outputPath with writeFunction(tmpPath) then renames it, outputPath is either missing or complete"""
+  tmpPath = outputPath + ".tmp"
+  try:
+    writeFunction(tmpPath)
+    os.replace(tmpPath, outputPath)
+  finally:
+    if os.path.exists(tmpPath):
+      os.remove(tmpPath)
+
+
+def _reduceDicomFile(inputPath, outputPath, sinogramMaxThreshold, clipFactor):
+  """Worker task : reduces the metal artifacts of one DICOM file. Returns (inputBytes, corrected)."""
+  ds = pydicom.dcmread(inputPath)
+  if ds.file_meta.TransferSyntaxUID.is_compressed:
+    ds.decompress()
+
+  corrected = reduceDicomSliceMetalArtifacts(ds.pixel_array, sinogramMaxThreshold, clipFactor)
+  if corrected is None:
+    _atomicWrite(outputPath, lambda tmpPath: shutil.copyfile(inputPath, tmpPath))
+  else:
+    ds.PixelData = corrected.tobytes()
+    _atomicWrite(outputPath, lambda tmpPath: ds.save_as(tmpPath))
+  return os.path.getsize(inputPath), corrected is not None
+
+
+class DicomMetalArtifactReductionBatch(object):
+  """
+  Metal artifact reduction of the DICOM files of a directory into an output directory (see
+  reduceDicomSliceMetalArtifacts).
+
+  The files are processed in the order of their sorted names by a worker process pool. Every output file is written
+  atomically and the input file signature (size and modification time) of each processed file is recorded in the
+  manifest file of the output directory. Files already processed from the same input are skipped, so an interrupted
+  batch resumes where it stopped.
+  """
+
+  manifestFileName = "manifest.json"
+
+  def __init__(self, inputDirPath, outputDirPath, pattern="IMG*.dcm", workerCount=None, useProcesses=True,
+               sinogramMaxThreshold=19., clipFactor=7.3, manifestSavePeriod=16):
+    self.inputDirPath = inputDirPath
+    self.outputDirPath = outputDirPath
+    self.pattern = pattern
+    self.workerCount = workerCount or defaultWorkerCount()
+    self.useProcesses = useProcesses
+    self.sinogramMaxThreshold = float(sinogramMaxThreshold)
+    self.clipFactor = float(clipFactor)
+    self.manifestSavePeriod = max(1, int(manifestSavePeriod))
+
+  @property
+  def manifestPath(self):
+    return os.path.join(self.outputDirPath, self.manifestFileName)
+
+  def fileNames(self):
+    """Sorted names of the input files to process"""
+    return sorted(f for f in os.listdir(self.inputDirPath) if fnmatch.fnmatch(f, self.pattern))
+
+  def inputSignature(self, fileName):
+    stat = os.stat(os.path.join(self.inputDirPath, fileName))
+    return [stat.st_size, stat.st_mtime_ns]
+
+  def loadManifest(self):
+    try:
+      with open(self.manifestPath, "r") as f:
+        return json.load(f)
+    except (IOError, ValueError):
+      return {}
+
+  def saveManifest(self, manifest):
+    def write(tmpPath):
+      with open(tmpPath, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    _atomicWrite(self.manifestPath, write)
+
+  def pendingFileNames(self, manifest):
+    """Input files which were not processed yet or which changed since they were processed"""
+    return [f for f in self.fileNames()
+            if manifest.get(f) != self.inputSignature(f) or not os.path.exists(os.path.join(self.outputDirPath, f))]
+
+  def run(self):
+    """
+    Process the pending files of the input directory.
+
+    :return: dict with the processing statistics (fileCount, processedCount, skippedCount, correctedCount, seconds,
+    filesPerSecond, megaBytesPerSecond)
+    """
+    startTime = time.perf_counter()
+    if not os.path.exists(self.outputDirPath):
+      os.makedirs(self.outputDirPath)
+
+    manifest = self.loadManifest()
+    fileNames = self.fileNames()
+    pendingFileNames = self.pendingFileNames(manifest)
+
+    def onResult(index, result):
+      manifest[pendingFileNames[index]] = self.inputSignature(pendingFileNames[index])
+      if (index + 1) % self.manifestSavePeriod == 0:
+        self.saveManifest(manifest)
+
+    tasks = [(os.path.join(self.inputDirPath, f), os.path.join(self.outputDirPath, f), self.sinogramMaxThreshold,
+              self.clipFactor) for f in pendingFileNames]
+    try:
+      results = runInWorkerPool(_reduceDicomFile, tasks, self.workerCount, self.useProcesses, onResult)
+    finally:
+      self.saveManifest(manifest)
+
+    return self._stats(len(fileNames), results, time.perf_counter() - startTime)
+
+  @staticmethod
+  def _stats(fileCount, results, seconds):
+    seconds = max(seconds, 1e-9)
+    stats = {
+      "fileCount": fileCount,
+      "processedCount": len(results),
+      "skippedCount": fileCount - len(results),
+      "correctedCount": sum(1 for _, corrected in results if corrected),
+      "seconds": seconds,
+      "filesPerSecond": len(results) / seconds,
+      "megaBytesPerSecond": sum(inputBytes for inputBytes, _ in results) / seconds / 1e6,
+    }
+    logging.info("DICOM metal artifact reduction: {processedCount} files processed ({correctedCount} corrected, "
+                 "{skippedCount} already done) in {seconds:.2f}s ({filesPerSecond:.1f} files/s, "
+                 "{megaBytesPerSecond:.1f} MB/s)".format(**stats))
+    return stats
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Metal artifact reduction of the DICOM files of a directory")
+  parser.add_argument("inputDirPath", help="Directory of the input DICOM files")
+  parser.add_argument("outputDirPath", help="Directory of the output DICOM files")
+  parser.add_argument("--pattern", default="IMG*.dcm", help="File name pattern of the input DICOM files")
+  parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+  parser.add_argument("--threads", action="store_true", help="Use worker threads instead of processes")
+  args = parser.parse_args(argv)
+
+  logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+  DicomMetalArtifactReductionBatch(args.inputDirPath, args.outputDirPath, pattern=args.pattern,
+                                   workerCount=args.workers, useProcesses=not args.threads).run()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,547 @@
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+import numpy
+import scipy.sparse
+from pydicom.pixel_data_handlers.util import apply_voi_lut
+
+from .RFProjections import ProjectionStack, defaultWorkerCount
+
+
+class RadonGeometry(object):
+  """
+  Precomputed geometry of the parallel beam radon transform and filtered back projection of size x size images.
+
+  The transforms are numerically equivalent to skimage.transform.radon / iradon with circle=True, the ramp filter
+  and linear interpolation, but they process a batch of images per call : the sampling positions and interpolation
+  weights of each angle are computed once for the whole batch (and kept in memory up to cacheBytes) instead of once
+  per image, and the Fourier filter is computed once for the geometry.
+  """
+
+  def __init__(self, size, angleCount, cacheBytes=256 * 1024 ** 2):
+    self.size = int(size)
+    self.theta = numpy.linspace(0., 180., int(angleCount), endpoint=False)
+    self._cos = numpy.cos(numpy.deg2rad(self.theta))
+    self._sin = numpy.sin(numpy.deg2rad(self.theta))
+    self._cacheBytes = cacheBytes
+    self._cachedBytes = 0
+    self._forwardTables = {}
+    self._backwardTables = {}
+
+    # Forward projection : rotation around the center pixel of the image
+    self._center = self.size // 2
+    self._rows, self._cols = numpy.mgrid[:self.size, :self.size].astype(numpy.float64)
+
+    # Back projection : the sinogram is padded to the image diagonal then to a power of 2 for the filtering
+    self.sinogramSize = int(numpy.ceil(numpy.sqrt(2) * self.size))
+    self._sinogramPadBefore = self.sinogramSize // 2 - self.size // 2
+    self.filterSize = max(64, int(2 ** numpy.ceil(numpy.log2(2 * self.sinogramSize))))
+    self.fourierFilter = self._rampFilter(self.filterSize)
+
+    radius = self.size // 2
+    self._xpr, self._ypr = numpy.mgrid[:self.size, :self.size] - radius
+    self.outsideCircle = (self._xpr ** 2 + self._ypr ** 2) > radius ** 2
+
+  @property
+  def angleCount(self):
+    return len(self.theta)
+
+  @staticmethod
+  def _rampFilter(size):
+    n = numpy.concatenate((numpy.arange(1, size / 2 + 1, 2, dtype=int), numpy.arange(size / 2 - 1, 0, -2, dtype=int)))
+    f = numpy.zeros(size)
+    f[0] = 0.25
+    f[1::2] = -1 / (numpy.pi * n) ** 2
+    return 2 * numpy.real(numpy.fft.fft(f))
+
+  def _cacheTable(self, cache, angleIndex, table):
+    tableBytes = table.data.nbytes + table.indices.nbytes + table.indptr.nbytes
+    if self._cachedBytes + tableBytes <= self._cacheBytes:
+      cache[angleIndex] = table
+      self._cachedBytes += tableBytes
+    return table
+
+  def _forwardTable(self, angleIndex):
+    """
+    Sparse (size, size * size) matrix summing the bilinear interpolation of the rotated image along its rows.
+    Row c holds the 4 neighbour weights of every rotated pixel of column c. Neighbours outside of the image get a
+    null weight.
+    """
+    if angleIndex in self._forwardTables:
+      return self._forwardTables[angleIndex]
+
+    # Rotated pixel positions in (column, row) order so that the entries of each matrix row are contiguous
+    cos_a, sin_a, center = self._cos[angleIndex], self._sin[angleIndex], self._center
+    x = cos_a * self._cols.T + sin_a * self._rows.T - center * (cos_a + sin_a - 1)
+    y = -sin_a * self._cols.T + cos_a * self._rows.T - center * (cos_a - sin_a - 1)
+
+    r0 = numpy.floor(y)
+    c0 = numpy.floor(x)
+    dr = y - r0
+    dc = x - c0
+    r0 = r0.astype(numpy.int32)
+    c0 = c0.astype(numpy.int32)
+
+    indices = numpy.empty(x.shape + (4,), dtype=numpy.int32)
+    weights = numpy.empty(x.shape + (4,))
+    for k, (dRow, dCol, weight) in enumerate(((0, 0, (1 - dr) * (1 - dc)), (0, 1, (1 - dr) * dc),
+                                              (1, 0, dr * (1 - dc)), (1, 1, dr * dc))):
+      r = r0 + dRow
+      c = c0 + dCol
+      inside = (r >= 0) & (r < self.size) & (c >= 0) & (c < self.size)
+      indices[..., k] = numpy.clip(r, 0, self.size - 1) * self.size + numpy.clip(c, 0, self.size - 1)
+      weights[..., k] = numpy.where(inside, weight, 0.0)
+
+    rowLength = 4 * self.size
+    table = scipy.sparse.csr_matrix((weights.ravel(), indices.ravel(), numpy.arange(self.size + 1) * rowLength),
+                                    shape=(self.size, self.size * self.size))
+    return self._cacheTable(self._forwardTables, angleIndex, table)
+
+  def _backwardTable(self, angleIndex):
+    """
+    Sparse (size * size, sinogramSize) matrix of the linear interpolation of the filtered projection at each image
+    pixel. Pixels projected outside of the sinogram get null weights.
+    """
+    if angleIndex in self._backwardTables:
+      return self._backwardTables[angleIndex]
+
+    t = self._ypr * self._cos[angleIndex] - self._xpr * self._sin[angleIndex]
+    u = (t + self.sinogramSize // 2).ravel()
+    inside = (u >= 0) & (u <= self.sinogramSize - 1)
+    i0 = numpy.clip(numpy.floor(u), 0, self.sinogramSize - 2).astype(numpy.int32)
+    weight = numpy.where(inside, u - i0, 0.0)
+
+    indices = numpy.empty((u.size, 2), dtype=numpy.int32)
+    indices[:, 0] = i0
+    indices[:, 1] = i0 + 1
+    weights = numpy.empty((u.size, 2))
+    weights[:, 0] = numpy.where(inside, 1 - weight, 0.0)
+    weights[:, 1] = weight
+    table = scipy.sparse.csr_matrix((weights.ravel(), indices.ravel(), numpy.arange(u.size + 1) * 2),
+                                    shape=(u.size, self.sinogramSize))
+    return self._cacheTable(self._backwardTables, angleIndex, table)
+
+  def radon(self, images):
+    """
+    Radon transform of a batch of images.
+
+    :param images: (B, size, size) array. Pixels outside of the inscribed circle are expected to be 0.
+    :return: (B, size, angleCount) float64 sinograms
+    """
+    batchSize = len(images)
+    # (size * size, B) layout : each sparse product computes one sinogram column of every image of the batch
+    flat = numpy.ascontiguousarray(images.reshape(batchSize, -1).T, dtype=numpy.float64)
+
+    sinograms = numpy.empty((self.angleCount, self.size, batchSize))
+    for angleIndex in range(self.angleCount):
+      sinograms[angleIndex] = self._forwardTable(angleIndex).dot(flat)
+    return sinograms.transpose(2, 1, 0).copy()
+
+  def filterSinograms(self, sinograms):
+    """Ramp filters a batch of (B, size, angleCount) sinograms. Returns (B, sinogramSize, angleCount) sinograms."""
+    padded = numpy.zeros((len(sinograms), self.filterSize, self.angleCount))
+    padded[:, self._sinogramPadBefore:self._sinogramPadBefore + self.size] = sinograms
+    projection = numpy.fft.fft(padded, axis=1) * self.fourierFilter[:, numpy.newaxis]
+    return numpy.real(numpy.fft.ifft(projection, axis=1)[:, :self.sinogramSize])
+
+  def iradon(self, sinograms):
+    """
+    Filtered back projection of a batch of sinograms.
+
+    :param sinograms: (B, size, angleCount) array
+    :return: (B, size, size) float64 images, 0 outside of the inscribed circle
+    """
+    batchSize = len(sinograms)
+    # (angleCount, sinogramSize, B) layout : each projection is a contiguous dense operand of the sparse product
+    filtered = numpy.ascontiguousarray(self.filterSinograms(sinograms).transpose(2, 1, 0))
+
+    reconstructed = numpy.zeros((self.size * self.size, batchSize))
+    for angleIndex in range(self.angleCount):
+      reconstructed += self._backwardTable(angleIndex).dot(filtered[angleIndex])
+
+    reconstructed = reconstructed.T.reshape(batchSize, self.size, self.size)
+    reconstructed[:, self.outsideCircle] = 0.0
+    return reconstructed * numpy.pi / (2 * self.angleCount)
+
+
+@lru_cache(maxsize=4)
+def radonGeometry(size, angleCount):
+  """Returns the RadonGeometry of the input size, shared by every call in the current process"""
+  return RadonGeometry(size, angleCount)
+
+
+def _squareCrop(frameShape):
+  """Slices of the centered square processed by the radon transform in a frame (same crop as skimage)"""
+  size = min(frameShape)
+  return tuple(slice(int(numpy.ceil((s - size) / 2)), int(numpy.ceil((s - size) / 2)) + size) for s in frameShape)
+
+
+def reduceMetalArtifacts(frames, meanThreshold=3000., sinogramClipFactor=5.):
+  """
+  Metal artifact reduction of a batch of projection frames.
+
+  Frames whose mean is above meanThreshold are transformed to their sinogram, the sinogram values above
+  sinogramClipFactor times the sinogram mean are clipped and the frame is reconstructed by filtered back projection.
+  The reconstructed frame is doubled and saturated to the frame dtype. Other frames are returned unchanged.
+  Non square frames are processed on their centered square, the rest of the frame is kept unchanged.
+
+  :param frames: (B, H, W) numpy array of unsigned integer frames
+  :return: (out, corrected) tuple with out the (B, H, W) frames and corrected the boolean mask of the processed frames
+  """
+  out = numpy.array(frames, copy=True)
+  corrected = frames.reshape(len(frames), -1).mean(axis=1) > meanThreshold
+  if not numpy.any(corrected):
+    return out, corrected
+
+  crop = (slice(None),) + _squareCrop(frames.shape[1:])
+  images = frames[corrected][crop].astype(numpy.float64)
+  geometry = radonGeometry(images.shape[1], max(frames.shape[1:]))
+
+  sinograms = geometry.radon(images)
+  clipValues = sinograms.reshape(len(sinograms), -1).mean(axis=1) * sinogramClipFactor
+  numpy.minimum(sinograms, clipValues[:, numpy.newaxis, numpy.newaxis], out=sinograms)
+  reconstructed = 2 * geometry.iradon(sinograms)
+
+  outInfo = numpy.iinfo(out.dtype)
+  numpy.clip(reconstructed, outInfo.min, outInfo.max, out=reconstructed)
+  corrections = out[corrected]
+  corrections[crop] = reconstructed
+  out[corrected] = corrections
+  return out, corrected
+
+
+def _reduceFrameFiles(framePaths, frameShape, dtype, outputPaths, meanThreshold, sinogramClipFactor):
+  """Worker task : reduces the metal artifacts of a batch of frame files. Returns the (seconds, corrected) per frame."""
+  startTime = time.perf_counter()
+  frames = ProjectionStack(framePaths, frameShape, dtype).read(0, len(framePaths))
+  out, corrected = reduceMetalArtifacts(frames, meanThreshold, sinogramClipFactor)
+  for frame, outputPath in zip(out, outputPaths):
+    frame.tofile(outputPath)
+  frameSeconds = (time.perf_counter() - startTime) / len(framePaths)
+  return [(frameSeconds, bool(c)) for c in corrected]
+
+
+def createProcessPool(workerCount):
+  """
+  Process pool executor usable from the Slicer application.
+
+  Workers are spawned (forking the Qt application is not safe) with the PythonSlicer interpreter since the Slicer
+  application executable cannot run Python scripts.
+  """
+  if "python" not in os.path.basename(sys.executable).lower():
+    pythonSlicer = shutil.which("PythonSlicer")
+    if pythonSlicer:
+      multiprocessing.set_executable(pythonSlicer)
+
+  if sys.version_info >= (3, 7):
+    return ProcessPoolExecutor(max_workers=workerCount, mp_context=multiprocessing.get_context("spawn"))
+  # Python 3.6 executors use the default start method of the platform, which is spawn on Windows
+  return ProcessPoolExecutor(max_workers=workerCount)
+
+
+def _collectResults(executor, function, tasks, onResult):
+  futures = [executor.submit(function, *arguments) for arguments in tasks]
+  results = []
+  for index, future in enumerate(futures):
+    results.append(future.result())
+    if onResult is not None:
+      onResult(index, results[-1])
+  return results
+
+
+def runInWorkerPool(function, tasks, workerCount, useProcesses=True, onResult=None):
+  """
+  Calls function(*arguments) for each arguments tuple of tasks in a worker process pool and returns the results in the
+  order of the tasks. If the process pool cannot be started or breaks, the tasks are run by threads instead.
+  The function must be defined at the module level to be usable by the worker processes.
+
+  :param onResult: (optional) callable(taskIndex, result) called in the order of the tasks as soon as each result is
+  available
+  """
+  if useProcesses:
+    try:
+      with createProcessPool(workerCount) as executor:
+        return _collectResults(executor, function, tasks, onResult)
+    except (BrokenProcessPool, OSError) as e:
+      logging.warning("Process pool failed, using threads instead : {}".format(e))
+
+  with ThreadPoolExecutor(max_workers=workerCount) as executor:
+    return _collectResults(executor, function, tasks, onResult)
+
+
+class MetalArtifactReductionEngine(object):
+  """
+  Metal artifact reduction of every frame of a projection stack (see reduceMetalArtifacts).
+
+  Frames are processed by batches spread over a worker process pool. Each worker keeps the radon geometry of the
+  frame size for all its batches. If the process pool cannot be started, the batches are processed by threads.
+  """
+
+  def __init__(self, meanThreshold=3000., sinogramClipFactor=5., batchSize=8, workerCount=None, useProcesses=True):
+    self.meanThreshold = float(meanThreshold)
+    self.sinogramClipFactor = float(sinogramClipFactor)
+    self.batchSize = max(1, int(batchSize))
+    self.workerCount = workerCount or defaultWorkerCount()
+    self.useProcesses = useProcesses
+
+  def run(self, stack, outputPaths):
+    """
+    Reduce the metal artifacts of the input stack and write each result frame to the corresponding output path.
+
+    :param stack: ProjectionStack to process
+    :param outputPaths: List[str] of output frame paths with the same length as the stack
+    :return: dict with the processing statistics (frameCount, correctedCount, seconds, framesPerSecond,
+    frameSeconds the list of the processing time of each frame)
+    """
+    if len(outputPaths) != len(stack):
+      raise ValueError("Expected {} output paths, got {}".format(len(stack), len(outputPaths)))
+
+    startTime = time.perf_counter()
+    tasks = []
+    for start in range(0, len(stack), self.batchSize):
+      stop = min(start + self.batchSize, len(stack))
+      tasks.append((stack.framePaths[start:stop], stack.frameShape, stack.dtype.str, outputPaths[start:stop],
+                    self.meanThreshold, self.sinogramClipFactor))
+
+    frameResults = []
+    for batchResults in runInWorkerPool(_reduceFrameFiles, tasks, self.workerCount, self.useProcesses):
+      frameResults.extend(batchResults)
+    return self._stats(frameResults, time.perf_counter() - startTime)
+
+  def runToDirectory(self, stack, outputDirPath):
+    """Reduce the metal artifacts of the input stack and write the frames to outputDirPath with the same names"""
+    if not os.path.exists(outputDirPath):
+      os.makedirs(outputDirPath)
+    outputPaths = [os.path.join(outputDirPath, os.path.basename(p)) for p in stack.framePaths]
+    return self.run(stack, outputPaths)
+
+  @staticmethod
+  def _stats(frameResults, seconds):
+    seconds = max(seconds, 1e-9)
+    frameSeconds = [frameSecond for frameSecond, _ in frameResults]
+    stats = {
+      "frameCount": len(frameResults),
+      "correctedCount": sum(1 for _, corrected in frameResults if corrected),
+      "seconds": seconds,
+      "framesPerSecond": len(frameResults) / seconds,
+      "frameSeconds": frameSeconds,
+      "maxFrameSeconds": max(frameSeconds) if frameSeconds else 0.0,
+    }
+    logging.info("Metal artifact reduction: {frameCount} frames ({correctedCount} corrected) in {seconds:.2f}s "
+                 "({framesPerSecond:.1f} frames/s, slowest frame {maxFrameSeconds:.3f}s)".format(**stats))
+    return stats
+
+
+def _saturate(values, dtype):
+  """Casts float values to dtype, integer dtypes are saturated instead of wrapping around"""
+  if numpy.issubdtype(dtype, numpy.integer):
+    info = numpy.iinfo(dtype)
+    values = numpy.clip(values, info.min, info.max)
+  return values.astype(dtype)
+
+
+def hotSliceIndices(volumeArray, maxThreshold=30000):
+  """Indices of the (k, j, i) volume array slices whose maximum is above maxThreshold"""
+  return numpy.flatnonzero(volumeArray.reshape(len(volumeArray), -1).max(axis=1) > maxThreshold)
+
+
+def reduceSliceMetalArtifacts(slices, voiDataset, sinogramThresholdRatio=0.65):
+  """
+  Metal artifact reduction of a batch of reconstructed volume slices.
+
+  The VOI LUT / window of voiDataset is applied to each slice, which is normalized to [0, 1] and transformed to its
+  sinogram. The sinogram values above sinogramThresholdRatio times the sinogram maximum are clipped and the slice is
+  reconstructed by filtered back projection. The result is windowed back with the window of voiDataset and the
+  positive part of the VOI slice is added to it to restore the metal.
+  Non square slices are processed on their centered square, the rest of the slice is kept unchanged.
+
+  :param slices: (B, H, W) numpy array
+  :param voiDataset: pydicom Dataset holding the VOI LUT / window attributes of the volume
+  :param sinogramThresholdRatio: float in ]0, 1]
+  :return: (B, H, W) array of the dtype of slices
+  """
+  batchSize = len(slices)
+  voi = numpy.asarray(apply_voi_lut(slices, voiDataset), dtype=numpy.float64)
+  flatVoi = voi.reshape(batchSize, -1)
+  offset = numpy.maximum(numpy.abs(flatVoi.min(axis=1)), flatVoi.max(axis=1))
+  images = voi + offset[:, numpy.newaxis, numpy.newaxis]
+  images /= images.reshape(batchSize, -1).max(axis=1)[:, numpy.newaxis, numpy.newaxis]
+
+  crop = (slice(None),) + _squareCrop(slices.shape[1:])
+  geometry = radonGeometry(min(slices.shape[1:]), slices.shape[1])
+  sinograms = geometry.radon(images[crop])
+  thresholds = sinograms.reshape(batchSize, -1).max(axis=1) * sinogramThresholdRatio
+  numpy.minimum(sinograms, thresholds[:, numpy.newaxis, numpy.newaxis], out=sinograms)
+  reconstructed = geometry.iradon(sinograms)
+
+  windowWidth = float(voiDataset.WindowWidth)
+  windowCenter = float(voiDataset.WindowCenter)
+  metal = numpy.maximum(voi, 0)
+  metalMax = metal.reshape(batchSize, -1).max(axis=1)
+  metal /= numpy.where(metalMax > 0, metalMax, 1)[:, numpy.newaxis, numpy.newaxis]
+  corrected = windowWidth * reconstructed - windowCenter + metal[crop] * windowWidth
+
+  out = numpy.array(slices, copy=True)
+  out[crop] = _saturate(corrected, slices.dtype)
+  return out
+
+
+def _reduceSharedSlices(inputPath, outputPath, shape, dtype, start, stop, voiDataset, sinogramThresholdRatio):
+  """Worker task : reduces the metal artifacts of the [start, stop[ slices of the shared input slices file"""
+  startTime = time.perf_counter()
+  slices = numpy.memmap(inputPath, dtype=dtype, mode="r", shape=shape)
+  result = reduceSliceMetalArtifacts(numpy.array(slices[start:stop]), voiDataset, sinogramThresholdRatio)
+  del slices
+
+  output = numpy.memmap(outputPath, dtype=dtype, mode="r+", shape=shape)
+  output[start:stop] = result
+  output.flush()
+  del output
+  return start, stop, time.perf_counter() - startTime
+
+
+class SliceMetalArtifactReductionJob(object):
+  """
+  Asynchronous metal artifact reduction of slices of a volume array (see reduceSliceMetalArtifacts).
+
+  The slices to process are copied to a memory mapped file shared with the worker processes, which write their
+  results to a second shared file. Batches can then be processed again if the worker processes crash. At most
+  maxPendingBatches batches are queued in the worker pool at the same time. poll() is meant to be called periodically
+  from the application event loop : it writes the finished batches back into the volume array in place and queues the
+  next batches, so that the application stays responsive.
+  """
+
+  def __init__(self, volumeArray, sliceIndices, voiDataset, sinogramThresholdRatio=0.65, batchSize=4,
+               workerCount=None, maxPendingBatches=None, useProcesses=True):
+    self.volumeArray = volumeArray
+    self.sliceIndices = numpy.asarray(sliceIndices, dtype=int)
+    self.voiDataset = voiDataset
+    self.sinogramThresholdRatio = float(sinogramThresholdRatio)
+    self.batchSize = max(1, int(batchSize))
+    self.workerCount = workerCount or defaultWorkerCount()
+    self.maxPendingBatches = maxPendingBatches or 2 * self.workerCount
+    self.useProcesses = useProcesses
+    self.processedCount = 0
+    self.isCanceled = False
+
+    self._executor = None
+    self._tempDirPath = None
+    self._inputPath = None
+    self._outputPath = None
+    self._sharedShape = (len(self.sliceIndices),) + volumeArray.shape[1:]
+    self._batches = []
+    self._pending = {}
+    self._startTime = None
+
+  @property
+  def sliceCount(self):
+    return len(self.sliceIndices)
+
+  def isDone(self):
+    return self._executor is None
+
+  def start(self):
+    self._startTime = time.perf_counter()
+    if self.sliceCount == 0:
+      return
+
+    self._tempDirPath = tempfile.mkdtemp(prefix="RFMar")
+    self._inputPath = os.path.join(self._tempDirPath, "input.raw")
+    self._outputPath = os.path.join(self._tempDirPath, "output.raw")
+    shared = numpy.memmap(self._inputPath, dtype=self.volumeArray.dtype, mode="w+", shape=self._sharedShape)
+    shared[:] = self.volumeArray[self.sliceIndices]
+    shared.flush()
+    del shared
+    numpy.memmap(self._outputPath, dtype=self.volumeArray.dtype, mode="w+", shape=self._sharedShape).flush()
+
+    self._batches = [(start, min(start + self.batchSize, self.sliceCount))
+                     for start in range(0, self.sliceCount, self.batchSize)]
+    self._executor = self._createExecutor()
+    self._submitNext()
+
+  def _createExecutor(self):
+    if self.useProcesses:
+      try:
+        return createProcessPool(self.workerCount)
+      except OSError as e:
+        logging.warning("Metal artifact reduction process pool failed, using threads instead : {}".format(e))
+        self.useProcesses = False
+    return ThreadPoolExecutor(max_workers=self.workerCount)
+
+  def _submitNext(self):
+    while self._batches and len(self._pending) < self.maxPendingBatches:
+      start, stop = self._batches.pop(0)
+      future = self._executor.submit(_reduceSharedSlices, self._inputPath, self._outputPath, self._sharedShape,
+                                     self.volumeArray.dtype.str, start, stop, self.voiDataset,
+                                     self.sinogramThresholdRatio)
+      self._pending[future] = (start, stop)
+
+  def _writeBack(self, start, stop):
+    shared = numpy.memmap(self._outputPath, dtype=self.volumeArray.dtype, mode="r", shape=self._sharedShape)
+    self.volumeArray[self.sliceIndices[start:stop]] = shared[start:stop]
+    del shared
+    self.processedCount += stop - start
+
+  def poll(self):
+    """
+    Writes the finished batches back into the volume array and queues the next batches.
+
+    :return: True while the job is running
+    """
+    if self.isDone():
+      return False
+
+    for future in [f for f in self._pending if f.done()]:
+      start, stop = self._pending.pop(future)
+      try:
+        future.result()
+      except BrokenProcessPool as e:
+        logging.warning("Metal artifact reduction process pool failed, using threads instead : {}".format(e))
+        self._batches = [(start, stop)] + list(self._pending.values()) + self._batches
+        self._pending = {}
+        self._executor.shutdown(wait=False)
+        self.useProcesses = False
+        self._executor = self._createExecutor()
+        break
+      except Exception:
+        self._close()
+        raise
+      self._writeBack(start, stop)
+
+    self._submitNext()
+    if not self._pending:
+      self._close()
+      logging.info("Metal artifact reduction: {} slices in {:.2f}s".format(self.processedCount,
+                                                                        time.perf_counter() - self._startTime))
+    return not self.isDone()
+
+  def wait(self, pollPeriod=0.05):
+    """Blocks until every slice is processed"""
+    while self.poll():
+      time.sleep(pollPeriod)
+
+  def cancel(self):
+    """Stops the job. Batches already written back into the volume array are kept."""
+    self.isCanceled = True
+    self._batches = []
+    for future in self._pending:
+      future.cancel()
+    self._pending = {}
+    self._close()
+
+  def _close(self):
+    if self._executor is not None:
+      self._executor.shutdown(wait=False)
+      self._executor = None
+    if self._tempDirPath is not None:
+      # Canceled workers may still map the shared files, in which case they are left in the temporary directory
+      shutil.rmtree(self._tempDirPath, ignore_errors=True)
+      self._tempDirPath = None
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+from itertools import chain
+
+import numpy
+
+
+def panoramaFrameIndices(frameCount, totalAngle, firstFrameAngle, initialAngleOffset=0, numberOfAngles=80):
+  """
+  Indices of the projection frames of a panorama, in the order of their columns in the panorama.
+
+  The frames cover numberOfAngles degrees on each side of the front angle, shifted by initialAngleOffset. The frames are
+  reversed when the offset faces the front of the patient.
+
+  :param frameCount: number of projection frames of the acquisition
+  :param totalAngle: acquisition arc in degrees (MNRI Geometry/TotalAngle)
+  :param firstFrameAngle: angle of the first frame in degrees (MNRI Geometry/InitAngle)
+  :return: list of frame indices
+  """
+
+  def relativeAngleToFrameIndex(angle):
+    # Convert an angle to a frame index where 0 is the front angle
+    projectionAngle = 90 + firstFrameAngle + angle + initialAngleOffset
+    return int(projectionAngle * (frameCount / totalAngle))
+
+  firstFrame = relativeAngleToFrameIndex(-numberOfAngles) % frameCount
+  lastFrame = relativeAngleToFrameIndex(numberOfAngles) % frameCount
+  if firstFrame < lastFrame:
+    frames = list(range(firstFrame, lastFrame))
+  else:
+    frames = list(chain(range(firstFrame, frameCount), range(0, lastFrame)))
+
+  if -90 < initialAngleOffset < 90:
+    frames.reverse()
+  return frames
+
+
+def panoramaColumnWindows(frameWidth, columnCount, startX=0):
+  """
+  Column window of each frame of a panorama.
+
+  Each window is (frameWidth - 2 * startX) / columnCount pixels wide. The first window starts at startX and the
+  windows are evenly spread up to the last one which ends at the frame border.
+
+  :return: list of (start, stop) column indices
+  """
+  columnWidth = (frameWidth - 2 * startX) / columnCount
+  increment = (frameWidth - columnWidth - startX) / max(columnCount - 1, 1)
+  return [(int(i * increment + startX + 0.5), int(i * increment + startX + columnWidth + 0.5))
+          for i in range(columnCount)]
+
+
+def rawToAttenuation(raw, iDark, i0, dtype=numpy.float64):
+  """Attenuation -log((raw - iDark) / (i0 - iDark)) of raw frame pixels. Pixels <= 0 are counted as 1."""
+  attenuation = numpy.maximum(raw, 1).astype(dtype)
+  attenuation -= iDark
+  attenuation /= (i0 - iDark)
+  return numpy.negative(numpy.log(attenuation, out=attenuation), out=attenuation)
+
+
+class PanoramaSynthesizer(object):
+  """
+  Panorama synthesis from column strips of the projection frames.
+
+  Only the frames and columns of the panorama are read from the frames, e.g. the memory mapped frame files of a
+  ProjectionStack. The columns are decoded to attenuation by aligned blocks of blockWidth columns. The decoded blocks are
+  cached by (source key, frame, column block) in a cache of at most cacheByteSize bytes : moving the panorama parameters
+  only decodes the blocks which were not used before.
+  """
+
+  def __init__(self, frames, iDark, i0, sourceKey=None, blockWidth=16, cacheByteSize=256 * 1024 * 1024):
+    """
+    :param frames: sequence of (H, W) raw frames, e.g. ProjectionStack or (N, H, W) numpy array
+    :param iDark, i0: dark and full intensity of the raw frames
+    :param sourceKey: hashable identifying the frames content
+    """
+    self.frames = frames
+    self.iDark = iDark
+    self.i0 = i0
+    self.sourceKey = sourceKey
+    self.blockWidth = max(1, int(blockWidth))
+    self.cacheByteSize = cacheByteSize
+    self._blocks = OrderedDict()
+    self._cachedBytes = 0
+    self.decodedBlockCount = 0
+
+  def clear(self):
+    self._blocks.clear()
+    self._cachedBytes = 0
+
+  def _block(self, frameIndex, blockIndex):
+    key = (self.sourceKey, frameIndex, blockIndex)
+    block = self._blocks.get(key)
+    if block is not None:
+      self._blocks.move_to_end(key)
+      return block
+
+    start = blockIndex * self.blockWidth
+    block = rawToAttenuation(self.frames[frameIndex][:, start:start + self.blockWidth], self.iDark, self.i0,
+                             numpy.float32)
+    self.decodedBlockCount += 1
+    self._blocks[key] = block
+    self._cachedBytes += block.nbytes
+    while self._cachedBytes > self.cacheByteSize and len(self._blocks) > 1:
+      _, removed = self._blocks.popitem(last=False)
+      self._cachedBytes -= removed.nbytes
+    return block
+
+  def strip(self, frameIndex, columnWindow, out):
+    """Writes the attenuation of the columns [start, stop[ of the frame into out"""
+    start, stop = columnWindow
+    for blockIndex in range(start // self.blockWidth, (stop - 1) // self.blockWidth + 1):
+      blockStart = blockIndex * self.blockWidth
+      block = self._block(frameIndex, blockIndex)
+      first, last = max(start, blockStart), min(stop, blockStart + block.shape[1])
+      out[:, first - start:last - start] = block[:, first - blockStart:last - blockStart]
+    return out
+
+  def synthesize(self, frameIndices, columnWindows):
+    """
+    Stitches the column windows of the frames side by side.
+
+    :return: (H, sum of window widths) float64 attenuation array
+    """
+    frameHeight, frameWidth = self.frames[frameIndices[0]].shape if len(frameIndices) else (0, 0)
+    columnWindows = [(min(start, frameWidth), min(stop, frameWidth)) for start, stop in columnWindows]
+    widths = [max(0, stop - start) for start, stop in columnWindows]
+    panorama = numpy.empty((frameHeight, sum(widths)), dtype=numpy.float64)
+    column = 0
+    for frameIndex, window, width in zip(frameIndices, columnWindows, widths):
+      if width:
+        self.strip(frameIndex, window, panorama[:, column:column + width])
+      column += width
+    return panorama
@@ -0,0 +1,255 @@
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+
+def frameFileName(index, baseName="image_", digits=3, ext="img"):
+  """Returns the file name of the index-th projection frame (ex: image_007.img)"""
+  return "{}{:0{}d}.{}".format(baseName, index, digits, ext)
+
+
+def defaultWorkerCount():
+  """Number of worker threads used by the projection processing stages"""
+  return max(1, min(8, os.cpu_count() or 1))
+
+
+class ProjectionStack(object):
+  """
+  Read-only (N, H, W) stack over the projection frame files of an MNRI acquisition.
+
+  Each frame file is memory mapped on access, no frame is read before it is needed and slicing a range of frames
+  only reads the bytes of the requested frames.
+  """
+
+  def __init__(self, framePaths, frameShape, dtype=numpy.uint16):
+    self.framePaths = list(framePaths)
+    self.frameShape = tuple(int(s) for s in frameShape)
+    self.dtype = numpy.dtype(dtype)
+
+  @classmethod
+  def fromDirectory(cls, frameDirPath, frameCount, frameShape, dtype=numpy.uint16, baseName="image_", digits=3,
+                    ext="img"):
+    framePaths = [os.path.join(frameDirPath, frameFileName(i, baseName, digits, ext)) for i in range(int(frameCount))]
+    return cls(framePaths, frameShape, dtype)
+
+  @property
+  def shape(self):
+    return (len(self.framePaths),) + self.frameShape
+
+  @property
+  def frameByteSize(self):
+    return int(numpy.prod(self.frameShape)) * self.dtype.itemsize
+
+  @property
+  def nbytes(self):
+    return len(self) * self.frameByteSize
+
+  def __len__(self):
+    return len(self.framePaths)
+
+  def frame(self, index):
+    """Memory mapped view of the index-th frame"""
+    framePath = self.framePaths[index]
+    fileSize = os.path.getsize(framePath)
+    if fileSize < self.frameByteSize:
+      raise ValueError("Frame file {} is too small for frame shape {} ({} bytes)".format(framePath, self.frameShape,
+                                                                                        fileSize))
+    return numpy.memmap(framePath, dtype=self.dtype, mode="r", shape=self.frameShape)
+
+  def read(self, start, stop, out=None):
+    """Reads frames [start, stop[ into a contiguous (stop - start, H, W) array"""
+    if out is None:
+      out = numpy.empty((stop - start,) + self.frameShape, dtype=self.dtype)
+    for i, index in enumerate(range(start, stop)):
+      out[i] = self.frame(index)
+    return out
+
+  def subset(self, start=0, stop=None, step=1):
+    """Strided view over the frames [start:stop:step] of the stack. No frame data is read or copied."""
+    return ProjectionStack(self.framePaths[start:stop:step], self.frameShape, self.dtype)
+
+  def mhdHeader(self, mhdDirPath, spacing, elementType="MET_USHORT"):
+    """
+    Creates an MHD header describing the stack frames as a 3D image.
+
+    The frames are listed with their path relative to mhdDirPath (ElementDataFile = LIST) so that any frame subset
+    can be read by RTK without duplicating the frame files on disk.
+
+    :param mhdDirPath: Directory in which the MHD file will be written
+    :param spacing: (x, y) spacing of the frame pixels
+    :param elementType: MetaIO element type of the frame pixels
+    :return: str MHD header content
+    """
+    height, width = self.frameShape
+    frameNames = [os.path.relpath(p, mhdDirPath).replace("\\", "/") for p in self.framePaths]
+    header = [
+      "ObjectType = Image",
+      "NDims = 3",
+      "DimSize = {} {} {}".format(width, height, len(self)),
+      "ElementType = {}".format(elementType),
+      "HeaderSize = -1",
+      "ElementSize = 1 1 1",
+      "ElementSpacing = {:.5f} {:.5f} 1".format(*spacing),
+      "ElementByteOrderMSB = False",
+      # ElementDataFile must be the last field of the header
+      "ElementDataFile = LIST 2D",
+    ]
+    return "\n".join(header + frameNames)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      start, stop, step = index.indices(len(self))
+      if step == 1:
+        return self.read(start, stop)
+      return numpy.stack([self.frame(i) for i in range(start, stop, step)])
+    return self.frame(index)
+
+
+class ProjectionSubset(namedtuple("ProjectionSubset", ["name", "start", "stop", "step", "geometryIndex"])):
+  """
+  Frames [start:stop:step] of an MNRI acquisition reconstructed as one volume.
+
+  geometryIndex is the suffix of the MNRI Frame/FrameCount, Geometry and BackProjection values describing the subset :
+  "" for the frames of a single acquisition, "1" and "2" for the odd and even frames of a two images acquisition. When
+  stop is None, the subset ends with the last frame of the acquisition or, for an indexed geometry, after
+  FrameCount<geometryIndex> frames.
+  """
+
+  @classmethod
+  def full(cls):
+    return cls("", 0, None, 1, "")
+
+  @classmethod
+  def odd(cls):
+    return cls("odd", 1, None, 2, "1")
+
+  @classmethod
+  def even(cls):
+    return cls("even", 0, None, 2, "2")
+
+  @classmethod
+  def arc(cls, name, start, stop, step=1):
+    """Partial arc of a single acquisition, the subset angles are derived from the acquisition arc"""
+    return cls(name, int(start), None if stop is None else int(stop), int(step), "")
+
+  def frameRange(self, frameCount):
+    """
+    :param frameCount: Number of frames of the subset geometry (FrameCount<geometryIndex> MNRI value)
+    :return: range of the subset frame indices in the acquisition
+    """
+    if self.geometryIndex:
+      stop = self.start + self.step * frameCount if self.stop is None else self.stop
+    else:
+      stop = frameCount if self.stop is None else min(self.stop, frameCount)
+    return range(self.start, stop, self.step)
+
+  def isFull(self, frameCount):
+    return not self.geometryIndex and self.frameRange(frameCount) == range(frameCount)
+
+
+def _chunkRanges(count, chunkSize, start=0):
+  return [(i, min(i + chunkSize, count)) for i in range(start, count, chunkSize)]
+
+
+def subtractPreviousFrames(current, previous, coefficient, out=None, buffer=None):
+  """
+  Computes current - previous * coefficient with saturating arithmetic.
+
+  The result is computed in float32 and clipped to the range of the output dtype before truncation, so that
+  negative differences are set to 0 instead of wrapping around.
+
+  :param current: numpy array of unsigned integer frames
+  :param previous: numpy array with the same shape as current
+  :param coefficient: float subtraction weight
+  :param out: (optional) output array. Defaults to a new array of the dtype of current
+  :param buffer: (optional) float32 work buffer with the shape of current
+  :return: out
+  """
+  if out is None:
+    out = numpy.empty_like(current)
+  if buffer is None:
+    buffer = numpy.empty(current.shape, dtype=numpy.float32)
+
+  numpy.multiply(previous, -coefficient, out=buffer, dtype=numpy.float32)
+  buffer += current
+
+  outInfo = numpy.iinfo(out.dtype)
+  numpy.clip(buffer, outInfo.min, outInfo.max, out=buffer)
+  out[...] = buffer
+  return out
+
+
+class FrameSubtractionEngine(object):
+  """
+  Dual-energy frame subtraction of a projection stack : out[i] = frame[i] - frame[i - 1] * coefficient.
+  The first frame has no previous frame and is copied unchanged.
+
+  Frames are processed by chunks spread over a thread pool. Numpy releases the GIL during the arithmetic so the
+  chunks are processed concurrently while the memory usage stays bounded by workerCount * chunkSize frames.
+  """
+
+  def __init__(self, coefficient, chunkSize=16, workerCount=None):
+    self.coefficient = float(coefficient)
+    self.chunkSize = max(1, int(chunkSize))
+    self.workerCount = workerCount or defaultWorkerCount()
+
+  def _processChunk(self, stack, start, stop, outputPaths):
+    # Read one extra frame before the chunk to have the previous frame of the first chunk frame
+    readStart = max(start - 1, 0)
+    frames = stack.read(readStart, stop)
+    offset = start - readStart
+
+    result = numpy.empty((stop - start,) + stack.frameShape, dtype=stack.dtype)
+    if start == 0:
+      result[0] = frames[0]
+      subtractPreviousFrames(frames[1:], frames[:-1], self.coefficient, out=result[1:])
+    else:
+      subtractPreviousFrames(frames[offset:], frames[:-1], self.coefficient, out=result)
+
+    for i, index in enumerate(range(start, stop)):
+      result[i].tofile(outputPaths[index])
+
+  def run(self, stack, outputPaths):
+    """
+    Subtract the frames of the input stack and write each result frame to the corresponding output path.
+
+    :param stack: ProjectionStack to process
+    :param outputPaths: List[str] of output frame paths with the same length as the stack
+    :return: dict with the processing statistics (frameCount, seconds, framesPerSecond, megaBytesPerSecond)
+    """
+    if len(outputPaths) != len(stack):
+      raise ValueError("Expected {} output paths, got {}".format(len(stack), len(outputPaths)))
+
+    startTime = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=self.workerCount) as executor:
+      futures = [executor.submit(self._processChunk, stack, start, stop, outputPaths)
+                 for start, stop in _chunkRanges(len(stack), self.chunkSize)]
+      for future in futures:
+        future.result()
+
+    return self._stats(stack, time.perf_counter() - startTime)
+
+  def runToDirectory(self, stack, outputDirPath):
+    """Subtract the frames of the input stack and write them to outputDirPath with the same file names"""
+    if not os.path.exists(outputDirPath):
+      os.makedirs(outputDirPath)
+    outputPaths = [os.path.join(outputDirPath, os.path.basename(p)) for p in stack.framePaths]
+    return self.run(stack, outputPaths)
+
+  @staticmethod
+  def _stats(stack, seconds):
+    seconds = max(seconds, 1e-9)
+    stats = {
+      "frameCount": len(stack),
+      "seconds": seconds,
+      "framesPerSecond": len(stack) / seconds,
+      # Every frame is read once (plus one per chunk) and written once
+      "megaBytesPerSecond": 2 * stack.nbytes / seconds / 1e6,
+    }
+    logging.info("Frame subtraction: {frameCount} frames in {seconds:.2f}s ({framesPerSecond:.1f} frames/s, "
+                 "{megaBytesPerSecond:.1f} MB/s)".format(**stats))
+    return stats
@@ -0,0 +1,111 @@
+import logging
+import os
+import time
+
+import slicer
+
+from RFViewerHomeLib import Signal, availablePhysicalMemory
+
+
+def maxConcurrentRuns(runCount, memoryPerRun, workersPerRun=2):
+  """
+  Number of runs which can be executed at the same time given the available cores and physical memory.
+
+  :param runCount: int - Number of runs to schedule
+  :param memoryPerRun: int - Estimated peak memory of one run in bytes
+  :param workersPerRun: int - Number of cores one run is expected to keep busy
+  :return: int between 1 and runCount
+  """
+  byCores = (os.cpu_count() or 1) // max(1, workersPerRun)
+  byMemory = availablePhysicalMemory() // max(1, memoryPerRun)
+  return int(max(1, min(runCount, byCores, byMemory)))
+
+
+class ParallelCLIScheduler(object):
+  """
+  Runs several parameter sets of the same CLI module concurrently, with at most maxConcurrentRuns CLIs running at the
+  same time. Remaining parameter sets are started as soon as a running CLI finishes.
+
+  Signals :
+    completed(List[vtkMRMLCommandLineModuleNode]) -> Emitted once every CLI is finished, cli nodes are in the order of
+    the parameter sets
+  """
+
+  def __init__(self, module, maxConcurrentRuns=2):
+    self._module = module
+    self._maxConcurrentRuns = max(1, int(maxConcurrentRuns))
+    self._pending = []
+    self._observers = []
+    self._isFinished = False
+    self._startTime = None
+    self.cliNodes = []
+    self.completed = Signal("List[vtkMRMLCommandLineModuleNode]")
+
+  def start(self, parameterSets):
+    self._pending = list(enumerate(parameterSets))
+    self.cliNodes = [None] * len(self._pending)
+    self._isFinished = False
+    self._startTime = time.perf_counter()
+    self._startPending()
+
+  def _runningCount(self):
+    return sum(1 for cliNode in self.cliNodes if cliNode is not None and cliNode.IsBusy())
+
+  def _startPending(self):
+    while self._pending and self._runningCount() < self._maxConcurrentRuns:
+      index, parameters = self._pending.pop(0)
+      cliNode = slicer.cli.createNode(self._module)
+      self._observers.append((cliNode, cliNode.AddObserver(cliNode.StatusModifiedEvent, self._onStatusModified)))
+      self.cliNodes[index] = slicer.cli.run(self._module, cliNode, parameters, update_display=False)
+
+  def _onStatusModified(self, cliNode, event):
+    if cliNode.IsBusy():
+      return
+
+    logging.info('{}:{}'.format(cliNode.GetParameterAsString('output'), cliNode.GetStatusString()))
+    if cliNode.GetErrorText():
+      logging.debug('{}\n'.format(cliNode.GetErrorText()))
+
+    self._startPending()
+    if self.isDone():
+      self._finish()
+
+  def isDone(self):
+    return not self._pending and all(cliNode is not None and not cliNode.IsBusy() for cliNode in self.cliNodes)
+
+  def isSuccessful(self):
+    return self.isDone() and all(cliNode.GetStatusString() == 'Completed' for cliNode in self.cliNodes)
+
+  def resultNode(self):
+    """First CLI node which didn't complete if any, otherwise the last CLI node"""
+    for cliNode in self.cliNodes:
+      if cliNode is not None and cliNode.GetStatusString() != 'Completed':
+        return cliNode
+    return self.cliNodes[-1] if self.cliNodes else None
+
+  def _finish(self):
+    if self._isFinished:
+      return
+    self._isFinished = True
+
+    for cliNode, tag in self._observers:
+      cliNode.RemoveObserver(tag)
+    self._observers = []
+
+    logging.info("{} CLI runs finished in {:.1f}s".format(len(self.cliNodes), time.perf_counter() - self._startTime))
+    self.completed.emit(self.cliNodes)
+
+  def wait(self, pollPeriod=0.05):
+    """Block until every CLI is finished while processing the application events"""
+    while not self._isFinished:
+      slicer.app.processEvents()
+      if self.isDone():
+        self._finish()
+        break
+      time.sleep(pollPeriod)
+
+  def cancel(self):
+    self._pending = []
+    for cliNode in self.cliNodes:
+      if cliNode is not None and cliNode.IsBusy():
+        cliNode.Cancel()
@@ -1,6 +1,7 @@
 # Import can fail if CUDA is not available on the computer
 try:
   from enum import unique, Enum
+  import numpy
   import slicer
 
   from SimpleFilters import SimpleFiltersLogic
@@ -9,6 +10,42 @@ except Exception as e:
   raise ImportError(str(e))
 
 
+def filterSlabsInPlace(imageFilter, array, haloSize, spacing=(1., 1., 1.), slabSize=32):
+  """
+  Applies a SimpleITK filter to a (K, J, I) volume array in place, slab by slab along the K axis.
+
+  Each slab is filtered with haloSize neighbouring slices on both sides so that the result matches the filter applied
+  to the whole volume as long as the filter neighbourhood radius is at most haloSize. Only one slab and its halo are
+  copied at a time instead of the whole volume.
+
+  :param imageFilter: SimpleITK image filter
+  :param array: numpy array of the volume voxels, modified in place
+  :param haloSize: int - Filter neighbourhood radius in slices
+  :param spacing: (x, y, z) voxel spacing of the volume
+  :param slabSize: int - Number of slices filtered at once
+  :return: array
+  """
+  slabSize = max(slabSize, haloSize, 1)
+  sliceCount = array.shape[0]
+
+  # Unfiltered voxels of the halo before the current slab, the volume array already contains their filtered values
+  previous = array[:0].copy()
+  for start in range(0, sliceCount, slabSize):
+    stop = min(start + slabSize, sliceCount)
+    inputSlab = numpy.concatenate([previous, array[start:min(sliceCount, stop + haloSize)]])
+    image = sitk.GetImageFromArray(inputSlab)
+    image.SetSpacing(tuple(spacing))
+
+    # Keep a reference to the output image, the array view doesn't own its data
+    outputImage = imageFilter.Execute(image)
+    outputSlab = sitk.GetArrayViewFromImage(outputImage)
+
+    first = len(previous)
+    previous = array[max(0, stop - haloSize):stop].copy()
+    array[start:stop] = outputSlab[first:first + stop - start]
+  return array
+
+
 class VolumeFiltersLogic:
   @unique
   class Type(Enum):
@@ -24,20 +61,30 @@ class VolumeFiltersLogic:
   def run(self, filter, volumeNode):
     return self._logic.run(filter, volumeNode, None, volumeNode)
 
+  def runInPlace(self, filter, volumeNode, haloSize):
+    """
+    Filters the voxels of the volume node in place (see filterSlabsInPlace). Contrary to run, the volume is neither
+    copied to nor from SimpleITK as a whole.
+    """
+    filterSlabsInPlace(filter, slicer.util.arrayFromVolume(volumeNode), haloSize, volumeNode.GetSpacing())
+    slicer.util.arrayFromVolumeModified(volumeNode)
+
   def applyMedianFilter(self, volumeNode, kernelSize):
-    
+
     filter = sitk.MedianImageFilter()
     filter.SetRadius(int(kernelSize))
 
-    self.run(filter, volumeNode)
+    self.runInPlace(filter, volumeNode, int(kernelSize))
 
   def applyGaussianFilter(self, volumeNode, stddev):
     filter = sitk.DiscreteGaussianImageFilter()
     filter.SetVariance(stddev)
 
-    self.run(filter, volumeNode)
+    # The Gaussian kernel is truncated to MaximumKernelWidth voxels on each side
+    self.runInPlace(filter, volumeNode, filter.GetMaximumKernelWidth() + 1)
 
   def applySharpenFilter(self, volumeNode):
+    # The sharpened voxels are rescaled with the statistics of the whole volume : the filter can't run slab by slab
     filter = sitk.LaplacianSharpeningImageFilter()
 
     self.run(filter, volumeNode)
@@ -0,0 +1,126 @@
+import os
+from collections import OrderedDict
+
+import numpy
+
+_metaElementTypeToDtype = {
+  "MET_CHAR": numpy.int8,
+  "MET_UCHAR": numpy.uint8,
+  "MET_SHORT": numpy.int16,
+  "MET_USHORT": numpy.uint16,
+  "MET_INT": numpy.int32,
+  "MET_UINT": numpy.uint32,
+  "MET_FLOAT": numpy.float32,
+  "MET_DOUBLE": numpy.float64,
+}
+
+
+def readMhdHeader(mhdPath):
+  """
+  Reads the key = value fields of an MHD header. Reading stops after the ElementDataFile field.
+
+  :param mhdPath: str - Path to the MHD file
+  :return: OrderedDict[str, str] of the header fields
+  """
+  header = OrderedDict()
+  with open(mhdPath, "r") as f:
+    for line in f:
+      if "=" not in line:
+        continue
+      key, value = line.split("=", 1)
+      header[key.strip()] = value.strip()
+      if key.strip() == "ElementDataFile":
+        break
+  return header
+
+
+class MhdVolumeInfo(object):
+  """Geometry and raw data location of a 3D MHD volume with a single uncompressed data file"""
+
+  def __init__(self, mhdPath):
+    self.mhdPath = mhdPath
+    self.header = readMhdHeader(mhdPath)
+
+    if self.header.get("CompressedData", "False").lower() == "true":
+      raise ValueError("Compressed MHD data is not supported : {}".format(mhdPath))
+
+    dataFile = self.header["ElementDataFile"]
+    if dataFile.split()[0].upper() == "LIST" or "%" in dataFile:
+      raise ValueError("Only single data file MHD volumes are supported : {}".format(mhdPath))
+
+    self.dataFilePath = os.path.join(os.path.dirname(mhdPath), dataFile)
+    dimSize = [int(v) for v in self.header["DimSize"].split()]
+    self.shape = tuple(reversed(dimSize))  # numpy (k, j, i) order
+    self.dtype = numpy.dtype(_metaElementTypeToDtype[self.header["ElementType"]])
+    if self.header.get("ElementByteOrderMSB", self.header.get("BinaryDataByteOrderMSB", "False")).lower() == "true":
+      self.dtype = self.dtype.newbyteorder(">")
+
+    self.spacing = self._floats("ElementSpacing", [1.0, 1.0, 1.0])
+    self.origin = self._floats("Offset", self._floats("Position", [0.0, 0.0, 0.0]))
+    self.direction = numpy.array(self._floats("TransformMatrix", [1, 0, 0, 0, 1, 0, 0, 0, 1])).reshape(3, 3).T
+    self.headerSize = int(self.header.get("HeaderSize", 0))
+
+  def _floats(self, key, default):
+    if key not in self.header:
+      return list(default)
+    return [float(v) for v in self.header[key].split()]
+
+  @property
+  def nbytes(self):
+    return int(numpy.prod(self.shape)) * self.dtype.itemsize
+
+  def dataOffset(self):
+    """Byte offset of the voxels in the data file. HeaderSize = -1 means the data is at the end of the file."""
+    if self.headerSize == -1:
+      return os.path.getsize(self.dataFilePath) - self.nbytes
+    return self.headerSize
+
+  def ijkToRASMatrix(self):
+    """4x4 numpy IJK to RAS matrix of the volume. MHD geometry is expressed in LPS."""
+    lpsToRas = numpy.diag([-1.0, -1.0, 1.0])
+    ijkToRas = numpy.eye(4)
+    ijkToRas[:3, :3] = lpsToRas.dot(self.direction).dot(numpy.diag(self.spacing))
+    ijkToRas[:3, 3] = lpsToRas.dot(self.origin)
+    return ijkToRas
+
+  def readInto(self, out):
+    """
+    Reads the raw voxels directly into the input array without intermediate copy.
+
+    :param out: C contiguous numpy array with the shape and byte size of the volume
+    """
+    if not out.flags["C_CONTIGUOUS"] or out.nbytes != self.nbytes:
+      raise ValueError("Output buffer must be contiguous and of size {} bytes".format(self.nbytes))
+
+    with open(self.dataFilePath, "rb") as f:
+      f.seek(self.dataOffset())
+      view = memoryview(out.reshape(-1).view(numpy.uint8))
+      readBytes = 0
+      while readBytes < self.nbytes:
+        count = f.readinto(view[readBytes:])
+        if not count:
+          raise IOError("Unexpected end of file in {}".format(self.dataFilePath))
+        readBytes += count
+
+    if self.dtype.byteorder == ">":
+      out.byteswap(inplace=True)
+    return out
+
+
+def stackedVolumeShape(volumeInfos):
+  """Shape of the volume obtained by stacking the input volumes along the slice (k) axis"""
+  firstShape = volumeInfos[0].shape
+  for info in volumeInfos[1:]:
+    if info.shape[1:] != firstShape[1:] or info.dtype != volumeInfos[0].dtype:
+      raise ValueError("Stacked volumes must share the same slice dimensions and scalar type")
+  return (sum(info.shape[0] for info in volumeInfos),) + firstShape[1:]
+
+
+def readStackedVolumesInto(volumeInfos, out):
+  """Reads the input volumes one after the other along the slice axis of the preallocated output array"""
+  start = 0
+  for info in volumeInfos:
+    stop = start + info.shape[0]
+    info.readInto(out[start:stop])
+    start = stop
+  return out
@@ -1,2 +1,14 @@
-from .RFVolumeFilters import *
-from .RFVolumeFiltersUI import *
+from .RFProjections import *
+from .RFVolumeIO import *
+from .RFMetalArtifactReduction import *
+from .RFPanoramaSynthesis import *
+
+try:
+  from .RFReconstructionScheduler import *
+except ImportError:
+  # The scheduler needs the Slicer application. It is not available in the metal artifact reduction worker processes
+  # which only use the numpy modules of the package.
+  pass
+
+# RFVolumeFilters and RFVolumeFiltersUI are not imported here since their import fails if CUDA is not available on the
+# computer. They are imported explicitly by the reconstruction widget.
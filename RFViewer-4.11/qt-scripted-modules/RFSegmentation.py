@@ -6,7 +6,7 @@ import slicer
 from slicer.ScriptedLoadableModule import *
 
 from RFViewerHomeLib import translatable, RFViewerWidget, removeNodeFromMRMLScene, createButton, showVolumeOnSlices, \
-    wrapInQTimer, WindowLevelUpdater, Signal, nodeID, getNodeByID, toggleCheckBox, strToBool
+    wrapInQTimer, WindowLevelUpdater, Signal, nodeID, getNodeByID, toggleCheckBox, strToBool, SessionLoadStage
 from RFVisualizationLib import setNodeVisibleInMainViewsOnly, ViewTag
 
 
@@ -333,6 +333,7 @@ class RFSegmentationWidget(RFViewerWidget):
     """
     Humble object delegating to RFSegmentationUI class. Enables instantiation of the Widget as a Slicer Module
     """
+    sessionLoadStage = SessionLoadStage.Segmentation
 
     def __init__(self, parent=None):
         RFViewerWidget.__init__(self, parent)
@@ -1,19 +1,21 @@
 import logging
 import codecs
+import os
+import unittest
+import zipfile
 import qt
 import slicer
+import vtk
 from slicer.ScriptedLoadableModule import *
 from RFViewerHomeLib import *
 from RFReconstruction import *
 from RFReconstruction import RFReconstructionLogic
 from RFViewerHomeLib import DataLoader, ModuleWidget, ToolbarWidget, createButton, Icons, \
-    translatable, ProgressBar, RFSessionSerialization, ExportDirectorySettings , RFViewerWidget, warningMessageBox, wrapInCollapsibleButton
+    translatable, ProgressBar, RFSessionSerialization, ExportDirectorySettings , RFViewerWidget, warningMessageBox, wrapInCollapsibleButton, \
+    SessionArchive, SessionArchiveWriter, SessionBlobStore
 import ScreenCapture
-import pydicom
+from RFReconstructionLib.RFDicomMetalArtifactReduction import DicomMetalArtifactReductionBatch
 # from oct2py import Oct2Py
-import threading
-from skimage.transform import iradon, radon
-from datetime import datetime
 
 class RFViewerHome(ScriptedLoadableModule):
     def __init__(self, parent):
@@ -118,6 +120,7 @@ class RFViewerHomeWidget(RFViewerWidget):
 
         # Instantiate session serialization object
         self._sessionSerializer = RFSessionSerialization(rfWidgets=self._rfModuleWidgets(), loadWidget=self._dataLoaderWidget)
+        self.connectProgressSignal(self._sessionSerializer)
 
         # Instantiate Toolbar and module widgets
         self._toolbarWidget = ToolbarWidget()
@@ -175,7 +178,7 @@ class RFViewerHomeWidget(RFViewerWidget):
             self.onLoadData(urls[0].toLocalFile())
             tmpfilepath = urls[0].toLocalFile()
             print ("tmpfilepath")
-            if tmpfilepath.endswith(".mrb"):
+            if RFSessionSerialization.isSessionFile(tmpfilepath):
                 self._sessionSerializer.loadSession(tmpfilepath)
                 ExportDirectorySettings.save(tmpfilepath)
             event.acceptProposedAction()
@@ -189,60 +192,8 @@ class RFViewerHomeWidget(RFViewerWidget):
         dirPath = ExportDirectorySettings.load()
         if dirPath is None:
             return
-        threads = []
-        for j in range(20): 
-            now = datetime.now()
-            current_time = now.strftime("%H:%M:%S")
-            print("Current Time =", current_time)
-            for i in range(20):
-                filename = ""
-                dcmfile_index = i + j * 20
-                if dcmfile_index < 10:
-                    filename = "IMG000" + str(dcmfile_index)
-                elif  dcmfile_index < 100:
-                    filename = "IMG00" + str(dcmfile_index)
-                elif  dcmfile_index < 1000:
-                    filename = "IMG0" + str(dcmfile_index)
-                elif  dcmfile_index < 10000:
-                    filename = "IMG" + str(dcmfile_index)
-                filename = filename + ".dcm"
-                t = threading.Thread(target=self.print_time , args=(filename,))
-                threads.append(t)
-                t.start()
-            print("All threads are started")
-
-            for t1 in threads:
-                t1.join() # Wait until thread terminates its task
-            print("All threads completed")
-
-    def print_time(self, dicomfilename):
-        filename = ExportDirectorySettings.load() + "/DICOM16/" + dicomfilename
-        dicomDirPath = ExportDirectorySettings.load()  + "/DICOM_tmp"
-        if os.path.isdir(dicomDirPath) != True:
-            os.mkdir(dicomDirPath)
-        ds = pydicom.dcmread(filename)
-        image = ds.pixel_array
-        image[( ds.pixel_array < 0)] = 0
-        theta = np.linspace(0., 180., max(image.shape), endpoint=False)
-        sinogram = radon(image, theta=theta, circle=True)
-        tmp = sinogram
-        maxvalue = np.max(sinogram)
-        print("maxvalue")
-        print(maxvalue)
-        if maxvalue < 19:
-            ds.save_as(dicomDirPath + "/"+ dicomfilename)
-            return
-        average = self.Average(self.Average(tmp))
-        threshold = (np.max(sinogram) - average) / 10
-        
-        tmp[ (tmp > (threshold * 7.3 + average)) ] = threshold * 7.3 + average
-        reconstruction_fbp = iradon(tmp, theta=theta, circle=True)
-        ds.PixelData  = reconstruction_fbp
-        ds.save_as(dicomDirPath + "/"+ dicomfilename)
-        return
-
-    def Average(self, lst): 
-        return sum(lst) / len(lst) 
+        DicomMetalArtifactReductionBatch(os.path.join(dirPath, "DICOM16"), os.path.join(dirPath, "DICOM_tmp")).run()
+
     def _loadCommandLineFiles(self):
         """
         Load first MRB file in passed command line files if any.
@@ -255,9 +206,9 @@ class RFViewerHomeWidget(RFViewerWidget):
         files = main_window.getCommandLineFiles()
         for file in files:
             print(file)
-            if file.endswith(".mrb"):
+            if RFSessionSerialization.isSessionFile(file):
                 self._sessionSerializer.loadSession(file)
-            if file.endswith(".mrb") or file.endswith(".mhd"):
+            if RFSessionSerialization.isSessionFile(file) or file.endswith(".mhd"):
                 self.onLoadData(file)
                 return
 
@@ -416,6 +367,7 @@ class RFViewerHomeWidget(RFViewerWidget):
     def connectProgressSignal(self, widget):
         widget.addProgressBar.connect(self.onAddProgressBar)
         widget.removeProgressBar.connect(self.onRemoveProgressBar)
+        widget.updateProgressBar.connect(self.onUpdateProgressBar)
 
     def onAddProgressBar(self, progressName):
         if progressName in self._progressBars:
@@ -439,6 +391,14 @@ class RFViewerHomeWidget(RFViewerWidget):
         self.layout.removeWidget(progressBar)
         progressBar.setVisible(False)
         del self._progressBars[progressName]
+
+    def onUpdateProgressBar(self, progressName, value, maximum):
+        if progressName not in self._progressBars:
+            return
+
+        progressBar = self._progressBars[progressName]
+        progressBar.setRange(0, maximum)
+        progressBar.setValue(value)
     def loadTakeScreenshotModule(self):
         self._currentWidget = slicer.modules.RFExportWidget
         self._currentWidget.onModuleOpened()
@@ -544,3 +504,197 @@ class RFViewerHomeWidget(RFViewerWidget):
 class RFViewerHomeLogic(ScriptedLoadableModuleLogic):
     """Empty logic class for the module to avoid error report on module loading"""
     pass
+
+
+class RFViewerHomeSessionArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tempDir = qt.QTemporaryDir()
+        self._tempDir.setAutoRemove(True)
+        self.sessionDir = self._tempDir.path()
+        self.blobStore = SessionArchive.blobStoreForArchive(os.path.join(self.sessionDir, "session.mrb"))
+
+    def a_file(self, relativePath, content, dirPath=None):
+        path = os.path.join(dirPath or self.sessionDir, relativePath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def a_session(self, archiveName, dataFiles):
+        """Saves a session archive of the {relative path: content} data files through a staging directory"""
+        stagingDir = os.path.join(self.sessionDir, "staging-" + archiveName)
+        mrmlFilePath = self.a_file("scene.mrml", b"<MRML></MRML>", stagingDir)
+        newFiles = {}
+        for index, (relativePath, content) in enumerate(dataFiles.items()):
+            self.a_file(relativePath, content, stagingDir)
+            newFiles[relativePath] = "vtkMRMLScalarVolumeNode{}".format(index + 1)
+        writer = SessionArchiveWriter(os.path.join(self.sessionDir, archiveName), stagingDir, mrmlFilePath, newFiles,
+                                      {})
+        return writer.run()
+
+    def blobNames(self):
+        return sorted(os.listdir(self.blobStore.dirPath))
+
+    def test_blobs_are_stored_once_by_content(self):
+        path = self.a_file("volume.nrrd", b"volume data")
+        digest = self.blobStore.add(path, ".nrrd")
+        self.assertEqual(SessionBlobStore.fileDigest(path), digest)
+        self.assertTrue(self.blobStore.contains(digest, ".nrrd"))
+        self.assertFalse(self.blobStore.contains(digest, ".seg.nrrd"))
+
+        self.assertEqual(digest, self.blobStore.add(self.a_file("copy.nrrd", b"volume data"), ".nrrd"))
+        self.assertEqual([digest + ".nrrd.gz"], self.blobNames())
+
+        outputPath = os.path.join(self.sessionDir, "output", "volume.nrrd")
+        self.blobStore.extract(digest, ".nrrd", outputPath)
+        with open(outputPath, "rb") as f:
+            self.assertEqual(b"volume data", f.read())
+
+    def test_blobs_which_are_not_referenced_are_pruned(self):
+        kept = self.blobStore.add(self.a_file("kept.nrrd", b"kept"), ".nrrd")
+        removed = self.blobStore.add(self.a_file("removed.nrrd", b"removed"), ".nrrd")
+        self.assertEqual(1, self.blobStore.prune({(kept, ".nrrd")}))
+        self.assertTrue(self.blobStore.contains(kept, ".nrrd"))
+        self.assertFalse(self.blobStore.contains(removed, ".nrrd"))
+
+    def test_a_session_archive_is_extracted_from_the_blob_store(self):
+        manifest = self.a_session("session.mrb", {"Data/volume.nrrd": b"volume", "Data/Segment.seg.nrrd": b"seg"})
+        archivePath = os.path.join(self.sessionDir, "session.mrb")
+        self.assertTrue(SessionArchive.isSessionArchive(archivePath))
+        self.assertFalse(SessionArchive.isSessionArchive(self.a_file("other.mrb", b"not a zip file")))
+        self.assertEqual(".seg.nrrd", manifest["files"]["Data/Segment.seg.nrrd"]["extension"])
+        self.assertFalse(os.path.exists(os.path.join(self.sessionDir, "staging-session.mrb")))
+
+        extractDir = os.path.join(self.sessionDir, "extracted")
+        mrmlFilePath, extractedManifest = SessionArchive.extract(archivePath, extractDir)
+        self.assertEqual(manifest, extractedManifest)
+        self.assertEqual(os.path.join(extractDir, "scene.mrml"), mrmlFilePath)
+        with open(os.path.join(extractDir, "Data", "volume.nrrd"), "rb") as f:
+            self.assertEqual(b"volume", f.read())
+
+        blob = manifest["files"]["Data/volume.nrrd"]
+        os.remove(self.blobStore.blobPath(blob["digest"], blob["extension"]))
+        with self.assertRaises(IOError):
+            SessionArchive.extract(archivePath, extractDir)
+
+    def test_saving_a_session_prunes_the_blobs_of_no_session(self):
+        self.a_session("first.mrb", {"Data/volume.nrrd": b"first volume", "Data/shared.nrrd": b"shared"})
+        self.a_session("second.mrb", {"Data/volume.nrrd": b"second volume", "Data/shared.nrrd": b"shared"})
+        self.assertEqual(3, len(self.blobNames()))
+
+        # Overwriting the first session releases its own volume, the shared blob is still referenced by the second one
+        self.a_session("first.mrb", {"Data/volume.nrrd": b"third volume"})
+        referenced = set()
+        for archiveName in ("first.mrb", "second.mrb"):
+            manifest = SessionArchive.readManifest(os.path.join(self.sessionDir, archiveName))
+            referenced.update(blob["digest"] + blob["extension"] + ".gz" for blob in manifest["files"].values())
+        self.assertEqual(sorted(referenced), self.blobNames())
+
+    def test_blobs_are_not_pruned_if_a_session_cannot_be_read(self):
+        self.a_session("first.mrb", {"Data/volume.nrrd": b"first volume"})
+        unreferenced = self.blobStore.add(self.a_file("unreferenced.nrrd", b"unreferenced"), ".nrrd")
+        with zipfile.ZipFile(os.path.join(self.sessionDir, "broken.mrb"), "w") as archive:
+            archive.writestr(SessionArchive.manifestName, "not json")
+
+        self.assertEqual(0, SessionArchive.pruneBlobStore(os.path.join(self.sessionDir, "first.mrb")))
+        self.assertTrue(self.blobStore.contains(unreferenced, ".nrrd"))
+
+
+class RFViewerHomeSessionSerializationTestCase(unittest.TestCase):
+    class LoadWidget(object):
+        def __init__(self):
+            self.newVolumeSettingEnabled = True
+
+        def setNewVolumeSettingEnabled(self, isEnabled):
+            self.newVolumeSettingEnabled = isEnabled
+
+        def getCurrentNodeID(self):
+            return ""
+
+    def setUp(self):
+        slicer.mrmlScene.Clear()
+        self._tempDir = qt.QTemporaryDir()
+        self._tempDir.setAutoRemove(True)
+        self.sessionPath = os.path.join(self._tempDir.path(), "session" + SessionArchive.extension)
+        self.exportDirectory = ExportDirectorySettings.load()
+        self.loadWidget = self.LoadWidget()
+        self.serializer = RFSessionSerialization([], self.loadWidget)
+
+    def tearDown(self):
+        self.serializer.waitForPendingSave()
+        self.serializer.finishPendingLoad()
+        qt.QSettings().setValue(ExportDirectorySettings._key(), self.exportDirectory)
+        slicer.mrmlScene.Clear()
+
+    @staticmethod
+    def a_table_with_numeric_columns():
+        tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode", "Profile")
+        for columnName, values in (("Distance", [0.0, 0.5, 1.0]), ("Intensity", [10.0, 12.5, 9.0])):
+            column = vtk.vtkDoubleArray()
+            column.SetName(columnName)
+            for value in values:
+                column.InsertNextValue(value)
+            tableNode.AddColumn(column)
+        return tableNode
+
+    def save(self):
+        self.serializer.saveSession(self.sessionPath, showMessageBox=False)
+        self.serializer.waitForPendingSave()
+        return SessionArchive.readManifest(self.sessionPath)
+
+    def load(self):
+        self.serializer.loadSession(self.sessionPath)
+        self.serializer.finishPendingLoad()
+        return slicer.util.getNode("Profile")
+
+    def assertNumericTable(self, tableNode):
+        intensity = tableNode.GetTable().GetColumnByName("Intensity")
+        self.assertIsNotNone(intensity)
+        self.assertTrue(intensity.IsA("vtkDataArray"), intensity.GetClassName())
+        self.assertEqual([10.0, 12.5, 9.0], [intensity.GetValue(i) for i in range(intensity.GetNumberOfTuples())])
+
+    def test_a_session_keeps_the_schema_of_the_tables(self):
+        tableNode = self.a_table_with_numeric_columns()
+        manifest = self.save()
+        self.assertEqual(["Data/Profile.schema.tsv", "Data/Profile.tsv"], sorted(manifest["files"]))
+
+        # The storage node doesn't keep the staging file names
+        self.assertFalse(tableNode.GetStorageNode().GetFileName())
+        self.assertEqual(0, tableNode.GetStorageNode().GetNumberOfFileNames())
+
+        self.assertNumericTable(self.load())
+        self.assertTrue(self.loadWidget.newVolumeSettingEnabled)
+
+        # The unmodified table reuses both its blobs
+        self.assertEqual(manifest, self.save())
+        self.assertNumericTable(self.load())
+
+    def test_a_session_missing_a_blob_fails_to_load(self):
+        self.a_table_with_numeric_columns()
+        manifest = self.save()
+        blobStore = SessionArchive.blobStoreForArchive(self.sessionPath)
+        blob = manifest["files"]["Data/Profile.tsv"]
+        os.remove(blobStore.blobPath(blob["digest"], blob["extension"]))
+
+        progressBars, failures = [], []
+        self.serializer.addProgressBar.connect(progressBars.append)
+        self.serializer.removeProgressBar.connect(progressBars.remove)
+        self.serializer.loadFailed.connect(lambda stageName, error: failures.append(stageName))
+        self.serializer.loadSession(self.sessionPath, showMessageBox=False)
+
+        self.assertEqual(1, len(failures))
+        self.assertEqual([], progressBars)
+        self.assertTrue(self.loadWidget.newVolumeSettingEnabled)
+
+        # The stages of the failed load are not run by the next load
+        self.serializer.finishPendingLoad()
+        self.assertEqual(1, len(failures))
+        self.assertEqual([], progressBars)
+
+
+class RFViewerHomeTest(ScriptedLoadableModuleTest):
+    def runTest(self):
+        # Gather tests for the plugin and run them in a test suite
+        testCases = [RFViewerHomeSessionArchiveTestCase, RFViewerHomeSessionSerializationTestCase]
+        suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(case) for case in testCases])
+        unittest.TextTestRunner(verbosity=3).run(suite)
@@ -0,0 +1,84 @@
+import errno
+import os
+from functools import lru_cache
+from types import MappingProxyType
+
+import qt
+
+
+def _typedValue(value):
+    """Converts an INI value to float if it is a number. Missing values are returned as an empty str."""
+    if value is None:
+        return ""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class IniSettings(object):
+    """
+    Immutable parsed content of an INI file.
+
+    Values are converted once when the file is read : numbers are stored as float, other values are kept as returned by
+    QSettings. Keys have the QSettings 'Section/Name' syntax and are case insensitive, as QSettings INI keys on Windows.
+    """
+
+    def __init__(self, filePath, values):
+        self.filePath = filePath
+        self._values = MappingProxyType({key.lower(): _typedValue(value) for key, value in values.items()})
+
+    @classmethod
+    def read(cls, filePath):
+        """Reads every key of the input INI file with QSettings"""
+        settings = qt.QSettings(filePath, qt.QSettings.IniFormat)
+        settings.setIniCodec("UTF-8")
+        return cls(filePath, {key: settings.value(key) for key in settings.allKeys()})
+
+    def value(self, name, default=None):
+        """Value of the 'Section/Name' key, as float if it is a number else as str"""
+        if name.lower() in self._values:
+            return self._values[name.lower()]
+        return _typedValue(default)
+
+    def sectionValue(self, section, name, default=None):
+        return self.value('{}/{}'.format(section, name), default)
+
+    def __contains__(self, name):
+        return name.lower() in self._values
+
+    def keys(self):
+        return list(self._values.keys())
+
+
+@lru_cache(maxsize=16)
+def _cachedIniSettings(filePath, modificationTime, fileSize):
+    if modificationTime is None:
+        return IniSettings(filePath, {})
+    return IniSettings.read(filePath)
+
+
+def loadIniSettings(filePath, mustExist=True):
+    """
+    Returns the parsed IniSettings of the input file.
+
+    The parsed settings are cached by path, modification time and size of the file : the file is only read again once
+    it has been modified.
+
+    :param filePath: str - Path to the INI file
+    :param mustExist: bool - If False, a missing file gives empty settings instead of raising
+    :raises: FileNotFoundError if mustExist and the file doesn't exist
+    :return: IniSettings
+    """
+    filePath = os.path.normcase(os.path.abspath(filePath))
+    try:
+        stat = os.stat(filePath)
+    except OSError:
+        if mustExist:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), filePath)
+        return _cachedIniSettings(filePath, None, None)
+    return _cachedIniSettings(filePath, stat.st_mtime_ns, stat.st_size)
+
+
+def clearIniSettingsCache():
+    _cachedIniSettings.cache_clear()
@@ -97,6 +97,14 @@ class DataLoader(object):
             self._currentVolumeNode = newNode
             self._notifyNewVolumeAdded()
 
+    def notifyCurrentVolumeNodeReplaced(self):
+        """
+        Notify the listeners again of the current volume node, when its image data was replaced in place (for instance
+        when a low resolution preview volume is replaced by the full resolution volume).
+        """
+        if self._currentVolumeNode is not None:
+            self._notifyNewVolumeAdded()
+
     def _addNewNodeObserver(self):
         if self._newNodeObserver is not None:
             self._removeNewNodeObserver()
@@ -214,6 +222,16 @@ class DataLoader(object):
         dicomWidget.browserWidget.dicomBrowser.importFiles(dicomFiles)
 
     def loadData(self, filePath):
+        return self.loadNode(lambda: slicer.util.loadNodeFromFile(filePath, "VolumeFile"), filePath)
+
+    def loadNode(self, loadFunction, filePath):
+        """
+        Load a volume node with the input load function and set it as the current volume node.
+
+        :param loadFunction: Callable creating the volume node in the scene and returning it
+        :param filePath: str - Path of the loaded data file, used as default export path
+        :return: loaded volume node or None if loading failed
+        """
         # Disable setting new volume on new node added to make sure the file loading is correctly finished first
         # If notification is done too early, the volume rendering display node will not be created correctly
         node = None
@@ -222,9 +240,9 @@ class DataLoader(object):
 
         # Import volume node from file
         try:
-            node = slicer.util.loadNodeFromFile(filePath, "VolumeFile")
+            node = loadFunction()
             self._previousLoadedDataDir = os.path.dirname(filePath)
-        except RuntimeError:
+        except (RuntimeError, IOError, ValueError):
             warningMessageBox(self.tr("Failed to import volume"), self.tr('Failed to import volume file : ') + filePath)
 
         # Re enable setting new volume
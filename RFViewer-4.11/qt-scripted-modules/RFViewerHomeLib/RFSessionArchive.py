@@ -0,0 +1,223 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import zipfile
+
+
+class SessionBlobStore(object):
+    """
+    Content addressed store of the session data files.
+
+    Each data file is stored once as a gzip compressed blob named after the SHA-1 of its uncompressed content. Sessions
+    saved in the same directory share the store : a data file which didn't change between two saves is not stored
+    again. The blobs no session references anymore are removed by prune.
+    """
+
+    def __init__(self, dirPath, compressLevel=6):
+        self.dirPath = dirPath
+        self.compressLevel = compressLevel
+
+    def blobPath(self, digest, extension):
+        return os.path.join(self.dirPath, digest + extension + ".gz")
+
+    def contains(self, digest, extension):
+        return os.path.exists(self.blobPath(digest, extension))
+
+    @staticmethod
+    def fileDigest(filePath, chunkSize=4 * 1024 * 1024):
+        sha1 = hashlib.sha1()
+        with open(filePath, "rb") as f:
+            for chunk in iter(lambda: f.read(chunkSize), b""):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def add(self, filePath, extension):
+        """
+        Adds the file to the store if its content is not already stored.
+
+        :return: SHA-1 digest of the file content
+        """
+        digest = self.fileDigest(filePath)
+        blobPath = self.blobPath(digest, extension)
+        if not os.path.exists(blobPath):
+            os.makedirs(self.dirPath, exist_ok=True)
+            partPath = blobPath + ".part"
+            with open(filePath, "rb") as source, gzip.open(partPath, "wb", compresslevel=self.compressLevel) as blob:
+                shutil.copyfileobj(source, blob, 4 * 1024 * 1024)
+            os.replace(partPath, blobPath)
+        return digest
+
+    def extract(self, digest, extension, outputPath):
+        """Writes the uncompressed content of the blob to the output path"""
+        os.makedirs(os.path.dirname(outputPath), exist_ok=True)
+        with gzip.open(self.blobPath(digest, extension), "rb") as blob, open(outputPath, "wb") as output:
+            shutil.copyfileobj(blob, output, 4 * 1024 * 1024)
+
+    def prune(self, referencedBlobs):
+        """
+        Removes the blobs which are not referenced.
+
+        :param referencedBlobs: iterable of the (digest, extension) of the blobs to keep
+        :return: number of removed blobs
+        """
+        if not os.path.isdir(self.dirPath):
+            return 0
+
+        keptPaths = set(self.blobPath(digest, extension) for digest, extension in referencedBlobs)
+        removedCount = 0
+        for name in os.listdir(self.dirPath):
+            path = os.path.join(self.dirPath, name)
+            if not name.endswith(".gz") or path in keptPaths:
+                continue
+            try:
+                os.remove(path)
+                removedCount += 1
+            except OSError as e:
+                logging.warning("Failed to remove session blob {} : {}".format(path, e))
+        return removedCount
+
+
+class SessionArchive(object):
+    """
+    Incremental session archive.
+
+    The archive is a small zip file containing the MRML scene and a manifest. The data files of the scene are not part
+    of the archive : the manifest maps each data file path of the scene to a blob of the SessionBlobStore of the session
+    directory.
+
+    The archive is not self-contained as a Slicer .mrb bundle is, hence its own extension : it can only be loaded along
+    with the blobStoreDirName directory next to it. Copying or moving a session means copying or moving both the
+    archive and this directory. Slicer itself cannot load the archive, sessions are saved as .mrb bundles to be shared.
+    """
+    extension = ".rfsession"
+    manifestName = "RFSessionManifest.json"
+    blobStoreDirName = "RFViewerSessionBlobs"
+    version = 1
+
+    @classmethod
+    def blobStoreForArchive(cls, archivePath):
+        return SessionBlobStore(os.path.join(os.path.dirname(os.path.abspath(archivePath)), cls.blobStoreDirName))
+
+    @classmethod
+    def isSessionArchive(cls, archivePath):
+        """True if the file is an incremental session archive, False for the other files such as Slicer .mrb bundles"""
+        if not zipfile.is_zipfile(archivePath):
+            return False
+        with zipfile.ZipFile(archivePath) as archive:
+            return cls.manifestName in archive.namelist()
+
+    @classmethod
+    def commit(cls, archivePath, mrmlFilePath, dataFiles):
+        """
+        Writes the archive atomically : the archive is written next to its final path and renamed once complete.
+
+        :param mrmlFilePath: path of the MRML scene file
+        :param dataFiles: dict of {scene relative data file path: {"digest":, "extension":, "nodeID":}}
+        """
+        manifest = {"version": cls.version, "scene": os.path.basename(mrmlFilePath), "files": dataFiles}
+        partPath = archivePath + ".part"
+        with zipfile.ZipFile(partPath, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.write(mrmlFilePath, manifest["scene"])
+            archive.writestr(cls.manifestName, json.dumps(manifest, indent=2))
+        os.replace(partPath, archivePath)
+        return manifest
+
+    @classmethod
+    def readManifest(cls, archivePath):
+        with zipfile.ZipFile(archivePath) as archive:
+            return json.loads(archive.read(cls.manifestName).decode("utf-8"))
+
+    @classmethod
+    def sessionArchivesSharingStore(cls, archivePath):
+        """Paths of the session archives of the archive directory, which share its blob store"""
+        dirPath = os.path.dirname(os.path.abspath(archivePath))
+        paths = [os.path.join(dirPath, name) for name in os.listdir(dirPath)]
+        return [path for path in paths if os.path.isfile(path) and cls.isSessionArchive(path)]
+
+    @classmethod
+    def pruneBlobStore(cls, archivePath):
+        """
+        Removes the blobs of the store of the archive which no session archive of its directory references.
+        Nothing is removed if a session archive can't be read, its blobs being unknown.
+
+        :return: number of removed blobs
+        """
+        referencedBlobs = set()
+        for path in cls.sessionArchivesSharingStore(archivePath):
+            try:
+                manifest = cls.readManifest(path)
+                referencedBlobs.update((blob["digest"], blob["extension"]) for blob in manifest["files"].values())
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+                logging.warning("Session blobs are not pruned, {} can't be read : {}".format(path, e))
+                return 0
+        return cls.blobStoreForArchive(archivePath).prune(referencedBlobs)
+
+    @classmethod
+    def extract(cls, archivePath, outputDir):
+        """
+        Extracts the scene and its data files from the blob store to the output directory.
+
+        :return: (path of the extracted MRML scene file, manifest)
+        """
+        manifest = cls.readManifest(archivePath)
+        blobStore = cls.blobStoreForArchive(archivePath)
+        missing = [path for path, blob in manifest["files"].items()
+                   if not blobStore.contains(blob["digest"], blob["extension"])]
+        if missing:
+            raise IOError("Session data missing from {} : {}".format(blobStore.dirPath, ", ".join(missing)))
+
+        with zipfile.ZipFile(archivePath) as archive:
+            archive.extract(manifest["scene"], outputDir)
+        for path, blob in manifest["files"].items():
+            blobStore.extract(blob["digest"], blob["extension"], os.path.join(outputDir, path))
+        return os.path.join(outputDir, manifest["scene"]), manifest
+
+
+class SessionArchiveWriter(object):
+    """
+    Finishes an incremental session save out of the main thread.
+
+    The scene file and the data files of the modified nodes are first written to a staging directory in the main
+    thread. The writer then hashes and compresses the new data files into the blob store, commits the archive, prunes
+    the blobs no session references anymore and removes the staging directory. It only uses the file system and can be
+    run by a worker thread.
+    """
+
+    def __init__(self, archivePath, stagingDir, mrmlFilePath, newFiles, reusedFiles):
+        """
+        :param newFiles: dict of {scene relative path of the data files written to the staging directory: nodeID}
+        :param reusedFiles: dict of {scene relative data file path: {"digest":, "extension":, "nodeID":}} of the data
+        files already in the blob store
+        """
+        self.archivePath = archivePath
+        self.stagingDir = stagingDir
+        self.mrmlFilePath = mrmlFilePath
+        self.newFiles = newFiles
+        self.reusedFiles = reusedFiles
+        self.blobStore = SessionArchive.blobStoreForArchive(archivePath)
+
+    @staticmethod
+    def fileExtension(path):
+        """Extension of the data file including the compound extensions such as .seg.nrrd"""
+        name = os.path.basename(path)
+        return name[name.find("."):] if "." in name else ""
+
+    def run(self):
+        """:return: manifest of the committed archive"""
+        try:
+            dataFiles = dict(self.reusedFiles)
+            for path, nodeID in self.newFiles.items():
+                extension = self.fileExtension(path)
+                digest = self.blobStore.add(os.path.join(self.stagingDir, path), extension)
+                dataFiles[path] = {"digest": digest, "extension": extension, "nodeID": nodeID}
+            manifest = SessionArchive.commit(self.archivePath, self.mrmlFilePath, dataFiles)
+            try:
+                SessionArchive.pruneBlobStore(self.archivePath)
+            except OSError as e:
+                logging.warning("Failed to prune the session blobs : {}".format(e))
+            return manifest
+        finally:
+            shutil.rmtree(self.stagingDir, ignore_errors=True)
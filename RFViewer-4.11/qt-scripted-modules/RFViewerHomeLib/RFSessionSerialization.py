@@ -1,24 +1,55 @@
+import logging
 import os
+import re
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+
 import ctk
 import qt
 import slicer
 import ScreenCapture
 from RFViewerHomeLib import translatable, warningMessageBox, informationMessageBox, Icons, TemporarySymlink, \
-    ExportDirectorySettings
+    ExportDirectorySettings, SessionArchive, SessionArchiveWriter, SessionLoadStage, Signal
 from enum import IntEnum, unique
 import vtk
 from RFExport import RFExportWidget
 @translatable
 class RFSessionSerialization(object):
     """Class responsible for saving and restoring viewer session"""
+    _dataDirName = "Data"
 
     def __init__(self, rfWidgets, loadWidget):
         self._rfWidgets = rfWidgets
         self._loadWidget = loadWidget
-        self._sessionFileFilter = self.tr("Session File") + " (*.mrb)"
-        self._sessionFileName = "RFViewerSession.mrb"
+        self._sessionFileFilter = self.tr("Session File") + " (*{})".format(SessionArchive.extension)
+        self._bundleFileFilter = self.tr("Slicer Bundle") + " (*.mrb)"
+        self._sessionFileName = "RFViewerSession" + SessionArchive.extension
         self._tmpSymlink = TemporarySymlink()
 
+        # Blob of the nodes saved or loaded from the last session, by node ID
+        self._savedBlobs = {}
+        self._pendingSave = None
+        self._saveExecutor = ThreadPoolExecutor(max_workers=1)
+        self._saveTimer = qt.QTimer()
+        self._saveTimer.setInterval(100)
+        self._saveTimer.timeout.connect(self._onSaveTimeout)
+        slicer.app.aboutToQuit.connect(self.waitForPendingSave)
+
+        # Stages of the session being loaded and their progress reporting
+        self._loadStages = deque()
+        self._loadProgressName = None
+        self._loadShowMessageBox = True
+        self._deferredDisplayNodeIDs = {}
+        self.addProgressBar = Signal("str")
+        self.removeProgressBar = Signal("str")
+        self.updateProgressBar = Signal("str", "int value", "int maximum")
+        self.loadStepProfiled = Signal("str stage name", "str step name", "float duration in seconds")
+        self.loadFailed = Signal("str stage name", "str error message")
+
     def onSaveSession(self):
         if not self.isSessionSavingPossible():
             warningMessageBox(self.tr("Save session impossible"), self.tr(
@@ -39,42 +70,209 @@ class RFSessionSerialization(object):
 
     def _querySessionSavePath(self):
         return qt.QFileDialog.getSaveFileName(None, self.tr("Save session file"), self._lastSessionPath(),
-                                              self._sessionFileFilter)
+                                              ";;".join([self._sessionFileFilter, self._bundleFileFilter]))
 
     def _querySessionLoadPath(self):
         return qt.QFileDialog.getOpenFileName(None, self.tr("Load session file"), self._lastSessionPath(),
-                                              self._sessionFileFilter)
+                                              self.tr("Session File") + " (*{} *.mrb)".format(SessionArchive.extension))
+
+    @staticmethod
+    def isSessionFile(filePath):
+        """True for the incremental session archives and the Slicer .mrb bundles"""
+        return filePath.lower().endswith((SessionArchive.extension, ".mrb"))
 
     def saveSession(self, sessionFilePath, showMessageBox=True):
+        """
+        Saves the session as an incremental session archive (see SessionArchive) or, if the path has the .mrb
+        extension, as a self-contained Slicer bundle.
+
+        Only the data files of the nodes modified since they were last saved or loaded are written, in the main thread.
+        The unchanged nodes reference their blob in the blob store of the session directory. Hashing and compressing
+        the new data files and committing the archive are done in a worker thread. The archive is not self-contained,
+        it is only valid along with the blob store.
+        """
+        self.waitForPendingSave()
+        self.finishPendingLoad()
+
         # Notify session about to be saved
         pixmap = qt.QPixmap(":/Icons/Cursor.png")
         cursor = qt.QCursor(pixmap, 32, 32)
         qt.QApplication.setOverrideCursor(cursor)
-        
-        for widget in self._rfWidgets:
-            widget.onSessionAboutToBeSaved()
 
-        # Save scene to path
-        slicer.util.saveScene(self._tmpSymlink.getSymlinkToNewPath(sessionFilePath))
+        try:
+            for widget in self._rfWidgets:
+                widget.onSessionAboutToBeSaved()
 
-        
-        qt.QApplication.restoreOverrideCursor()
+            if sessionFilePath.lower().endswith(".mrb"):
+                slicer.util.saveScene(self._tmpSymlink.getSymlinkToNewPath(sessionFilePath))
+                writer = None
+            else:
+                writer = self._writeStagedSession(sessionFilePath)
+        finally:
+            qt.QApplication.restoreOverrideCursor()
 
-        if showMessageBox:
-            warningMessageBox(self.tr("Session saved"), self.tr("Session was successfully saved."))
+        if writer is None:
+            if showMessageBox:
+                warningMessageBox(self.tr("Session saved"), self.tr("Session was successfully saved."))
+        else:
+            self._pendingSave = (self._saveExecutor.submit(writer.run), writer, showMessageBox)
+            self._saveTimer.start()
 
         # Save session directory to settings
         ExportDirectorySettings.save(sessionFilePath)
+
+        # Grab the screenshot once the pending events are processed instead of forcing the rendering here
+        qt.QTimer.singleShot(0, self._saveSessionScreenshot)
+
+    def _writeStagedSession(self, sessionFilePath):
+        """
+        Writes the scene file and the data files of the modified nodes to a staging directory.
+
+        :return: SessionArchiveWriter finishing the save
+        """
+        stagingDir = tempfile.mkdtemp(prefix="RFViewerSession")
+        blobStore = SessionArchive.blobStoreForArchive(sessionFilePath)
+        newFiles, reusedFiles, usedPaths = {}, {}, set()
+        originalFileNames = []
+
+        try:
+            # The data files are written through the temporary symlink, the ITK and VTK writers failing on the non
+            # ASCII paths of the temporary directory
+            writeDir = self._shortDirPath(stagingDir)
+            os.makedirs(os.path.join(stagingDir, self._dataDirName))
+            for node in slicer.util.getNodesByClass("vtkMRMLStorableNode"):
+                if not node.GetSaveWithScene():
+                    continue
+
+                storageNode = node.GetStorageNode()
+                if storageNode is None:
+                    if not node.AddDefaultStorageNode():
+                        continue
+                    storageNode = node.GetStorageNode()
+
+                # The staging file names are only used to write the scene, the original ones are restored after
+                relativePath = self._dataFilePath(node, storageNode, usedPaths)
+                originalFileNames.append((storageNode, self._storageFileNames(storageNode)))
+
+                # The reused blobs keep the relative paths they were saved with, the additional files of the storage
+                # node such as the table schema being named after its data file
+                savedBlobs = self._savedBlobs.get(node.GetID(), {})
+                if relativePath in savedBlobs and not node.GetModifiedSinceRead() and \
+                        all(blob["storeDir"] == blobStore.dirPath and blobStore.contains(blob["digest"], blob["extension"])
+                            for blob in savedBlobs.values()):
+                    paths = [relativePath] + [path for path in savedBlobs if path != relativePath]
+                    usedPaths.update(paths)
+                    self._setStorageFileNames(storageNode, [os.path.join(writeDir, path) for path in paths])
+                    reusedFiles.update((path, {"digest": savedBlobs[path]["digest"],
+                                               "extension": savedBlobs[path]["extension"],
+                                               "nodeID": node.GetID()}) for path in paths)
+                    continue
+
+                # The data files are compressed by the blob store in the worker thread
+                self._setStorageFileNames(storageNode, [os.path.join(writeDir, relativePath)])
+                useCompression = storageNode.GetUseCompression()
+                storageNode.SetUseCompression(False)
+                written = storageNode.WriteData(node)
+                storageNode.SetUseCompression(useCompression)
+                if not written:
+                    raise IOError("Failed to write {} data to {}".format(node.GetName(), relativePath))
+
+                # Writing the data may add file names to the storage node, such as the schema of the tables
+                for fileName in self._storageFileNames(storageNode):
+                    if fileName and self._isInDirectory(fileName, writeDir) and os.path.isfile(fileName):
+                        path = os.path.relpath(fileName, writeDir).replace(os.sep, "/")
+                        usedPaths.add(path)
+                        newFiles[path] = node.GetID()
+
+            mrmlFilePath = os.path.join(writeDir, os.path.splitext(self._sessionFileName)[0] + ".mrml")
+            self._commitScene(mrmlFilePath)
+        except Exception:
+            shutil.rmtree(stagingDir, ignore_errors=True)
+            raise
+        finally:
+            for storageNode, fileNames in originalFileNames:
+                self._setStorageFileNames(storageNode, fileNames)
+
+        return SessionArchiveWriter(sessionFilePath, stagingDir, os.path.join(stagingDir, os.path.basename(mrmlFilePath)),
+                                    newFiles, reusedFiles)
+
+    def _shortDirPath(self, dirPath):
+        """Path of the directory through the temporary symlink if it can be created"""
+        shortPath = self._tmpSymlink.getSymlinkToExistingPath(dirPath)
+        return shortPath if os.path.isdir(shortPath) else dirPath
+
+    @staticmethod
+    def _storageFileNames(storageNode):
+        """File name and additional file names of the storage node, without duplicates"""
+        fileNames = [storageNode.GetFileName()] + [storageNode.GetNthFileName(i)
+                                                   for i in range(storageNode.GetNumberOfFileNames())]
+        return list(dict.fromkeys(fileNames))
+
+    @staticmethod
+    def _setStorageFileNames(storageNode, fileNames):
+        storageNode.ResetFileNameList()
+        storageNode.SetFileName(fileNames[0])
+        for fileName in fileNames[1:]:
+            storageNode.AddFileName(fileName)
+
+    @classmethod
+    def _dataFilePath(cls, node, storageNode, usedPaths):
+        """Unique scene relative path of the node data file"""
+        baseName = re.sub(r"[^A-Za-z0-9_-]", "_", node.GetName() or node.GetID())
+        extension = "." + storageNode.GetDefaultWriteFileExtension()
+        path, index = "{}/{}{}".format(cls._dataDirName, baseName, extension), 1
+        while path in usedPaths:
+            path, index = "{}/{}_{}{}".format(cls._dataDirName, baseName, index, extension), index + 1
+        usedPaths.add(path)
+        return path
+
+    @staticmethod
+    def _commitScene(mrmlFilePath):
+        """Writes the scene file, the storage node file names being written relative to its directory"""
+        scene = slicer.mrmlScene
+        url, rootDirectory = scene.GetURL(), scene.GetRootDirectory()
+        scene.SetRootDirectory(os.path.dirname(mrmlFilePath))
+        scene.SetURL(mrmlFilePath)
+        try:
+            if not scene.Commit():
+                raise IOError("Failed to write the session scene file")
+        finally:
+            scene.SetURL(url)
+            scene.SetRootDirectory(rootDirectory)
+
+    def _onSaveTimeout(self):
+        if self._pendingSave is not None and self._pendingSave[0].done():
+            self._finishPendingSave()
+
+    def _finishPendingSave(self):
+        future, writer, showMessageBox = self._pendingSave
+        self._pendingSave = None
+        self._saveTimer.stop()
+
+        try:
+            manifest = future.result()
+        except Exception as e:
+            warningMessageBox(self.tr("Save session failed"), "{}".format(e))
+            return
+
+        self._recordSavedBlobs(manifest, writer.blobStore)
+        if showMessageBox:
+            warningMessageBox(self.tr("Session saved"), self.tr("Session was successfully saved."))
+
+    def waitForPendingSave(self):
+        """Blocks until the session being saved by the worker thread is committed"""
+        if self._pendingSave is not None:
+            wait([self._pendingSave[0]])
+            self._finishPendingSave()
+
+    def _recordSavedBlobs(self, manifest, blobStore):
+        """Records the {scene relative path: blob} of the data files of each node"""
+        self._savedBlobs = {}
+        for path, blob in manifest["files"].items():
+            self._savedBlobs.setdefault(blob["nodeID"], {})[path] = dict(blob, storeDir=blobStore.dirPath)
+
+    def _saveSessionScreenshot(self):
         path = os.path.join(ExportDirectorySettings.load(), "Session-screenshot.png")
-        # msg = qt.QMessageBox()
-        # msg.setText(path)
-        # msg.exec_()
-        # cap = ScreenCapture.ScreenCaptureLogic()
-        # cap.showViewControllers(False)
-        # cap._captureImageFromView(path)
-        # cap.showViewControllers(True)
-        slicer.app.processEvents()
-        slicer.util.forceRenderAllViews()
 
         # Grab the main window and use only the viewport's area
         allViews = slicer.app.layoutManager().viewport()
@@ -90,7 +288,20 @@ class RFSessionSerialization(object):
                                             qt.QRect(topLeft.x(), topLeft.y(), imageSize.x(), imageSize.y()))
 
         img.save(path)
-    def loadSession(self, sessionFilePath):
+
+    def loadSession(self, sessionFilePath, showMessageBox=True):
+        """
+        Loads the session in stages.
+
+        The scene is loaded and the widgets of the SessionLoadStage.SliceViews stage are notified before returning, the
+        slice views showing the volume. The volume renderings and the segmentation 3D displays are hidden while the
+        scene is loaded and the next stages are run from single shot timers : each stage shows its deferred displays,
+        notifies its widgets and renders the views. The time of each step is logged and emitted by loadStepProfiled.
+        If a stage fails, the remaining stages are dropped and the error is emitted by loadFailed.
+        """
+        self.waitForPendingSave()
+        self.finishPendingLoad()
+
         # Deactivate load widget notifications
         self._loadWidget.setNewVolumeSettingEnabled(False)
 
@@ -98,24 +309,158 @@ class RFSessionSerialization(object):
         for widget in self._rfWidgets:
             widget.clean()
 
+        self._loadStages = deque([(self.tr("Scene"), partial(self._loadScene, sessionFilePath))])
+        self._loadStages.extend((self._loadStageName(stage), partial(self._loadStage, stage))
+                                for stage in SessionLoadStage)
+        self._loadStages.append((self.tr("Rendering"), self._finishLoad))
+        self._loadShowMessageBox = showMessageBox
+
+        # Run the scene and slice views stages before returning
+        self._runLoadStage(runNextStageLater=False)
+        self._runLoadStage()
+
+        # Save session directory to settings
+        ExportDirectorySettings.save(sessionFilePath)
+
+    def _loadStageName(self, stage):
+        return {SessionLoadStage.SliceViews: self.tr("Slice views"),
+                SessionLoadStage.VolumeRendering: self.tr("Volume rendering"),
+                SessionLoadStage.Segmentation: self.tr("Segmentation"),
+                SessionLoadStage.Annotations: self.tr("Annotations"),
+                SessionLoadStage.Implants: self.tr("Implants")}[stage]
+
+    def finishPendingLoad(self):
+        """Runs the remaining stages of the session being loaded"""
+        while self._loadStages:
+            self._runLoadStage(runNextStageLater=False)
+
+    def _runLoadStage(self, runNextStageLater=True):
+        if not self._loadStages:
+            return
+
+        stageName, stage = self._loadStages.popleft()
+        self._setLoadProgress(stageName)
+        try:
+            self._profileLoadStep(stageName, stageName, stage)
+        except Exception as e:
+            self._abortLoad(stageName, e)
+            return
+
+        if not self._loadStages:
+            self._setLoadProgress(None)
+        elif runNextStageLater:
+            qt.QTimer.singleShot(0, self._runLoadStage)
+
+    def _abortLoad(self, stageName, error):
+        """Drops the remaining stages of the failed load and reactivates the load widget notifications"""
+        logging.exception("Session loading {} failed".format(stageName))
+        self._loadStages.clear()
+        self._deferredDisplayNodeIDs = {}
+        self._setLoadProgress(None)
+        self._loadWidget.setNewVolumeSettingEnabled(True)
+
+        self.loadFailed(stageName, "{}".format(error))
+        if self._loadShowMessageBox:
+            warningMessageBox(self.tr("Load session failed"), "{}".format(error))
+
+    def _setLoadProgress(self, stageName):
+        if self._loadProgressName is not None:
+            self.removeProgressBar(self._loadProgressName)
+        self._loadProgressName = None if stageName is None else self.tr("Loading session") + " : " + stageName
+        if self._loadProgressName is not None:
+            self.addProgressBar(self._loadProgressName)
+
+    def _profileLoadStep(self, stageName, stepName, step):
+        start = time.perf_counter()
+        step()
+        duration = time.perf_counter() - start
+        logging.info("Session loading {} - {} : {:.3f} s".format(stageName, stepName, duration))
+        self.loadStepProfiled(stageName, stepName, duration)
+
+    def _loadScene(self, sessionFilePath):
         # Clear scene
         slicer.mrmlScene.Clear()
+        self._savedBlobs = {}
 
-        # Load scene from session path
-        if os.path.exists(self._tmpSymlink.getSymlinkToExistingPath(sessionFilePath)):
-            slicer.util.loadScene(self._tmpSymlink.getSymlinkToExistingPath(sessionFilePath))
-        else:
-            slicer.util.loadScene(sessionFilePath)
-        # Notify scene was loaded
+        # Load scene from session path, hiding the displays of the later stages while the scene is imported
+        self._deferredDisplayNodeIDs = {SessionLoadStage.VolumeRendering: [], SessionLoadStage.Segmentation: []}
+        observerTag = slicer.mrmlScene.AddObserver(slicer.mrmlScene.NodeAddedEvent, self._onLoadedNodeAdded)
+        try:
+            if SessionArchive.isSessionArchive(sessionFilePath):
+                self._loadSessionArchive(sessionFilePath)
+            elif os.path.exists(self._tmpSymlink.getSymlinkToExistingPath(sessionFilePath)):
+                slicer.util.loadScene(self._tmpSymlink.getSymlinkToExistingPath(sessionFilePath))
+            else:
+                slicer.util.loadScene(sessionFilePath)
+        finally:
+            slicer.mrmlScene.RemoveObserver(observerTag)
+
+    @vtk.calldata_type(vtk.VTK_OBJECT)
+    def _onLoadedNodeAdded(self, caller, event, node):
+        if node.IsA("vtkMRMLVolumeRenderingDisplayNode") and node.GetVisibility():
+            node.SetVisibility(False)
+            self._deferredDisplayNodeIDs[SessionLoadStage.VolumeRendering].append(node.GetID())
+        elif node.IsA("vtkMRMLSegmentationDisplayNode") and node.GetVisibility3D():
+            node.SetVisibility3D(False)
+            self._deferredDisplayNodeIDs[SessionLoadStage.Segmentation].append(node.GetID())
+
+    def _showDeferredDisplays(self, stage):
+        for displayNodeID in self._deferredDisplayNodeIDs.pop(stage, []):
+            displayNode = slicer.mrmlScene.GetNodeByID(displayNodeID)
+            if displayNode is None:
+                continue
+            if stage == SessionLoadStage.VolumeRendering:
+                displayNode.SetVisibility(True)
+            else:
+                displayNode.SetVisibility3D(True)
+
+    def _loadStage(self, stage):
+        """Shows the deferred displays of the stage, notifies its widgets and renders the views"""
+        stageName = self._loadStageName(stage)
+        self._profileLoadStep(stageName, self.tr("Deferred displays"), partial(self._showDeferredDisplays, stage))
         for widget in self._rfWidgets:
-            widget.onSessionLoaded()
+            if widget.sessionLoadStage == stage:
+                self._profileLoadStep(stageName, type(widget).__name__, widget.onSessionLoaded)
+
+        layoutManager = slicer.app.layoutManager()
+        if stage == SessionLoadStage.SliceViews:
+            views = [layoutManager.sliceWidget(name).sliceView() for name in layoutManager.sliceViewNames()]
+        else:
+            views = [layoutManager.threeDWidget(i).threeDView() for i in range(layoutManager.threeDViewCount)]
+        self._profileLoadStep(stageName, self.tr("Render"), lambda: [view.forceRender() for view in views])
+
+    def _finishLoad(self):
         slicer.app.processEvents()
         slicer.util.forceRenderAllViews()
         # Reactivate load widget notifications
         self._loadWidget.setNewVolumeSettingEnabled(True)
 
-        # Save session directory to settings
-        ExportDirectorySettings.save(sessionFilePath)
+    def _loadSessionArchive(self, sessionFilePath):
+        extractDir = tempfile.mkdtemp(prefix="RFViewerSession")
+        readDir = extractDir
+        try:
+            mrmlFilePath, manifest = SessionArchive.extract(sessionFilePath, extractDir)
+
+            # The data files are read through the temporary symlink, as they are written
+            readDir = self._shortDirPath(extractDir)
+            slicer.util.loadScene(os.path.join(readDir, os.path.relpath(mrmlFilePath, extractDir)))
+        finally:
+            shutil.rmtree(extractDir, ignore_errors=True)
+
+            # The loaded nodes don't keep referencing the removed extracted files
+            for storageNode in slicer.util.getNodesByClass("vtkMRMLStorageNode"):
+                fileNames = self._storageFileNames(storageNode)
+                if any(fileName and (self._isInDirectory(fileName, readDir) or self._isInDirectory(fileName, extractDir))
+                       for fileName in fileNames):
+                    self._setStorageFileNames(storageNode, [None])
+
+        # The loaded nodes keep referencing their blob until they are modified
+        self._recordSavedBlobs(manifest, SessionArchive.blobStoreForArchive(sessionFilePath))
+
+    @staticmethod
+    def _isInDirectory(filePath, dirPath):
+        dirPath = os.path.join(os.path.normcase(os.path.abspath(dirPath)), "")
+        return os.path.normcase(os.path.abspath(filePath)).startswith(dirPath)
 
     def isSessionSavingPossible(self):
         return self._loadWidget.getCurrentNodeID() != ""
@@ -587,6 +587,39 @@ def getShortPathToExistingPath(path):
             output_buf_size = needed
 
 
+defaultAvailablePhysicalMemory = 4 * 1024 ** 3
+
+
+def availablePhysicalMemory():
+    """
+    Gets the physical memory currently available on the computer. On hosts other than Windows, the available memory
+    is read from sysconf and defaults to defaultAvailablePhysicalMemory if sysconf doesn't report it.
+
+    :return: int - Available physical memory in bytes
+    """
+    if not hasattr(ctypes, "windll"):
+        try:
+            return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (AttributeError, ValueError, OSError):
+            return defaultAvailablePhysicalMemory
+
+    class MEMORYSTATUSEX(ctypes.Structure):
+        _fields_ = [("dwLength", wintypes.DWORD),
+                    ("dwMemoryLoad", wintypes.DWORD),
+                    ("ullTotalPhys", ctypes.c_ulonglong),
+                    ("ullAvailPhys", ctypes.c_ulonglong),
+                    ("ullTotalPageFile", ctypes.c_ulonglong),
+                    ("ullAvailPageFile", ctypes.c_ulonglong),
+                    ("ullTotalVirtual", ctypes.c_ulonglong),
+                    ("ullAvailVirtual", ctypes.c_ulonglong),
+                    ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+    memoryStatus = MEMORYSTATUSEX()
+    memoryStatus.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+    ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(memoryStatus))
+    return memoryStatus.ullAvailPhys
+
+
 @translatable
 class TemporarySymlink(object):
     """
@@ -1,3 +1,5 @@
+from enum import IntEnum, unique
+
 import ctk
 import slicer
 
@@ -6,6 +8,19 @@ from slicer.ScriptedLoadableModule import ScriptedLoadableModuleWidget
 from slicer.util import VTKObservationMixin
 
 
+@unique
+class SessionLoadStage(IntEnum):
+    """
+    Stages of the session loading. The widgets of a stage are notified of the loaded session once the views of the
+    previous stages are rendered.
+    """
+    SliceViews = 0
+    VolumeRendering = 1
+    Segmentation = 2
+    Annotations = 3
+    Implants = 4
+
+
 class RFViewerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     """
     Base widget for the RFViewer modules. Defines convenience signals and methods for configuring and using a module
@@ -14,13 +29,16 @@ class RFViewerWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     Signals :
       addProgressBar(str) -> Adds a progress bar with the input string information in the Home module
       removeProgressBar(str) -> Removes progress bar with the input string from the Home module
+      updateProgressBar(str, int, int) -> Sets the value and the maximum of the progress bar with the input string
     """
+    sessionLoadStage = SessionLoadStage.SliceViews
 
     def __init__(self, parent):
         ScriptedLoadableModuleWidget.__init__(self, parent)
         VTKObservationMixin.__init__(self)
         self.addProgressBar = Signal("str")
         self.removeProgressBar = Signal("str")
+        self.updateProgressBar = Signal("str", "int value", "int maximum")
         self.spacing = 7
         self._dataLoaderWidget = None
 
@@ -1,5 +1,7 @@
 from .RFViewerUtils import *
+from .RFIniSettings import *
 from .RFLoadWidget import *
 from .RFViewerHomePanel import *
 from .RFViewerWidget import *
+from .RFSessionArchive import *
 from .RFSessionSerialization import *
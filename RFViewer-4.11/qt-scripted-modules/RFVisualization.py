@@ -3,20 +3,17 @@ import slicer
 from slicer.ScriptedLoadableModule import *
 import vtk
 from RFReconstruction import RFReconstructionLogic
+from RFReconstructionLib import SliceMetalArtifactReductionJob, hotSliceIndices
 import RFViewerHomeLib
 from RFViewerHomeLib import wrapInQTimer, translatable, RFViewerWidget, showVolumeOnSlices,showVolumeOnSlice, warningMessageBox, \
-  getViewBySingletonTag,ExportDirectorySettings 
+  getViewBySingletonTag,ExportDirectorySettings, SessionLoadStage
 from RFVisualizationLib import RFLayoutType, layoutSetup, layoutBackgroundSetup, RFVisualizationUI, IndustryType, \
   closestPowerOfTen, getAll3DViewNodes, createDiscretizableColorTransferFunctionFromColorPreset, \
   createColorNodeFromVolumePropertyNode, ViewTag
-import threading
-from skimage.transform import iradon, radon
-import skimage
-from datetime import datetime
+import logging
 import numpy as np
 import pydicom
 import os
-from pydicom.pixel_data_handlers.util import apply_voi_lut
 from numba import jit, cuda ,njit,float64, int32
 import numba  
 class RFVisualization(ScriptedLoadableModule):
@@ -36,6 +33,8 @@ class RFVisualization(ScriptedLoadableModule):
 
 @translatable
 class RFVisualizationWidget(RFViewerWidget):
+  sessionLoadStage = SessionLoadStage.VolumeRendering
+
   def __init__(self, parent):
     RFViewerWidget.__init__(self, parent)
     self.volumeNode = None
@@ -57,9 +56,16 @@ class RFVisualizationWidget(RFViewerWidget):
     self._roisVisibility = {}
     self._viewVisibility = {}
 
+    self._marJob = None
+    self._marProgress = None
+    self._marTimer = qt.QTimer()
+    self._marTimer.setInterval(100)
+    self._marTimer.timeout.connect(self.onMetalArtifactReductionTimeout)
+
   def getVolumeDisplayNode3D(self):
     return self._vrLogic.GetFirstVolumeRenderingDisplayNode(self.volumeNode)
   def setVolumeNode(self, volumeNode):
+    self.cancelMetalArtifactReduction()
     self.volumeNode = volumeNode
 
 
@@ -103,44 +109,75 @@ class RFVisualizationWidget(RFViewerWidget):
       
     filename =  ExportDirectorySettings.load() + "/DICOM16/" + 'IMG0001.dcm'
     if os.path.exists(filename) != False:
-      self.ds = pydicom.dcmread(filename)
+      # Only the window / VOI LUT attributes are used by the metal artifact reduction
+      self.ds = pydicom.dcmread(filename, stop_before_pixels=True)
     else:
       return
     tmp_center = self.ds.WindowCenter
     tmp_width = self.ds.WindowWidth
     self.ds.WindowCenter = tmp_width
     self.ds.WindowWidth = tmp_center
-    threads = []
-    index1 = 0
-    now = datetime.now()
-    current_time = now.strftime("%H:%M:%S")
-    print("Current Time =", current_time)
-    self.threadcount = 0
-    for x in array1:
-      max = np.max(x)
-      if max > 30000:
-        self.threadcount = self.threadcount + 1
-        print(index1)
-        shapes = x.shape
-        t = threading.Thread(target=self.calc_mar1 , args=(shapes, x, index1,))
-        threads.append(t)
-        t.start()
-      index1 = index1 + 1
-      if self.threadcount > 15:
-        print("All threads are started")
-        for t1 in threads:
-          t1.join() # Wait until thread terminates its task
-        print("All threads completed")
-        self.threadcount = 0
-    now = datetime.now()
-    current_time = now.strftime("%H:%M:%S")
-    print("Current Time =", current_time)
-    # showVolumeOnSlice(self.tmpArray, ViewTag.Axial)
-    # self.volumeNode.GnoetImageData().SetScalars(self.tmpArray)
-    showVolumeOnSlices(self.tmpArray, ViewTag.mainViewTags())
-    # # except:
-    # #   showVolumeOnSlices(self.tmpArray, ViewTag.mainViewTags())
-  
+    self.startMetalArtifactReduction(array1)
+
+  def startMetalArtifactReduction(self, volumeArray):
+    """
+    Starts the metal artifact reduction of the slices of the volume array containing metal. The slices are processed
+    by a worker pool and written back in place into the volume array while the application stays responsive.
+    """
+    self.cancelMetalArtifactReduction()
+
+    try:
+      sinogramThresholdRatio = float(self.marthreshold)
+    except (TypeError, ValueError):
+      sinogramThresholdRatio = 0
+    if sinogramThresholdRatio <= 0:
+      sinogramThresholdRatio = 0.65
+
+    self._marJob = SliceMetalArtifactReductionJob(volumeArray, hotSliceIndices(volumeArray), self.ds,
+                                                  sinogramThresholdRatio)
+    self._marJob.start()
+    self._marProgress = self.tr("Metal artifact reduction")
+    self.addProgressBar.emit(self._marProgress)
+    self._marTimer.start()
+    self.onMetalArtifactReductionTimeout()
+
+  def _removeMetalArtifactReductionProgress(self):
+    if self._marProgress is not None:
+      self.removeProgressBar.emit(self._marProgress)
+      self._marProgress = None
+
+  def onMetalArtifactReductionTimeout(self):
+    if self._marJob is None:
+      return
+
+    try:
+      isRunning = self._marJob.poll()
+    except Exception as e:
+      logging.error("Metal artifact reduction failed : {}".format(e))
+      isRunning = False
+
+    if isRunning:
+      self.updateProgressBar.emit(self._marProgress, self._marJob.processedCount, self._marJob.sliceCount)
+      return
+
+    self._marTimer.stop()
+    self._marJob = None
+    self._removeMetalArtifactReductionProgress()
+    slicer.util.arrayFromVolumeModified(self.volumeNode)
+    showVolumeOnSlices(self.volumeNode.GetID(), ViewTag.mainViewTags())
+
+  def cancelMetalArtifactReduction(self):
+    if self._marJob is None:
+      return
+
+    self._marTimer.stop()
+    self._marJob.cancel()
+    self._marJob = None
+    self._removeMetalArtifactReductionProgress()
+
+  def clean(self):
+    """Override from RFViewerWidget"""
+    self.cancelMetalArtifactReduction()
 
   # @jit(fastmath=True,nopython=True)
   # def SLFilter( N, d):
@@ -181,41 +218,6 @@ class RFVisualizationWidget(RFViewerWidget):
   #               res[np.int64(pictureSize - 1 - row), np.int64(col)] = res[np.int64(pictureSize - 1 - row), np.int64(col)] + p
   #   return res
  
-  def calc_mar1(self, shapes, image1, index1):
-    
-    image = apply_voi_lut(image1, self.ds)
-    print(image)
-    tmp_image = image
-    m = max(abs(np.min(image)),np.max(image))
-    image = image + m
-    omax = np.max(image)
-    image = image / omax
-
-    theta = np.linspace(0., 180., shapes[0], endpoint=False)
-    sinogram = skimage.transform.radon(image, theta=theta, circle=True)
-    # print("Sinogram:===>")
-    # print(np.max(sinogram))
-    if self.marthreshold > 0 :
-      eff = self.marthreshold
-    else:
-      eff = 0.65
-    th = np.max(sinogram) * eff
-    sinogram[sinogram > th] =  th
-    reconstruction_fbp = skimage.transform.iradon(sinogram, theta=theta, circle=True)
-    # delta = np.pi / shapes[0]
-    # reconstruction_fbp = RLIRadonTransform(shapes[0], shapes[0] + 1, sinogram, delta)
-    tmp_image[tmp_image < tmp_image * 0.99 ] = 0
-    # print(window_width)
-    scaled_img = self.ds.WindowWidth * reconstruction_fbp - self.ds.WindowCenter 
-    print("tmp_image")
-    print(np.max(tmp_image))
-    print(np.max(scaled_img))
-    scaled_img = scaled_img + (tmp_image / (np.max(tmp_image))) * self.ds.WindowWidth
-    self.tmpArray[index1] = scaled_img 
-    # print(self.tmpArray[index1])
-    return
-
-
   def calc_mar(self, shapes, image1, index1):
    
     image = pydicom.pixel_data_handlers.util.apply_voi_lut(image1, self.ds)
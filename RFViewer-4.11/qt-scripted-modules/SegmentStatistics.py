@@ -2,6 +2,9 @@ from __future__ import print_function
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from SegmentStatisticsPlugins import *
 
 
@@ -121,6 +124,11 @@ class SegmentStatisticsWidget(ScriptedLoadableModuleWidget):
 
     outputFormLayout.addRow("Output table:", self.outputTableSelector)
 
+    self.autoUpdateCheckBox = qt.QCheckBox()
+    self.autoUpdateCheckBox.setToolTip("Update the output table when the segments or the scalar volume are modified"
+                                       " after Apply. Only the statistics of the modified segments are computed again.")
+    outputFormLayout.addRow("Auto-update:", self.autoUpdateCheckBox)
+
     # Parameter set
     parametersCollapsibleButton = ctk.ctkCollapsibleButton()
     parametersCollapsibleButton.text = "Advanced"
@@ -151,6 +159,7 @@ class SegmentStatisticsWidget(ScriptedLoadableModuleWidget):
     self.scalarSelector.connect('currentNodeChanged(vtkMRMLNode*)', self.onNodeSelectionChanged)
     self.segmentationSelector.connect('currentNodeChanged(vtkMRMLNode*)', self.onNodeSelectionChanged)
     self.outputTableSelector.connect('currentNodeChanged(vtkMRMLNode*)', self.onNodeSelectionChanged)
+    self.autoUpdateCheckBox.connect('toggled(bool)', self.onAutoUpdateToggled)
     self.parameterNodeSelector.connect('currentNodeChanged(vtkMRMLNode*)', self.onNodeSelectionChanged)
     self.parameterNodeSelector.connect('currentNodeChanged(vtkMRMLNode*)', self.onParameterSetSelected)
 
@@ -170,12 +179,18 @@ class SegmentStatisticsWidget(ScriptedLoadableModuleWidget):
       self.segmentationSelector.setCurrentNode(segmentationNode)
 
   def cleanup(self):
+    self.logic.setAutoUpdate(False)
     if self.parameterNode and self.parameterNodeObserver:
       self.parameterNode.RemoveObserver(self.parameterNodeObserver)
 
   def onNodeSelectionChanged(self):
     self.applyButton.enabled = (self.segmentationSelector.currentNode() is not None and
                                 self.parameterNodeSelector.currentNode() is not None)
+    # The observed nodes are set by the next Apply
+    self.logic.setAutoUpdate(False)
+    previousState = self.autoUpdateCheckBox.blockSignals(True)
+    self.autoUpdateCheckBox.checked = False
+    self.autoUpdateCheckBox.blockSignals(previousState)
     if self.segmentationSelector.currentNode():
       self.outputTableSelector.baseName = self.segmentationSelector.currentNode().GetName() + ' statistics'
 
@@ -204,6 +219,17 @@ class SegmentStatisticsWidget(ScriptedLoadableModuleWidget):
     self.applyButton.text = "Apply"
 
     self.logic.showTable(self.outputTableSelector.currentNode())
+    self.logic.setAutoUpdate(self.autoUpdateCheckBox.checked, self.onStatisticsAutoUpdated)
+
+  def onAutoUpdateToggled(self, enabled):
+    if not enabled:
+      self.logic.setAutoUpdate(False)
+    elif self.outputTableSelector.currentNode() and self.applyButton.enabled:
+      self.onApply()
+
+  def onStatisticsAutoUpdated(self):
+    if self.outputTableSelector.currentNode():
+      self.logic.exportToTable(self.outputTableSelector.currentNode())
 
   def onEditParameters(self, pluginName=None):
     """Open dialog box to edit plugin's parameters"""
@@ -348,11 +374,19 @@ class SegmentStatisticsLogic(ScriptedLoadableModuleLogic):
   Nodes are passed in as arguments.
   Results are stored as 'statistics' instance variable.
   Additional plugins for computation of other statistical measurements may be registered.
+  computeStatistics runs in batched mode unless the 'batched' parameter is False : the binary labelmap layers are
+  shared by the plugins through a SegmentLabelmapCache, and the plugins which support it compute the statistics of the
+  segments in a worker pool. If the 'computationTimes' parameter is True, the computation time of each plugin is added
+  to the results of each segment.
+  The results of the plugins are cached by (segment, plugin, plugin parameters) along with the modification times of
+  the segment labelmap, and of the scalar volume for the plugins which use it : only the stale results are computed
+  again. setAutoUpdate recomputes the statistics when the segmentation or the scalar volume is modified.
   Uses ScriptedLoadableModuleLogic base class, available at:
   https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
   """
   registeredPlugins = [LabelmapSegmentStatisticsPlugin, ScalarVolumeSegmentStatisticsPlugin,
                            ClosedSurfaceSegmentStatisticsPlugin]
+  computationTimeKey = "computation_time"
 
   @staticmethod
   def registerPlugin(plugin):
@@ -378,6 +412,19 @@ class SegmentStatisticsLogic(ScriptedLoadableModuleLogic):
 
     self.keys = ["Segment"]
     self.notAvailableValueString = ""
+    self.workerCount = max(1, min(8, os.cpu_count() or 1))
+
+    # Cached plugin results : (segmentID, plugin name, parameters hash) -> (input state, (stats, computation time))
+    self._resultCache = {}
+    #: (segmentID, plugin name) of the results computed by the last update, the others came from the cache
+    self.recomputedResults = []
+
+    self.autoUpdateDelayMs = 300
+    self._autoUpdateCallback = None
+    self._autoUpdateObservations = []
+    self._autoUpdateTimer = qt.QTimer()
+    self._autoUpdateTimer.setSingleShot(True)
+    self._autoUpdateTimer.connect('timeout()', self._onAutoUpdateTimeout)
     self.reset()
 
   def getParameterNode(self):
@@ -401,6 +448,10 @@ class SegmentStatisticsLogic(ScriptedLoadableModuleLogic):
       plugin.setDefaultParameters(parameterNode)
     if not parameterNode.GetParameter('visibleSegmentsOnly'):
       parameterNode.SetParameter('visibleSegmentsOnly', str(True))
+    if not parameterNode.GetParameter('batched'):
+      parameterNode.SetParameter('batched', str(True))
+    if not parameterNode.GetParameter('computationTimes'):
+      parameterNode.SetParameter('computationTimes', str(False))
 
   def getStatistics(self):
     """Get the calculated statistical measurements"""
@@ -415,6 +466,8 @@ class SegmentStatisticsLogic(ScriptedLoadableModuleLogic):
     for plugin in self.plugins:
       self.keys += [plugin.toLongKey(k) for k in plugin.keys]
     params = self.getParameterNode()
+    if params.GetParameter('computationTimes')=='True':
+      self.keys += [plugin.toLongKey(self.computationTimeKey) for plugin in self.plugins]
     params.statistics = {"SegmentIDs":[], "MeasurementInfo": {}}
 
   def computeStatistics(self):
@@ -432,11 +485,188 @@ class SegmentStatisticsLogic(ScriptedLoadableModuleLogic):
     if visibleSegmentIds.GetNumberOfValues() == 0:
       logging.debug("computeStatistics will not return any results: there are no visible segments")
 
+    segmentIDs = [visibleSegmentIds.GetValue(segmentIndex)
+                  for segmentIndex in range(visibleSegmentIds.GetNumberOfValues())]
+
+    # Forget the results of the removed segments
+    segmentation = segmentationNode.GetSegmentation()
+    self._resultCache = {key: value for key, value in self._resultCache.items() if segmentation.GetSegment(key[0])}
+
+    self.recomputedResults = []
+    if self.getParameterNode().GetParameter('batched')!='False':
+      self.updateStatisticsForSegments(segmentIDs)
+      return
+
     # update statistics for all segment IDs
-    for segmentIndex in range(visibleSegmentIds.GetNumberOfValues()):
-      segmentID = visibleSegmentIds.GetValue(segmentIndex)
+    for segmentID in segmentIDs:
       self.updateStatisticsForSegment(segmentID)
 
+  def updateStatisticsForSegments(self, segmentIDs):
+    """
+    Update statistical measures for the specified segments in batched mode.
+    The plugins share the labelmap layers prepared once in a SegmentLabelmapCache. The statistics of the plugins
+    supporting it are computed by a worker pool, the other plugins are run in the main thread. Up to date results are
+    taken from the result cache.
+    Note: This will not change or reset measurement results of other segments
+    """
+    segmentationNode = slicer.mrmlScene.GetNodeByID(self.getParameterNode().GetParameter("Segmentation"))
+    segmentIDs = [segmentID for segmentID in segmentIDs if segmentationNode.GetSegmentation().GetSegment(segmentID)]
+    enabledPlugins = [plugin for plugin in self.plugins
+                      if self.getParameterNode().GetParameter(plugin.__class__.__name__+'.enabled')=='True']
+
+    results = {}
+    staleResults = {}
+    for segmentID in segmentIDs:
+      segmentState = self._inputState(segmentationNode, segmentID)
+      scalarVolumeState = segmentState + self._scalarVolumeState()
+      for plugin in enabledPlugins:
+        inputState = scalarVolumeState if plugin.usesScalarVolume else segmentState
+        cacheKey = self._resultCacheKey(segmentID, plugin)
+        result = self._cachedResult(cacheKey, inputState)
+        if result is not None:
+          results[segmentID, plugin] = result
+        else:
+          staleResults[segmentID, plugin] = (cacheKey, inputState)
+    self.recomputedResults = [(segmentID, plugin.__class__.__name__) for segmentID, plugin in staleResults]
+
+    cache = SegmentLabelmapCache(segmentationNode)
+    for plugin in enabledPlugins:
+      staleSegmentIDs = [segmentID for segmentID in segmentIDs if (segmentID, plugin) in staleResults]
+      if staleSegmentIDs:
+        plugin.segmentLabelmapCache = cache
+        plugin.preparedRequestedKeys = plugin.getRequestedKeys()
+        plugin.prepareLabelmapCache(cache, staleSegmentIDs)
+
+    try:
+      workerPlugins = [plugin for plugin in enabledPlugins if plugin.canComputeInWorkerThread()]
+      with ThreadPoolExecutor(max_workers=self.workerCount) as executor:
+        futures = {(segmentID, plugin): executor.submit(self._computePluginStatistics, plugin, segmentID)
+                   for segmentID, plugin in staleResults if plugin in workerPlugins}
+        for segmentID, plugin in staleResults:
+          if plugin not in workerPlugins:
+            results[segmentID, plugin] = self._computePluginStatistics(plugin, segmentID)
+        results.update((key, future.result()) for key, future in futures.items())
+    finally:
+      for plugin in enabledPlugins:
+        plugin.segmentLabelmapCache = None
+        plugin.preparedRequestedKeys = None
+
+    for key, (cacheKey, inputState) in staleResults.items():
+      self._resultCache[cacheKey] = (inputState, results[key])
+
+    # Add results in the segment and plugin order
+    for segmentID in segmentIDs:
+      self._addSegment(segmentationNode.GetSegmentation().GetSegment(segmentID), segmentID)
+      for plugin in enabledPlugins:
+        stats, computationTime = results[segmentID, plugin]
+        self._setPluginStatistics(segmentID, plugin, stats, computationTime)
+
+  def clearResultCache(self):
+    """Forget the cached plugin results, all the statistics are computed by the next update"""
+    self._resultCache = {}
+
+  def _resultCacheKey(self, segmentID, plugin):
+    """Cache key of the plugin results for the segment, depending on the plugin parameters and the input nodes"""
+    parameterNode = self.getParameterNode()
+    pluginName = plugin.__class__.__name__
+    inputNodeParameters = ("Segmentation", "ScalarVolume") if plugin.usesScalarVolume else ("Segmentation",)
+    parameters = tuple((name, parameterNode.GetParameter(name)) for name in sorted(parameterNode.GetParameterNames())
+                       if name.startswith(pluginName+'.') or name in inputNodeParameters)
+    return segmentID, pluginName, parameters
+
+  @staticmethod
+  def _transformState(node):
+    transformNode = node.GetParentTransformNode()
+    return transformNode.GetTransformToWorldMTime() if transformNode else 0
+
+  def _inputState(self, segmentationNode, segmentID):
+    """Modification times of the segment labelmap and of the segmentation transform"""
+    import vtkSegmentationCorePython as vtkSegmentationCore
+    segment = segmentationNode.GetSegmentation().GetSegment(segmentID)
+    labelmap = segment.GetRepresentation(
+      vtkSegmentationCore.vtkSegmentationConverter.GetSegmentationBinaryLabelmapRepresentationName())
+    return segment.GetMTime(), labelmap.GetMTime() if labelmap else 0, self._transformState(segmentationNode)
+
+  def _scalarVolumeState(self):
+    """Modification times of the scalar volume, of its voxels and of its transform, for the plugins which use it"""
+    grayscaleNode = slicer.mrmlScene.GetNodeByID(self.getParameterNode().GetParameter("ScalarVolume"))
+    if grayscaleNode is None:
+      return ()
+    return (self._transformState(grayscaleNode), grayscaleNode.GetMTime(),
+            grayscaleNode.GetImageData().GetMTime() if grayscaleNode.GetImageData() else 0)
+
+  def _cachedResult(self, cacheKey, inputState):
+    cached = self._resultCache.get(cacheKey)
+    if cached is None or cached[0]!=inputState:
+      return None
+    return cached[1]
+
+  def setAutoUpdate(self, enabled, callback=None):
+    """
+    Recompute the statistics when the segmentation or the scalar volume of the parameter node is modified.
+    Modified events are coalesced by a single shot timer of autoUpdateDelayMs milliseconds, so painting a segment only
+    updates the statistics once the strokes pause. The results of the unchanged segments are taken from the result
+    cache. callback() is called after each automatic update, e.g. to export the statistics to a table.
+    """
+    for node, tag in self._autoUpdateObservations:
+      node.RemoveObserver(tag)
+    self._autoUpdateObservations = []
+    self._autoUpdateTimer.stop()
+    self._autoUpdateCallback = callback if enabled else None
+    if not enabled:
+      return
+
+    import vtkSegmentationCorePython as vtkSegmentationCore
+    segmentationNode = slicer.mrmlScene.GetNodeByID(self.getParameterNode().GetParameter("Segmentation"))
+    grayscaleNode = slicer.mrmlScene.GetNodeByID(self.getParameterNode().GetParameter("ScalarVolume"))
+    observedEvents = []
+    if segmentationNode:
+      observedEvents += [(segmentationNode, event) for event in [
+        vtkSegmentationCore.vtkSegmentation.MasterRepresentationModified,
+        vtkSegmentationCore.vtkSegmentation.SegmentAdded,
+        vtkSegmentationCore.vtkSegmentation.SegmentRemoved,
+        vtkSegmentationCore.vtkSegmentation.SegmentModified]]
+      if segmentationNode.GetDisplayNode():
+        observedEvents.append((segmentationNode.GetDisplayNode(), vtk.vtkCommand.ModifiedEvent))
+    if grayscaleNode:
+      observedEvents += [(grayscaleNode, vtk.vtkCommand.ModifiedEvent),
+                         (grayscaleNode, slicer.vtkMRMLVolumeNode.ImageDataModifiedEvent)]
+    for node, event in observedEvents:
+      self._autoUpdateObservations.append((node, node.AddObserver(event, self._onAutoUpdateEvent)))
+
+  def _onAutoUpdateEvent(self, caller=None, event=None):
+    self._autoUpdateTimer.start(self.autoUpdateDelayMs)
+
+  def _onAutoUpdateTimeout(self):
+    self.computeStatistics()
+    if self._autoUpdateCallback:
+      self._autoUpdateCallback()
+
+  @staticmethod
+  def _computePluginStatistics(plugin, segmentID):
+    """Return the statistics of the plugin for the segment and their computation time in seconds"""
+    startTime = time.perf_counter()
+    stats = plugin.computeStatistics(segmentID)
+    return stats, time.perf_counter() - startTime
+
+  def _addSegment(self, segment, segmentID):
+    statistics = self.getStatistics()
+    if segmentID not in statistics["SegmentIDs"]:
+      statistics["SegmentIDs"].append(segmentID)
+    statistics[segmentID,"Segment"] = segment.GetName()
+
+  def _setPluginStatistics(self, segmentID, plugin, stats, computationTime):
+    statistics = self.getStatistics()
+    pluginName = plugin.__class__.__name__
+    for key in stats:
+      statistics[segmentID,pluginName+'.'+key] = stats[key]
+      statistics["MeasurementInfo"][pluginName+'.'+key] = plugin.getMeasurementInfo(key)
+    if self.getParameterNode().GetParameter('computationTimes')=='True':
+      timeKey = plugin.toLongKey(self.computationTimeKey)
+      statistics[segmentID,timeKey] = computationTime
+      statistics["MeasurementInfo"][timeKey] = SegmentStatisticsPluginBase.createMeasurementInfo(
+        name=plugin.name+" computation time", description="Computation time of the "+plugin.name+" plugin", units="s")
+
   def updateStatisticsForSegment(self, segmentID):
     """
     Update statistical measures for specified segment.
@@ -451,19 +681,23 @@ class SegmentStatisticsLogic(ScriptedLoadableModuleLogic):
       return
 
     segment = segmentationNode.GetSegmentation().GetSegment(segmentID)
-    statistics = self.getStatistics()
-    if segmentID not in statistics["SegmentIDs"]:
-      statistics["SegmentIDs"].append(segmentID)
-    statistics[segmentID,"Segment"] = segment.GetName()
+    self._addSegment(segment, segmentID)
 
     # apply all enabled plugins
+    segmentState = self._inputState(segmentationNode, segmentID)
+    scalarVolumeState = segmentState + self._scalarVolumeState()
     for plugin in self.plugins:
       pluginName = plugin.__class__.__name__
       if self.getParameterNode().GetParameter(pluginName+'.enabled')=='True':
-        stats = plugin.computeStatistics(segmentID)
-        for key in stats:
-          statistics[segmentID,pluginName+'.'+key] = stats[key]
-          statistics["MeasurementInfo"][pluginName+'.'+key] = plugin.getMeasurementInfo(key)
+        inputState = scalarVolumeState if plugin.usesScalarVolume else segmentState
+        cacheKey = self._resultCacheKey(segmentID, plugin)
+        result = self._cachedResult(cacheKey, inputState)
+        if result is None:
+          result = self._computePluginStatistics(plugin, segmentID)
+          self._resultCache[cacheKey] = (inputState, result)
+          self.recomputedResults.append((segmentID, pluginName))
+        stats, computationTime = result
+        self._setPluginStatistics(segmentID, plugin, stats, computationTime)
 
   def getPluginByKey(self, key):
     """Get plugin responsible for obtaining measurement value for given key"""
@@ -682,6 +916,11 @@ class SegmentStatisticsTest(ScriptedLoadableModuleTest):
     self.setUp()
     self.test_SegmentStatisticsPlugins()
 
+    self.setUp()
+    self.test_SegmentStatisticsBatched()
+    self.setUp()
+    self.test_SegmentStatisticsIncremental()
+
   def test_SegmentStatisticsBasic(self):
     """
     This tests some aspects of the label statistics
@@ -903,6 +1142,112 @@ class SegmentStatisticsTest(ScriptedLoadableModuleTest):
 
     self.delayDisplay('test_SegmentStatisticsPlugins passed!')
 
+  def test_SegmentStatisticsBatched(self):
+    """
+    This tests that the batched computation gives the results of the computation segment by segment
+    """
+
+    self.delayDisplay("Starting test_SegmentStatisticsBatched")
+
+    import SampleData
+    from SegmentStatistics import SegmentStatisticsLogic
+
+    masterVolumeNode = SampleData.downloadSample('MRBrainTumor1')
+    segmentationNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSegmentationNode')
+    segmentationNode.CreateDefaultDisplayNodes()
+    segmentationNode.SetReferenceImageGeometryParameterFromVolumeNode(masterVolumeNode)
+
+    # Geometry for each segment is defined by: radius, posX, posY, posZ
+    segmentGeometries = [[10, -6,30,28], [20, 0,65,32], [15, 1, -14, 30], [12, 0, 28, -7], [5, 0,30,64]]
+    for segmentGeometry in segmentGeometries:
+      sphereSource = vtk.vtkSphereSource()
+      sphereSource.SetRadius(segmentGeometry[0])
+      sphereSource.SetCenter(segmentGeometry[1], segmentGeometry[2], segmentGeometry[3])
+      sphereSource.Update()
+      uniqueSegmentID = segmentationNode.GetSegmentation().GenerateUniqueSegmentID("Test")
+      segmentationNode.AddSegmentFromClosedSurfaceRepresentation(sphereSource.GetOutput(), uniqueSegmentID)
+
+    def computeStatistics(batched):
+      segStatLogic = SegmentStatisticsLogic()
+      segStatLogic.getParameterNode().SetParameter("Segmentation", segmentationNode.GetID())
+      segStatLogic.getParameterNode().SetParameter("ScalarVolume", masterVolumeNode.GetID())
+      segStatLogic.getParameterNode().SetParameter("batched", str(batched))
+      segStatLogic.getParameterNode().SetParameter("computationTimes", str(True))
+      segStatLogic.getParameterNode().SetParameter("ScalarVolumeSegmentStatisticsPlugin.median.enabled", str(True))
+      segStatLogic.computeStatistics()
+      return segStatLogic.getStatistics()
+
+    statistics = computeStatistics(batched=False)
+    batchedStatistics = computeStatistics(batched=True)
+
+    self.assertEqual(batchedStatistics["SegmentIDs"], statistics["SegmentIDs"])
+    for segmentID in statistics["SegmentIDs"]:
+      for pluginName in ["LabelmapSegmentStatisticsPlugin", "ScalarVolumeSegmentStatisticsPlugin"]:
+        for key in ["voxel_count", "volume_mm3", "min", "max", "mean", "stdev", "median"]:
+          longKey = pluginName+'.'+key
+          if (segmentID, longKey) in statistics:
+            self.assertAlmostEqual(batchedStatistics[segmentID, longKey], statistics[segmentID, longKey])
+        self.assertTrue((segmentID, pluginName+'.computation_time') in batchedStatistics)
+
+    self.delayDisplay('test_SegmentStatisticsBatched passed!')
+
+  def test_SegmentStatisticsIncremental(self):
+    """
+    This tests that only the stale results are computed again
+    """
+
+    self.delayDisplay("Starting test_SegmentStatisticsIncremental")
+
+    import SampleData
+    from SegmentStatistics import SegmentStatisticsLogic
+
+    masterVolumeNode = SampleData.downloadSample('MRBrainTumor1')
+    segmentationNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSegmentationNode')
+    segmentationNode.CreateDefaultDisplayNodes()
+    segmentationNode.SetReferenceImageGeometryParameterFromVolumeNode(masterVolumeNode)
+
+    segmentGeometries = [[10, -6,30,28], [20, 0,65,32], [15, 1, -14, 30]]
+    for segmentGeometry in segmentGeometries:
+      sphereSource = vtk.vtkSphereSource()
+      sphereSource.SetRadius(segmentGeometry[0])
+      sphereSource.SetCenter(segmentGeometry[1], segmentGeometry[2], segmentGeometry[3])
+      sphereSource.Update()
+      uniqueSegmentID = segmentationNode.GetSegmentation().GenerateUniqueSegmentID("Test")
+      segmentationNode.AddSegmentFromClosedSurfaceRepresentation(sphereSource.GetOutput(), uniqueSegmentID)
+
+    segStatLogic = SegmentStatisticsLogic()
+    segStatLogic.getParameterNode().SetParameter("Segmentation", segmentationNode.GetID())
+    segStatLogic.getParameterNode().SetParameter("ScalarVolume", masterVolumeNode.GetID())
+    segStatLogic.computeStatistics()
+    statistics = segStatLogic.getStatistics()
+    self.assertEqual(len(segStatLogic.recomputedResults), 3*len(segStatLogic.plugins))
+
+    self.delayDisplay("Unchanged inputs")
+    segStatLogic.computeStatistics()
+    self.assertEqual(segStatLogic.recomputedResults, [])
+    self.assertEqual(segStatLogic.getStatistics(), statistics)
+
+    self.delayDisplay("Modified plugin parameter")
+    segStatLogic.getParameterNode().SetParameter("ScalarVolumeSegmentStatisticsPlugin.median.enabled", str(True))
+    segStatLogic.computeStatistics()
+    self.assertEqual(set(pluginName for segmentID, pluginName in segStatLogic.recomputedResults),
+                     set(["ScalarVolumeSegmentStatisticsPlugin"]))
+
+    self.delayDisplay("Modified scalar volume")
+    slicer.util.arrayFromVolumeModified(masterVolumeNode)
+    segStatLogic.computeStatistics()
+    self.assertEqual(set(pluginName for segmentID, pluginName in segStatLogic.recomputedResults),
+                     set(["ScalarVolumeSegmentStatisticsPlugin"]))
+
+    self.delayDisplay("Removed segment")
+    removedSegmentID = statistics["SegmentIDs"][0]
+    segmentationNode.GetSegmentation().RemoveSegment(removedSegmentID)
+    segStatLogic.computeStatistics()
+    self.assertFalse(removedSegmentID in segStatLogic.getStatistics()["SegmentIDs"])
+    self.assertFalse(any(key[0]==removedSegmentID for key in segStatLogic._resultCache))
+
+    self.delayDisplay('test_SegmentStatisticsIncremental passed!')
+
 
 class Slicelet(object):
   """A slicer slicelet is a module widget that comes up in stand alone mode
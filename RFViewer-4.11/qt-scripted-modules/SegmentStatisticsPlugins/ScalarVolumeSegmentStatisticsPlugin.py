@@ -1,4 +1,5 @@
 import vtk, slicer
+import numpy as np
 from SegmentStatisticsPlugins import SegmentStatisticsPluginBase
 from functools import reduce
 
@@ -12,9 +13,15 @@ class ScalarVolumeSegmentStatisticsPlugin(SegmentStatisticsPluginBase):
     self.keys = ["voxel_count", "volume_mm3", "volume_cm3", "min", "max", "mean", "median", "stdev"]
     self.defaultKeys = self.keys # calculate all measurements by default
     #... developer may add extra options to configure other parameters
+    #: ID of the scalar volume prepared in the labelmap cache before a batched computation
+    self.preparedScalarVolumeID = None
 
   def computeStatistics(self, segmentID):
     import vtkSegmentationCorePython as vtkSegmentationCore
+    if self.segmentLabelmapCache is not None:
+      # Batched computation, possibly in a worker thread : only the prepared values are used
+      return self.computeStatisticsFromLabelmapCache(segmentID)
+
     requestedKeys = self.getRequestedKeys()
 
     segmentationNode = slicer.mrmlScene.GetNodeByID(self.getParameterNode().GetParameter("Segmentation"))
@@ -114,6 +121,59 @@ class ScalarVolumeSegmentStatisticsPlugin(SegmentStatisticsPluginBase):
         stats["median"] = medians.GetMedian()
     return stats
 
+  def computeStatisticsFromLabelmapCache(self, segmentID):
+    """Compute the statistics of the grayscale voxels selected by the segment mask of the shared labelmap layer
+    resampled to the grayscale geometry. The median is the lower median of the voxel values.
+    Only reads the values prepared by prepareLabelmapCache, MRML is not accessed.
+    """
+    requestedKeys = self.preparedRequestedKeys
+    if not requestedKeys or self.preparedScalarVolumeID is None:
+      return {}
+    segmentMask, bounds, spacing = self.segmentLabelmapCache.segmentMask(segmentID, self.preparedScalarVolumeID)
+    if segmentMask is None:
+      return {}
+    values = self.segmentLabelmapCache.volumeArray(self.preparedScalarVolumeID)[bounds][segmentMask].astype(np.float64)
+
+    cubicMMPerVoxel = reduce(lambda x,y: x*y, spacing)
+    ccPerCubicMM = 0.001
+    voxelCount = len(values)
+    stats = {}
+    if "voxel_count" in requestedKeys:
+      stats["voxel_count"] = voxelCount
+    if "volume_mm3" in requestedKeys:
+      stats["volume_mm3"] = voxelCount * cubicMMPerVoxel
+    if "volume_cm3" in requestedKeys:
+      stats["volume_cm3"] = voxelCount * cubicMMPerVoxel * ccPerCubicMM
+    if voxelCount>0:
+      if "min" in requestedKeys:
+        stats["min"] = float(values.min())
+      if "max" in requestedKeys:
+        stats["max"] = float(values.max())
+      if "mean" in requestedKeys:
+        stats["mean"] = float(values.mean())
+      if "stdev" in requestedKeys:
+        stats["stdev"] = float(values.std(ddof=1)) if voxelCount>1 else 0.0
+      if "median" in requestedKeys:
+        medianIndex = (voxelCount-1)//2
+        stats["median"] = float(np.partition(values, medianIndex)[medianIndex])
+    return stats
+
+  def prepareLabelmapCache(self, cache, segmentIDs):
+    """Overridden from SegmentStatisticsPluginBase"""
+    self.preparedScalarVolumeID = None
+    grayscaleNode = slicer.mrmlScene.GetNodeByID(self.getParameterNode().GetParameter("ScalarVolume"))
+    if (not grayscaleNode
+      or not grayscaleNode.GetImageData()
+      or not grayscaleNode.GetImageData().GetPointData()
+      or not grayscaleNode.GetImageData().GetPointData().GetScalars()):
+      return
+    cache.prepare(segmentIDs, grayscaleNode)
+    self.preparedScalarVolumeID = grayscaleNode.GetID()
+
+  def canComputeInWorkerThread(self):
+    """Overridden from SegmentStatisticsPluginBase"""
+    return True
+
   def getMeasurementInfo(self, key):
     """Get information (name, description, units, ...) about the measurement for the given key"""
 
@@ -1,11 +1,133 @@
 import vtk
 import qt
 import slicer
+from vtk.util import numpy_support
+import numpy as np
+
+
+class SegmentLabelmapCache(object):
+  """Binary labelmap layers of a segmentation shared by the plugins during a batched computation.
+  Each shared labelmap layer is converted to a numpy array once, in the segmentation geometry or resampled once to the
+  geometry of a reference volume. The mask of a segment is taken from the label value of the segment in its layer,
+  cropped to the bounding box of the segment so that concurrent workers do not each allocate a full volume mask.
+  The arrays, the layer indices, the label values and the bounding boxes of the segments are read from MRML in the
+  main thread by prepare(). segmentMask() and volumeArray() only read them, so that plugins can use them from worker
+  threads.
+  """
+
+  def __init__(self, segmentationNode):
+    self.segmentationNode = segmentationNode
+    # (layer index, reference volume ID) -> (labelmap, array, spacing)
+    self._layerArrays = {}
+    self._volumeArrays = {}
+    # segment ID -> (layer index, label value)
+    self._segmentLabels = {}
+    # (segment ID, reference volume ID) -> bounding box of the segment as a tuple of (K, J, I) slices
+    self._segmentBounds = {}
+
+  @staticmethod
+  def _binaryLabelmapName():
+    import vtkSegmentationCorePython as vtkSegmentationCore
+    return vtkSegmentationCore.vtkSegmentationConverter.GetSegmentationBinaryLabelmapRepresentationName()
+
+  def prepare(self, segmentIDs, referenceVolumeNode=None):
+    """Create the arrays of the layers of the segments, resampled to the reference volume geometry if any.
+    Must be called from the main thread.
+    """
+    segmentation = self.segmentationNode.GetSegmentation()
+    if not segmentation.ContainsRepresentation(self._binaryLabelmapName()):
+      return
+    for segmentID in segmentIDs:
+      if segmentID not in self._segmentLabels:
+        self._segmentLabels[segmentID] = (segmentation.GetLayerIndex(segmentID, self._binaryLabelmapName()),
+                                          segmentation.GetSegment(segmentID).GetLabelValue())
+
+    referenceVolumeID = referenceVolumeNode.GetID() if referenceVolumeNode else None
+    for layerIndex in sorted(set(self._segmentLabels[segmentID][0] for segmentID in segmentIDs)):
+      if (layerIndex, referenceVolumeID) not in self._layerArrays:
+        self._layerArrays[layerIndex, referenceVolumeID] = self._createLayerArray(layerIndex, referenceVolumeNode)
+    if referenceVolumeNode and referenceVolumeID not in self._volumeArrays:
+      self._volumeArrays[referenceVolumeID] = slicer.util.arrayFromVolume(referenceVolumeNode)
+    for segmentID in segmentIDs:
+      if (segmentID, referenceVolumeID) not in self._segmentBounds:
+        layerIndex, labelValue = self._segmentLabels[segmentID]
+        layerArray = self._layerArrays[layerIndex, referenceVolumeID][1]
+        if layerArray is not None:
+          self._segmentBounds[segmentID, referenceVolumeID] = self._labelBounds(layerArray, labelValue)
+
+  def volumeArray(self, volumeID):
+    """Voxels of the prepared reference volume as a (K, J, I) numpy array"""
+    return self._volumeArrays[volumeID]
+
+  def segmentMask(self, segmentID, referenceVolumeID=None):
+    """Return (mask, bounds, spacing) of the segment voxels, in the geometry of the reference volume of that ID if any.
+    The mask covers the bounding box of the segment, bounds are the (K, J, I) slices of that box in the layer array.
+    The mask is None if the segment was not prepared or its layer contains no labelmap.
+    """
+    if segmentID not in self._segmentLabels:
+      return None, None, None
+    layerIndex, labelValue = self._segmentLabels[segmentID]
+    labelmap, layerArray, spacing = self._layerArrays[layerIndex, referenceVolumeID]
+    if layerArray is None:
+      return None, None, spacing
+    bounds = self._segmentBounds[segmentID, referenceVolumeID]
+    return layerArray[bounds] == labelValue, bounds, spacing
+
+  @staticmethod
+  def _labelBounds(layerArray, labelValue):
+    """Return the bounding box of the voxels of the label value as a tuple of slices, empty if there are none"""
+    bounds = []
+    for axis in range(layerArray.ndim):
+      otherAxes = tuple(otherAxis for otherAxis in range(layerArray.ndim) if otherAxis != axis)
+      # Crop the previous axes first, so that only the first projection reads the whole layer
+      indices = np.flatnonzero(np.any(layerArray[tuple(bounds)] == labelValue, axis=otherAxes))
+      if len(indices) == 0:
+        return tuple(slice(0, 0) for axis in range(layerArray.ndim))
+      bounds.append(slice(int(indices[0]), int(indices[-1])+1))
+    return tuple(bounds)
+
+  def _createLayerArray(self, layerIndex, referenceVolumeNode):
+    """Return (labelmap, array, spacing) of the layer, the array sharing the labelmap memory"""
+    import vtkSegmentationCorePython as vtkSegmentationCore
+    labelmap = self.segmentationNode.GetSegmentation().GetLayerDataObject(layerIndex, self._binaryLabelmapName())
+    if not labelmap:
+      return None, None, None
+
+    if referenceVolumeNode:
+      # Resample the layer to the reference volume geometry, nearest neighbor interpolation keeps the label values
+      referenceGeometry_Reference = vtkSegmentationCore.vtkOrientedImageData()
+      referenceGeometry_Reference.SetExtent(referenceVolumeNode.GetImageData().GetExtent())
+      ijkToRasMatrix = vtk.vtkMatrix4x4()
+      referenceVolumeNode.GetIJKToRASMatrix(ijkToRasMatrix)
+      referenceGeometry_Reference.SetGeometryFromImageToWorldMatrix(ijkToRasMatrix)
+
+      segmentationToReferenceGeometryTransform = vtk.vtkGeneralTransform()
+      slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(self.segmentationNode.GetParentTransformNode(),
+        referenceVolumeNode.GetParentTransformNode(), segmentationToReferenceGeometryTransform)
+
+      labelmap_Reference = vtkSegmentationCore.vtkOrientedImageData()
+      vtkSegmentationCore.vtkOrientedImageDataResample.ResampleOrientedImageToReferenceOrientedImage(
+        labelmap, referenceGeometry_Reference, labelmap_Reference,
+        False, # nearest neighbor interpolation
+        False, # no padding
+        segmentationToReferenceGeometryTransform)
+      labelmap = labelmap_Reference
+
+    if (not labelmap
+      or not labelmap.GetPointData()
+      or not labelmap.GetPointData().GetScalars()):
+      return labelmap, None, labelmap.GetSpacing() if labelmap else None
+
+    dimensions = labelmap.GetDimensions()
+    return (labelmap, numpy_support.vtk_to_numpy(labelmap.GetPointData().GetScalars()).reshape(dimensions[::-1]),
+            labelmap.GetSpacing())
 
 class SegmentStatisticsPluginBase(object):
   """Base class for statistics plugins operating on segments.
   Derived classes should specify: self.name, self.keys, self.defaultKeys
   and implement: computeStatistics, getMeasurementInfo
+  Derived classes may use the segmentLabelmapCache set during batched computations, see prepareLabelmapCache and
+  canComputeInWorkerThread.
   """
 
   @staticmethod
@@ -43,9 +165,16 @@ class SegmentStatisticsPluginBase(object):
     self.keys = []
     #: measurements that will be calculated by default
     self.defaultKeys = []
+    #: True if the measurements depend on the scalar volume of the parameter node : the cached results of the plugin
+    #: are then invalidated when the scalar volume is changed or modified
+    self.usesScalarVolume = True
     self.requestedKeysCheckboxes = {}
     self.parameterNode = None
     self.parameterNodeObserver = None
+    #: SegmentLabelmapCache shared by the plugins during a batched computation, None otherwise
+    self.segmentLabelmapCache = None
+    #: Requested keys read in the main thread before a batched computation, None otherwise
+    self.preparedRequestedKeys = None
 
   def __del__(self):
     if self.parameterNode and self.parameterNodeObserver:
@@ -57,6 +186,19 @@ class SegmentStatisticsPluginBase(object):
     """
     pass
 
+  def prepareLabelmapCache(self, cache, segmentIDs):
+    """Create the labelmap arrays the plugin will use from the cache to compute the statistics of the segments, and
+    read any other MRML state computeStatistics needs. Called in the main thread before a batched computation.
+    """
+    pass
+
+  def canComputeInWorkerThread(self):
+    """Return True if computeStatistics only reads the prepared segmentLabelmapCache arrays, preparedRequestedKeys and
+    the values read by prepareLabelmapCache, without accessing MRML, and can be called from a worker thread during a
+    batched computation
+    """
+    return False
+
   def getMeasurementInfo(self, key):
     """Get information (name, description, units, ...) about the measurement for the given key.
     Utilize createMeasurementInfo() to create the dictionary containing the measurement information.
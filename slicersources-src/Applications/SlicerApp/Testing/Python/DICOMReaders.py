@@ -59,6 +59,10 @@ class DICOMReadersTest(ScriptedLoadableModuleTest):
     self.test_AlternateReaders()
     self.setUp()
     self.test_MissingSlices()
+    self.setUp()
+    self.test_SortedImageFiles()
+    self.setUp()
+    self.test_TagIndex()
 
   def test_AlternateReaders(self):
     """ Test the DICOM loading of sample testing data
@@ -299,3 +303,197 @@ reloadScriptedModule('DICOMReaders'); import DICOMReaders; tester = DICOMReaders
     slicer.util.selectModule('DICOMReaders')
 
     return testPass
+
+  @staticmethod
+  def fileByFileSortedImageFiles(fileValues, filePaths, epsilon=0.01):
+    """ Reference implementation of DICOMUtils.getSortedImageFiles computing the slice distances file by file
+    """
+    warningText = ''
+    if fileValues[filePaths[0]].get("0028,0008", "") != "":
+      warningText += "Multi-frame image. If slice orientation or spacing is non-uniform then the image may be displayed incorrectly. Use with caution.\n"
+
+    ref = {}
+    for tag in ["0020,0032", "0020,0037"]:
+      value = fileValues[filePaths[0]].get(tag, "")
+      if not value:
+        warningText += "Reference image in series does not contain geometry information. Please use caution.\n"
+        return filePaths, [], warningText
+      ref[tag] = value
+
+    sliceAxes = [float(zz) for zz in ref["0020,0037"].split('\\')]
+    scanAxis = numpy.cross(numpy.array(sliceAxes[:3]), numpy.array(sliceAxes[3:]))
+    scanOrigin = numpy.array([float(zz) for zz in ref["0020,0032"].split('\\')])
+
+    sortList = []
+    for file in filePaths:
+      positionStr = fileValues[file].get("0020,0032", "")
+      orientationStr = fileValues[file].get("0020,0037", "")
+      if not positionStr or not orientationStr:
+        warningText += "One or more images is missing geometry information in series. Please use caution.\n"
+        return filePaths, [], warningText
+      position = numpy.array([float(zz) for zz in positionStr.split('\\')])
+      sortList.append((file, (position - scanOrigin).dot(scanAxis)))
+
+    sortedFiles = sorted(sortList, key=lambda x: x[1])
+    files = [file for file, dist in sortedFiles]
+    distances = dict(sortedFiles)
+
+    regularizationEnabled = (qt.QSettings().value("DICOM/ScalarVolume/AcquisitionGeometryRegularization", "default") == "transform")
+    if len(files) > 1:
+      spacing0 = distances[files[1]] - distances[files[0]]
+      for n in range(1, len(files)):
+        spaceError = distances[files[n]] - distances[files[n-1]] - spacing0
+        if abs(spaceError) > epsilon:
+          warningText += "Images are not equally spaced (a difference of %g vs %g in spacings was detected)." % (spaceError, spacing0)
+          if regularizationEnabled:
+            warningText += "  Slicer will apply a transform to this series trying to regularize the volume. Please use caution.\n"
+          else:
+            warningText += ("  If loaded image appears distorted, enable 'Acquisition geometry regularization'"
+              " in Application settings / DICOM / DICOMScalarVolumePlugin. Please use caution.\n")
+          break
+    return files, distances, warningText
+
+  def test_SortedImageFiles(self):
+    """ Test the parsing of the geometry tags and the slice sorting and spacing check of getSortedImageFiles
+    against the file by file implementation they replace
+    """
+    self.delayDisplay("Starting test_SortedImageFiles")
+
+    nan = float("nan")
+    parsedValues = DICOMUtils._parseDecimalStrings(["1\\2\\3", "", "1\\2", "a\\b\\c", "4.5\\-1e2\\0"], 3)
+    numpy.testing.assert_array_equal(parsedValues, [[1, 2, 3], [nan, nan, nan], [nan, nan, nan], [nan, nan, nan],
+                                                    [4.5, -100, 0]])
+
+    axial = "1\\0\\0\\0\\1\\0"
+    oblique = "1\\0\\0\\0\\0.8\\0.6"
+    def series(zs, orientation=axial, **tagsOfFirstFile):
+      fileValues = {}
+      for index, z in enumerate(zs):
+        position = "" if z is None else "0\\%g\\%g" % (-0.6 * z if orientation == oblique else 0, z)
+        fileValues["slice%d.dcm" % index] = {"0020,0032": position, "0020,0037": orientation if position else ""}
+      fileValues["slice0.dcm"].update(tagsOfFirstFile)
+      return fileValues
+
+    testSeries = {
+      "regular": series([5, 0, 10, 2.5, 7.5]),
+      "irregular": series([0, 2.5, 5.5, 7.5]),
+      "oblique": series([3.2, 0, 1.6, 4.8], orientation=oblique),
+      "missing geometry": series([0, 2.5, None, 7.5]),
+      "missing reference geometry": series([None, 2.5, 5]),
+      "multi-frame": series([0], **{"0028,0008": "10"}),
+      }
+
+    originalGetFileValues = DICOMUtils.getFileValues
+    try:
+      for seriesIndex, (name, fileValues) in enumerate(testSeries.items()):
+        for values in fileValues.values():
+          values["0020,000E"] = "1.2.3.%d" % seriesIndex
+
+        def getFileValues(filePaths, tags):
+          return dict((tag, [fileValues[filePath].get(tag, "") for filePath in filePaths]) for tag in tags)
+        DICOMUtils.getFileValues = getFileValues
+
+        filePaths = sorted(fileValues.keys())
+        files, distances, warningText = DICOMUtils.getSortedImageFiles(filePaths)
+        referenceFiles, referenceDistances, referenceWarningText = self.fileByFileSortedImageFiles(fileValues, filePaths)
+        self.assertEqual(files, referenceFiles, name)
+        self.assertEqual(warningText, referenceWarningText, name)
+        if referenceDistances == []:
+          self.assertEqual(distances, [], name)
+        else:
+          self.assertEqual(sorted(distances.keys()), sorted(referenceDistances.keys()), name)
+          for file in referenceDistances:
+            self.assertAlmostEqual(distances[file], referenceDistances[file], msg=name)
+    finally:
+      DICOMUtils.getFileValues = originalGetFileValues
+      DICOMUtils.SeriesGeometry.clearCache()
+
+    # The scenarios exercise the warnings, not only the sorting
+    self.assertIn("not equally spaced", self.fileByFileSortedImageFiles(testSeries["irregular"], sorted(testSeries["irregular"]))[2])
+    self.assertIn("missing geometry", self.fileByFileSortedImageFiles(testSeries["missing geometry"], sorted(testSeries["missing geometry"]))[2])
+
+    self.delayDisplay('test_SortedImageFiles passed!')
+
+  @staticmethod
+  def writeDICOMFile(filePath, patientName, imagePosition):
+    import pydicom
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+    dataset = Dataset()
+    dataset.file_meta = FileMetaDataset()
+    dataset.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.2"
+    dataset.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    dataset.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    dataset.is_little_endian = True
+    dataset.is_implicit_VR = False
+    dataset.SOPClassUID = dataset.file_meta.MediaStorageSOPClassUID
+    dataset.SOPInstanceUID = dataset.file_meta.MediaStorageSOPInstanceUID
+    dataset.PatientName = patientName
+    dataset.Modality = "CT"
+    dataset.ImagePositionPatient = imagePosition
+    dataset.ImageOrientationPatient = "1\\0\\0\\0\\1\\0"
+    dataset.Rows = 2
+    dataset.Columns = 2
+    dataset.BitsAllocated = 16
+    dataset.PixelRepresentation = 0
+    dataset.PixelData = bytes(8)
+    pydicom.dcmwrite(filePath, dataset)
+
+  def test_TagIndex(self):
+    """ Test the values of the DICOM tag index, the indexing of the modified files and the fallback
+    to the DICOM database for the files which cannot be parsed
+    """
+    self.delayDisplay("Starting test_TagIndex")
+
+    import shutil, tempfile
+    from DICOMLib import DICOMTagIndex
+    testDirectory = tempfile.mkdtemp(prefix="DICOMTagIndexTest-", dir=slicer.app.temporaryPath)
+    tagIndex = None
+    try:
+      filePaths = [os.path.join(testDirectory, "image%d.dcm" % index) for index in range(3)]
+      for index, filePath in enumerate(filePaths):
+        self.writeDICOMFile(filePath, "Patient^Test", "0\\0\\%g" % (2.5 * index))
+      tagIndex = DICOMTagIndex(os.path.join(testDirectory, DICOMTagIndex.indexFileName))
+
+      # Values are formatted as the DICOM database formats them, in the order of the requested files
+      tags = ["0010,0010", "0008,0060", "0020,0032", "0028,0008", "7fe0,0010"]
+      values = tagIndex.values(filePaths[::-1] + filePaths[:1], tags)
+      self.assertEqual(values["0010,0010"], ["Patient^Test"] * 4)
+      self.assertEqual(values["0008,0060"], ["CT"] * 4)
+      self.assertEqual(values["0020,0032"], ["0\\0\\5", "0\\0\\2.5", "0\\0\\0", "0\\0\\0"])
+      self.assertEqual(values["0028,0008"], [""] * 4)
+      self.assertEqual(values["7fe0,0010"], [DICOMTagIndex.pixelDataPresentValue] * 4)
+      # Tags which are not indexed are read from the DICOM database
+      self.assertIsNone(tagIndex.values(filePaths, ["0008,0020"]))
+
+      # The files are read from the index until they are modified
+      self.assertEqual(sorted(tagIndex._indexedValues(filePaths).keys()), sorted(filePaths))
+      self.writeDICOMFile(filePaths[1], "Patient^Modified", "0\\0\\10")
+      fileStat = os.stat(filePaths[1])
+      os.utime(filePaths[1], (fileStat.st_atime, fileStat.st_mtime + 10))
+      self.assertEqual(sorted(tagIndex._indexedValues(filePaths).keys()), sorted([filePaths[0], filePaths[2]]))
+      values = tagIndex.values(filePaths, ["0010,0010", "0020,0032"])
+      self.assertEqual(values["0010,0010"], ["Patient^Test", "Patient^Modified", "Patient^Test"])
+      self.assertEqual(values["0020,0032"], ["0\\0\\0", "0\\0\\10", "0\\0\\5"])
+
+      # The files which cannot be parsed are not indexed, so their values are read from the DICOM database
+      unparsableFilePath = os.path.join(testDirectory, "unparsable.dcm")
+      with open(unparsableFilePath, "wb") as unparsableFile:
+        unparsableFile.write(b"Not a DICOM file")
+      missingFilePath = os.path.join(testDirectory, "missing.dcm")
+      for filePath in [unparsableFilePath, missingFilePath]:
+        self.assertIsNone(DICOMTagIndex.readFileValues(filePath), filePath)
+        self.assertIsNone(tagIndex.values(filePaths + [filePath], ["0010,0010"]), filePath)
+        self.assertEqual(sorted(tagIndex._indexedValues(filePaths + [filePath]).keys()), sorted(filePaths), filePath)
+
+      # The prescan indexes the files in the background
+      prescannedFilePath = os.path.join(testDirectory, "prescanned.dcm")
+      self.writeDICOMFile(prescannedFilePath, "Patient^Prescanned", "0\\0\\0")
+      tagIndex.prescan([prescannedFilePath]).result()
+      self.assertEqual(tagIndex._indexedValues([prescannedFilePath])[prescannedFilePath]["0010,0010"], "Patient^Prescanned")
+    finally:
+      if tagIndex:
+        tagIndex.close()
+      shutil.rmtree(testDirectory, ignore_errors=True)
+
+    self.delayDisplay('test_TagIndex passed!')
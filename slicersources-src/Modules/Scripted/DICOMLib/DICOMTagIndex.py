@@ -0,0 +1,261 @@
+import importlib.util
+import json
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import slicer
+
+#########################################################
+#
+#
+comment = """
+
+  DICOMTagIndex is a persistent index of the DICOM header
+  values used to examine, sort and annotate the images.
+  The headers are parsed in a worker pool, so examining a
+  series looks up the index instead of going through the
+  DICOM database once per file and tag.
+
+"""
+#
+#########################################################
+
+#------------------------------------------------------------------------------
+class DICOMTagIndex(object):
+  """ Persistent index of the DICOM header values of files.
+
+  The values of the indexedTags of each file are stored in a SQLite table keyed by file path, along with the
+  modification time and size of the file : a file modified after it was indexed is parsed again.
+  The headers are parsed with pydicom by a worker pool, either in the background for the files just imported
+  (prescan) or on demand for the files missing from the index (values).
+  Values are formatted as the DICOM database formats them : multiple values are separated by backslashes and missing
+  tags have empty values. The value of the pixel data tag is not stored, only whether the file has pixel data.
+  """
+  indexFileName = "DICOMTagIndex.sqlite"
+  pixelDataTag = "7FE0,0010"
+  pixelDataPresentValue = "1"
+
+  indexedTags = [
+    "0008,0008", # Image Type
+    "0008,0016", # SOP Class UID
+    "0008,0018", # SOP Instance UID
+    "0008,0021", # Series Date
+    "0008,0031", # Series Time
+    "0008,0033", # Content Time
+    "0008,0060", # Modality
+    "0008,0070", # Manufacturer
+    "0008,0080", # Institution Name
+    "0008,0090", # Referring Physician Name
+    "0008,103E", # Series Description
+    "0008,1090", # Manufacturer Model Name
+    "0010,0010", # Patient Name
+    "0010,0020", # Patient ID
+    "0010,0030", # Patient Birth Date
+    "0010,0040", # Patient Sex
+    "0010,1010", # Patient Age
+    "0018,0080", # Repetition Time
+    "0018,0081", # Echo Time
+    "0018,1060", # Trigger Time
+    "0018,5100", # Patient Position
+    "0018,9089", # Diffusion Gradient Orientation
+    "0020,000E", # Series Instance UID
+    "0020,0011", # Series Number
+    "0020,0012", # Acquisition Number
+    "0020,0032", # Image Position Patient
+    "0020,0037", # Image Orientation Patient
+    "0028,0008", # Number of Frames
+    "0028,0010", # Rows
+    "0028,0011", # Columns
+    "0028,1050", # Window Center
+    "0028,1051", # Window Width
+    pixelDataTag,
+    ]
+
+  # Value representations stored as text, which are indexed without being decoded by pydicom
+  textVRs = {"AE", "AS", "CS", "DA", "DS", "DT", "IS", "LO", "LT", "PN", "SH", "ST", "TM", "UI", "UT"}
+
+  # Number of files parsed and stored per transaction
+  scanChunkSize = 64
+  # SQLite limit of the number of parameters of a query
+  queryChunkSize = 500
+
+  _instances = {}
+
+  @classmethod
+  def forDatabase(cls, database=None):
+    """ Get the tag index of a DICOM database (the Slicer one by default), stored in the database directory.
+    Returns None if the database is not open or pydicom is not available.
+    """
+    if database is None:
+      database = slicer.dicomDatabase
+    if database is None or not database.isOpen or not database.databaseDirectory:
+      return None
+    indexFilePath = os.path.join(database.databaseDirectory, cls.indexFileName)
+    if indexFilePath not in cls._instances:
+      if importlib.util.find_spec("pydicom") is None:
+        logging.warning("DICOM tag index is not available : pydicom is not installed")
+        cls._instances[indexFilePath] = None
+        return None
+      try:
+        cls._instances[indexFilePath] = cls(indexFilePath)
+      except sqlite3.Error as e:
+        logging.warning("DICOM tag index is not available : %s" % e)
+        cls._instances[indexFilePath] = None
+    return cls._instances[indexFilePath]
+
+  def __init__(self, indexFilePath, workerCount=None):
+    self.indexFilePath = indexFilePath
+    self._lock = threading.Lock()
+    self._connection = sqlite3.connect(indexFilePath, check_same_thread=False)
+    with self._connection:
+      self._connection.execute("CREATE TABLE IF NOT EXISTS Files ("
+                               "FilePath TEXT PRIMARY KEY, ModifiedTime REAL, FileSize INTEGER, TagValues TEXT)")
+    self._executor = ThreadPoolExecutor(max_workers=workerCount or min(8, os.cpu_count() or 1))
+    self._prescanExecutor = ThreadPoolExecutor(max_workers=1)
+
+  def close(self):
+    """ Wait for the pending prescans, stop the workers and close the index file.
+    The index cannot be used after it is closed.
+    """
+    self._prescanExecutor.shutdown(wait=True)
+    self._executor.shutdown(wait=True)
+    with self._lock:
+      self._connection.close()
+    if self._instances.get(self.indexFilePath) is self:
+      del self._instances[self.indexFilePath]
+
+  @staticmethod
+  def _fileStamp(filePath):
+    try:
+      fileStat = os.stat(filePath)
+    except OSError:
+      return None
+    return fileStat.st_mtime, fileStat.st_size
+
+  @classmethod
+  def _tagValue(cls, dataset, tag):
+    from pydicom.datadict import dictionary_VR
+    tagKey = int(tag.replace(",", ""), 16)
+    if tagKey not in dataset:
+      return ""
+    element = dataset.get_item(tagKey)
+    if isinstance(element.value, bytes) and (element.VR or dictionary_VR(tagKey)) in cls.textVRs:
+      try:
+        return element.value.decode("ascii").rstrip(" \0")
+      except UnicodeDecodeError:
+        pass
+    value = dataset[tagKey].value
+    if value is None:
+      return ""
+    if isinstance(value, (list, tuple)):
+      return "\\".join(str(item) for item in value)
+    return str(value)
+
+  @classmethod
+  def readFileValues(cls, filePath):
+    """ Parse the header of a file.
+    Returns (modification time, size, {tag: value}) or None if the file cannot be parsed or has no SOP instance UID.
+    """
+    import pydicom
+    stamp = cls._fileStamp(filePath)
+    if stamp is None:
+      return None
+    try:
+      # Large values such as the pixel data are skipped instead of being read
+      dataset = pydicom.dcmread(filePath, defer_size=1024, force=True)
+      # Files which are not DICOM are read as datasets without elements, instead of failing
+      if 0x00080018 not in dataset:
+        logging.debug("Cannot index DICOM file %s : no SOP instance UID" % filePath)
+        return None
+      values = dict((tag, cls._tagValue(dataset, tag)) for tag in cls.indexedTags if tag != cls.pixelDataTag)
+      values[cls.pixelDataTag] = cls.pixelDataPresentValue if 0x7FE00010 in dataset else ""
+    except Exception as e:
+      logging.debug("Cannot index DICOM file %s : %s" % (filePath, e))
+      return None
+    return stamp + (values,)
+
+  def _indexedValues(self, filePaths, tags=()):
+    """ Values of the files indexed since their last modification, which have all the tags """
+    stamps = dict((filePath, self._fileStamp(filePath)) for filePath in filePaths)
+    rows = []
+    with self._lock:
+      for start in range(0, len(filePaths), self.queryChunkSize):
+        chunk = filePaths[start:start + self.queryChunkSize]
+        rows += self._connection.execute(
+          "SELECT FilePath, ModifiedTime, FileSize, TagValues FROM Files WHERE FilePath IN (%s)" % ",".join("?" * len(chunk)),
+          chunk).fetchall()
+
+    indexedValues = {}
+    for filePath, modifiedTime, fileSize, tagValues in rows:
+      if stamps[filePath] != (modifiedTime, fileSize):
+        continue
+      values = json.loads(tagValues)
+      if all(tag in values for tag in tags):
+        indexedValues[filePath] = values
+    return indexedValues
+
+  def scan(self, filePaths):
+    """ Parse the headers of the files in the worker pool and store their values in the index.
+    Returns the {file path: {tag: value}} of the files or None if some files cannot be parsed.
+    """
+    fileValues = {}
+    failed = False
+    for start in range(0, len(filePaths), self.scanChunkSize):
+      chunk = filePaths[start:start + self.scanChunkSize]
+      rows = []
+      for filePath, result in zip(chunk, self._executor.map(self.readFileValues, chunk)):
+        if result is None:
+          failed = True
+          continue
+        modifiedTime, fileSize, values = result
+        fileValues[filePath] = values
+        rows.append((filePath, modifiedTime, fileSize, json.dumps(values)))
+      with self._lock, self._connection:
+        self._connection.executemany("INSERT OR REPLACE INTO Files VALUES (?, ?, ?, ?)", rows)
+    return None if failed else fileValues
+
+  def values(self, filePaths, tags):
+    """ Get the values of tags for a list of files, in the same format as DICOMUtils.getFileValues.
+    The files missing from the index or modified since they were indexed are parsed first.
+    Returns None if some tags are not indexed or some files cannot be parsed, so the values can be read from the
+    DICOM database instead.
+    """
+    indexedTags = [tag.upper() for tag in tags]
+    if any(tag not in self.indexedTags for tag in indexedTags):
+      return None
+    uniqueFilePaths = list(dict.fromkeys(filePaths))
+    fileValues = self._indexedValues(uniqueFilePaths, indexedTags)
+    missingFilePaths = [filePath for filePath in uniqueFilePaths if filePath not in fileValues]
+    if missingFilePaths:
+      scannedValues = self.scan(missingFilePaths)
+      if scannedValues is None:
+        return None
+      fileValues.update(scannedValues)
+    return dict((tag, [fileValues[filePath][indexedTag] for filePath in filePaths])
+                for tag, indexedTag in zip(tags, indexedTags))
+
+  def prescan(self, filePaths):
+    """ Index the files which are not indexed yet in the background.
+    Returns the future of the prescan.
+    """
+    filePaths = list(filePaths)
+
+    def prescanFiles():
+      for start in range(0, len(filePaths), self.scanChunkSize):
+        chunk = filePaths[start:start + self.scanChunkSize]
+        indexedValues = self._indexedValues(chunk, self.indexedTags)
+        self.scan([filePath for filePath in chunk if filePath not in indexedValues])
+
+    return self._prescanExecutor.submit(prescanFiles)
+
+  def prescanInstances(self, sopInstanceUIDs, database=None):
+    """ Index the files of instances of a DICOM database (the Slicer one by default) in the background,
+    typically the instances just imported.
+    """
+    if database is None:
+      database = slicer.dicomDatabase
+    filePaths = [database.fileForInstance(sopInstanceUID) for sopInstanceUID in dict.fromkeys(sopInstanceUIDs)]
+    return self.prescan([filePath for filePath in filePaths if filePath])
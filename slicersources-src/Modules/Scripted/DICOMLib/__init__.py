@@ -4,6 +4,7 @@ from .DICOMExportScene import *
 from .DICOMBrowser import *
 from .DICOMPlugin import *
 from .DICOMUtils import *
+from .DICOMTagIndex import *
 from .DICOMPluginSelector import *
 from .DICOMRecentActivityWidget import *
 from .DICOMSendDialog import *
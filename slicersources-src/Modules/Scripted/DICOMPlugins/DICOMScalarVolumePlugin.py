@@ -4,6 +4,7 @@ import vtk, qt, ctk, slicer, vtkITK
 from DICOMLib import DICOMPlugin
 from DICOMLib import DICOMLoadable
 from DICOMLib import DICOMUtils
+from DICOMLib import DICOMTagIndex
 from DICOMLib import DICOMExportScalarVolume
 import logging
 from functools import cmp_to_key
@@ -187,18 +188,19 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
     # - build a list of files for each unique value
     #   of each tag
     #
+    # fetch the tag values of all the files at once
+    fileValues = DICOMUtils.getFileValues(allFilesLoadable.files, [self.tags[tag] for tag in subseriesTags+['sopClassUID']])
+    sopClassUIDs = dict(zip(allFilesLoadable.files, fileValues[self.tags['sopClassUID']]))
+
     subseriesFiles = {}
-    subseriesValues = {}
-    for file in allFilesLoadable.files:
+    subseriesValues = dict((tag, []) for tag in subseriesTags)
+    for fileIndex, file in enumerate(allFilesLoadable.files):
       # check for subseries values
       for tag in subseriesTags:
-        value = slicer.dicomDatabase.fileValue(file,self.tags[tag])
+        value = fileValues[self.tags[tag]][fileIndex]
         value = value.replace(",","_") # remove commas so it can be used as an index
-        if tag not in subseriesValues:
-          subseriesValues[tag] = []
-        if not subseriesValues[tag].__contains__(value):
-          subseriesValues[tag].append(value)
         if (tag,value) not in subseriesFiles:
+          subseriesValues[tag].append(value)
           subseriesFiles[tag,value] = []
         subseriesFiles[tag,value].append(file)
 
@@ -228,17 +230,26 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
 
     # remove any files from loadables that don't have pixel data (no point sending them to ITK for reading)
     # also remove DICOM SEG, since it is not handled by ITK readers
+    # the subseries share their files with the default loadable, so look for pixel data once per file
+    hasPixelData = {}
+    tagIndex = DICOMTagIndex.forDatabase()
+    pixelDataValues = tagIndex.values(allFilesLoadable.files, [tagIndex.pixelDataTag]) if tagIndex else None
+    if pixelDataValues is not None:
+      hasPixelData = dict((file, value != "") for file, value in
+                          zip(allFilesLoadable.files, pixelDataValues[tagIndex.pixelDataTag]))
     newLoadables = []
     for loadable in loadables:
       newFiles = []
       excludedLoadable = False
       for file in loadable.files:
-        if slicer.dicomDatabase.fileValueExists(file,self.tags['pixelData']):
+        if file not in hasPixelData:
+          hasPixelData[file] = slicer.dicomDatabase.fileValueExists(file,self.tags['pixelData'])
+        if hasPixelData[file]:
           newFiles.append(file)
-        if slicer.dicomDatabase.fileValue(file,self.tags['sopClassUID'])=='1.2.840.10008.5.1.4.1.1.66.4':
+        if sopClassUIDs[file]=='1.2.840.10008.5.1.4.1.1.66.4':
           excludedLoadable = True
           logging.error('Please install Quantitative Reporting extension to enable loading of DICOM Segmentation objects')
-        elif slicer.dicomDatabase.fileValue(file,self.tags['sopClassUID'])=='1.2.840.10008.5.1.4.1.1.481.3':
+        elif sopClassUIDs[file]=='1.2.840.10008.5.1.4.1.1.481.3':
           excludedLoadable = True
           logging.error('Please install SlicerRT extension to enable loading of DICOM RT Structure Set objects')
       if len(newFiles) > 0 and not excludedLoadable:
@@ -259,6 +270,7 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
     # now for each series and subseries, sort the images
     # by position and check for consistency
     # then adjust confidence values based on warnings
+    # (the geometry of the files is fetched once for the series and reused by the subseries)
     #
     for loadable in loadables:
       loadable.files, distances, loadable.warning = DICOMUtils.getSortedImageFiles(loadable.files, self.epsilon)
@@ -851,8 +851,22 @@ class SliceAnnotations(VTKObservationMixin):
     "0018,0080": "Repetition Time",
     "0018,0081": "Echo Time"
     }
+    # Look up the values of the file of the instance in the DICOM tag index, if available
+    indexedValues = None
+    try:
+      from DICOMLib import DICOMTagIndex
+      tagIndex = DICOMTagIndex.forDatabase()
+    except ImportError:
+      tagIndex = None
+    filePath = slicer.dicomDatabase.fileForInstance(uid) if tagIndex else ''
+    if filePath:
+      indexedValues = tagIndex.values([filePath], list(tags.keys()))
+
     for tag in tags.keys():
-      value = slicer.dicomDatabase.instanceValue(uid,tag)
+      if indexedValues is not None:
+        value = indexedValues[tag][0]
+      else:
+        value = slicer.dicomDatabase.instanceValue(uid,tag)
       p[tags[tag]] = value
 
     # Store DICOM tags in cache
@@ -1,10 +1,11 @@
 from __future__ import print_function
 import os
 import unittest
-import vtk, qt, ctk, slicer
+import qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 import logging
 from functools import reduce
+import numpy as np
 
 #
 # LabelStatistics
@@ -271,6 +272,148 @@ class LabelStatisticsWidget(ScriptedLoadableModuleWidget):
       self.model.setHeaderData(col,1,k)
       col += 1
 
+#
+# Label statistics computation
+#
+
+def _arrayChunks(array, chunkVoxelCount):
+  """Slabs of the array along its first axis of about chunkVoxelCount voxels"""
+  sliceVoxelCount = max(1, int(np.prod(array.shape[1:])))
+  sliceCount = max(1, chunkVoxelCount // sliceVoxelCount)
+  for start in range(0, array.shape[0], sliceCount):
+    yield slice(start, start + sliceCount)
+
+def computeLabelStatistics(grayscaleArray, labelArray, chunkVoxelCount=16*1024*1024, maxBinCount=65536,
+                           maxHistogramSize=4*1024*1024):
+  """Compute the statistics of the grayscale voxels of every label at once.
+
+  The volumes are processed slab by slab : a first pass collects the label values and the grayscale range, a second
+  pass accumulates the count, sum and sum of squares of each label with bincount, and a histogram of the grayscale
+  values of each label from which the median is taken.
+  Integer grayscale volumes spanning less than maxBinCount values get one histogram bin per value and their statistics
+  are exact. Other volumes get maxBinCount bins between their minimum and maximum : the median is the center of the
+  median bin, as for vtkImageHistogramStatistics, and the minimum and maximum are computed from the sorted voxels of
+  each label.
+  The histograms of all the labels take labelCount * binCount integers. Above maxHistogramSize, the labelled voxels
+  are sorted by label and value instead, which takes memory proportional to the volume size, and the statistics are
+  exact.
+
+  Only the integer label values are reported, as done by thresholding each integer of the label range.
+  The median is the lower median for an even count, the standard deviation is the sample standard deviation.
+
+  :param grayscaleArray: numpy array of the grayscale voxels, e.g. slicer.util.arrayFromVolume
+  :param labelArray: numpy array of the label voxels, of the same shape
+  :return: dict of {label: {"Count", "Min", "Max", "Mean", "Median", "StdDev"}}
+  """
+  if grayscaleArray.shape != labelArray.shape:
+    raise ValueError("Grayscale and label volumes must have the same dimensions")
+  if grayscaleArray.size == 0:
+    return {}
+
+  chunks = list(_arrayChunks(labelArray, chunkVoxelCount))
+
+  # First pass : label values and grayscale range
+  labels = np.array([], dtype=np.int64)
+  grayscaleMin, grayscaleMax = np.inf, -np.inf
+  for chunk in chunks:
+    chunkLabels = np.unique(labelArray[chunk])
+    if not np.issubdtype(chunkLabels.dtype, np.integer):
+      chunkLabels = chunkLabels[chunkLabels == np.floor(chunkLabels)]
+    labels = np.union1d(labels, chunkLabels.astype(np.int64))
+    grayscaleMin = min(grayscaleMin, float(grayscaleArray[chunk].min()))
+    grayscaleMax = max(grayscaleMax, float(grayscaleArray[chunk].max()))
+  labelCount = len(labels)
+  if labelCount == 0:
+    return {}
+
+  isExactHistogram = np.issubdtype(grayscaleArray.dtype, np.integer) and grayscaleMax - grayscaleMin < maxBinCount
+  if isExactHistogram:
+    binCount, binSpacing = int(grayscaleMax - grayscaleMin) + 1, 1.0
+  else:
+    binCount = maxBinCount
+    binSpacing = (grayscaleMax - grayscaleMin) / (binCount - 1) if grayscaleMax > grayscaleMin else 1.0
+  useHistograms = labelCount * binCount <= maxHistogramSize
+
+  # Second pass : per label accumulation
+  counts = np.zeros(labelCount, dtype=np.int64)
+  sums = np.zeros(labelCount)
+  sumsOfSquares = np.zeros(labelCount)
+  mins = np.full(labelCount, np.inf)
+  maxs = np.full(labelCount, -np.inf)
+  medians = np.zeros(labelCount)
+  if useHistograms:
+    histograms = np.zeros(labelCount * binCount, dtype=np.int64)
+  else:
+    labelledIndices, labelledValues = [], []
+  for chunk in chunks:
+    chunkLabels = labelArray[chunk].ravel()
+    values = grayscaleArray[chunk].ravel().astype(np.float64)
+
+    indices = np.searchsorted(labels, chunkLabels)
+    isLabel = labels[np.minimum(indices, labelCount - 1)] == chunkLabels
+    if not isLabel.all():
+      indices, values = indices[isLabel], values[isLabel]
+
+    counts += np.bincount(indices, minlength=labelCount)
+    sums += np.bincount(indices, weights=values, minlength=labelCount)
+    sumsOfSquares += np.bincount(indices, weights=values * values, minlength=labelCount)
+
+    if not useHistograms:
+      labelledIndices.append(indices)
+      labelledValues.append(values)
+      continue
+
+    bins = np.rint((values - grayscaleMin) / binSpacing).astype(np.int64)
+    np.clip(bins, 0, binCount - 1, out=bins)
+    # Only the bins up to the last filled one are allocated for the chunk
+    chunkHistograms = np.bincount(indices * binCount + bins)
+    histograms[:len(chunkHistograms)] += chunkHistograms
+
+    if not isExactHistogram and len(indices):
+      order = np.argsort(indices, kind="stable")
+      sortedIndices, sortedValues = indices[order], values[order]
+      starts = np.flatnonzero(np.r_[True, sortedIndices[1:] != sortedIndices[:-1]])
+      present = sortedIndices[starts]
+      mins[present] = np.minimum(mins[present], np.minimum.reduceat(sortedValues, starts))
+      maxs[present] = np.maximum(maxs[present], np.maximum.reduceat(sortedValues, starts))
+
+  if useHistograms:
+    histograms = histograms.reshape(labelCount, binCount)
+    cumulativeHistograms = np.cumsum(histograms, axis=1)
+    medianBins = np.argmax(cumulativeHistograms >= 0.5 * counts[:, np.newaxis], axis=1)
+    medians = grayscaleMin + medianBins * binSpacing
+    if isExactHistogram:
+      nonEmpty = histograms > 0
+      mins = grayscaleMin + np.argmax(nonEmpty, axis=1)
+      maxs = grayscaleMin + binCount - 1 - np.argmax(nonEmpty[:, ::-1], axis=1)
+  else:
+    indices, values = np.concatenate(labelledIndices), np.concatenate(labelledValues)
+    del labelledIndices, labelledValues
+    order = np.lexsort((values, indices))
+    indices, values = indices[order], values[order]
+    if len(indices):
+      starts = np.flatnonzero(np.r_[True, indices[1:] != indices[:-1]])
+      ends = np.r_[starts[1:], len(indices)]
+      present = indices[starts]
+      mins[present] = values[starts]
+      maxs[present] = values[ends - 1]
+      medians[present] = values[starts + (ends - starts - 1) // 2]
+
+  statistics = {}
+  for index in np.flatnonzero(counts):
+    count = int(counts[index])
+    mean = sums[index] / count
+    variance = max(sumsOfSquares[index] - sums[index] * mean, 0.0) / (count - 1) if count > 1 else 0.0
+    statistics[int(labels[index])] = {
+      "Count": count,
+      "Min": float(mins[index]),
+      "Max": float(maxs[index]),
+      "Mean": float(mean),
+      "Median": float(medians[index]),
+      "StdDev": float(np.sqrt(variance)),
+      }
+  return statistics
+
 #
 # LabelStatisticsLogic
 #
@@ -315,72 +458,22 @@ class LabelStatisticsLogic(ScriptedLoadableModuleLogic):
       # No input grayscale image data
       return
 
-    stataccum = vtk.vtkImageAccumulate()
-    stataccum.SetInputConnection(labelNode.GetImageDataConnection())
-    stataccum.Update()
-    lo = int(stataccum.GetMin()[0])
-    hi = int(stataccum.GetMax()[0])
-
-    for i in range(lo,hi+1):
-
-      # this->SetProgress((float)i/hi);
-      # std::string event_message = "Label "; std::stringstream s; s << i; event_message.append(s.str());
-      # this->InvokeEvent(vtkLabelStatisticsLogic::LabelStatsOuterLoop, (void*)event_message.c_str());
-
-      # logic copied from slicer3 LabelStatistics
-      # to create the binary volume of the label
-      # //logic copied from slicer2 LabelStatistics MaskStat
-      # // create the binary volume of the label
-      thresholder = vtk.vtkImageThreshold()
-      thresholder.SetInputConnection(labelNode.GetImageDataConnection())
-      thresholder.SetInValue(1)
-      thresholder.SetOutValue(0)
-      thresholder.ReplaceOutOn()
-      thresholder.ThresholdBetween(i,i)
-      thresholder.SetOutputScalarType(grayscaleNode.GetImageData().GetScalarType())
-      thresholder.Update()
-
-      # this.InvokeEvent(vtkLabelStatisticsLogic::LabelStatsInnerLoop, (void*)"0.25");
-
-      #  use vtk's statistics class with the binary labelmap as a stencil
-      stencil = vtk.vtkImageToImageStencil()
-      stencil.SetInputConnection(thresholder.GetOutputPort())
-      stencil.ThresholdBetween(1, 1)
-
-      # this.InvokeEvent(vtkLabelStatisticsLogic::LabelStatsInnerLoop, (void*)"0.5")
-
-      stat1 = vtk.vtkImageAccumulate()
-      stat1.SetInputConnection(grayscaleNode.GetImageDataConnection())
-      stencil.Update()
-      stat1.SetStencilData(stencil.GetOutput())
-
-      stat1.Update()
-
-      medians = vtk.vtkImageHistogramStatistics()
-      medians.SetInputConnection(grayscaleNode.GetImageDataConnection())
-      stencil.Update()
-      medians.SetStencilData(stencil.GetOutput())
-
-      medians.Update()
-
-      # this.InvokeEvent(vtkLabelStatisticsLogic::LabelStatsInnerLoop, (void*)"0.75")
-
-      if stat1.GetVoxelCount() > 0:
-        # add an entry to the LabelStats list
-        self.labelStats["Labels"].append(i)
-        self.labelStats[i,"Index"] = i
-        self.labelStats[i,"Count"] = stat1.GetVoxelCount()
-        self.labelStats[i,"Volume mm^3"] = self.labelStats[i,"Count"] * cubicMMPerVoxel
-        self.labelStats[i,"Volume cc"] = self.labelStats[i,"Volume mm^3"] * ccPerCubicMM
-        self.labelStats[i,"Min"] = stat1.GetMin()[0]
-        self.labelStats[i,"Max"] = stat1.GetMax()[0]
-        self.labelStats[i,"Mean"] = stat1.GetMean()[0]
-        self.labelStats[i,"Median"] = medians.GetMedian()
-        self.labelStats[i,"StdDev"] = stat1.GetStandardDeviation()[0]
-
-        # this.InvokeEvent(vtkLabelStatisticsLogic::LabelStatsInnerLoop, (void*)"1")
-
-    # this.InvokeEvent(vtkLabelStatisticsLogic::EndLabelStats, (void*)"end label stats")
+    grayscaleArray = slicer.util.arrayFromVolume(grayscaleNode)
+    labelArray = slicer.util.arrayFromVolume(labelNode)
+    statistics = computeLabelStatistics(grayscaleArray, labelArray)
+
+    for i in sorted(statistics):
+      # add an entry to the LabelStats list
+      self.labelStats["Labels"].append(i)
+      self.labelStats[i,"Index"] = i
+      self.labelStats[i,"Count"] = statistics[i]["Count"]
+      self.labelStats[i,"Volume mm^3"] = self.labelStats[i,"Count"] * cubicMMPerVoxel
+      self.labelStats[i,"Volume cc"] = self.labelStats[i,"Volume mm^3"] * ccPerCubicMM
+      self.labelStats[i,"Min"] = statistics[i]["Min"]
+      self.labelStats[i,"Max"] = statistics[i]["Max"]
+      self.labelStats[i,"Mean"] = statistics[i]["Mean"]
+      self.labelStats[i,"Median"] = statistics[i]["Median"]
+      self.labelStats[i,"StdDev"] = statistics[i]["StdDev"]
 
   def getColorNode(self):
     """Returns the color node corresponding to the labelmap. If a color node is explicitly
@@ -521,6 +614,10 @@ class LabelStatisticsTest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_LabelStatisticsBasic()
+    self.setUp()
+    self.test_LabelStatisticsMultipleLabels()
+    self.setUp()
+    self.test_LabelStatisticsWithoutHistograms()
 
   def test_LabelStatisticsBasic(self):
     """
@@ -554,6 +651,56 @@ class LabelStatisticsTest(ScriptedLoadableModuleTest):
 
     self.delayDisplay('test_LabelStatisticsBasic passed!')
 
+  def test_LabelStatisticsMultipleLabels(self):
+    """
+    This tests the statistics of all the labels computed at once against the statistics of each label
+    """
+
+    self.delayDisplay("Starting test_LabelStatisticsMultipleLabels")
+    randomState = np.random.RandomState(0)
+    grayscaleArray = randomState.randint(-1000, 3000, (20, 30, 40)).astype(np.int16)
+    labelArray = randomState.choice([0, 2, 5, 61], (20, 30, 40)).astype(np.int16)
+    grayscaleNode = slicer.util.addVolumeFromArray(grayscaleArray, name="grayscale")
+    labelNode = slicer.util.addVolumeFromArray(labelArray, name="label", nodeClassName="vtkMRMLLabelMapVolumeNode")
+
+    logic = LabelStatisticsLogic(grayscaleNode, labelNode)
+
+    self.assertEqual(logic.labelStats["Labels"], [0, 2, 5, 61])
+    for label in logic.labelStats["Labels"]:
+      values = np.sort(grayscaleArray[labelArray == label].astype(np.float64))
+      self.assertEqual(logic.labelStats[label, "Count"], len(values))
+      self.assertEqual(logic.labelStats[label, "Min"], values[0])
+      self.assertEqual(logic.labelStats[label, "Max"], values[-1])
+      self.assertAlmostEqual(logic.labelStats[label, "Mean"], values.mean())
+      self.assertEqual(logic.labelStats[label, "Median"], values[(len(values) - 1) // 2])
+      self.assertAlmostEqual(logic.labelStats[label, "StdDev"], values.std(ddof=1))
+
+    self.delayDisplay('test_LabelStatisticsMultipleLabels passed!')
+
+  def test_LabelStatisticsWithoutHistograms(self):
+    """
+    This tests the statistics computed from the sorted voxels when the histograms would exceed their memory budget
+    """
+
+    self.delayDisplay("Starting test_LabelStatisticsWithoutHistograms")
+    randomState = np.random.RandomState(0)
+    grayscaleArray = (randomState.randn(20, 30, 40) * 100).astype(np.float32)
+    labelArray = randomState.choice([0, 2, 5, 61], (20, 30, 40)).astype(np.int16)
+
+    statistics = computeLabelStatistics(grayscaleArray, labelArray, chunkVoxelCount=5000, maxHistogramSize=0)
+
+    self.assertEqual(sorted(statistics.keys()), [0, 2, 5, 61])
+    for label, labelStatistics in statistics.items():
+      values = np.sort(grayscaleArray[labelArray == label].astype(np.float64))
+      self.assertEqual(labelStatistics["Count"], len(values))
+      self.assertEqual(labelStatistics["Min"], values[0])
+      self.assertEqual(labelStatistics["Max"], values[-1])
+      self.assertAlmostEqual(labelStatistics["Mean"], values.mean())
+      self.assertEqual(labelStatistics["Median"], values[(len(values) - 1) // 2])
+      self.assertAlmostEqual(labelStatistics["StdDev"], values.std(ddof=1))
+
+    self.delayDisplay('test_LabelStatisticsWithoutHistograms passed!')
+
 class Slicelet(object):
   """A slicer slicelet is a module widget that comes up in stand alone mode
   implemented as a python class.
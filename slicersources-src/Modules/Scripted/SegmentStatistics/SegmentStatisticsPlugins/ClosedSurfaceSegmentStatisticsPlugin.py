@@ -9,6 +9,7 @@ class ClosedSurfaceSegmentStatisticsPlugin(SegmentStatisticsPluginBase):
   def __init__(self):
     super(ClosedSurfaceSegmentStatisticsPlugin,self).__init__()
     self.name = "Closed Surface"
+    self.usesScalarVolume = False
     self.keys = ["surface_mm2", "volume_mm3", "volume_cm3"]
     self.defaultKeys = self.keys # calculate all measurements by default
     #... developer may add extra options to configure other parameters
@@ -2,6 +2,7 @@ import vtk
 import slicer
 import vtkITK
 import logging
+import numpy as np
 from SegmentStatisticsPlugins import SegmentStatisticsPluginBase
 from functools import reduce
 
@@ -11,6 +12,7 @@ class LabelmapSegmentStatisticsPlugin(SegmentStatisticsPluginBase):
   def __init__(self):
     super(LabelmapSegmentStatisticsPlugin,self).__init__()
     self.name = "Labelmap"
+    self.usesScalarVolume = False
     self.obbKeys = ["obb_origin_ras", "obb_diameter_mm", "obb_direction_ras_x", "obb_direction_ras_y", "obb_direction_ras_z"]
     self.principalAxisKeys = ["principal_axis_x", "principal_axis_y", "principal_axis_z"]
     self.shapeKeys = [
@@ -43,6 +45,10 @@ class LabelmapSegmentStatisticsPlugin(SegmentStatisticsPluginBase):
 
   def computeStatistics(self, segmentID):
     import vtkSegmentationCorePython as vtkSegmentationCore
+    if self.segmentLabelmapCache is not None and self.canComputeFromLabelmapCache(self.preparedRequestedKeys):
+      # Batched computation, possibly in a worker thread : only the prepared values are used
+      return self.computeStatisticsFromLabelmapCache(segmentID, self.preparedRequestedKeys)
+
     requestedKeys = self.getRequestedKeys()
 
     segmentationNode = slicer.mrmlScene.GetNodeByID(self.getParameterNode().GetParameter("Segmentation"))
@@ -55,6 +61,12 @@ class LabelmapSegmentStatisticsPlugin(SegmentStatisticsPluginBase):
     if not containsLabelmapRepresentation:
       return {}
 
+    calculateShapeStats = False
+    for shapeKey in self.shapeKeys:
+      if shapeKey in requestedKeys:
+        calculateShapeStats = True
+        break
+
     segmentLabelmap = slicer.vtkOrientedImageData()
     segmentationNode.GetBinaryLabelmapRepresentation(segmentID, segmentLabelmap)
     if (not segmentLabelmap
@@ -96,12 +108,6 @@ class LabelmapSegmentStatisticsPlugin(SegmentStatisticsPluginBase):
     if "volume_cm3" in requestedKeys:
       stats["volume_cm3"] = stat.GetVoxelCount() * cubicMMPerVoxel * ccPerCubicMM
 
-    calculateShapeStats = False
-    for shapeKey in self.shapeKeys:
-      if shapeKey in requestedKeys:
-        calculateShapeStats = True
-        break
-
     if calculateShapeStats:
       directions = vtk.vtkMatrix4x4()
       segmentLabelmap.GetDirectionMatrix(directions)
@@ -389,6 +395,42 @@ class LabelmapSegmentStatisticsPlugin(SegmentStatisticsPluginBase):
 
     return stats
 
+  def computeStatisticsFromLabelmapCache(self, segmentID, requestedKeys):
+    """Compute the voxel count and volumes from the segment mask of the shared labelmap layer.
+    Only reads the values prepared by prepareLabelmapCache, MRML is not accessed.
+    """
+    if not requestedKeys:
+      return {}
+    segmentMask, bounds, spacing = self.segmentLabelmapCache.segmentMask(segmentID)
+    if segmentMask is None:
+      return {}
+
+    voxelCount = int(np.count_nonzero(segmentMask))
+    cubicMMPerVoxel = reduce(lambda x,y: x*y, spacing)
+    ccPerCubicMM = 0.001
+    stats = {}
+    if "voxel_count" in requestedKeys:
+      stats["voxel_count"] = voxelCount
+    if "volume_mm3" in requestedKeys:
+      stats["volume_mm3"] = voxelCount * cubicMMPerVoxel
+    if "volume_cm3" in requestedKeys:
+      stats["volume_cm3"] = voxelCount * cubicMMPerVoxel * ccPerCubicMM
+    return stats
+
+  def prepareLabelmapCache(self, cache, segmentIDs):
+    """Overridden from SegmentStatisticsPluginBase"""
+    cache.prepare(segmentIDs)
+
+  def canComputeFromLabelmapCache(self, requestedKeys):
+    """Return True if the requested keys can be computed from the labelmap cache, the shape statistics are computed by
+    VTK pipelines
+    """
+    return requestedKeys is not None and not any(shapeKey in requestedKeys for shapeKey in self.shapeKeys)
+
+  def canComputeInWorkerThread(self):
+    """Overridden from SegmentStatisticsPluginBase"""
+    return self.canComputeFromLabelmapCache(self.getRequestedKeys())
+
   def getMeasurementInfo(self, key):
     """Get information (name, description, units, ...) about the measurement for the given key"""
     info = {}